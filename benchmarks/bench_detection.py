@@ -0,0 +1,76 @@
+"""
+Compares the single-pass detection engine against the original detectors,
+which each ran a full `os.walk` over the server directory.
+
+Usage: python -m benchmarks.bench_detection [servers] [region files per server]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from medusa.servers import FABRIC, FORGE, VANILLA, NOTASERVER
+from medusa.servers import detection, fabric, forge, vanilla
+from medusa.servers.models import add_supported_server_type, get_supported_types
+
+def legacy_is_path(directory, needles):
+    """
+    The pre-engine detector: walks the whole tree but only inspects top-level files.
+    """
+    srv_dir = os.path.abspath(directory)
+    strat_jar = False
+    for dir_path, dir_names, f_names in os.walk(srv_dir):
+        if dir_path != srv_dir:
+            continue
+        for file in f_names:
+            file = file.lower()
+            if file.endswith('.jar'):
+                if any(needle in file for needle in needles):
+                    strat_jar = True
+    return strat_jar
+
+def legacy_detect(directory):
+    if legacy_is_path(directory, ['forge']):
+        return FORGE
+    elif legacy_is_path(directory, ['fabric']):
+        return FABRIC
+    elif legacy_is_path(directory, ['mc', 'minecraft']):
+        return VANILLA
+    return NOTASERVER
+
+def build_tree(root, servers, regions):
+    jars = ['forge-1.16.5-36.2.0.jar', 'fabric-server-launch.jar', 'minecraft_server.1.16.5.jar']
+    for i in range(servers):
+        srv = os.path.join(root, 'srv{}'.format(i))
+        for world in ('world', 'world_nether', 'world_the_end'):
+            region_dir = os.path.join(srv, world, 'region')
+            os.makedirs(region_dir)
+            for r in range(regions):
+                open(os.path.join(region_dir, 'r.{}.0.mca'.format(r)), 'w').close()
+        os.makedirs(os.path.join(srv, 'logs'))
+        open(os.path.join(srv, jars[i % len(jars)]), 'w').close()
+
+def timed(label, fn, paths):
+    start = time.perf_counter()
+    results = [fn(p) for p in paths]
+    elapsed = time.perf_counter() - start
+    print('{:<12} {:>8.1f} ms'.format(label, elapsed * 1000))
+    return results
+
+if __name__ == '__main__':
+    servers = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    regions = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    if len(get_supported_types()) == 0:
+        add_supported_server_type(FORGE, None, None, forge.detect_forge)
+        add_supported_server_type(FABRIC, None, None, fabric.detect_fabric)
+        add_supported_server_type(VANILLA, None, None, vanilla.detect_vanilla)
+
+    with tempfile.TemporaryDirectory() as root:
+        build_tree(root, servers, regions)
+        paths = sorted(e.path for e in os.scandir(root))
+        print('{} servers, {} region files each'.format(servers, regions * 3))
+
+        legacy = timed('os.walk', legacy_detect, paths)
+        engine = timed('scandir', lambda p: detection.detect_server_type(p)[0], paths)
+        assert legacy == engine, 'Detectors disagree'
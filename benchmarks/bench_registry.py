@@ -0,0 +1,62 @@
+"""
+Compares identifier lookups through the indexed `ServerRegistry` with the
+linear `Server.is_identifiable_by` scan it replaced.
+
+Usage: python -m benchmarks.bench_registry [servers]
+"""
+import sys
+import time
+
+from medusa.servers.models import Server
+from medusa.servers.registry import ServerRegistry
+
+def make_servers(count):
+    servers = []
+    for i in range(count):
+        srv = Server()
+        srv.Path = '/srv/minecraft/server{}'.format(i)
+        srv.Alias = 'alias{}'.format(i)
+        srv.Type = 'VANILLA'
+        servers.append(srv)
+    return servers
+
+def linear_find(servers, identifier):
+    for srv in servers:
+        if srv.is_identifiable_by(identifier):
+            return srv
+    return None
+
+def linear_register(servers):
+    registered = []
+    for srv in servers:
+        if linear_find(registered, srv.Path) is None:
+            registered.append(srv)
+    return registered
+
+def indexed_register(servers):
+    registry = ServerRegistry()
+    for srv in servers:
+        if not registry.find_all(srv.Path):
+            registry.add(srv)
+    return registry
+
+def timed(label, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print('{:<28} {:>10.1f} ms'.format(label, elapsed * 1000))
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    servers = make_servers(count)
+    registry = ServerRegistry(servers)
+    # look up a sample of basenames spread over the whole registry
+    probes = ['server{}'.format(i) for i in range(0, count, max(1, count // 200))]
+
+    print('{} servers, {} lookups'.format(count, len(probes)))
+    timed('linear lookup', lambda: [linear_find(servers, p) for p in probes])
+    timed('indexed lookup', lambda: [registry.find(p) for p in probes])
+    timed('indexed register (all)', lambda: indexed_register(servers))
+    # the linear registration is quadratic, so only time a slice of it
+    sample = servers[:min(count, 500)]
+    timed('linear register ({})'.format(len(sample)), lambda: linear_register(sample))
@@ -0,0 +1,49 @@
+"""
+Compares decoding and encoding the server registry in the plain-JSON format
+against the `jsonpickle` format it replaced.
+
+Usage: python -m benchmarks.bench_registry_codec [servers ...]
+"""
+import json
+import sys
+import time
+
+import jsonpickle
+
+from medusa.servers.models import Server
+from medusa.servers.registry import REGISTRY_VERSION, decode_registry, encode_registry
+
+def make_servers(count):
+    servers = []
+    for i in range(count):
+        srv = Server()
+        srv.Path = '/srv/minecraft/server{}'.format(i)
+        srv.Alias = 'alias{}'.format(i)
+        srv.Type = 'FORGE'
+        servers.append(srv)
+    return servers
+
+def timed(label, fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('  {:<26} {:>9.2f} ms'.format(label, best * 1000))
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    for count in counts:
+        servers = make_servers(count)
+        legacy_text = jsonpickle.encode({'server_directory': '/srv', 'server_registry': servers})
+        plain_text = json.dumps({'server_directory': '/srv', 'registry_version': REGISTRY_VERSION,
+            'server_registry': encode_registry(servers)})
+        print('{} servers ({} KiB jsonpickle, {} KiB plain)'.format(count,
+            len(legacy_text) // 1024, len(plain_text) // 1024))
+
+        timed('jsonpickle decode', lambda: jsonpickle.decode(legacy_text)['server_registry'])
+        timed('plain decode', lambda: decode_registry(json.loads(plain_text)['server_registry']))
+        timed('jsonpickle encode', lambda: jsonpickle.encode({'server_directory': '/srv', 'server_registry': servers}))
+        timed('plain encode', lambda: json.dumps({'server_directory': '/srv',
+            'registry_version': REGISTRY_VERSION, 'server_registry': encode_registry(servers)}))
@@ -0,0 +1,129 @@
+"""
+`medusa access`, which keeps the whitelists, ops, and bans of registered
+servers in sync.
+"""
+from typing import List
+
+from . import parsers
+from .servers import manager
+from .servers import access
+from .servers.access import ListDiff, ServerSync
+from .servers.registry import path_key
+
+def process_access(args: List[str]):
+    """
+    Process CLI arguments for the `access` command.
+
+    Parameters
+    ----------
+        args : List of str
+            Command-line arguments following the `access` command.
+    """
+    parser = parsers.get_access_parsers()
+    args = parser.parse_args(args)
+
+    if (args.action == 'sync'):
+        process_sync(args)
+    else:
+        parser.print_usage()
+        print('Please specify a subcommand for `access`')
+
+def process_sync(args):
+    """
+    Merges the canonical lists into those of the selected servers and tells
+    the running ones to reload.
+    """
+    from .logs import select
+    servers = select(args)
+    if args.source is not None:
+        try:
+            source = manager.get_server_by_identifier(args.source)
+        except manager.AmbiguousIdentifierError as amb:
+            print(amb)
+            return
+        if source is None:
+            print('No server "{}"'.format(args.source))
+            return
+        directory = source.Path
+        servers = [srv for srv in servers if path_key(srv.Path) != path_key(source.Path)]
+    else:
+        directory = access.get_access_lists_location()
+    if len(servers) == 0:
+        print('No servers selected')
+        return
+
+    try:
+        canonical = access.read_canonical(directory, args.list or access.LIST_NAMES)
+    except access.AccessListError as err:
+        print(err)
+        return
+    if len(canonical) == 0:
+        print('No access lists to sync in {}'.format(directory))
+        return
+
+    state = access.SyncState.load()
+    syncs = []
+    for srv in servers:
+        try:
+            syncs.append(access.plan_sync(srv, canonical, args.exact, not args.no_link, state))
+        except access.AccessListError as err:
+            print('[{}] {}'.format(srv.display_name, err))
+    for sync in syncs:
+        for update in sync.changed:
+            print(format_update(sync, update))
+
+    changed = [sync for sync in syncs if sync.changed]
+    count = sum(len(sync.changed) for sync in changed)
+    if args.dry_run:
+        print('Would update {} lists on {} servers'.format(count, len(changed)))
+        return
+
+    linked = 0
+    failures = 0
+    for sync in syncs:
+        for update in sync.updates:
+            if update.action is not None:
+                try:
+                    linked += access.apply_update(update) == 'linked'
+                except OSError as err:
+                    failures += 1
+                    print('[{}] could not write {}: {}'.format(sync.srv.display_name, update.path, err))
+                    continue
+            state.record(sync.srv, update.name, update.entries)
+    state.save()
+
+    reloaded = 0
+    if not args.no_reload:
+        targets = [(sync.srv, access.reload_commands(sync)) for sync in changed]
+        targets = [(srv, commands) for srv, commands in targets if commands]
+        for result in access.push_commands(targets, args.jobs, args.timeout):
+            if result['error'] is not None:
+                failures += 1
+                print('[{}] could not reload: {}'.format(result['server'], result['error']))
+            elif result['running']:
+                reloaded += 1
+            elif args.verbose > 0:
+                print('[{}] not running; it will read the new lists when it starts'.format(result['server']))
+        for sync in changed:
+            for diff in access.restart_changes(sync):
+                print('[{}] {}: {} cannot be applied over RCON; a running server picks them up when it restarts'.format(
+                    sync.srv.display_name, diff.name, ' '.join(describe_diff(diff))))
+    print('Updated {} lists on {} servers ({} linked); reloaded {} running servers{}'.format(count, len(changed),
+        linked, reloaded, '; {} failed'.format(failures) if failures else ''))
+
+def format_update(sync: ServerSync, update: access.ListUpdate) -> str:
+    """
+    Formats a change to one list as a line such as
+    `[lobby] whitelist: +Steve -Griefer ~Alex`.
+    """
+    parts = ['[{}] {}:'.format(sync.srv.display_name, update.name)]
+    parts += describe_diff(update.diff)
+    if update.action == 'link':
+        parts.append('(linked)')
+    return ' '.join(parts)
+
+def describe_diff(diff: ListDiff) -> List[str]:
+    label = (lambda entry: entry.get('ip', '?')) if diff.name == 'banned-ips' \
+        else (lambda entry: entry.get('name') or entry.get('uuid', '?'))
+    return ['+' + label(entry) for entry in diff.added] + ['-' + label(entry) for entry in diff.removed] \
+        + ['~' + label(entry) for entry in diff.changed]
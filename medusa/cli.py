@@ -0,0 +1,77 @@
+from typing import List
+
+# Only the modules needed by the requested command are imported, since the
+# CLI is often invoked by scripts where startup time dominates.
+
+def register_server_types():
+    """
+    Registers the built-in server types. Their modules are imported when a
+    type is first used, not here. Calling this again has no effect.
+    """
+    from . import servers
+    from .servers.models import add_lazy_server_type, is_type_supported
+    if is_type_supported(servers.FORGE):
+        return
+    # registration order breaks detection ties, so keep the most specific types first
+    add_lazy_server_type(servers.FORGE, 'medusa.servers.forge',
+        'ForgeServer', 'ForgeController', 'detect_forge')
+    add_lazy_server_type(servers.FABRIC, 'medusa.servers.fabric',
+        'FabricServer', 'FabricController', 'detect_fabric')
+    add_lazy_server_type(servers.VANILLA, 'medusa.servers.vanilla',
+        'VanillaServer', 'VanillaController', 'detect_vanilla')
+
+def main(argv: List[str]):
+    """
+    Runs a Medusa command in this process.
+
+    Parameters
+    ----------
+        argv: List of str
+            Command-line arguments, excluding the program name.
+    """
+    # inspect command, then handle in the respective submodule
+    # pop the subcommand from argv because argparse will be used
+    # on argv and is only expecting the command options, we are triggering the command itself
+    if len(argv) < 1:
+        cmd = ""
+    else:
+        cmd = argv[0]
+        args = argv[1:]
+
+    if (cmd == 'config'):
+        from . import config
+        config.process_config(args)
+    elif (cmd == 'server'):
+        register_server_types()
+        from .servers import manager
+        manager.process_server(args)
+    elif (cmd == 'run'):
+        register_server_types()
+        from . import run
+        run.process_run(args)
+    elif (cmd == 'status'):
+        register_server_types()
+        from . import status
+        status.process_status(args)
+    elif (cmd == 'logs'):
+        register_server_types()
+        from . import logs
+        logs.process_logs(args)
+    elif (cmd == 'access'):
+        register_server_types()
+        from . import access
+        access.process_access(args)
+    elif (cmd == 'dedupe'):
+        register_server_types()
+        from . import dedupe
+        dedupe.process_dedupe(args)
+    elif (cmd == 'mods'):
+        register_server_types()
+        from . import mods
+        mods.process_mods(args)
+    elif (cmd == 'daemon'):
+        from . import daemon
+        daemon.process_daemon(args)
+    else:
+        from . import parsers
+        parsers.print_help()
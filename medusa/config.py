@@ -2,9 +2,11 @@ import io
 import json
 from json import JSONDecodeError
 import os
+import threading
 
 from . import filebases
 from . import parsers
+from . import storage
 
 APP_NAME = 'medusa'
 APP_AUTHOR = 'Jay Rode'
@@ -56,14 +58,91 @@ def get_config_value(key: str):
     if key is None or key == "":
         raise KeyError
     try:
-        with open(get_config_location(), 'r') as dat:
-            obj = json.load(dat)
-            return obj[key]            
+        return get_config()[key]
     except FileNotFoundError:
         raise
     except:
         return
 
+class ConfigSnapshot:
+    """
+    Parsed copy of the config file that is shared by everything in the process.
+    The file is only read and parsed again once its identity, modification time,
+    or size changes, so repeated lookups cost a single `os.stat`. Long-running
+    processes such as `server watch` pick up edits made by other processes the
+    next time they read a value.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.data = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _version_of(path: str):
+        stat = os.stat(path)
+        return (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def get(self) -> dict:
+        """
+        Returns the parsed config, reloading it if the file has changed.
+        The returned dict is shared and must not be modified.
+
+        Raises
+        ------
+            FileNotFoundError
+                If there is no config file.
+        """
+        with self._lock:
+            path = get_config_location()
+            version = self._version_of(path)
+            if version != self.version:
+                with open(path, 'r') as dat:
+                    self.data = json.load(dat)
+                self.version = version
+            return self.data
+
+    def get_version(self):
+        """
+        Returns a value that changes whenever the config file changes, or `None`
+        if there is no config file.
+        """
+        try:
+            return self._version_of(get_config_location())
+        except OSError:
+            return None
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+            self.data = None
+
+_snapshot = ConfigSnapshot()
+
+def get_config() -> dict:
+    """
+    Returns the parsed config file from the shared `ConfigSnapshot`.
+    The returned dict must not be modified.
+
+    Raises
+    ------
+        FileNotFoundError
+            If there is no config file.
+    """
+    return _snapshot.get()
+
+def get_config_version():
+    """
+    Returns a value that changes whenever the config file changes.
+    """
+    return _snapshot.get_version()
+
+def invalidate_config():
+    """
+    Forces the next config read to go to disk.
+    """
+    _snapshot.invalidate()
+
 def set_config_value(key, value):
     """
     Sets the value of a given key in the Medusa config.
@@ -81,31 +160,34 @@ def set_config_value(key, value):
         KeyError
             If the given key is null or empty
     """
-    try:
-        file = open(get_config_location(), 'r')
-        obj = json.load(file)
-    except JSONDecodeError as jer:
-        if jer.lineno == 1 and jer.colno == 1:
-            print('Config file empty -- generate a new one with `medusa config init`')
-            exit(1)
-        else:
-            print(jer)
-        print('Error opening config for write -- file is malformed or corrupt')
-        raise
-    except FileNotFoundError as fnf:
-        print('Config not found at', get_config_location())
-        raise
-    except:
-        print("Unknown error opening config for write")
-        raise
+    with storage.locked(get_config_location()):
+        try:
+            with open(get_config_location(), 'r') as file:
+                obj = json.load(file)
+        except JSONDecodeError as jer:
+            if jer.lineno == 1 and jer.colno == 1:
+                print('Config file empty -- generate a new one with `medusa config init`')
+                exit(1)
+            else:
+                print(jer)
+            print('Error opening config for write -- file is malformed or corrupt')
+            raise
+        except FileNotFoundError as fnf:
+            print('Config not found at', get_config_location())
+            raise
+        except:
+            print("Unknown error opening config for write")
+            raise
 
-    obj[key] = value
-    try:
-        with open(get_config_location(), 'w') as file:
-            json.dump(obj, file)
-    except:
-        print('Error writing updated config to disk')
-        raise
+        obj[key] = value
+        try:
+            with storage.atomic_open(get_config_location()) as file:
+                json.dump(obj, file)
+        except:
+            print('Error writing updated config to disk')
+            raise
+        finally:
+            invalidate_config()
     
 
 def init_config(verbosity = None):
@@ -125,8 +207,10 @@ def init_config(verbosity = None):
         os.makedirs(os.path.dirname(get_config_location()))
     
     # open and write
-    with open(get_config_location(), 'w') as file:
-        file.write(filebases.DATA)
+    with storage.locked(get_config_location()):
+        with storage.atomic_open(get_config_location()) as file:
+            file.write(filebases.DATA)
+    invalidate_config()
     
     # print result
     print('Created new Medusa config at', os.path.abspath(get_config_location()))
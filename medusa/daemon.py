@@ -0,0 +1,409 @@
+"""
+`medusad`, an optional resident process that runs Medusa commands on behalf of
+the CLI. It keeps the config snapshot, the server registry, and any loaded
+server types in memory between commands, so a forwarded command skips
+interpreter startup and the registry decode.
+
+Requests and responses travel over a Unix domain socket next to the config as
+JSON objects, each preceded by its length as a 4-byte big-endian integer. The
+daemon greets each connection it picks up with `{"op": "ready"}`, and the CLI
+only sends its request after that, so a CLI that gives up waiting on a busy
+daemon can run the command itself without it also running in the daemon.
+"""
+import io
+import json
+import os
+import struct
+import sys
+from typing import List, Union
+
+SOCKET_NAME = 'medusad.sock'
+
+HEADER = struct.Struct('>I')
+
+MAX_MESSAGE = 64 * 1024 * 1024
+"""Largest message, in bytes, that will be accepted"""
+
+CONNECT_TIMEOUT = 1.0
+"""Seconds to wait for the daemon to accept a connection before running locally"""
+
+READY_TIMEOUT = 2.0
+"""Seconds to wait for a busy daemon to pick up the connection before running locally"""
+
+REQUEST_TIMEOUT = 5.0
+"""Seconds the daemon waits for a request once it has greeted a connection"""
+
+NO_DAEMON_ENV = 'MEDUSA_NO_DAEMON'
+"""Environment variable that, when set, keeps the CLI from forwarding commands"""
+
+LOCAL_COMMANDS = [['config', 'init'], ['server', 'watch'], ['daemon'], ['status'], ['logs', 'search'],
+    ['logs', 'retention'], ['access', 'sync'], ['dedupe'], ['mods']]
+"""
+Commands that always run in the calling process, because they prompt for
+input, run until interrupted, manage the daemon itself, or may take long
+enough to hold up every other command, since the daemon runs one at a time.
+"""
+
+LOCAL_OPTIONS = {'logs': ['-f', '--follow'], 'run': ['--all', '--type', '--match']}
+"""Options that make a command run in the calling process wherever they appear"""
+
+def get_socket_location() -> str:
+    """
+    Returns the path of the daemon's socket, which lives next to the config file.
+    """
+    from . import config
+    return os.path.join(os.path.dirname(config.get_config_location()), SOCKET_NAME)
+
+def send_message(sock, message: dict):
+    """
+    Sends one length-prefixed JSON message.
+    """
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+def recv_message(sock) -> Union[dict, None]:
+    """
+    Receives one length-prefixed JSON message, or returns `None` if the peer
+    closed the connection before sending anything.
+
+    Raises
+    ------
+        ConnectionError
+            If the connection closes part way through a message.
+        ValueError
+            If the message is too large or is not valid JSON.
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE:
+        raise ValueError('Message of {} bytes exceeds the limit of {}'.format(length, MAX_MESSAGE))
+    data = _recv_exactly(sock, length) if length > 0 else b''
+    if data is None:
+        raise ConnectionError('Connection closed part way through a message')
+    return json.loads(data.decode('utf-8'))
+
+def _recv_exactly(sock, size: int) -> Union[bytes, None]:
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ConnectionError('Connection closed part way through a message')
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def is_forwardable(argv: List[str]) -> bool:
+    """
+    Determines whether the given command may be handed to the daemon.
+    """
+    if len(argv) == 0:
+        return False
+    for prefix in LOCAL_COMMANDS:
+        if argv[:len(prefix)] == prefix:
+            return False
+    for option in LOCAL_OPTIONS.get(argv[0], []):
+        if option in argv[1:]:
+            return False
+    return True
+
+def _open(path: str):
+    """
+    Returns a socket connected to whatever listens at `path`, or `None` if
+    nothing does.
+    """
+    if not os.path.exists(path):
+        return None
+    # socket is only imported once there is a daemon to talk to
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(path)
+    except OSError:
+        # a socket file left behind by a daemon that did not shut down cleanly
+        sock.close()
+        return None
+    return sock
+
+def _connect(path: str):
+    """
+    Returns a socket connected to the daemon at `path` once the daemon has
+    picked up the connection, or `None` if no daemon is listening there or
+    it is still busy with another command after `READY_TIMEOUT` seconds.
+    """
+    sock = _open(path)
+    if sock is None:
+        return None
+    sock.settimeout(READY_TIMEOUT)
+    try:
+        greeting = recv_message(sock)
+    except (OSError, ValueError):
+        greeting = None
+    if not isinstance(greeting, dict) or greeting.get('op') != 'ready':
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+def request(message: dict, path: str = None) -> Union[dict, None]:
+    """
+    Sends a request to the daemon and returns its response, or `None` if
+    the daemon is not running.
+    """
+    sock = _connect(path or get_socket_location())
+    if sock is None:
+        return None
+    with sock:
+        send_message(sock, message)
+        return recv_message(sock)
+
+def forward(argv: List[str], path: str = None) -> Union[int, None]:
+    """
+    Runs a command in the daemon and copies its output to this process.
+
+    Parameters
+    ----------
+        argv: List of str
+            Command-line arguments, excluding the program name.
+
+        path: str (Optional)
+            Socket of the daemon. Defaults to `get_socket_location()`.
+
+    Returns
+    -------
+        int or None
+            The exit status of the command, or `None` if it should run in this
+            process instead, because no daemon is running or the command is
+            one of `LOCAL_COMMANDS`.
+    """
+    if os.environ.get(NO_DAEMON_ENV) or not is_forwardable(argv):
+        return None
+
+    sock = _connect(path or get_socket_location())
+    if sock is None:
+        return None
+
+    # once the request is sent the daemon may have acted on it, so errors
+    # past this point are reported rather than retried locally
+    try:
+        with sock:
+            send_message(sock, {'op': 'run', 'argv': argv})
+            response = recv_message(sock)
+    except (OSError, ValueError) as err:
+        print('Lost connection to medusad:', err, file=sys.stderr)
+        return 1
+    if response is None:
+        print('medusad closed the connection without responding', file=sys.stderr)
+        return 1
+
+    sys.stdout.write(response.get('stdout', ''))
+    sys.stderr.write(response.get('stderr', ''))
+    sys.stdout.flush()
+    return response.get('status', 1)
+
+def execute(argv: List[str]) -> dict:
+    """
+    Runs a command in this process with its output captured, returning the
+    response sent back to the CLI.
+    """
+    import traceback
+    from contextlib import redirect_stderr, redirect_stdout
+    from . import cli
+
+    out = io.StringIO()
+    err = io.StringIO()
+    status = 0
+    with redirect_stdout(out), redirect_stderr(err):
+        try:
+            cli.main(argv)
+        except SystemExit as exit:
+            # mirror how the interpreter turns `sys.exit` arguments into a status
+            if exit.code is None:
+                status = 0
+            elif isinstance(exit.code, int):
+                status = exit.code
+            else:
+                print(exit.code, file=sys.stderr)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+    return {'status': status, 'stdout': out.getvalue(), 'stderr': err.getvalue()}
+
+class Daemon:
+    """
+    Serves requests on a Unix domain socket, one at a time. Requests are
+    handled serially because commands print to the process-wide `sys.stdout`,
+    which is redirected while each one runs, and because it keeps the
+    in-memory registry consistent without further locking. Commands that can
+    take long run in the CLI instead (see `LOCAL_COMMANDS`), and a CLI that
+    finds the daemon busy for more than `READY_TIMEOUT` seconds runs the
+    command itself.
+
+    Commands run in the daemon's working directory. The CLI only finds the
+    daemon through the config location derived from its own working
+    directory, so the two always agree.
+    """
+
+    def __init__(self, path: str = None, verbosity: int = 1):
+        self.path = path or get_socket_location()
+        self.verbosity = verbosity
+        self.running = False
+        self._sock = None
+
+    def bind(self):
+        """
+        Creates the listening socket, replacing a stale socket file.
+
+        Raises
+        ------
+            RuntimeError
+                If another daemon is already listening on the socket.
+        """
+        import socket
+        if os.path.exists(self.path):
+            # a daemon busy with a command still accepts connections
+            existing = _open(self.path)
+            if existing is not None:
+                existing.close()
+                raise RuntimeError('medusad is already running at {}'.format(self.path))
+            os.remove(self.path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the owner may connect, since commands run with the daemon's permissions
+        umask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen(16)
+        self._sock = sock
+
+    def serve_forever(self):
+        """
+        Handles requests until a `stop` request arrives or the process is
+        interrupted, then removes the socket.
+        """
+        from . import cli
+        from .servers import supervisor
+        if self._sock is None:
+            self.bind()
+        cli.register_server_types()
+        # servers started here keep their consoles for as long as the daemon runs
+        supervisor.set_resident()
+        self._warm()
+        if self.verbosity > 0:
+            print('medusad listening on', self.path)
+            sys.stdout.flush()
+
+        self.running = True
+        try:
+            while self.running:
+                conn, _ = self._sock.accept()
+                with conn:
+                    self.handle(conn)
+        finally:
+            self.close()
+
+    def _warm(self):
+        # load the registry now rather than on the first request
+        from .servers import manager
+        try:
+            manager.get_servers()
+        except (OSError, ValueError):
+            pass
+
+    def handle(self, conn):
+        """
+        Greets the connection, then reads one request from it and answers it.
+        """
+        # a client that never sends its request must not hold up the others
+        conn.settimeout(REQUEST_TIMEOUT)
+        try:
+            send_message(conn, {'op': 'ready'})
+            message = recv_message(conn)
+        except (OSError, ValueError):
+            return
+        conn.settimeout(None)
+        if not isinstance(message, dict):
+            return
+
+        op = message.get('op', 'run')
+        if op == 'run':
+            argv = message.get('argv')
+            if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+                response = {'status': 2, 'stdout': '', 'stderr': 'Malformed request\n'}
+            else:
+                response = execute(argv)
+        elif op == 'ping':
+            response = {'status': 0, 'pid': os.getpid()}
+        elif op == 'stop':
+            self.running = False
+            response = {'status': 0}
+        else:
+            response = {'status': 2, 'stdout': '', 'stderr': 'Unknown request "{}"\n'.format(op)}
+
+        try:
+            send_message(conn, response)
+        except OSError:
+            # the client went away; there is nobody to report to
+            pass
+
+    def close(self):
+        self.running = False
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+def process_daemon(args):
+    """
+    Process CLI arguments for `daemon` commands.
+
+    Parameters
+    ----------
+        args : List of str
+            Command-line arguments following the `daemon` command.
+    """
+    from . import parsers
+    parser = parsers.get_daemon_parsers()
+    args = parser.parse_args(args)
+
+    if (args.action == 'start'):
+        import signal
+        daemon = Daemon(verbosity=args.verbose + 1)
+        try:
+            daemon.bind()
+        except RuntimeError as err:
+            print(err)
+            sys.exit(1)
+        # shut down cleanly, removing the socket, when asked to by the init system
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    elif (args.action == 'stop'):
+        if request({'op': 'stop'}) is None:
+            print('medusad is not running')
+        else:
+            print('Stopped medusad')
+    elif (args.action == 'status'):
+        response = request({'op': 'ping'})
+        if response is None:
+            print('medusad is not running')
+        else:
+            print('medusad is running (pid {}) at {}'.format(response.get('pid'), get_socket_location()))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    process_daemon(['start'] + sys.argv[1:])
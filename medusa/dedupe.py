@@ -0,0 +1,132 @@
+"""
+`medusa dedupe`, which keeps one copy of each mod and plugin jar shared by
+registered servers.
+"""
+import os
+import sys
+from typing import List
+
+from . import parsers, storage
+from .servers import jarstore
+from .servers.models import Server
+
+def process_dedupe(args: List[str]):
+    """
+    Process CLI arguments for the `dedupe` command.
+
+    Parameters
+    ----------
+        args : List of str
+            Command-line arguments following the `dedupe` command.
+    """
+    parser = parsers.get_dedupe_parsers()
+    args = parser.parse_args(args)
+
+    from .logs import select
+    store = jarstore.get_store_location()
+    if not os.path.isdir(os.path.dirname(store)):
+        print('The data directory {} does not exist; run `medusa config init` first'.format(os.path.dirname(store)))
+        return
+
+    servers = select(args)
+    if args.verify:
+        if not verify(store, servers, args.jobs):
+            sys.exit(1)
+        return
+    if len(servers) == 0:
+        print('No servers selected')
+        return
+    # one run at a time, so objects are not collected while another run links to them
+    with storage.locked(store):
+        cache = jarstore.HashCache.load()
+        jars = jarstore.hash_jars(servers, cache, args.jobs)
+        cache.save()
+        if args.verbose > 0:
+            print('Hashed {} jars ({} cached, {} read)'.format(len(jars), cache.hits, cache.misses))
+        if args.undo:
+            undo(jars, store, args.dry_run)
+        else:
+            dedupe(jars, store, args.dry_run, args.verbose)
+
+def dedupe(jars: List[jarstore.Jar], store: str, dry_run: bool = False, verbose: int = 0):
+    """
+    Links duplicate jars to the store and prints how much space that saved.
+    """
+    from .servers.retention import format_size
+    plan = jarstore.plan_dedupe(jars, store)
+    count = sum(len(group) for group in plan.values())
+    if dry_run:
+        for digest, group in plan.items():
+            for jar in group:
+                print('[{}] would link {} ({})'.format(jar.srv.display_name, os.path.relpath(jar.path, jar.srv.Path),
+                    format_size(jar.stat.st_size)))
+        print('Would link {} jars, saving {}'.format(count, format_size(jarstore.estimate_savings(plan, store))))
+        return
+
+    saved = 0
+    linked = 0
+    failures = 0
+    for result in jarstore.link_jars(plan, store):
+        if result.error is not None:
+            failures += 1
+            print('[{}] could not link {}: {}'.format(result.jar.srv.display_name, result.jar.path, result.error))
+            continue
+        linked += 1
+        saved += result.saved
+        if verbose > 0:
+            print('[{}] linked {}'.format(result.jar.srv.display_name, os.path.relpath(result.jar.path, result.jar.srv.Path)))
+    collected, collected_size = jarstore.collect_garbage(store)
+    print('Linked {} jars, saving {}{}'.format(linked, format_size(saved + collected_size),
+        '; {} failed'.format(failures) if failures else ''))
+    if collected > 0 and verbose > 0:
+        print('Removed {} jars from the store that no server uses'.format(collected))
+
+def undo(jars: List[jarstore.Jar], store: str, dry_run: bool = False):
+    """
+    Gives every linked jar its own copy again and empties the store of
+    objects no longer linked.
+    """
+    from .servers.retention import format_size
+    linked = jarstore.find_linked(jars, store)
+    size = sum(jar.stat.st_size for jar in linked)
+    if dry_run:
+        print('Would copy {} jars back, using {}'.format(len(linked), format_size(size)))
+        return
+    failures = 0
+    for jar in linked:
+        try:
+            jarstore.unlink_jar(jar)
+        except OSError as err:
+            failures += 1
+            print('[{}] could not copy {}: {}'.format(jar.srv.display_name, jar.path, err))
+    jarstore.collect_garbage(store)
+    print('Copied {} jars back, using {}{}'.format(len(linked) - failures, format_size(size),
+        '; {} failed'.format(failures) if failures else ''))
+
+def verify(store: str, servers: List[Server], jobs: int = 8) -> bool:
+    """
+    Rehashes every object in the store and prints those that are corrupt,
+    along with the jars of the given servers that link to them. Returns
+    whether the store is intact.
+    """
+    objects = list(jarstore.iter_objects(store))
+    corrupt = jarstore.verify_store(store, jobs)
+    if corrupt:
+        inodes = {}
+        for srv in servers:
+            for path in jarstore.find_jars(srv):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                inodes.setdefault((stat.st_dev, stat.st_ino), []).append((srv, path))
+    for path, digest in corrupt:
+        print('{} is corrupt: its contents hash to {}'.format(path, digest))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        for srv, jar_path in inodes.get((stat.st_dev, stat.st_ino), []):
+            print('  used by [{}] {}'.format(srv.display_name, os.path.relpath(jar_path, srv.Path)))
+    print('Verified {} jars in the store; {} corrupt'.format(len(objects), len(corrupt)))
+    return not corrupt
@@ -1,3 +1,3 @@
 DOT_MEDUSA = '{"metadata": {"alias":null}}'
 
-DATA = '{"server_directory":null,"server_registry":[]}'
\ No newline at end of file
+DATA = '{"server_directory":null,"registry_version":1,"server_registry":[]}'
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+`medusa logs`, which reads the logs of registered servers.
+"""
+import json
+import os
+import re
+import sys
+from typing import Iterable, Iterator, List, Tuple
+
+from . import parsers
+from .servers import manager
+from .servers.logtail import LogEvent, LogOffsets
+from .servers.models import Server
+
+def process_logs(args: List[str]):
+    """
+    Process CLI arguments for the `logs` command.
+
+    Parameters
+    ----------
+        args : List of str
+            Command-line arguments following the `logs` command.
+    """
+    parser = parsers.get_logs_parsers()
+    args = parser.parse_args(args)
+
+    if args.follow:
+        servers = select(args)
+        if len(servers) == 0:
+            print('No servers selected')
+            return
+        pattern = None
+        if args.grep is not None:
+            try:
+                pattern = re.compile(args.grep, re.IGNORECASE if args.ignore_case else 0)
+            except re.error as err:
+                print('Invalid expression "{}": {}'.format(args.grep, err))
+                return
+        try:
+            follow(servers, pattern, args.rate, not args.poll)
+        except KeyboardInterrupt:
+            pass
+    elif (args.action == 'events'):
+        servers = select(args)
+        if len(servers) == 0:
+            print('No servers selected')
+            return
+        offsets = LogOffsets.load()
+        try:
+            for srv, event in read_events(servers, offsets, args.kind):
+                if args.format == 'ndjson':
+                    record = event._asdict()
+                    record['server'] = srv.display_name
+                    print(json.dumps(record))
+                else:
+                    print(format_event(srv, event))
+        finally:
+            offsets.save()
+    elif (args.action == 'search'):
+        process_search(args)
+    elif (args.action == 'retention'):
+        process_retention(args)
+    else:
+        parser.print_usage()
+        print('Please specify a subcommand for `logs`')
+
+def print_read_error(path: str, error: str):
+    """
+    Reports an archive that `logs search` could not read to the end.
+    """
+    print('Could not read {}: {}'.format(path, error), file=sys.stderr)
+
+def process_search(args):
+    """
+    Prints the archived log lines that match the `logs search` arguments.
+    """
+    from .servers import logsearch
+    servers = select(args)
+    if len(servers) == 0:
+        print('No servers selected')
+        return
+    if args.pattern is not None:
+        try:
+            re.compile(args.pattern)
+        except re.error as err:
+            print('Invalid expression "{}": {}'.format(args.pattern, err))
+            return
+    query = logsearch.SearchQuery(args.pattern, args.ignore_case, args.player,
+        tuple(args.kind) if args.kind else None, args.since, args.until)
+
+    index = logsearch.LogIndex.load()
+    count = 0
+    try:
+        for match in logsearch.search(servers, query, args.jobs, index, on_error=print_read_error):
+            count += 1
+            if args.format == 'ndjson':
+                print(json.dumps(match._asdict()))
+                sys.stdout.flush()
+            else:
+                print('[{}] {} {}'.format(match.server, match.time, match.line))
+    finally:
+        index.save()
+    if args.verbose > 0:
+        print('{} matching lines'.format(count))
+
+def process_retention(args):
+    """
+    Applies the retention policy to the logs and crash reports of the selected
+    servers, or prints what it would do with `--dry-run`.
+    """
+    from .servers import retention
+    servers = select(args)
+    if len(servers) == 0:
+        print('No servers selected')
+        return
+    try:
+        policy = retention.get_policy(max_age_days=args.max_age, max_bytes=args.max_size,
+            compress_after_days=args.compress_after, format=args.compress_format)
+    except ValueError as err:
+        print('Invalid retention policy: {}'.format(err))
+        return
+
+    actions = [(srv, action) for srv in servers for action in retention.plan_retention(srv, policy)]
+    deleted = [action.size for srv, action in actions if action.action == 'delete']
+    compressed = [action.size for srv, action in actions if action.action == 'compress']
+    if args.dry_run:
+        for srv, action in actions:
+            print('[{}] would {} {} ({}, {})'.format(srv.display_name, action.action,
+                os.path.relpath(action.path, srv.Path), retention.format_size(action.size), action.reason))
+        print('Would delete {} files ({}) and compress {} files ({})'.format(len(deleted),
+            retention.format_size(sum(deleted)), len(compressed), retention.format_size(sum(compressed))))
+        return
+
+    reclaimed = 0
+    failures = 0
+    done = {'delete': 0, 'compress': 0}
+    for result in retention.apply_plan(actions, policy, args.jobs):
+        if result['error'] is not None:
+            failures += 1
+            print('[{}] could not {} {}: {}'.format(result['server'], result['action'], result['path'], result['error']))
+            continue
+        reclaimed += result['before'] - result['after']
+        done[result['action']] += 1
+        if args.verbose > 0:
+            print('[{}] {} {} ({} -> {})'.format(result['server'], 'deleted' if result['action'] == 'delete' else 'compressed',
+                result['path'], retention.format_size(result['before']), retention.format_size(result['after'])))
+    print('Reclaimed {} by deleting {} files and compressing {} files{}'.format(retention.format_size(reclaimed),
+        done['delete'], done['compress'], '; {} failed'.format(failures) if failures else ''))
+
+def select(args) -> List[Server]:
+    """
+    Returns the servers chosen by the `--type` or `--match` selector, or every
+    registered server if neither is given.
+    """
+    from .run import select_servers
+    if args.srv_type is None and args.match is None:
+        return list(manager.get_servers())
+    return select_servers(manager.get_servers(), srv_type=args.srv_type, match=args.match)
+
+def follow(servers: List[Server], pattern=None, rate: float = 0, use_inotify: bool = True,
+        out=None, until=None, interval: float = 1.0):
+    """
+    Prints lines appended to the logs of the given servers, each prefixed with
+    the server's name, until interrupted or until `until()` returns true,
+    which is checked at least every `interval` seconds.
+    """
+    from .servers.logfollow import LogFollower
+    out = out or sys.stdout
+    width = max(len(srv.display_name) for srv in servers)
+    follower = LogFollower(servers, pattern, rate, use_inotify)
+    try:
+        while until is None or not until():
+            lines = follower.poll(interval)
+            for srv, line in lines:
+                out.write('[{}] {}{}\n'.format(srv.display_name, ' ' * (width - len(srv.display_name)), line))
+            if lines:
+                out.flush()
+    finally:
+        follower.close()
+
+def read_events(servers: Iterable[Server], offsets: LogOffsets,
+        kinds: Iterable[str] = None) -> Iterator[Tuple[Server, LogEvent]]:
+    """
+    Yields the events each server logged since its saved offset, one server
+    after another, and records the new offsets in `offsets`.
+    """
+    kinds = set(kinds) if kinds else None
+    for srv in servers:
+        tail = offsets.open(srv)
+        try:
+            for event in tail.events():
+                if kinds is None or event.kind in kinds:
+                    yield srv, event
+        finally:
+            offsets.update(tail)
+            tail.close()
+
+def format_event(srv: Server, event: LogEvent) -> str:
+    """
+    Formats an event as a line such as `[lobby] 12:34:56 join Steve`.
+    """
+    parts = ['[{}]'.format(srv.display_name), event.time, event.kind]
+    if event.player is not None:
+        parts.append(event.player)
+    if event.kind not in ('join', 'leave'):
+        parts.append(event.text)
+    return ' '.join(parts)
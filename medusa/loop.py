@@ -0,0 +1,65 @@
+"""
+A single asyncio event loop, run in a background thread, shared by everything
+in the process that keeps network connections or child processes open. The
+synchronous CLI code submits coroutines to it with `run`, and long-lived
+resources such as RCON connections stay attached to the same loop between
+commands when Medusa runs as a daemon.
+"""
+import asyncio
+import threading
+from typing import Awaitable, TypeVar
+
+T = TypeVar('T')
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the shared event loop, starting its thread on first use.
+    """
+    global _loop, _thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name='medusa-loop', daemon=True)
+            _thread.start()
+        return _loop
+
+def run(coro: Awaitable[T], timeout: float = None) -> T:
+    """
+    Runs a coroutine on the shared loop and waits for its result.
+
+    Raises
+    ------
+        concurrent.futures.TimeoutError
+            If `timeout` seconds pass first. The coroutine is cancelled.
+        RuntimeError
+            If called from the shared loop's own thread, which would deadlock.
+    """
+    loop = get_loop()
+    if threading.current_thread() is _thread:
+        raise RuntimeError('medusa.loop.run() cannot be called from the loop thread')
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+def stop():
+    """
+    Stops the shared loop and waits for its thread to exit. The next call to
+    `get_loop` starts a new one.
+    """
+    global _loop, _thread
+    with _lock:
+        loop, thread = _loop, _thread
+        _loop = None
+        _thread = None
+    if loop is None:
+        return
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
@@ -0,0 +1,85 @@
+"""
+`medusa mods`, which answers which servers run which mods and plugins.
+"""
+import json
+import os
+import sys
+from typing import List
+
+from . import parsers
+from .servers import modindex
+from .servers.modindex import InstalledMod
+
+def process_mods(args: List[str]):
+    """
+    Process CLI arguments for the `mods` command.
+
+    Parameters
+    ----------
+        args : List of str
+            Command-line arguments following the `mods` command.
+    """
+    parser = parsers.get_mods_parsers()
+    args = parser.parse_args(args)
+    if args.action is None:
+        parser.print_usage()
+        print('Please specify a subcommand for `mods`')
+        return
+
+    from .logs import select
+    servers = select(args)
+    if len(servers) == 0:
+        print('No servers selected')
+        return
+    index = modindex.ModIndex.load()
+    inventory = modindex.get_inventory(servers, index, args.jobs)
+    index.save()
+    if args.verbose > 0:
+        print('Read {} jars ({} indexed)'.format(index.hits + index.misses, index.hits), file=sys.stderr)
+
+    if (args.action == 'list'):
+        print_mods(sorted(inventory, key=lambda mod: (mod.server, mod.id.lower())), args.format)
+    elif (args.action == 'where'):
+        found = modindex.find_mod(inventory, args.mod, args.version)
+        if len(found) == 0 and args.format == 'table':
+            print('No server has {}{}'.format(args.mod, ' ' + args.version if args.version else ''))
+            return
+        print_mods(sorted(found, key=lambda mod: (mod.id.lower(), mod.server)), args.format)
+    elif (args.action == 'outdated'):
+        outdated = modindex.find_outdated(inventory)
+        if args.mod is not None:
+            matching = {(mod.server, mod.path, mod.id) for mod in modindex.find_mod(inventory, args.mod)}
+            outdated = [(mod, latest) for mod, latest in outdated if (mod.server, mod.path, mod.id) in matching]
+        outdated.sort(key=lambda item: (item[0].id.lower(), item[0].server))
+        if args.format == 'ndjson':
+            for mod, latest in outdated:
+                record = mod._asdict()
+                record['newest'] = latest
+                print(json.dumps(record))
+            return
+        if len(outdated) == 0:
+            print('Every server runs the newest version found of each mod')
+            return
+        from prettytable import PrettyTable
+        x = PrettyTable()
+        x.field_names = ['Server', 'Mod', 'Version', 'Newest']
+        x.align = 'l'
+        for mod, latest in outdated:
+            x.add_row([mod.server, mod.id, mod.version, latest])
+        print(x)
+
+def print_mods(mods: List[InstalledMod], format: str = 'table'):
+    """
+    Prints installed mods as a table or as one JSON object per line.
+    """
+    if format == 'ndjson':
+        for mod in mods:
+            print(json.dumps(mod._asdict()))
+        return
+    from prettytable import PrettyTable
+    x = PrettyTable()
+    x.field_names = ['Server', 'Mod', 'Name', 'Version', 'Loader', 'File']
+    x.align = 'l'
+    for mod in mods:
+        x.add_row([mod.server, mod.id, mod.name or '', mod.version or '', mod.loader, os.path.basename(mod.path)])
+    print(x)
@@ -11,10 +11,18 @@ arg_verbose.add_argument('--verbose', '-v', action='count', default=0)
 arg_identifier = argparse.ArgumentParser(add_help=False)
 arg_identifier.add_argument('identifier', help='Alias or path of the server to remove')
 
-
+def _add_command_parser(name: str, **kwargs):
+    """
+    Adds a top-level command parser, discarding any parser previously built
+    under the same name. The `get_*_parsers` functions build a fresh parser on
+    every call, which argparse refuses to register twice since Python 3.11.
+    """
+    subparsers._name_parser_map.pop(name, None)
+    subparsers._choices_actions[:] = [a for a in subparsers._choices_actions if a.dest != name]
+    return subparsers.add_parser(name, **kwargs)
 
 def get_config_parsers():
-    config_parser = subparsers.add_parser('config')
+    config_parser = _add_command_parser('config')
     config_subparsers = config_parser.add_subparsers(dest='action')
     config_get_parser = config_subparsers.add_parser('get', parents=[arg_verbose])
     config_set_parser = config_subparsers.add_parser('set', parents=[arg_verbose])
@@ -29,7 +37,7 @@ def get_config_parsers():
     return config_parser
 
 def get_server_parsers():
-    server_parser = subparsers.add_parser('server')
+    server_parser = _add_command_parser('server')
     server_subparsers = server_parser.add_subparsers(dest='action')
 
     server_create_parser = server_subparsers.add_parser('create', parents=[arg_verbose])
@@ -40,9 +48,22 @@ def get_server_parsers():
 
     server_remove_parser = server_subparsers.add_parser('remove', parents=[arg_identifier, arg_verbose])
     server_list_parser = server_subparsers.add_parser('list', parents=[arg_verbose])
+    server_list_parser.add_argument('--plain', action='store_true',
+        help='Print one tab-separated line per server as it is read instead of a table')
     
     server_scan_parser = server_subparsers.add_parser('scan', parents=[arg_verbose])
     server_scan_parser.add_argument('-p', '--path', help='Path to directory to be scanned')
+    server_scan_parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of directories to inspect concurrently')
+    server_scan_parser.add_argument('--no-cache', action='store_true',
+        help='Inspect every directory again instead of reusing earlier results')
+
+    server_watch_parser = server_subparsers.add_parser('watch', parents=[arg_verbose])
+    server_watch_parser.add_argument('-p', '--path', help='Path to directory to be watched')
+    server_watch_parser.add_argument('-d', '--delay', type=float, default=2.0,
+        help='Seconds a directory must be left alone before it is inspected')
+    server_watch_parser.add_argument('--poll', action='store_true',
+        help='Poll for changes instead of using inotify')
 
     server_set_parser = server_subparsers.add_parser('set', parents=[arg_identifier, arg_verbose])
     server_set_parser.add_argument('property', choices=['alias','path', 'type'])
@@ -53,14 +74,162 @@ def get_server_parsers():
 
     return server_parser
 
+def get_daemon_parsers():
+    daemon_parser = _add_command_parser('daemon')
+    daemon_subparsers = daemon_parser.add_subparsers(dest='action')
+    daemon_subparsers.add_parser('start', parents=[arg_verbose],
+        help='Serve commands from this directory until stopped')
+    daemon_subparsers.add_parser('stop', help='Stop the running daemon')
+    daemon_subparsers.add_parser('status', help='Report whether the daemon is running')
+    return daemon_parser
+
 def get_run_parsers():
-    run_parser = subparsers.add_parser('run', parents = [arg_identifier, arg_verbose])
+    run_parser = _add_command_parser('run', parents = [arg_identifier, arg_verbose])
+    return run_parser
+
+RUN_SELECTORS = ['--all', '--type', '--match']
+"""Options of `run` that select several servers instead of naming one"""
+
+def get_run_fanout_parsers():
+    run_parser = _add_command_parser('run', parents=[arg_verbose])
+    selector = run_parser.add_mutually_exclusive_group(required=True)
+    selector.add_argument('--all', action='store_true', help='Run on every registered server')
+    selector.add_argument('--type', dest='srv_type', help='Run on every server of this type')
+    selector.add_argument('--match', metavar='GLOB',
+        help='Run on every server whose alias (or directory name, if it has none) matches')
+    run_parser.add_argument('-j', '--jobs', type=int, default=16,
+        help='Number of servers to contact at a time')
+    run_parser.add_argument('-t', '--timeout', type=float, default=10.0,
+        help='Seconds to wait for each server')
+    run_parser.add_argument('--format', choices=['table', 'ndjson'], default='table',
+        help='Print a table once every server has answered, or one JSON line per server as it answers')
+
+    run_subs = run_parser.add_subparsers(dest='action', required=True)
+    passthru_parser = run_subs.add_parser('pass', help='Passes the given command to each Minecraft server')
+    passthru_parser.add_argument('command', help='Command to execute in each server console')
     return run_parser
     
-def add_status_parsers(main_parser, main_subparser):
-    status_parser = main_subparser.add_parser('status')
+arg_selector = argparse.ArgumentParser(add_help=False)
+_selector_group = arg_selector.add_mutually_exclusive_group()
+_selector_group.add_argument('--type', dest='srv_type', help='Only servers of this type')
+_selector_group.add_argument('--match', metavar='GLOB',
+    help='Only servers whose alias (or directory name, if it has none) matches')
+
+def get_logs_parsers():
+    logs_parser = _add_command_parser('logs', parents=[arg_selector])
+    logs_parser.add_argument('-f', '--follow', action='store_true',
+        help='Print lines as they are appended to the logs of the selected servers, until interrupted')
+    logs_parser.add_argument('-g', '--grep', metavar='REGEX', help='Only print lines that match this expression')
+    logs_parser.add_argument('-i', '--ignore-case', action='store_true', help='Match --grep without regard to case')
+    logs_parser.add_argument('--rate', type=float, default=20.0,
+        help='Lines per second printed for each server before its lines are dropped; 0 for no limit')
+    logs_parser.add_argument('--poll', action='store_true', help='Check the logs on an interval instead of using inotify')
+    logs_subparsers = logs_parser.add_subparsers(dest='action')
+
+    logs_events_parser = logs_subparsers.add_parser('events', parents=[arg_selector, arg_verbose],
+        help='Print join, leave, lag, crash, and chat events logged since the last call')
+    logs_events_parser.add_argument('--kind', action='append', choices=['join', 'leave', 'lag', 'crash', 'chat'],
+        help='Only print events of this kind; may be repeated')
+    logs_events_parser.add_argument('--format', choices=['text', 'ndjson'], default='text',
+        help='Print one line of text or one JSON object per event')
+
+    logs_search_parser = logs_subparsers.add_parser('search', parents=[arg_selector, arg_verbose],
+        help='Search the archived logs of the selected servers, oldest lines first')
+    logs_search_parser.add_argument('pattern', nargs='?', help='Regular expression to look for in each line')
+    logs_search_parser.add_argument('-i', '--ignore-case', action='store_true', help='Match the pattern without regard to case')
+    logs_search_parser.add_argument('-p', '--player', help='Only lines that mention this player')
+    logs_search_parser.add_argument('--kind', action='append', choices=['join', 'leave', 'lag', 'crash', 'chat'],
+        help='Only lines that hold an event of this kind; may be repeated')
+    logs_search_parser.add_argument('--since', metavar='TIME', help='Only lines at or after this time, as YYYY-MM-DD [HH:MM:SS]')
+    logs_search_parser.add_argument('--until', metavar='TIME', help='Only lines before this time, as YYYY-MM-DD [HH:MM:SS]')
+    logs_search_parser.add_argument('-j', '--jobs', type=int, help='Number of archives to search at once; one per CPU by default')
+    logs_search_parser.add_argument('--format', choices=['text', 'ndjson'], default='text',
+        help='Print one line of text or one JSON object per match')
+
+    logs_retention_parser = logs_subparsers.add_parser('retention', parents=[arg_selector, arg_verbose],
+        help='Delete old logs and crash reports and compress the rest harder, per the retention policy')
+    logs_retention_parser.add_argument('-n', '--dry-run', action='store_true',
+        help='Print what would be deleted and compressed without changing anything')
+    logs_retention_parser.add_argument('--max-age', type=float, metavar='DAYS',
+        help='Delete files last modified more than this many days ago; 90 by default')
+    logs_retention_parser.add_argument('--max-size', metavar='SIZE',
+        help='Delete the oldest files until each server keeps at most this much, such as 500M')
+    logs_retention_parser.add_argument('--compress-after', type=float, metavar='DAYS',
+        help='Compress files last modified more than this many days ago; 1 by default')
+    logs_retention_parser.add_argument('--compress-format', choices=['xz', 'gzip'],
+        help='Compress with xz or with gzip at its highest level; xz by default')
+    logs_retention_parser.add_argument('-j', '--jobs', type=int, default=2,
+        help='Number of low-priority processes compressing at once')
+    return logs_parser
+
+def get_access_parsers():
+    access_parser = _add_command_parser('access')
+    access_subparsers = access_parser.add_subparsers(dest='action')
+
+    access_sync_parser = access_subparsers.add_parser('sync', parents=[arg_selector, arg_verbose],
+        help='Merge the canonical whitelist, ops, and bans into those of the selected servers')
+    access_sync_parser.add_argument('--source', metavar='IDENTIFIER',
+        help='Take the canonical lists from this server instead of data/access_lists/')
+    access_sync_parser.add_argument('--list', action='append', choices=['whitelist', 'ops', 'banned-players', 'banned-ips'],
+        help='Only sync this list; may be repeated')
+    access_sync_parser.add_argument('--exact', action='store_true',
+        help='Remove entries the canonical list lacks instead of keeping them')
+    access_sync_parser.add_argument('-n', '--dry-run', action='store_true',
+        help='Print what would change on each server without changing anything')
+    access_sync_parser.add_argument('--no-link', action='store_true',
+        help='Always write copies instead of hard linking lists that match the canonical one')
+    access_sync_parser.add_argument('--no-reload', action='store_true',
+        help='Do not tell running servers to reload their changed lists')
+    access_sync_parser.add_argument('-j', '--jobs', type=int, default=16,
+        help='Maximum number of servers told to reload at once')
+    access_sync_parser.add_argument('-t', '--timeout', type=float, default=5.0,
+        help='Seconds to wait for each running server to answer')
+    return access_parser
+
+def get_dedupe_parsers():
+    dedupe_parser = _add_command_parser('dedupe', parents=[arg_selector, arg_verbose])
+    dedupe_mode = dedupe_parser.add_mutually_exclusive_group()
+    dedupe_mode.add_argument('-n', '--dry-run', action='store_true',
+        help='Print which jars would be linked and the space saved without changing anything')
+    dedupe_mode.add_argument('--verify', action='store_true',
+        help='Rehash every jar in the store and report those that are corrupt')
+    dedupe_mode.add_argument('--undo', action='store_true',
+        help='Give every linked jar its own copy again and empty the store')
+    dedupe_parser.add_argument('-j', '--jobs', type=int, default=8, help='Number of jars hashed at once')
+    return dedupe_parser
+
+def get_mods_parsers():
+    mods_parser = _add_command_parser('mods')
+    mods_subparsers = mods_parser.add_subparsers(dest='action')
+    arg_mods = argparse.ArgumentParser(add_help=False, parents=[arg_selector, arg_verbose])
+    arg_mods.add_argument('-j', '--jobs', type=int, default=8, help='Number of jars read at once')
+    arg_mods.add_argument('--format', choices=['table', 'ndjson'], default='table',
+        help='Print a table or one JSON object per line')
+
+    mods_subparsers.add_parser('list', parents=[arg_mods],
+        help='List the mods and plugins of the selected servers')
+    mods_where_parser = mods_subparsers.add_parser('where', parents=[arg_mods],
+        help='List the servers that have a mod or plugin')
+    mods_where_parser.add_argument('mod', help='ID or name of the mod, or a glob such as "jei*"')
+    mods_where_parser.add_argument('version', nargs='?', help='Only servers with exactly this version')
+    mods_outdated_parser = mods_subparsers.add_parser('outdated', parents=[arg_mods],
+        help='List installs older than the newest version of the same mod found on any server')
+    mods_outdated_parser.add_argument('mod', nargs='?', help='Only this mod, by ID, name, or glob')
+    return mods_parser
+
+def get_status_parsers():
+    status_parser = _add_command_parser('status', parents=[arg_verbose])
     status_parser.add_argument('--server', '-s',
-        help='Name of the server')
+        help='Alias or path of a single server to query instead of all of them')
+    status_parser.add_argument('-t', '--timeout', type=float, default=3.0,
+        help='Seconds to wait for each probe of each server')
+    status_parser.add_argument('--format', choices=['table', 'ndjson'], default='table',
+        help='Print a table once every server has answered, or one JSON line per server as it answers')
+    status_parser.add_argument('--fresh', action='store_true',
+        help='Probe every server again instead of reusing recent results from the status cache')
+    status_parser.add_argument('--cache-stats', action='store_true',
+        help='Print how often the status cache has answered instead of the servers, then exit')
+    return status_parser
 
 def add_user_parsers(main_parser, main_subparser):
     user_parser = main_subparser.add_parser('user')
@@ -0,0 +1,358 @@
+"""
+Asyncio client for the Source RCON protocol spoken by Minecraft servers.
+
+Every packet is a little-endian `int32` length followed by an `int32` request
+ID, an `int32` type, and a null-terminated body plus one more null byte. A
+response to a command may be split over several packets that share the
+command's request ID, with no marker on the last one. To find the end, each
+command is followed by an empty `SERVERDATA_RESPONSE_VALUE` packet with an ID
+of its own; servers answer packets in order, so the echo of that sentinel
+arrives after the last part of the command's response.
+
+Request IDs also let several commands be in flight on one connection at a time.
+"""
+import asyncio
+import itertools
+import struct
+from typing import Dict, List, NamedTuple, Tuple
+
+from .servers import properties
+from .servers.models import Server
+
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+
+HEADER = struct.Struct('<ii')
+LENGTH = struct.Struct('<i')
+
+MAX_PACKET = 4096 + 10
+"""Largest packet, counted from after the length field, a server may send"""
+
+DEFAULT_TIMEOUT = 5.0
+"""Seconds to wait for a connection, authentication, or a response"""
+
+DEFAULT_RETRIES = 3
+"""Extra attempts made to open a connection before giving up"""
+
+class RconError(Exception):
+    """
+    Base class for RCON failures.
+    """
+
+class RconAuthError(RconError):
+    """
+    Raised when the server rejects the RCON password.
+    """
+
+class RconConnectionError(RconError, ConnectionError):
+    """
+    Raised when a connection cannot be opened or is lost.
+    """
+
+class RconTimeoutError(RconError, TimeoutError):
+    """
+    Raised when the server does not answer in time.
+    """
+
+class RconTarget(NamedTuple):
+    """
+    Address and password of a server's RCON listener.
+    """
+    host: str
+    port: int
+    password: str
+
+def get_rcon_target(srv: Server) -> RconTarget:
+    """
+    Reads the RCON settings from the server's `server.properties`.
+
+    Raises
+    ------
+        RconError
+            If RCON is not enabled or has no password.
+    """
+    props = properties.get_properties(srv)
+    if props.get('enable-rcon', 'false').lower() != 'true':
+        raise RconError('RCON is not enabled in {}'.format(properties.PROPERTIES_NAME))
+    password = props.get('rcon.password', '')
+    if password == '':
+        raise RconError('No rcon.password set in {}'.format(properties.PROPERTIES_NAME))
+    return RconTarget(properties.get_host(props),
+        properties.get_int(props, 'rcon.port', properties.DEFAULT_RCON_PORT), password)
+
+def encode_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    """
+    Encodes one RCON packet, including its length prefix.
+    """
+    payload = HEADER.pack(request_id, packet_type) + body.encode('utf-8') + b'\x00\x00'
+    return LENGTH.pack(len(payload)) + payload
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, int, str]:
+    """
+    Reads one packet and returns its `(request_id, type, body)`.
+
+    Raises
+    ------
+        asyncio.IncompleteReadError
+            If the connection closes part way through a packet.
+        RconError
+            If the packet is malformed.
+    """
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    if length < 10 or length > MAX_PACKET:
+        raise RconError('Invalid RCON packet length {}'.format(length))
+    data = await reader.readexactly(length)
+    request_id, packet_type = HEADER.unpack(data[:8])
+    return request_id, packet_type, data[8:-2].decode('utf-8', errors='replace')
+
+class RconConnection:
+    """
+    One authenticated RCON connection. Commands may be issued concurrently;
+    responses are matched to them by request ID by a single reader task.
+    """
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._ids = itertools.count(1)
+        # request ID -> (future, parts received so far)
+        self._pending: Dict[int, Tuple[asyncio.Future, List[str]]] = {}
+        # sentinel ID -> request ID of the command it follows
+        self._sentinels: Dict[int, int] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._read_task is not None and not self._read_task.done()
+
+    def _next_id(self) -> int:
+        # IDs are positive int32s; -1 is reserved for failed authentication
+        return next(self._ids) % 0x7fffffff + 1
+
+    async def connect(self):
+        """
+        Opens and authenticates the connection.
+
+        Raises
+        ------
+            RconAuthError
+                If the password is rejected.
+            RconTimeoutError
+                If the server does not answer within the timeout.
+            OSError
+                If the connection cannot be opened.
+        """
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            await asyncio.wait_for(self._authenticate(), self.timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise RconTimeoutError('Timed out connecting to {}:{}'.format(self.host, self.port))
+        except BaseException:
+            await self.close()
+            raise
+        self._read_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    async def _authenticate(self):
+        request_id = self._next_id()
+        self._writer.write(encode_packet(request_id, SERVERDATA_AUTH, self.password))
+        await self._writer.drain()
+        while True:
+            packet_id, packet_type, _ = await read_packet(self._reader)
+            # some servers send an empty response value ahead of the auth response
+            if packet_type != SERVERDATA_AUTH_RESPONSE:
+                continue
+            if packet_id == -1:
+                raise RconAuthError('RCON password rejected by {}:{}'.format(self.host, self.port))
+            if packet_id == request_id:
+                return
+
+    async def command(self, command: str, timeout: float = None) -> str:
+        """
+        Runs a console command and returns the server's full response.
+
+        Raises
+        ------
+            RconConnectionError
+                If the connection is closed or is lost before the response arrives.
+            RconTimeoutError
+                If the response does not arrive within `timeout` seconds.
+        """
+        if not self.connected:
+            raise RconConnectionError('Not connected to {}:{}'.format(self.host, self.port))
+
+        request_id = self._next_id()
+        sentinel_id = self._next_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, [])
+        self._sentinels[sentinel_id] = request_id
+        try:
+            self._writer.write(encode_packet(request_id, SERVERDATA_EXECCOMMAND, command)
+                + encode_packet(sentinel_id, SERVERDATA_RESPONSE_VALUE, ''))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise RconTimeoutError('Timed out waiting for {}:{} to run "{}"'.format(
+                self.host, self.port, command))
+        except RconError:
+            raise
+        except OSError as err:
+            raise RconConnectionError('Connection to {}:{} lost: {}'.format(self.host, self.port, err))
+        finally:
+            # a response arriving after a timeout is dropped by the reader
+            self._pending.pop(request_id, None)
+            self._sentinels.pop(sentinel_id, None)
+
+    async def _read_loop(self):
+        error = RconConnectionError('Connection to {}:{} closed'.format(self.host, self.port))
+        try:
+            while True:
+                packet_id, _, body = await read_packet(self._reader)
+                if packet_id in self._sentinels:
+                    entry = self._pending.pop(self._sentinels.pop(packet_id), None)
+                    if entry is not None and not entry[0].done():
+                        entry[0].set_result(''.join(entry[1]))
+                elif packet_id in self._pending:
+                    self._pending[packet_id][1].append(body)
+        except (asyncio.IncompleteReadError, OSError, RconError) as err:
+            if not isinstance(err, asyncio.IncompleteReadError):
+                error = RconConnectionError('Connection to {}:{} lost: {}'.format(self.host, self.port, err))
+        finally:
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            self._sentinels.clear()
+            if self._writer is not None:
+                self._writer.close()
+
+    async def close(self):
+        """
+        Closes the connection. Commands still waiting for a response fail.
+        """
+        if self._read_task is not None and not self._read_task.done():
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, asyncio.CancelledError):
+                pass
+            self._writer = None
+
+class RconPool:
+    """
+    Keeps one authenticated connection per server, opening it on first use and
+    again, with exponential backoff between attempts, after it is lost.
+
+    A command is never retried once it has been sent, since the server may have
+    run it; only opening the connection is retried.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+            backoff: float = 0.1, max_backoff: float = 5.0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._connections: Dict[Tuple[str, int], RconConnection] = {}
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+
+    async def get_connection(self, target: RconTarget) -> RconConnection:
+        """
+        Returns a live connection to the target, opening one if needed.
+
+        Raises
+        ------
+            RconAuthError
+                If the password is rejected. This is not retried.
+            RconConnectionError
+                If no connection could be opened after every retry.
+        """
+        key = (target.host, target.port)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        # the lock keeps concurrent commands from each opening a connection
+        async with lock:
+            conn = self._connections.get(key)
+            if conn is not None and conn.connected and conn.password == target.password:
+                return conn
+            if conn is not None:
+                await conn.close()
+                del self._connections[key]
+            conn = await self._connect(target)
+            self._connections[key] = conn
+            return conn
+
+    async def _connect(self, target: RconTarget) -> RconConnection:
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            conn = RconConnection(target.host, target.port, target.password, self.timeout)
+            try:
+                await conn.connect()
+                return conn
+            except RconAuthError:
+                raise
+            except (OSError, RconError) as err:
+                last_error = err
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        raise RconConnectionError('Could not connect to {}:{}: {}'.format(target.host, target.port, last_error))
+
+    async def command(self, target: RconTarget, command: str, timeout: float = None) -> str:
+        """
+        Runs a console command on the target server and returns its response.
+        """
+        conn = await self.get_connection(target)
+        return await conn.command(command, timeout)
+
+    async def close(self):
+        """
+        Closes every pooled connection.
+        """
+        connections = list(self._connections.values())
+        self._connections.clear()
+        for conn in connections:
+            await conn.close()
+
+_pool = None
+_pool_loop = None
+
+def get_pool() -> RconPool:
+    """
+    Returns the process-wide pool, whose connections live on the shared loop
+    from `medusa.loop` and so persist between commands run by `medusad`.
+    """
+    global _pool, _pool_loop
+    from . import loop
+    current = loop.get_loop()
+    if _pool is None or _pool_loop is not current:
+        _pool = RconPool()
+        _pool_loop = current
+    return _pool
+
+def send_command(srv: Server, command: str, timeout: float = None) -> str:
+    """
+    Runs a console command on a registered server over RCON and returns its
+    response. Blocks until the response arrives.
+
+    Raises
+    ------
+        RconError
+            If RCON is not configured for the server, the connection fails,
+            or the server does not answer in time.
+    """
+    from . import loop
+    target = get_rcon_target(srv)
+    return loop.run(get_pool().command(target, command, timeout))
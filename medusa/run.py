@@ -1,7 +1,15 @@
-from medusa.servers.forge import ForgeController
+import asyncio
+import fnmatch
+import json
+import queue
+import sys
+import time
+from typing import Iterable, Iterator, List
+
 from . import parsers
-from . import servers
-from .servers import FORGE, manager
+from . import rcon
+from .servers import manager, models
+from .servers.models import Server
 
 def process_run(args):
     """
@@ -12,20 +20,250 @@ def process_run(args):
     The most significant component of this method is the generation of
     a `ServerController` object for the named server. The desired command
     is handled within the ServerController.
+
+    With `--all`, `--type`, or `--match` in place of an identifier, the command
+    is sent to every selected server instead; see `run_on_servers`.
     """
+    if is_fanout(args):
+        process_fanout(args)
+        return
+
     parser = parsers.get_run_parsers()
-    args = parser.parse_args(args)
-    srv = manager.get_server_by_identifier(args.identifier)
+    # the action is parsed by the controller's own parser once the server is known
+    cmd_args = args
+    args, _ = parser.parse_known_args(args)
+    try:
+        srv = manager.get_server_by_identifier(args.identifier)
+    except manager.AmbiguousIdentifierError as amb:
+        print(amb)
+        return
 
     if srv is None:
         print('No server "{}"'.format(args.identifier))
         return
     else:
-        if srv.Type == FORGE:
-            controller = ForgeController(srv)
-            
-        else:
+        # controllers are looked up in the type registry, which imports
+        # only the module of the requested type
+        supported = models.get_supported_type(srv.Type)
+        if supported is None or supported.get('controller') is None:
             print('No controller available for', srv.Type)
             return
+        controller = supported['controller'](srv)
+
+    cmd = controller.get_parser().parse_args(cmd_args)
+    if (cmd.action == 'pass'):
+        try:
+            response = controller.send_command(cmd.command)
+        except rcon.RconError as err:
+            print('RCON error for {}: {}'.format(args.identifier, err))
+            return
+        if response:
+            print(response)
+    elif (cmd.action in ('start', 'stop', 'restart')):
+        from .servers.supervisor import SupervisorError
+        try:
+            if (cmd.action in ('stop', 'restart')):
+                returncode = controller.shutdown()
+                if cmd.action == 'restart' and returncode is None:
+                    # only asked to stop over RCON; starting again now would open the world twice
+                    controller.wait_for_stop()
+            if (cmd.action in ('start', 'restart')):
+                proc = controller.startup()
+                print('Started {} (pid {})'.format(args.identifier, proc.pid))
+                if proc.console_log is not None:
+                    print('Console output goes to', proc.console_log)
+        except (SupervisorError, rcon.RconError) as err:
+            print(err)
+    else:
+        controller.get_parser().print_help()
+
+def is_fanout(args: List[str]) -> bool:
+    """
+    Determines whether `run` arguments select several servers rather than one.
+    """
+    for arg in args:
+        if not arg.startswith('-'):
+            # options after the action belong to the action
+            if arg in ('pass', 'start', 'stop', 'restart'):
+                return False
+            continue
+        if any(arg == opt or arg.startswith(opt + '=') for opt in parsers.RUN_SELECTORS):
+            return True
+    return False
+
+def select_servers(servers: Iterable[Server], all: bool = False, srv_type: str = None,
+        match: str = None) -> List[Server]:
+    """
+    Returns the servers chosen by a `run` selector.
+
+    Parameters
+    ----------
+        all: bool
+            Select every server.
+
+        srv_type: str
+            Select servers of this type, ignoring case.
+
+        match: str
+            Select servers whose alias matches this glob. Servers without an
+            alias are matched by their directory name.
+    """
+    selected = []
+    for srv in servers:
+        if all:
+            selected.append(srv)
+        elif srv_type is not None:
+            if (srv.Type or '').lower() == srv_type.lower():
+                selected.append(srv)
+        elif match is not None:
+            if fnmatch.fnmatchcase(srv.display_name, match):
+                selected.append(srv)
+    return selected
+
+FANOUT_GRACE = 5.0
+"""Seconds beyond the slowest possible server that `run_on_servers` waits for results"""
+
+def run_on_servers(servers: List[Server], command: str, jobs: int = 16,
+        timeout: float = 10.0) -> Iterator[dict]:
+    """
+    Sends a console command to every given server over RCON, contacting at most
+    `jobs` servers at a time, and yields one result per server in the order
+    the servers finish.
+
+    Each result is a dict with the server's `server` name, `path`, and `type`,
+    whether it succeeded (`ok`), its `response` or `error`, and the
+    `elapsed` seconds. A server that does not answer within `timeout` seconds,
+    including the time spent connecting, is reported as failed. So is every
+    server that has not reported when the fan-out itself fails, or once every
+    wave of `jobs` servers could have timed out.
+    """
+    from . import loop
+
+    results = queue.Queue()
+    targets = []
+    unreachable = []
+    for srv in servers:
+        try:
+            targets.append((srv, rcon.get_rcon_target(srv)))
+        except rcon.RconError as err:
+            # servers without RCON fail straight away, without a connection attempt
+            unreachable.append(_result(srv, False, error=str(err)))
+
+    yield from unreachable
+    if len(targets) == 0:
+        return
+
+    future = asyncio.run_coroutine_threadsafe(_fanout(targets, command, jobs, timeout, results), loop.get_loop())
+    waves = -(-len(targets) // max(jobs, 1))
+    deadline = time.monotonic() + waves * timeout + FANOUT_GRACE
+    reported = set()
+    try:
+        while len(reported) < len(targets):
+            try:
+                index, result = results.get(timeout=0.1)
+            except queue.Empty:
+                if not future.done() and time.monotonic() < deadline:
+                    continue
+                break
+            reported.add(index)
+            yield result
+        else:
+            return
+
+        # every server reports before the fan-out finishes, so collect any stragglers
+        while True:
+            try:
+                index, result = results.get_nowait()
+            except queue.Empty:
+                break
+            reported.add(index)
+            yield result
+        if not future.done():
+            error = 'No result within {:g}s'.format(waves * timeout + FANOUT_GRACE)
+        elif future.cancelled():
+            error = 'Cancelled'
+        elif future.exception() is not None:
+            err = future.exception()
+            error = '{}: {}'.format(type(err).__name__, err)
+        else:
+            error = 'No result'
+        for index, (srv, target) in enumerate(targets):
+            if index not in reported:
+                yield _result(srv, False, error=error)
+    finally:
+        future.cancel()
+
+async def _fanout(targets, command: str, jobs: int, timeout: float, results: queue.Queue):
+    # runs on the shared loop; every server reports to `results` when it finishes
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+    pool = rcon.get_pool()
+    await asyncio.gather(*(_send_one(pool, semaphore, index, srv, target, command, timeout, results)
+        for index, (srv, target) in enumerate(targets)))
+
+async def _send_one(pool: 'rcon.RconPool', semaphore: asyncio.Semaphore, index: int, srv: Server,
+        target: 'rcon.RconTarget', command: str, timeout: float, results: queue.Queue):
+    start = time.monotonic()
+    result = _result(srv, False, error='Cancelled')
+    try:
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(pool.command(target, command, timeout), timeout)
+                result = _result(srv, True, response=response)
+            except asyncio.TimeoutError:
+                result = _result(srv, False, error='Timed out after {:g}s'.format(timeout))
+            except (rcon.RconError, OSError) as err:
+                result = _result(srv, False, error=str(err))
+            except Exception as err:
+                result = _result(srv, False, error='{}: {}'.format(type(err).__name__, err))
+    finally:
+        # reported even if cancelled, so the caller never waits on a server
+        result['elapsed'] = round(time.monotonic() - start, 3)
+        results.put((index, result))
+
+def _result(srv: Server, ok: bool, response: str = None, error: str = None) -> dict:
+    result = {'server': srv.display_name, 'path': srv.Path, 'type': srv.Type, 'ok': ok}
+    if ok:
+        result['response'] = response
+    else:
+        result['error'] = error
+    result['elapsed'] = 0.0
+    return result
+
+def process_fanout(args: List[str]):
+    """
+    Process `run` arguments that select several servers. Exits with status 1
+    if any server failed.
+    """
+    parser = parsers.get_run_fanout_parsers()
+    args = parser.parse_args(args)
+
+    servers = select_servers(manager.get_servers(), all=args.all, srv_type=args.srv_type,
+        match=args.match)
+    if len(servers) == 0:
+        print('No servers selected')
+        return
+
+    failed = 0
+    if args.format == 'ndjson':
+        for result in run_on_servers(servers, args.command, args.jobs, args.timeout):
+            failed += 0 if result['ok'] else 1
+            print(json.dumps(result))
+            sys.stdout.flush()
+    else:
+        from prettytable import PrettyTable
+        x = PrettyTable()
+        x.field_names = ['Server', 'Status', 'Response']
+        x.align = 'l'
+        for result in run_on_servers(servers, args.command, args.jobs, args.timeout):
+            failed += 0 if result['ok'] else 1
+            if result['ok']:
+                x.add_row([result['server'], 'ok', result['response']])
+            else:
+                x.add_row([result['server'], 'failed', result['error']])
+        print(x)
 
-    pass
\ No newline at end of file
+    if args.verbose > 0:
+        print('{} of {} servers succeeded'.format(len(servers) - failed, len(servers)))
+    if failed > 0:
+        sys.exit(1)
@@ -0,0 +1,459 @@
+"""
+Keeps the access lists of registered servers, `whitelist.json`, `ops.json`,
+`banned-players.json`, and `banned-ips.json`, in line with a canonical copy.
+
+The canonical lists live in `data/access_lists/`, or are taken from one of the
+servers. For each server, `plan_sync` merges them into the server's own lists
+and works out what changes: entries added, removed, and changed. Only lists
+that change are rewritten. Where the result is exactly the canonical list, the
+server's file is replaced by a hard link to the canonical file instead, so
+that every such server shares one copy; if the file system refuses the link,
+the file is written as usual.
+
+A running server keeps its lists in memory and writes them back whenever they
+change, so editing the files is not enough. `reload_commands` turns each
+server's changes into console commands (`whitelist reload`, `op`, `ban`, and
+so on) that `push_commands` sends to the servers that are running. The console
+cannot set an op level or a ban's expiry, so `restart_changes` lists the
+entries that only take effect on a restart.
+
+A linked list changes whenever the canonical file is edited in place, so its
+own contents say nothing about what the server has loaded. `SyncState` keeps
+the entries each server was last given, in `data/access_state.json`, and those
+are what a linked list is compared against.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from .. import config, storage
+from . import properties
+from .models import Server
+from .registry import path_key
+
+LIST_NAMES = ('whitelist', 'ops', 'banned-players', 'banned-ips')
+
+ACCESS_DIR = 'access_lists'
+
+STATE_NAME = 'access_state.json'
+
+DEFAULT_BAN_REASON = 'Banned by an operator.'
+
+DEFAULT_OP_LEVEL = 4
+"""Level `op` grants when `server.properties` sets no `op-permission-level`"""
+
+class AccessListError(Exception):
+    """
+    Raised when an access list cannot be read.
+    """
+
+class ListDiff(NamedTuple):
+    """
+    Difference between a server's list and what it should hold.
+    """
+    name: str
+    added: List[dict]
+    removed: List[dict]
+    changed: List[dict]
+    """New versions of entries that are in both but differ, such as an op level"""
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+class ListUpdate(NamedTuple):
+    name: str
+    path: str
+    entries: List[dict]
+    """Contents the list should have"""
+    diff: ListDiff
+    action: Union[str, None]
+    """`write`, `link` to the canonical file, or `None` if the file is already right"""
+    link: str
+    """Canonical file the list is, or would be, hard linked to"""
+
+class ServerSync(NamedTuple):
+    srv: Server
+    updates: List[ListUpdate]
+    """Every canonical list, whether or not the server's copy changes"""
+
+    @property
+    def changed(self) -> List[ListUpdate]:
+        return [update for update in self.updates if update.action is not None or not update.diff.empty]
+
+def get_access_lists_location() -> str:
+    """
+    Returns the directory holding the canonical lists, next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), ACCESS_DIR)
+
+def get_list_path(directory: str, name: str) -> str:
+    return os.path.join(directory, name + '.json')
+
+def read_list(path: str) -> Union[List[dict], None]:
+    """
+    Returns the entries of an access list, or `None` if the file does not exist.
+
+    Raises
+    ------
+        AccessListError
+            If the file is not a JSON list of objects.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            entries = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        raise AccessListError('Could not read {}: {}'.format(path, err))
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise AccessListError('{} is not a list of entries'.format(path))
+    return entries
+
+def format_list(entries: List[dict]) -> str:
+    """
+    Formats entries the way the server writes them.
+    """
+    return json.dumps(entries, indent=2, ensure_ascii=False)
+
+def read_canonical(directory: str, names: Iterable[str] = LIST_NAMES) -> Dict[str, Tuple[str, List[dict]]]:
+    """
+    Returns `{name: (path, entries)}` for each canonical list that exists in
+    the directory. Lists without a canonical file are left alone.
+    """
+    canonical = {}
+    for name in names:
+        path = get_list_path(directory, name)
+        entries = read_list(path)
+        if entries is not None:
+            canonical[name] = (path, entries)
+    return canonical
+
+def _keys(name: str, entry: dict) -> List[str]:
+    # players are matched by UUID or by name, since hand-written entries often lack one
+    if name == 'banned-ips':
+        return ['ip:' + str(entry.get('ip', ''))]
+    keys = []
+    if entry.get('uuid'):
+        keys.append('uuid:' + str(entry['uuid']).lower())
+    if entry.get('name'):
+        keys.append('name:' + str(entry['name']).lower())
+    return keys
+
+def _index(name: str, entries: List[dict]) -> Dict[str, dict]:
+    index = {}
+    for entry in entries:
+        for key in _keys(name, entry):
+            index.setdefault(key, entry)
+    return index
+
+def _find(name: str, index: Dict[str, dict], entry: dict) -> Union[dict, None]:
+    for key in _keys(name, entry):
+        if key in index:
+            return index[key]
+    return None
+
+def merge_lists(name: str, canonical: List[dict], current: List[dict], exact: bool = False) -> List[dict]:
+    """
+    Returns the canonical entries followed by those of the server's entries
+    that the canonical list does not cover. With `exact`, returns only the
+    canonical entries.
+    """
+    if exact:
+        return list(canonical)
+    index = _index(name, canonical)
+    return list(canonical) + [entry for entry in current if _find(name, index, entry) is None]
+
+def diff_lists(name: str, current: List[dict], target: List[dict]) -> ListDiff:
+    """
+    Compares a server's list with what it should hold.
+    """
+    current_index = _index(name, current)
+    target_index = _index(name, target)
+    added = []
+    changed = []
+    for entry in target:
+        old = _find(name, current_index, entry)
+        if old is None:
+            added.append(entry)
+        elif old != entry:
+            changed.append(entry)
+    removed = [entry for entry in current if _find(name, target_index, entry) is None]
+    return ListDiff(name, added, removed, changed)
+
+def plan_sync(srv: Server, canonical: Dict[str, Tuple[str, List[dict]]], exact: bool = False,
+        link: bool = True, state: 'SyncState' = None) -> ServerSync:
+    """
+    Works out which of the server's lists must change to take in the
+    canonical ones, and how.
+
+    Raises
+    ------
+        AccessListError
+            If one of the server's lists cannot be read.
+    """
+    updates = []
+    for name, (canonical_path, canonical_entries) in canonical.items():
+        path = get_list_path(srv.Path, name)
+        current = read_list(path)
+        entries = merge_lists(name, canonical_entries, current or [], exact)
+        linked = _same_file(path, canonical_path)
+        base = current or []
+        if linked and state is not None:
+            # the file changed along with the canonical list; compare with what the server was given
+            given = state.get(srv, name)
+            base = given if given is not None else base
+        diff = diff_lists(name, base, entries)
+        if link and entries == canonical_entries and not linked:
+            action = 'link'
+        elif current is None or (not linked and not diff.empty):
+            action = 'write'
+        else:
+            action = None
+        updates.append(ListUpdate(name, path, entries, diff, action, canonical_path))
+    return ServerSync(srv, updates)
+
+def _same_file(path: str, other: str) -> bool:
+    try:
+        return os.path.samefile(path, other)
+    except OSError:
+        return False
+
+def apply_update(update: ListUpdate) -> str:
+    """
+    Replaces the server's list, by a hard link to the canonical file if
+    planned and possible. Returns `linked` or `written`.
+
+    Raises
+    ------
+        OSError
+            If the list could not be written.
+    """
+    directory = os.path.dirname(update.path)
+    tmp_path = os.path.join(directory, '.{}.{}.tmp'.format(os.path.basename(update.path), os.getpid()))
+    if update.action == 'link':
+        try:
+            os.link(update.link, tmp_path)
+            os.replace(tmp_path, update.path)
+            return 'linked'
+        except OSError:
+            # other file systems, or no permission to link; fall back to a copy
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(format_list(update.entries))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, update.path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return 'written'
+
+def _ban_command(command: str, target: str, entry: dict) -> str:
+    reason = entry.get('reason')
+    if reason and reason != DEFAULT_BAN_REASON:
+        return '{} {} {}'.format(command, target, reason)
+    return '{} {}'.format(command, target)
+
+def _console_can_apply(name: str, entry: dict, op_level: int) -> bool:
+    # `op` grants the server's own level and `ban` cannot set an expiry
+    if name == 'ops':
+        return entry.get('level', op_level) == op_level and not entry.get('bypassesPlayerLimit', False)
+    if name in ('banned-players', 'banned-ips'):
+        return entry.get('expires', 'forever') == 'forever'
+    return True
+
+def _op_level(srv: Server) -> int:
+    return properties.get_int(properties.get_properties(srv), 'op-permission-level', DEFAULT_OP_LEVEL)
+
+def reload_commands(sync: ServerSync) -> List[str]:
+    """
+    Returns the console commands that bring a running server's lists in
+    memory in line with the changes made to its files. Changed entries are
+    removed and added again. Entries that the console cannot reproduce are
+    left out; see `restart_changes`.
+    """
+    commands = []
+    op_level = _op_level(sync.srv)
+    for update in sync.changed:
+        diff = update.diff
+        key = 'ip' if update.name == 'banned-ips' else 'name'
+        added = [entry for entry in diff.added if entry.get(key) and _console_can_apply(update.name, entry, op_level)]
+        removed = [entry for entry in diff.removed if entry.get(key)]
+        changed = [entry for entry in diff.changed if entry.get(key) and _console_can_apply(update.name, entry, op_level)]
+        if update.name == 'whitelist' and not diff.empty:
+            commands.append('whitelist reload')
+        elif update.name == 'ops':
+            commands += ['op {}'.format(entry['name']) for entry in added]
+            commands += ['deop {}'.format(entry['name']) for entry in removed]
+            for entry in changed:
+                commands += ['deop {}'.format(entry['name']), 'op {}'.format(entry['name'])]
+        elif update.name == 'banned-players':
+            commands += [_ban_command('ban', entry['name'], entry) for entry in added]
+            commands += ['pardon {}'.format(entry['name']) for entry in removed]
+            for entry in changed:
+                commands += ['pardon {}'.format(entry['name']), _ban_command('ban', entry['name'], entry)]
+        elif update.name == 'banned-ips':
+            commands += [_ban_command('ban-ip', entry['ip'], entry) for entry in added]
+            commands += ['pardon-ip {}'.format(entry['ip']) for entry in removed]
+            for entry in changed:
+                commands += ['pardon-ip {}'.format(entry['ip']), _ban_command('ban-ip', entry['ip'], entry)]
+    return commands
+
+def restart_changes(sync: ServerSync) -> List[ListDiff]:
+    """
+    Returns the added and changed entries that `reload_commands` cannot apply
+    to a running server, such as an op level other than the server's
+    `op-permission-level` or a ban that expires. They take effect when the
+    server next starts.
+    """
+    diffs = []
+    op_level = _op_level(sync.srv)
+    for update in sync.changed:
+        if update.name == 'whitelist':
+            continue
+        added = [entry for entry in update.diff.added if not _console_can_apply(update.name, entry, op_level)]
+        changed = [entry for entry in update.diff.changed if not _console_can_apply(update.name, entry, op_level)]
+        diff = ListDiff(update.name, added, [], changed)
+        if not diff.empty:
+            diffs.append(diff)
+    return diffs
+
+def get_state_location() -> str:
+    """
+    Returns the path of the sync state, which lives next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), STATE_NAME)
+
+def _digest(entries: List[dict]) -> str:
+    return hashlib.sha1(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()
+
+class SyncState:
+    """
+    The entries each server was last given for each list. Identical lists are
+    stored once.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.lists: Dict[str, List[dict]] = {}
+        self.servers: Dict[str, Dict[str, str]] = {}
+
+    @classmethod
+    def load(cls, path: str = None) -> 'SyncState':
+        """
+        Reads the state at the given path, or the default location if omitted.
+        A missing or unreadable file yields an empty state.
+        """
+        state = cls(path or get_state_location())
+        try:
+            with open(state.path, 'r') as file:
+                data = json.load(file)
+            state.lists = data.get('lists', {})
+            state.servers = data.get('servers', {})
+        except (OSError, ValueError, AttributeError):
+            state.lists = {}
+            state.servers = {}
+        return state
+
+    def get(self, srv: Server, name: str) -> Union[List[dict], None]:
+        digest = self.servers.get(path_key(srv.Path), {}).get(name)
+        return self.lists.get(digest) if digest is not None else None
+
+    def record(self, srv: Server, name: str, entries: List[dict]):
+        digest = _digest(entries)
+        self.lists[digest] = entries
+        self.servers.setdefault(path_key(srv.Path), {})[name] = digest
+
+    def save(self):
+        """
+        Writes the state to disk, keeping servers recorded by other processes
+        in the meantime. Nothing is written if the directory holding the config
+        does not exist yet.
+        """
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        with storage.locked(self.path):
+            stored = SyncState.load(self.path)
+            for key, names in self.servers.items():
+                for name, digest in names.items():
+                    stored.servers.setdefault(key, {})[name] = digest
+                    stored.lists[digest] = self.lists[digest]
+            used = {digest for names in stored.servers.values() for digest in names.values()}
+            lists = {digest: entries for digest, entries in stored.lists.items() if digest in used}
+            with storage.atomic_open(self.path) as file:
+                json.dump({'lists': lists, 'servers': stored.servers}, file)
+
+def push_commands(targets: List[Tuple[Server, List[str]]], jobs: int = 16, timeout: float = 5.0) -> Iterator[dict]:
+    """
+    Sends each server its commands, in order, and yields one result per server
+    with its `server` name, whether it was `running`, and an `error` if the
+    commands could not be delivered. Servers supervised by this process get
+    them on their console; the rest over RCON. A server whose RCON port
+    refuses the connection is taken to be stopped: it reads the new files
+    when it next starts.
+    """
+    from .. import loop
+    from . import supervisor
+    remote = []
+    for srv, commands in targets:
+        proc = supervisor.get_process(srv)
+        if proc is None or not proc.running:
+            remote.append((srv, commands))
+            continue
+        result = _result(srv, True)
+        try:
+            for command in commands:
+                supervisor.send_console(srv, command)
+        except supervisor.SupervisorError as err:
+            result['error'] = str(err)
+        yield result
+    if remote:
+        yield from loop.run(_push_all(remote, jobs, timeout))
+
+async def _push_all(targets: List[Tuple[Server, List[str]]], jobs: int, timeout: float) -> List[dict]:
+    from .. import rcon
+    # a refused connection means the server is stopped, so it is not retried
+    pool = rcon.RconPool(timeout=timeout, retries=0)
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+    try:
+        return await asyncio.gather(*[_push_one(pool, semaphore, srv, commands, timeout)
+            for srv, commands in targets])
+    finally:
+        await pool.close()
+
+async def _push_one(pool, semaphore: asyncio.Semaphore, srv: Server, commands: List[str], timeout: float) -> dict:
+    from .. import rcon
+    try:
+        target = rcon.get_rcon_target(srv)
+    except rcon.RconError as err:
+        return _result(srv, None, str(err))
+    async with semaphore:
+        try:
+            conn = await pool.get_connection(target)
+        except rcon.RconConnectionError:
+            return _result(srv, False)
+        except (rcon.RconError, OSError) as err:
+            return _result(srv, None, str(err))
+        try:
+            for command in commands:
+                await conn.command(command, timeout)
+        except (rcon.RconError, OSError) as err:
+            return _result(srv, True, str(err))
+    return _result(srv, True)
+
+def _result(srv: Server, running: Union[bool, None], error: str = None) -> dict:
+    return {
+        'server': srv.display_name,
+        'running': running,
+        'error': error,
+    }
@@ -0,0 +1,256 @@
+import abc
+import json
+import os
+from typing import Iterable, Iterator, List, Union
+
+from .. import config
+from .models import Server
+from .registry import AmbiguousIdentifierError, basename_key, path_key
+
+DEFAULT_BACKEND = 'json'
+
+SQLITE_NAME = 'medusa.db'
+
+class RegistryBackend(abc.ABC):
+    """
+    Storage for the server registry. A backend hands out a registry object
+    supporting `find`, `find_all`, `add`, `remove`, `replace`, `indexed_path`,
+    `len()` and iteration, and persists the changes recorded by a
+    `RegistryTransaction` when it commits.
+    """
+
+    name: str
+    """Value of the `registry_backend` config key that selects this backend"""
+
+    @abc.abstractmethod
+    def get_registry(self):
+        """
+        Returns the registry object for the current state of the backend.
+        """
+        pass
+
+    def begin(self, txn):
+        """
+        Called when a transaction opens, before any change is made.
+        """
+        pass
+
+    @abc.abstractmethod
+    def commit(self, txn):
+        """
+        Persists the changes recorded by the transaction.
+        """
+        pass
+
+    @abc.abstractmethod
+    def rollback(self, txn):
+        """
+        Discards the changes recorded by the transaction.
+        """
+        pass
+
+    def close(self):
+        pass
+
+def get_sqlite_location():
+    """
+    Returns the path of the SQLite registry, which lives next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), SQLITE_NAME)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS servers (
+    id INTEGER PRIMARY KEY,
+    alias TEXT,
+    path TEXT NOT NULL,
+    path_key TEXT,
+    basename TEXT,
+    type TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS servers_alias ON servers(alias);
+CREATE INDEX IF NOT EXISTS servers_path ON servers(path_key);
+CREATE INDEX IF NOT EXISTS servers_basename ON servers(basename);
+CREATE INDEX IF NOT EXISTS servers_type ON servers(type);
+'''
+
+class SqliteRegistry:
+    """
+    Registry view over the `servers` table. Lookups use the table's indexes
+    and iteration streams rows from a cursor, so the registry is never loaded
+    into memory as a whole. Every call returns new `Server` objects, which
+    remember their row in a `_rowid` attribute.
+    """
+
+    def __init__(self, conn: 'sqlite3.Connection'):
+        self._conn = conn
+
+    def _to_server(self, row) -> Server:
+        srv = Server.from_dict(json.loads(row[1]))
+        srv._rowid = row[0]
+        return srv
+
+    def _query(self, where: str, params) -> List[Server]:
+        rows = self._conn.execute('SELECT id, data FROM servers WHERE ' + where + ' ORDER BY id', params)
+        return [self._to_server(row) for row in rows]
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM servers').fetchone()[0]
+
+    def __iter__(self) -> Iterator[Server]:
+        cursor = self._conn.execute('SELECT id, data FROM servers ORDER BY id')
+        for row in cursor:
+            yield self._to_server(row)
+
+    def __getitem__(self, index: int) -> Server:
+        if index < 0:
+            index += len(self)
+        row = self._conn.execute('SELECT id, data FROM servers ORDER BY id LIMIT 1 OFFSET ?', (index,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return self._to_server(row)
+
+    def __contains__(self, srv):
+        rowid = getattr(srv, '_rowid', None)
+        if rowid is None:
+            return False
+        return self._conn.execute('SELECT 1 FROM servers WHERE id = ?', (rowid,)).fetchone() is not None
+
+    def iter_by_type(self, srv_type: str) -> Iterator[Server]:
+        """
+        Streams the servers of the given type.
+        """
+        cursor = self._conn.execute('SELECT id, data FROM servers WHERE type = ? ORDER BY id', (srv_type,))
+        for row in cursor:
+            yield self._to_server(row)
+
+    def _row_values(self, srv: Server):
+        return (srv.Alias or None, srv.Path, path_key(srv.Path), basename_key(srv.Path),
+            getattr(srv, 'Type', None), json.dumps(srv.to_dict()))
+
+    def add(self, srv: Server):
+        cursor = self._conn.execute(
+            'INSERT INTO servers (alias, path, path_key, basename, type, data) VALUES (?, ?, ?, ?, ?, ?)',
+            self._row_values(srv))
+        srv._rowid = cursor.lastrowid
+
+    def append(self, srv: Server):
+        self.add(srv)
+
+    def extend(self, servers: Iterable[Server]):
+        for srv in servers:
+            self.add(srv)
+
+    def remove(self, srv: Server):
+        if srv not in self:
+            raise ValueError('Server not in registry: {}'.format(srv.Path))
+        self._conn.execute('DELETE FROM servers WHERE id = ?', (srv._rowid,))
+
+    def replace(self, old: Server, new: Server):
+        if old not in self:
+            raise ValueError('Server not in registry: {}'.format(old.Path))
+        self._conn.execute(
+            'UPDATE servers SET alias = ?, path = ?, path_key = ?, basename = ?, type = ?, data = ? WHERE id = ?',
+            self._row_values(new) + (old._rowid,))
+        new._rowid = old._rowid
+
+    def reindex(self, srv: Server):
+        self.replace(srv, srv)
+
+    def indexed_path(self, srv: Server) -> Union[str, None]:
+        row = self._conn.execute('SELECT path_key FROM servers WHERE id = ?',
+            (getattr(srv, '_rowid', None),)).fetchone()
+        return row[0] if row else None
+
+    def find_all(self, identifier: str) -> List[Server]:
+        """
+        Returns every server the identifier could refer to, with the same
+        precedence as `ServerRegistry.find_all`.
+        """
+        if identifier is None:
+            return []
+        matches = self._query('alias = ? OR path_key = ?', (identifier, path_key(identifier)))
+        if matches:
+            return matches
+        return self._query('basename = ?', (identifier,))
+
+    def find(self, identifier: str) -> Union[Server, None]:
+        """
+        Returns the server identified by the given alias, path, or directory
+        name, or `None` if there is no such server.
+
+        Raises
+        ------
+            AmbiguousIdentifierError
+                If the identifier matches more than one server.
+        """
+        matches = self.find_all(identifier)
+        if len(matches) > 1:
+            raise AmbiguousIdentifierError(identifier, matches)
+        if len(matches) == 1:
+            return matches[0]
+        return None
+
+class SqliteBackend(RegistryBackend):
+    """
+    Keeps the registry in an SQLite database in WAL mode, so that lookups
+    and changes touch only the rows involved instead of the whole registry.
+    Suited to fleets of thousands of servers.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = None, import_servers: Iterable[Server] = None):
+        """
+        Parameters
+        ----------
+            path: str
+                Database file. Defaults to `medusa.db` next to the config.
+
+            import_servers: Iterable of Server (Optional)
+                Servers to copy in when the database is created, such as the
+                registry of the JSON backend being replaced.
+        """
+        # imported here so the default JSON backend never loads sqlite3
+        import sqlite3
+        self.path = path or get_sqlite_location()
+        self._conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # executescript() would commit early, so run the statements one by one
+                for statement in SCHEMA.split(';'):
+                    if statement.strip():
+                        self._conn.execute(statement)
+                if version == 0 and import_servers is not None:
+                    SqliteRegistry(self._conn).extend(import_servers)
+                self._conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        self._registry = SqliteRegistry(self._conn)
+
+    def get_registry(self) -> SqliteRegistry:
+        return self._registry
+
+    def begin(self, txn):
+        # take the write lock up front so the transaction cannot deadlock on upgrade
+        self._conn.execute('BEGIN IMMEDIATE')
+
+    def commit(self, txn):
+        self._conn.execute('COMMIT')
+
+    def rollback(self, txn):
+        if self._conn.in_transaction:
+            self._conn.execute('ROLLBACK')
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,90 @@
+import os
+from os import PathLike
+from typing import List, Tuple
+
+from . import NOTASERVER
+from . import models
+
+def list_top_level(directory: PathLike) -> List[os.DirEntry]:
+    """
+    Lists the immediate children of the given directory with a single
+    `os.scandir` call. Subdirectories are returned as entries but never
+    descended into, so the cost is independent of how large the world,
+    log, and backup folders inside a server have grown.
+
+    Parameters
+    ----------
+        directory: PathLike
+            Path to the directory to list.
+
+    Returns
+    -------
+        List of os.DirEntry
+            The entries of the directory, or an empty list if the path
+            is not a readable directory.
+    """
+    try:
+        with os.scandir(directory) as scan:
+            return list(scan)
+    except (NotADirectoryError, FileNotFoundError, PermissionError):
+        return []
+
+def top_level_jars(entries: List[os.DirEntry]) -> List[str]:
+    """
+    Returns the lowercased names of the `.jar` files among the given entries.
+    """
+    jars = []
+    for entry in entries:
+        name = entry.name.lower()
+        if name.endswith('.jar') and entry.is_file():
+            jars.append(name)
+    return jars
+
+def detect_server_type_from_entries(entries: List[os.DirEntry]) -> Tuple[str, float]:
+    """
+    Offers the given top-level directory entries to every registered type
+    strategy and returns the type that reported the highest confidence.
+    Ties go to whichever type was registered first.
+
+    Parameters
+    ----------
+        entries: List of os.DirEntry
+            Top-level entries of the candidate server directory.
+
+    Returns
+    -------
+        (str, float)
+            The detected server type and its confidence in the range `[0, 1]`.
+            If no strategy recognizes the directory, `(NOTASERVER, 0.0)` is returned.
+    """
+    best_type = NOTASERVER
+    best_confidence = 0.0
+    for supported in models.get_supported_types():
+        detector = supported.get('detector')
+        if detector is None:
+            continue
+
+        confidence = detector(entries)
+        if confidence > best_confidence:
+            best_type = supported['name']
+            best_confidence = confidence
+
+    return best_type, best_confidence
+
+def detect_server_type(directory: PathLike) -> Tuple[str, float]:
+    """
+    Determines the type of server stored in the given directory by reading
+    its top-level listing exactly once.
+
+    Parameters
+    ----------
+        directory: PathLike
+            Path to the candidate server directory.
+
+    Returns
+    -------
+        (str, float)
+            The detected server type and its confidence in the range `[0, 1]`.
+            If no strategy recognizes the directory, `(NOTASERVER, 0.0)` is returned.
+    """
+    return detect_server_type_from_entries(list_top_level(directory))
@@ -1,32 +1,35 @@
 from os import PathLike
 import os
+from typing import List
 
 from medusa.servers import FABRIC
 
+from .detection import list_top_level
 from .models import ServerController, Server
 
 
+def detect_fabric(entries: List[os.DirEntry]) -> float:
+    """
+    Detection strategy for Fabric servers. Returns the confidence, from 0 to 1,
+    that the given top-level directory entries belong to a Fabric server.
+    """
+    confidence = 0.0
+    for entry in entries:
+        name = entry.name.lower()
+        # strat 1 - jar files
+        if name.endswith('.jar') and 'fabric' in name and entry.is_file():
+            return 1.0
+        # strat 2 - loader cache directory
+        if name == '.fabric' and entry.is_dir():
+            confidence = 0.5
+
+    return confidence
+
 def is_path_fabirc(directory: PathLike) -> bool:
     """
     Determines whether the given path points to a Fabric server
     """
-    srv_dir = os.path.abspath(directory)
-    strat_jar = False
-    for dir_path, dir_names, f_names in os.walk(srv_dir):
-        # don't enter subdirectories
-        if dir_path != srv_dir:
-            continue        
-
-        # iterate through file names, recording each strategy's guess
-        for file in f_names:
-            file = file.lower()
-
-            # strat 1 - jar files
-            if file.endswith('.jar'):
-                if 'fabric' in file:
-                    strat_jar =  True
-                    
-    return strat_jar
+    return detect_fabric(list_top_level(directory)) > 0
 
 class FabricServer(Server):
     def __init__(self):
@@ -47,11 +50,13 @@ class FabricController(ServerController):
         
         self.info = srv
 
-    def startup(cls):
+    def startup(self):
         print('Starting Fabric server')
+        return super().startup()
 
-    def shutdown(cls):
+    def shutdown(self):
         print('Shutting down Fabric server')
+        return super().shutdown()
 
     @classmethod
     def get_parser(cls):
@@ -0,0 +1,341 @@
+"""
+Exact server type and version detection from the server jar itself.
+
+The detectors of each type only look at file names, so a jar called
+`mcmmo.jar` passes for a vanilla server. Instead, each top-level jar is opened
+as a zip, which reads only its central directory, and the few small entries
+that name the build are decompressed: `version.json`, which Mojang's server
+jars and the bundlers of Paper and Spigot carry, `META-INF/MANIFEST.MF`, whose
+main class tells the launchers apart and whose per-package sections hold the
+Forge and Minecraft versions of a Forge jar, `install.properties` of the Fabric
+server launcher, and `install_profile.json` of a Forge installer.
+
+Forge 1.17 and later, and NeoForge, start from `libraries/` rather than a
+top-level jar, so the version directory that the installer left there (the one
+`run.sh` or `run.bat` points at, if several) is used for them.
+"""
+import json
+import os
+import re
+import zipfile
+import zlib
+from typing import Dict, List, NamedTuple, Union
+
+from . import FABRIC, FORGE, PAPER, SPIGOT, VANILLA
+from .detection import list_top_level
+
+MANIFEST_ENTRY = 'META-INF/MANIFEST.MF'
+VERSION_ENTRY = 'version.json'
+VERSIONS_LIST_ENTRY = 'META-INF/versions.list'
+FABRIC_INSTALL_ENTRY = 'install.properties'
+INSTALL_PROFILE_ENTRY = 'install_profile.json'
+
+MAX_ENTRY = 1024 * 1024
+"""Largest entry that is read"""
+
+LIBRARY_MARKERS = (
+    ('libraries/net/minecraftforge/forge', 'forge'),
+    ('libraries/net/neoforged/neoforge', 'neoforge'),
+    ('libraries/net/neoforged/forge', 'neoforge'),
+)
+"""Directories the Forge and NeoForge installers leave, one subdirectory per version"""
+
+RUN_SCRIPTS = ('run.sh', 'run.bat')
+
+LOADER_TYPES = {
+    'forge': FORGE,
+    'neoforge': FORGE,
+    'fabric': FABRIC,
+    'quilt': FABRIC,
+    'paper': PAPER,
+    'spigot': SPIGOT,
+    'vanilla': VANILLA,
+}
+
+# sources of a fingerprint by preference: a launcher jar names the loader,
+# while a leftover installer may be for an older version than the one in use
+_RANKS = {'jar': 0, 'libraries': 1, 'installer': 2, 'server': 3, 'vanilla': 4}
+
+class Fingerprint(NamedTuple):
+    """
+    The loader and versions read from a server's files.
+    """
+    loader: str
+    """`vanilla`, `forge`, `neoforge`, `fabric`, `quilt`, `paper`, or `spigot`"""
+    loader_version: Union[str, None]
+    mc_version: Union[str, None]
+    source: str
+    """Path of the jar or directory it was read from, relative to the server"""
+
+def get_type(fp: Fingerprint) -> str:
+    """
+    Returns the server type for the fingerprint. Paper and Spigot are run
+    like vanilla servers until a type of their own is registered.
+    """
+    from .models import is_type_supported
+    srv_type = LOADER_TYPES.get(fp.loader, VANILLA)
+    return srv_type if is_type_supported(srv_type) else VANILLA
+
+def describe(fp: Fingerprint) -> str:
+    """
+    Returns a short description such as `forge 47.1.0 (1.20.1)`.
+    """
+    text = fp.loader
+    if fp.loader_version:
+        text += ' ' + fp.loader_version
+    if fp.mc_version:
+        text += ' ({})'.format(fp.mc_version) if fp.loader != 'vanilla' else ' ' + fp.mc_version
+    return text
+
+def parse_manifest(text: str) -> Dict[str, Dict[str, str]]:
+    """
+    Returns the attributes of a jar manifest by section. The main section is
+    keyed by the empty string and the others by their `Name`.
+    """
+    sections = {'': {}}
+    current = sections['']
+    key = None
+    for line in text.splitlines():
+        if line.startswith(' ') and key is not None:
+            # long values are wrapped onto lines starting with a space
+            current[key] += line[1:]
+            continue
+        if not line.strip():
+            current = None
+            key = None
+            continue
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        value = value.strip()
+        if current is None:
+            current = sections.setdefault(value if key == 'Name' else '', {})
+        current[key] = value
+    return sections
+
+def _read_entry(jar: zipfile.ZipFile, name: str) -> Union[str, None]:
+    try:
+        info = jar.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > MAX_ENTRY:
+        return None
+    return jar.read(info).decode('utf-8', errors='replace')
+
+def _read_json(jar: zipfile.ZipFile, name: str) -> dict:
+    text = _read_entry(jar, name)
+    if text is None:
+        return {}
+    try:
+        data = json.loads(text, strict=False)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _read_properties(text: str) -> Dict[str, str]:
+    props = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith(('#', '!')) and '=' in line:
+            key, value = line.split('=', 1)
+            props[key.strip()] = value.strip()
+    return props
+
+_MC_VERSION = re.compile(r'(?<![\d.])(1\.\d+(?:\.\d+)?)(?![\d.])')
+
+def _bundled_version(jar: zipfile.ZipFile) -> Union[str, None]:
+    # the Minecraft version a server jar or bundler was built from
+    version = _read_json(jar, VERSION_ENTRY).get('id')
+    if isinstance(version, str) and version:
+        return version
+    for line in (_read_entry(jar, VERSIONS_LIST_ENTRY) or '').splitlines():
+        # `<sha256>\t<id>\t<path>`, where the id may carry a prefix such as `paper-`
+        parts = line.split('\t')
+        if len(parts) >= 2:
+            match = _MC_VERSION.search(parts[1])
+            return match.group(1) if match else parts[1]
+    return None
+
+def _from_launcher(jar: zipfile.ZipFile, main_class: str, class_path: str) -> Union[tuple, None]:
+    # Fabric's server launcher records what it installs; older launchers
+    # and Quilt's only list the loader and mappings on their class path
+    text = _read_entry(jar, FABRIC_INSTALL_ENTRY)
+    if text is not None:
+        props = _read_properties(text)
+        if 'fabric-loader-version' in props:
+            return 'fabric', props['fabric-loader-version'], props.get('game-version')
+    for loader, package in (('fabric', 'net.fabricmc.'), ('quilt', 'org.quiltmc.')):
+        if not main_class.startswith(package):
+            continue
+        version = re.search(r'{}-loader-([^/\s]+?)\.jar'.format(loader), class_path)
+        mappings = re.search(r'(?:intermediary|hashed)-([^/\s]+?)\.jar', class_path)
+        return loader, version and version.group(1), mappings and mappings.group(1)
+    return None
+
+def _from_forge(jar: zipfile.ZipFile, manifest: Dict[str, Dict[str, str]]) -> Union[tuple, None]:
+    # Forge 1.13 to 1.16 name their versions in sections of the manifest
+    forge = manifest.get('net/minecraftforge/versions/forge/')
+    if forge is not None:
+        mcp = manifest.get('net/minecraftforge/versions/mcp/', {})
+        return 'forge', forge.get('Implementation-Version'), mcp.get('Specification-Version')
+    # older universal jars carry a launcher profile inheriting from vanilla
+    profile = _read_json(jar, VERSION_ENTRY)
+    profile_id = str(profile.get('id', ''))
+    if profile.get('inheritsFrom') and 'forge' in profile_id.lower():
+        mc_version = str(profile['inheritsFrom'])
+        version = re.split('forge', profile_id, flags=re.IGNORECASE)[-1].lstrip('-')
+        if version.startswith(mc_version + '-'):
+            version = version[len(mc_version) + 1:]
+        return 'forge', version or None, mc_version
+    return None
+
+def _from_installer(jar: zipfile.ZipFile) -> Union[tuple, None]:
+    profile = _read_json(jar, INSTALL_PROFILE_ENTRY)
+    # older installers nest the details under `install`
+    install = profile.get('install')
+    install = install if isinstance(install, dict) else {}
+    version = str(profile.get('version') or install.get('version') or '')
+    if not version:
+        return None
+    mc_version = profile.get('minecraft') or install.get('minecraft')
+    mc_version = str(mc_version) if mc_version else None
+    loader = 'neoforge' if 'neoforge' in version.lower() or profile.get('profile') == 'NeoForge' else 'forge'
+    # `1.20.1-forge-47.1.0`, `forge-1.12.2-14.23.5.2860`, or `neoforge-20.4.80`
+    version = re.split(r'forge-?', version, flags=re.IGNORECASE)[-1]
+    if mc_version and version.startswith(mc_version + '-'):
+        version = version[len(mc_version) + 1:]
+    return loader, version or None, mc_version
+
+def _read_server_jar(path: str) -> Union[tuple, None]:
+    # returns `(kind, loader, loader_version, mc_version)`, where `kind` ranks the source
+    name = os.path.basename(path)
+    with zipfile.ZipFile(path) as jar:
+        names = set(jar.namelist())
+        manifest = parse_manifest(_read_entry(jar, MANIFEST_ENTRY) or '')
+        main = manifest.get('', {})
+        main_class = main.get('Main-Class', '')
+
+        found = _from_launcher(jar, main_class, main.get('Class-Path', ''))
+        if found is None:
+            found = _from_forge(jar, manifest)
+        if found is not None:
+            return ('jar',) + found
+        if INSTALL_PROFILE_ENTRY in names:
+            found = _from_installer(jar)
+            return ('installer',) + found if found is not None else None
+
+        implementation = main.get('Implementation-Version')
+        if main_class.startswith(('io.papermc.paperclip.', 'com.destroystokyo.paperclip.')):
+            build = re.search(r'git-Paper-(\d+)', implementation or '') or re.search(r'-(\d+)\.jar$', name)
+            return 'server', 'paper', build and build.group(1), _bundled_version(jar)
+        if main_class.startswith('org.bukkit.craftbukkit.'):
+            return 'server', 'spigot', implementation, _bundled_version(jar)
+        if (main_class.startswith(('net.minecraft.server.', 'net.minecraft.bundler.'))
+                or 'net/minecraft/server/MinecraftServer.class' in names):
+            # jars before 1.14 have no version.json, so their name is the only hint
+            mc_version = _bundled_version(jar)
+            if mc_version is None:
+                match = _MC_VERSION.search(name)
+                mc_version = match and match.group(1)
+            return 'vanilla', 'vanilla', None, mc_version
+    return None
+
+def fingerprint_jar(path: str) -> Union[Fingerprint, None]:
+    """
+    Returns what the jar at `path` says about the server it runs, or `None`
+    if it is not a server jar, a launcher, or an installer, or is not a zip.
+    """
+    found = _read_jar_safely(path)
+    if found is None:
+        return None
+    return Fingerprint(found[1], found[2], found[3], os.path.basename(path))
+
+def _read_jar_safely(path: str) -> Union[tuple, None]:
+    try:
+        return _read_server_jar(path)
+    except (OSError, zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError, EOFError):
+        return None
+
+def _library_version(directory: str, marker: str, loader: str, scripts: str) -> Union[tuple, None]:
+    try:
+        versions = sorted(entry.name for entry in os.scandir(os.path.join(directory, marker)) if entry.is_dir())
+    except OSError:
+        return None
+    if not versions:
+        return None
+    # after an upgrade the old version is left behind, so prefer the one the scripts start
+    referenced = [version for version in versions if '{}/{}/'.format(marker, version) in scripts]
+    if referenced:
+        version = referenced[0]
+    else:
+        from .modindex import version_key
+        version = max(versions, key=version_key)
+
+    if '-' in version and _MC_VERSION.match(version):
+        # `1.20.1-47.1.0`
+        mc_version, loader_version = version.split('-', 1)
+    else:
+        # NeoForge numbers its releases after the Minecraft version: 20.4.x is 1.20.4, 21.0.x is 1.21
+        loader_version = version
+        parts = version.split('.')
+        mc_version = None
+        if len(parts) >= 2 and parts[0].isdigit() and parts[1].isdigit():
+            mc_version = '1.' + parts[0] + ('.' + parts[1] if parts[1] != '0' else '')
+    return loader, loader_version, mc_version, '{}/{}'.format(marker, version)
+
+def _read_scripts(directory: str) -> str:
+    text = ''
+    for name in RUN_SCRIPTS:
+        try:
+            with open(os.path.join(directory, name), 'r', errors='replace') as file:
+                text += file.read(MAX_ENTRY).replace('\\', '/')
+        except OSError:
+            pass
+    return text
+
+def get_inputs(directory: str, entries: List[os.DirEntry] = None) -> List[str]:
+    """
+    Returns the paths, relative to the server, whose contents decide its
+    fingerprint: the top-level jars, the run scripts, and the library
+    directories of the Forge and NeoForge installers, whether or not the
+    latter exist yet.
+    """
+    if entries is None:
+        entries = list_top_level(directory)
+    jars = sorted(entry.name for entry in entries if entry.name.lower().endswith('.jar') and entry.is_file())
+    return jars + list(RUN_SCRIPTS) + [marker for marker, loader in LIBRARY_MARKERS]
+
+def fingerprint_directory(directory: str, entries: List[os.DirEntry] = None) -> Union[Fingerprint, None]:
+    """
+    Returns the fingerprint of the server in `directory`, or `None` if none
+    of its files name a loader or Minecraft version.
+
+    A loader's launcher wins over the Forge libraries, which win over an
+    installer, then Paper or Spigot, then a vanilla server jar. A loader
+    whose files do not name the Minecraft version takes it from the vanilla
+    jar next to it, which is how older Fabric launchers are set up.
+    """
+    if entries is None:
+        entries = list_top_level(directory)
+    found = []
+    for name in get_inputs(directory, entries):
+        if name.lower().endswith('.jar'):
+            result = _read_jar_safely(os.path.join(directory, name))
+            if result is not None:
+                found.append((_RANKS[result[0]], result[1:] + (name,)))
+
+    if any(entry.name == 'libraries' and entry.is_dir() for entry in entries):
+        scripts = _read_scripts(directory)
+        for marker, loader in LIBRARY_MARKERS:
+            result = _library_version(directory, marker, loader, scripts)
+            if result is not None:
+                found.append((_RANKS['libraries'], result))
+
+    if not found:
+        return None
+    found.sort(key=lambda item: item[0])
+    best = Fingerprint(*found[0][1])
+    if best.mc_version is None:
+        mc_version = next((fp[2] for rank, fp in found if fp[2] is not None), None)
+        best = best._replace(mc_version=mc_version)
+    return best
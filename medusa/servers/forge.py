@@ -1,34 +1,36 @@
 import argparse
 from os import PathLike
 import os
-from typing import Union
+from typing import List, Union
 
 from medusa.servers import FORGE
 
+from .detection import list_top_level
 from .models import ServerController, Server
 from .. import parsers
 
+def detect_forge(entries: List[os.DirEntry]) -> float:
+    """
+    Detection strategy for Forge servers. Returns the confidence, from 0 to 1,
+    that the given top-level directory entries belong to a forge server.
+    """
+    confidence = 0.0
+    for entry in entries:
+        name = entry.name.lower()
+        # strat 1 - jar files
+        if name.endswith('.jar') and 'forge' in name and entry.is_file():
+            return 1.0
+        # strat 2 - installer-generated JVM args file (Forge 1.17+ has no top-level jar)
+        if name == 'user_jvm_args.txt' and entry.is_file():
+            confidence = 0.5
+
+    return confidence
+
 def is_path_forge(directory: PathLike) -> bool:
     """
     Determines whether the given path points to a forge server
     """
-    srv_dir = os.path.abspath(directory)
-    strat_jar = False
-    for dir_path, dir_names, f_names in os.walk(srv_dir):
-        # don't enter subdirectories
-        if dir_path != srv_dir:
-            continue        
-
-        # iterate through file names, recording each strategy's guess
-        for file in f_names:
-            file = file.lower()
-
-            # strat 1 - jar files
-            if file.endswith('.jar'):
-                if 'forge' in file:
-                    strat_jar =  True
-                    
-    return strat_jar
+    return detect_forge(list_top_level(directory)) > 0
 
 class ForgeServer(Server):
     def __init__(self):
@@ -49,11 +51,13 @@ class ForgeController(ServerController):
         
         self.info = srv
 
-    def startup(cls):
+    def startup(self):
         print('Starting Forge server')
+        return super().startup()
 
-    def shutdown(cls):
+    def shutdown(self):
         print('Shutting down Forge server')
+        return super().shutdown()
 
     @classmethod
     def get_parser(cls):
@@ -0,0 +1,325 @@
+"""
+Content-addressed store for the mod and plugin jars of registered servers.
+
+Every jar under a server's `mods/` and `plugins/` is hashed with SHA-256 in a
+pool of threads. Hashes are cached in `data/jar_hashes.json` by the file's
+device, inode, size, and modification time, so only new or changed jars are
+read again. Jars found more than once are kept once, in
+`data/jar_store/<2 hex digits>/<sha256>.jar`, and every copy is replaced by a
+hard link to that object. Hard links only work within one file system, so
+jars on another file system than the data directory are left alone.
+
+`verify_store` rehashes every object to catch corruption, and `undo` gives
+each linked jar its own copy again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from .. import config, storage
+from .models import Server
+
+JAR_DIRS = ('mods', 'plugins')
+
+STORE_NAME = 'jar_store'
+
+HASHES_NAME = 'jar_hashes.json'
+
+READ_SIZE = 1024 * 1024
+
+class Jar(NamedTuple):
+    srv: Server
+    path: str
+    stat: os.stat_result
+    digest: str
+
+class LinkResult(NamedTuple):
+    jar: Jar
+    saved: int
+    """Bytes freed by replacing the jar, which is 0 if its inode lives on elsewhere"""
+    error: Union[str, None]
+
+def get_store_location() -> str:
+    """
+    Returns the directory of the jar store, which lives next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), STORE_NAME)
+
+def get_hashes_location() -> str:
+    return os.path.join(os.path.dirname(config.get_config_location()), HASHES_NAME)
+
+def get_object_path(store: str, digest: str) -> str:
+    return os.path.join(store, digest[:2], digest + '.jar')
+
+class HashCache:
+    """
+    Remembers the SHA-256 of each jar, keyed on its device, inode, size, and
+    modification time. Replacing a jar changes its inode, and writing to it
+    changes its mtime, so an unchanged key means the hash still holds. Hard
+    links share a key and so are only hashed once.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = None) -> 'HashCache':
+        """
+        Reads the cache at the given path, or the default location if omitted.
+        A missing or unreadable cache file yields an empty cache.
+        """
+        cache = cls(path or get_hashes_location())
+        try:
+            with open(cache.path, 'r') as file:
+                cache.entries = json.load(file).get('entries', {})
+        except (OSError, ValueError, AttributeError):
+            cache.entries = {}
+        return cache
+
+    @staticmethod
+    def key(stat: os.stat_result) -> str:
+        return '{}:{}:{}:{}'.format(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def hash(self, path: str, stat: os.stat_result) -> str:
+        """
+        Returns the SHA-256 of the file, from the cache if it has not changed.
+        """
+        key = self.key(stat)
+        with self._lock:
+            self._seen.add(key)
+            digest = self.entries.get(key)
+            if digest is not None:
+                self.hits += 1
+                return digest
+            self.misses += 1
+        digest = hash_file(path)
+        with self._lock:
+            self.entries[key] = digest
+        return digest
+
+    def save(self):
+        """
+        Writes the entries used since loading to disk, dropping the rest.
+        Nothing is written if the directory holding the config does not exist yet.
+        """
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        entries = {key: digest for key, digest in self.entries.items() if key in self._seen}
+        with storage.atomic_open(self.path) as file:
+            json.dump({'entries': entries}, file)
+
+def hash_file(path: str) -> str:
+    """
+    Returns the hex SHA-256 of the file's contents.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                return sha.hexdigest()
+            sha.update(chunk)
+
+def find_jars(srv: Server) -> List[str]:
+    """
+    Returns the paths of the jars under the server's `mods/` and `plugins/`,
+    including subdirectories but not following symlinks.
+    """
+    paths = []
+    for directory in JAR_DIRS:
+        for root, dirs, files in os.walk(os.path.join(srv.Path, directory)):
+            paths += [os.path.join(root, name) for name in sorted(files)
+                if name.endswith('.jar') and not name.startswith('.')]
+            dirs.sort()
+    return paths
+
+def hash_jars(servers: Iterable[Server], cache: HashCache, jobs: int = 8) -> List[Jar]:
+    """
+    Hashes every jar of the given servers, reading up to `jobs` at a time.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def hash_one(item: Tuple[Server, str]) -> Union[Jar, None]:
+        srv, path = item
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+            if not os.path.isfile(path) or os.path.islink(path):
+                return None
+            return Jar(srv, path, stat, cache.hash(path, stat))
+        except OSError:
+            return None
+
+    items = [(srv, path) for srv in servers for path in find_jars(srv)]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix='medusa-hash') as pool:
+        return [jar for jar in pool.map(hash_one, items) if jar is not None]
+
+def _stat(path: str) -> Union[os.stat_result, None]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def plan_dedupe(jars: List[Jar], store: str) -> Dict[str, List[Jar]]:
+    """
+    Returns, by hash, the jars to replace with a link to the store object:
+    every jar whose contents exist elsewhere under another inode, whether in
+    another jar or in the store, and is not already that object.
+    """
+    groups: Dict[str, List[Jar]] = {}
+    for jar in jars:
+        groups.setdefault(jar.digest, []).append(jar)
+    plan = {}
+    for digest, group in groups.items():
+        stored = _stat(get_object_path(store, digest))
+        inodes = {(jar.stat.st_dev, jar.stat.st_ino) for jar in group}
+        if stored is not None:
+            inodes.add((stored.st_dev, stored.st_ino))
+        if len(inodes) < 2:
+            continue
+        pending = [jar for jar in group if stored is None
+            or (jar.stat.st_dev, jar.stat.st_ino) != (stored.st_dev, stored.st_ino)]
+        plan[digest] = pending
+    return plan
+
+def estimate_savings(plan: Dict[str, List[Jar]], store: str) -> int:
+    """
+    Returns the bytes that linking would free: one copy of each inode, less
+    the one kept as the store object if there is none yet.
+    """
+    saved = 0
+    for digest, group in plan.items():
+        inodes = {}
+        for jar in group:
+            inodes[(jar.stat.st_dev, jar.stat.st_ino)] = jar.stat.st_size
+        saved += sum(inodes.values())
+        if _stat(get_object_path(store, digest)) is None and inodes:
+            saved -= next(iter(inodes.values()))
+    return saved
+
+def _replace_with_link(source: str, path: str):
+    tmp_path = os.path.join(os.path.dirname(path), '.{}.{}.tmp'.format(os.path.basename(path), os.getpid()))
+    try:
+        os.link(source, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def link_jars(plan: Dict[str, List[Jar]], store: str) -> Iterator[LinkResult]:
+    """
+    Moves one copy of each planned hash into the store, if it is not there
+    yet, and replaces the other copies with hard links to it. A jar whose
+    inode, size, or mtime changed since it was hashed is left alone.
+    """
+    for digest, group in plan.items():
+        object_path = get_object_path(store, digest)
+        for jar in group:
+            try:
+                current = os.stat(jar.path)
+                if HashCache.key(current) != HashCache.key(jar.stat):
+                    yield LinkResult(jar, 0, 'changed since it was hashed')
+                    continue
+                if _stat(object_path) is None:
+                    # the first copy becomes the object; nothing is freed yet
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    os.link(jar.path, object_path)
+                    yield LinkResult(jar, 0, None)
+                    continue
+                _replace_with_link(object_path, jar.path)
+                yield LinkResult(jar, current.st_size if current.st_nlink == 1 else 0, None)
+            except OSError as err:
+                yield LinkResult(jar, 0, str(err))
+
+def collect_garbage(store: str) -> Tuple[int, int]:
+    """
+    Deletes store objects that no jar links to any more. Returns how many
+    were deleted and their total size.
+    """
+    count = 0
+    size = 0
+    for path, stat in iter_objects(store):
+        if stat.st_nlink == 1:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            count += 1
+            size += stat.st_size
+    return count, size
+
+def iter_objects(store: str) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Yields the path and stat of each object in the store.
+    """
+    try:
+        prefixes = sorted(os.listdir(store))
+    except OSError:
+        return
+    for prefix in prefixes:
+        directory = os.path.join(store, prefix)
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith('.jar'):
+                stat = _stat(os.path.join(directory, name))
+                if stat is not None:
+                    yield os.path.join(directory, name), stat
+
+def verify_store(store: str, jobs: int = 8) -> List[Tuple[str, str]]:
+    """
+    Rehashes every store object, ignoring the hash cache, and returns
+    `(path, actual hash)` for each whose contents no longer match its name.
+    Objects that can no longer be read, such as those collected by another
+    run in the meantime, are skipped.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    paths = [path for path, stat in iter_objects(store)]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix='medusa-hash') as pool:
+        digests = list(pool.map(_hash_object, paths))
+    return [(path, digest) for path, digest in zip(paths, digests)
+        if digest is not None and os.path.basename(path) != digest + '.jar']
+
+def _hash_object(path: str) -> Union[str, None]:
+    try:
+        return hash_file(path)
+    except OSError:
+        return None
+
+def find_linked(jars: Iterable[Jar], store: str) -> List[Jar]:
+    """
+    Returns the jars that are hard links to a store object.
+    """
+    linked = []
+    for jar in jars:
+        stored = _stat(get_object_path(store, jar.digest))
+        if stored is not None and (stored.st_dev, stored.st_ino) == (jar.stat.st_dev, jar.stat.st_ino):
+            linked.append(jar)
+    return linked
+
+def unlink_jar(jar: Jar):
+    """
+    Replaces a linked jar with a copy of its own, keeping its mode and times.
+    """
+    tmp_path = os.path.join(os.path.dirname(jar.path), '.{}.{}.tmp'.format(os.path.basename(jar.path), os.getpid()))
+    try:
+        shutil.copy2(jar.path, tmp_path)
+        os.replace(tmp_path, jar.path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,185 @@
+"""
+Follows the `logs/latest.log` of many servers at once from a single thread.
+
+One inotify instance watches the `logs/` directory of every followed server,
+so a write to any log, or its rotation, wakes the follower, which then reads
+only the logs that changed. Where inotify is unavailable, every log is checked
+on a short interval instead; an unchanged log costs one `os.stat`.
+
+Each server has its own token bucket, so a server that floods its log has its
+excess lines dropped, and counted, instead of drowning out the others.
+"""
+import os
+import time
+from typing import Dict, Iterable, List, Pattern, Tuple
+
+from .logtail import LOG_PATH, LogTail
+from .models import Server
+from .watch import IN_CLOSE_WRITE, IN_CREATE, IN_IGNORED, IN_MODIFY, IN_MOVED_TO, IN_Q_OVERFLOW, Inotify
+
+LOGS_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+"""Events watched on each `logs/` directory, which mean that a log grew or was replaced"""
+
+POLL_INTERVAL = 0.5
+"""Seconds between checks of every log when inotify is unavailable"""
+
+RESCAN_INTERVAL = 5.0
+"""Seconds between attempts to watch servers whose `logs/` directory is missing"""
+
+class RateLimiter:
+    """
+    Token bucket that lets through `rate` lines per second on average, with
+    bursts of up to `burst` lines, and counts the lines it holds back.
+    """
+
+    def __init__(self, rate: float, burst: float = None, now: float = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.burst
+        self.suppressed = 0
+        self._last = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def allow(self, now: float) -> bool:
+        """
+        Takes a token for one line, or counts the line as suppressed if there is none.
+        """
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.suppressed += 1
+        return False
+
+    def take_suppressed(self, now: float) -> int:
+        """
+        Returns and resets the count of suppressed lines once there is a token
+        left to report them with, or returns 0.
+        """
+        if self.suppressed == 0:
+            return 0
+        self._refill(now)
+        if self.tokens < 1.0:
+            return 0
+        self.tokens -= 1.0
+        count, self.suppressed = self.suppressed, 0
+        return count
+
+class LogFollower:
+    """
+    Follows the logs of the given servers, starting at their current ends.
+
+    Parameters
+    ----------
+        servers: Iterable of Server
+
+        pattern: Pattern
+            Only lines matching this compiled pattern are reported.
+
+        rate: float
+            Lines per second reported for each server before its lines are
+            suppressed; 0 or less disables the limit.
+
+        use_inotify: bool
+            Wait for inotify events rather than checking every log on an interval.
+    """
+
+    def __init__(self, servers: Iterable[Server], pattern: Pattern = None, rate: float = 0,
+            use_inotify: bool = True):
+        self.pattern = pattern
+        self.tails: List[LogTail] = []
+        self.limiters: Dict[int, RateLimiter] = {}
+        for srv in servers:
+            tail = LogTail(srv)
+            tail.skip_to_end()
+            self.tails.append(tail)
+            if rate > 0:
+                self.limiters[id(tail)] = RateLimiter(rate)
+
+        self._inotify = None
+        self._watches: Dict[int, LogTail] = {}
+        self._unwatched: List[LogTail] = []
+        self._next_rescan = 0.0
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+            except OSError:
+                self._inotify = None
+        if self._inotify is not None:
+            self._unwatched = list(self.tails)
+            self._watch_missing(time.monotonic())
+
+    def _watch_missing(self, now: float) -> List[LogTail]:
+        # watch `logs/` rather than the log, so that a rotated-in log is noticed too
+        watched = []
+        for tail in self._unwatched:
+            try:
+                wd = self._inotify.add_watch(os.path.dirname(tail.path), LOGS_MASK)
+            except OSError:
+                continue
+            self._watches[wd] = tail
+            watched.append(tail)
+        self._unwatched = [tail for tail in self._unwatched if tail not in watched]
+        self._next_rescan = now + RESCAN_INTERVAL
+        return watched
+
+    def close(self):
+        for tail in self.tails:
+            tail.close()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _changed(self, timeout: float) -> List[LogTail]:
+        if self._inotify is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return self.tails
+        changed = []
+        for wd, mask, name in self._inotify.read_events(timeout):
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, so any log may have changed
+                changed = list(self.tails)
+                continue
+            tail = self._watches.get(wd)
+            if tail is None:
+                continue
+            if mask & IN_IGNORED:
+                # `logs/` itself went away
+                del self._watches[wd]
+                self._unwatched.append(tail)
+            elif name == os.path.basename(LOG_PATH) and tail not in changed:
+                changed.append(tail)
+        now = time.monotonic()
+        if self._unwatched and now >= self._next_rescan:
+            # a server that just created `logs/` may already have written to it
+            changed.extend(tail for tail in self._watch_missing(now) if tail not in changed)
+        return changed
+
+    def poll(self, timeout: float) -> List[Tuple[Server, str]]:
+        """
+        Waits up to `timeout` seconds for logs to change and returns the new
+        lines that pass the filter and rate limit as `(server, line)` pairs,
+        along with notices of suppressed lines.
+        """
+        out = []
+        changed = self._changed(timeout)
+        now = time.monotonic()
+        for tail in changed:
+            limiter = self.limiters.get(id(tail))
+            for offset, line in tail.lines():
+                if self.pattern is not None and not self.pattern.search(line):
+                    continue
+                if limiter is not None and not limiter.allow(now):
+                    continue
+                out.append((tail.srv, line))
+
+        for tail in self.tails:
+            limiter = self.limiters.get(id(tail))
+            if limiter is not None:
+                count = limiter.take_suppressed(now)
+                if count:
+                    out.append((tail.srv, '({} lines suppressed)'.format(count)))
+        return out
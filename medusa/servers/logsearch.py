@@ -0,0 +1,476 @@
+"""
+Search over the rotated `logs/*.log.gz` archives of registered servers,
+including those recompressed to `.log.xz` by `medusa logs retention`.
+
+Archives are decompressed a block at a time and searched in a pool of
+processes. While an archive is searched, a small index of it is built: the
+time range of its lines, a bitmap of the kinds of event it holds, and a Bloom
+filter of the words in it, which tells whether a player could be mentioned.
+Indexes are saved in `data/log_index.json`, keyed by the archive's identity,
+and let later searches skip archives that cannot match without opening them.
+
+Vanilla, Fabric, and most other logs only record the time of day. The date of
+each line is taken from the archive's name (`2023-01-31-1.log.gz`) and moved
+forward whenever the time of day goes back, as it does at midnight. Such an
+archive cannot hold a line from before its name's date, which lets the first
+results of a search appear before the archives have been indexed.
+
+Matches are yielded in time order across every server as soon as no archive
+still being searched can hold an earlier line, so the first results appear
+while the remaining archives are still being read.
+"""
+import base64
+import datetime
+import gzip
+import hashlib
+import heapq
+import json
+import lzma
+import os
+import re
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from .. import config, storage
+from . import FABRIC, VANILLA
+from .logtail import EVENT_KINDS, get_event_pattern
+from .models import Server
+from .registry import path_key
+
+ARCHIVE_SUFFIXES = ('.log.gz', '.log.xz')
+INDEX_NAME = 'log_index.json'
+INDEX_VERSION = 3
+
+READ_SIZE = 1024 * 1024
+"""Bytes of decompressed lines searched at a time"""
+
+NAME_LENGTHS = (3, 16)
+"""Shortest and longest words recorded in the name filter, as for player names"""
+
+FILTER_BITS_PER_WORD = 10
+FILTER_HASHES = 7
+"""Size of the name filter, which gives about one false positive in a hundred"""
+
+FILTER_SIZES = (64, 64 * 1024)
+"""Smallest and largest name filter in bytes; fuller filters only prune less"""
+
+_WORD = re.compile(rb'\w+')
+_WORDS_ONLY = bytes(
+    byte if chr(byte).isascii() and (chr(byte).isalnum() or byte == ord('_')) else ord(' ')
+    for byte in range(256)
+).lower()
+"""Translation that lowercases a block and blanks the bytes `\\w` does not match"""
+
+_TIME_OF_DAY_TYPES = (VANILLA, FABRIC)
+"""Types whose lines only record the time of day"""
+
+_ARCHIVE_NAME = re.compile(r'^(\d{4})-(\d\d)-(\d\d)-(\d+)\.log\.(?:gz|xz)$')
+_MONTHS = {name.encode(): number for number, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
+
+class SearchQuery(NamedTuple):
+    """
+    What to look for. Every criterion that is set must match.
+    """
+    pattern: Union[str, None] = None
+    """Regular expression searched for in each line"""
+    ignore_case: bool = False
+    player: Union[str, None] = None
+    """Only lines that mention this player"""
+    kinds: Union[Tuple[str, ...], None] = None
+    """Only lines holding one of these kinds of event"""
+    since: Union[str, None] = None
+    """Only lines at or after this `YYYY-MM-DD HH:MM:SS` time, or any prefix of one"""
+    until: Union[str, None] = None
+    """Only lines before this time, or any prefix of one"""
+
+class SearchMatch(NamedTuple):
+    time: str
+    """`YYYY-MM-DD HH:MM:SS` time of the line"""
+    server: str
+    line: str
+    archive: str
+
+class Archive(NamedTuple):
+    srv_name: str
+    srv_type: str
+    path: str
+    day: str
+    """Date from the archive's name, as `YYYY-MM-DD`"""
+
+def find_archives(srv: Server) -> List[Archive]:
+    """
+    Returns the archives in the server's `logs/` directory, oldest first.
+    """
+    logs = os.path.join(srv.Path, 'logs')
+    try:
+        with os.scandir(logs) as scan:
+            names = [entry.name for entry in scan if entry.name.endswith(ARCHIVE_SUFFIXES) and entry.is_file()]
+    except OSError:
+        return []
+    name = srv.display_name
+    archives = []
+    for file_name in names:
+        match = _ARCHIVE_NAME.match(file_name)
+        if match is not None:
+            year, month, day, number = match.groups()
+            key = ('{}-{}-{}'.format(year, month, day), int(number))
+        else:
+            # not named by date; fall back to when it was last written
+            mtime = os.stat(os.path.join(logs, file_name)).st_mtime
+            key = (datetime.date.fromtimestamp(mtime).isoformat(), 0)
+        archives.append((key, Archive(name, srv.Type, os.path.join(logs, file_name), key[0])))
+    return [archive for key, archive in sorted(archives)]
+
+def _identity(path: str) -> Union[List[int], None]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+class _Clock:
+    """
+    Works out the full time of each line from the timestamps in the log.
+    """
+
+    def __init__(self, day: str):
+        self.day = datetime.date.fromisoformat(day)
+        self._day_text = day
+        self._last_seconds = None
+        self._dates: Dict[bytes, str] = {}
+
+    def stamp(self, line: bytes) -> Union[str, None]:
+        """
+        Returns the `YYYY-MM-DD HH:MM:SS` time of the line, or `None` if the
+        line has no timestamp.
+        """
+        if line[:1] != b'[':
+            return None
+        if line[3:4] == b':' and line[9:10] == b']':
+            # `[12:34:56]`
+            time = line[1:9]
+            try:
+                seconds = int(time[0:2]) * 3600 + int(time[3:5]) * 60 + int(time[6:8])
+            except ValueError:
+                return None
+            if self._last_seconds is not None and seconds < self._last_seconds - 3600:
+                self.day += datetime.timedelta(days=1)
+                self._day_text = self.day.isoformat()
+            self._last_seconds = seconds
+            return self._day_text + ' ' + time.decode('ascii')
+        if line[10:11] == b' ' and line[13:14] == b':':
+            # `[01Jan2023 12:34:56.789]`
+            date = self._dates.get(line[1:10])
+            if date is None:
+                month = _MONTHS.get(line[3:6])
+                if month is None:
+                    return None
+                date = '{}-{:02d}-{}'.format(line[6:10].decode('ascii'), month, line[1:3].decode('ascii'))
+                self._dates[line[1:10]] = date
+            return date + ' ' + line[11:19].decode('ascii')
+        return None
+
+def scan_archive(archive: Archive, query: SearchQuery) -> Tuple[Union[dict, None], List[SearchMatch], Union[str, None]]:
+    """
+    Decompresses an archive a block of lines at a time and returns its index,
+    the lines matching the query, and `None`. An archive that cannot be read
+    to the end, such as one cut short while it was written, has no index and
+    comes back with the matches found before the damage and the error instead.
+    Runs in a worker process.
+    """
+    event_pattern = get_event_pattern(archive.srv_type)
+    flags = re.IGNORECASE if query.ignore_case else 0
+    pattern = re.compile(query.pattern.encode('utf-8'), flags) if query.pattern else None
+    player = re.compile(rb'\b' + re.escape(query.player.encode('utf-8')) + rb'\b', re.IGNORECASE) \
+        if query.player else None
+    kinds = set(query.kinds) if query.kinds else None
+
+    bitmap = 0
+    words = set()
+    clock = _Clock(archive.day)
+    start = end = None
+    stamp = archive.day + ' 00:00:00'
+    matches = []
+    count = 0
+    opener = lzma.open if archive.path.endswith('.xz') else gzip.open
+    try:
+        with opener(archive.path, 'rb') as file:
+            while True:
+                lines = file.readlines(READ_SIZE)
+                if not lines:
+                    break
+                # events are found with one pass of the type's pattern over each block
+                block = b''.join(lines)
+                events = {}
+                for match in event_pattern.finditer(block):
+                    kind = match.lastgroup
+                    events[match.start()] = kind
+                    bitmap |= 1 << EVENT_KINDS.index(kind)
+                # `\b<name>\b` only matches a whole word of the line
+                words.update(block.translate(_WORDS_ONLY).split())
+
+                offset = 0
+                for line in lines:
+                    line_offset = offset
+                    offset += len(line)
+                    count += 1
+                    line = line.rstrip(b'\n')
+                    line_stamp = clock.stamp(line)
+                    if line_stamp is not None:
+                        stamp = line_stamp
+                    if not line:
+                        continue
+                    # the range covers the time given to every line, stamped or not
+                    if start is None or stamp < start:
+                        start = stamp
+                    if end is None or stamp > end:
+                        end = stamp
+                    if query.since is not None and stamp < query.since:
+                        continue
+                    if query.until is not None and stamp >= query.until:
+                        continue
+                    if kinds is not None and events.get(line_offset) not in kinds:
+                        continue
+                    if player is not None and not player.search(line):
+                        continue
+                    if pattern is not None and not pattern.search(line):
+                        continue
+                    matches.append(SearchMatch(stamp, archive.srv_name,
+                        line.rstrip(b'\r').decode('utf-8', errors='replace'), archive.path))
+    except (OSError, EOFError, zlib.error, lzma.LZMAError) as err:
+        return None, matches, str(err) or type(err).__name__
+
+    index = {
+        'identity': _identity(archive.path),
+        'start': start,
+        'end': end,
+        'events': bitmap,
+        'names': build_name_filter(words),
+        'lines': count,
+    }
+    return index, matches, None
+
+def _filter_bits(word: bytes, size: int) -> Iterator[int]:
+    # double hashing of one 64-bit digest gives every probe of the word
+    digest = int.from_bytes(hashlib.blake2b(word, digest_size=8).digest(), 'little')
+    first, second = digest & 0xffffffff, (digest >> 32) | 1
+    for i in range(FILTER_HASHES):
+        yield (first + i * second) % size
+
+def _is_name_word(word: bytes) -> bool:
+    # numbers fill logs with coordinates and counts, so they are never recorded
+    low, high = NAME_LENGTHS
+    return low <= len(word) <= high and not word.isdigit()
+
+def build_name_filter(words: Iterable[bytes]) -> str:
+    """
+    Returns a Bloom filter of the lowercase words that could be player names,
+    encoded for the index.
+    """
+    words = [word for word in words if _is_name_word(word)]
+    smallest, largest = FILTER_SIZES
+    size = min(max(len(words) * FILTER_BITS_PER_WORD // 8, smallest), largest) * 8
+    bits = bytearray(size // 8)
+    for word in words:
+        for bit in _filter_bits(word, size):
+            bits[bit >> 3] |= 1 << (bit & 7)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+def may_mention(name_filter: str, player: str) -> bool:
+    """
+    Tells whether an archive with the given name filter could hold a line in
+    which `\b<player>\b` matches. Every whole word of the name must appear
+    as a whole word of the line, so only those words are looked up.
+    """
+    bits = base64.b64decode(name_filter)
+    for word in _WORD.findall(player.encode('utf-8').lower()):
+        if not _is_name_word(word):
+            continue
+        if not all(bits[bit >> 3] & (1 << (bit & 7)) for bit in _filter_bits(word, len(bits) * 8)):
+            return False
+    return True
+
+def may_match(index: dict, query: SearchQuery) -> bool:
+    """
+    Tells whether an archive with the given index could hold a line matching
+    the query. Only a `True` answer needs the archive to be searched.
+    """
+    if index['start'] is None:
+        # the archive holds no lines at all
+        return False
+    if query.since is not None and index['end'] < query.since:
+        return False
+    if query.until is not None and index['start'] >= query.until:
+        return False
+    if query.kinds:
+        wanted = 0
+        for kind in query.kinds:
+            wanted |= 1 << EVENT_KINDS.index(kind)
+        if not index['events'] & wanted:
+            return False
+    if query.player and not may_mention(index['names'], query.player):
+        return False
+    return True
+
+def get_index_location() -> str:
+    """
+    Returns the path of the saved archive indexes, which live next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), INDEX_NAME)
+
+class LogIndex:
+    """
+    Saved indexes of log archives, keyed by archive path. An index is only
+    used while the archive's inode, size, and modification time are unchanged.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.entries = {}
+        self._updated = {}
+
+    @classmethod
+    def load(cls, path: str = None) -> 'LogIndex':
+        index = cls(path or get_index_location())
+        index.entries = index._read()
+        return index
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def get(self, path: str) -> Union[dict, None]:
+        """
+        Returns the index of the archive, or `None` if it has none or has changed.
+        """
+        entry = self.entries.get(path_key(path))
+        if entry is None or entry['identity'] != _identity(path):
+            return None
+        return entry
+
+    def put(self, path: str, entry: dict):
+        self.entries[path_key(path)] = entry
+        self._updated[path_key(path)] = entry
+
+    def save(self):
+        """
+        Merges the indexes added here into the saved ones. Nothing is written
+        if nothing was added or the directory holding the config does not exist.
+        """
+        if not self._updated or not os.path.isdir(os.path.dirname(self.path)):
+            return
+        with storage.locked(self.path):
+            entries = self._read()
+            entries.update(self._updated)
+            # forget archives that have been deleted
+            entries = {path: entry for path, entry in entries.items() if os.path.exists(path)}
+            with storage.atomic_open(self.path) as file:
+                json.dump({'version': INDEX_VERSION, 'entries': entries}, file)
+        self._updated = {}
+
+def search(servers: Iterable[Server], query: SearchQuery, jobs: int = None,
+        index: LogIndex = None, on_error: Callable[[str, str], None] = None) -> Iterator[SearchMatch]:
+    """
+    Searches the archives of the given servers and yields matching lines in
+    time order. Archives whose index rules out a match are skipped. Up to
+    `jobs` archives are searched at once in worker processes; by default, one
+    per CPU.
+
+    An archive that cannot be read to the end does not stop the search: the
+    lines before the damage are still searched, and `on_error`, if provided,
+    is called with the archive's path and the error.
+
+    New indexes are recorded in `index`, which the caller should save.
+    """
+    index = index if index is not None else LogIndex()
+    tasks = []
+    for srv in servers:
+        # an archive cannot start before the previous one of the same server ended
+        bound = ''
+        for archive in find_archives(srv):
+            entry = index.get(archive.path)
+            if entry is not None and entry['start'] is not None:
+                bound = entry['start']
+            elif entry is None and archive.srv_type in _TIME_OF_DAY_TYPES:
+                bound = max(bound, archive.day + ' 00:00:00')
+            if entry is None or may_match(entry, query):
+                tasks.append((bound, archive))
+            if entry is not None and entry['end'] is not None:
+                bound = entry['end']
+    if not tasks:
+        return
+    tasks.sort(key=lambda task: task[0])
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=jobs)
+    else:
+        pool = _SerialPool()
+    with pool:
+        yield from _merge(pool, tasks, query, index, jobs, on_error)
+
+def _merge(pool, tasks: List[Tuple[str, Archive]], query: SearchQuery, index: LogIndex,
+        jobs: int, on_error: Callable[[str, str], None] = None) -> Iterator[SearchMatch]:
+    from concurrent.futures import FIRST_COMPLETED, wait
+    remaining = iter(tasks)
+    pending = {}
+    heap = []
+    sequence = 0
+
+    def fill():
+        # keep a few archives queued per worker, taking them in order of their lower bound
+        while len(pending) < jobs * 2:
+            task = next(remaining, None)
+            if task is None:
+                return
+            pending[pool.submit(scan_archive, task[1], query)] = task
+
+    fill()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            bound, archive = pending.pop(future)
+            try:
+                entry, matches, error = future.result()
+            except Exception as err:
+                # such as a worker process that died
+                entry, matches, error = None, [], '{}: {}'.format(type(err).__name__, err)
+            if entry is not None:
+                index.put(archive.path, entry)
+            if error is not None and on_error is not None:
+                on_error(archive.path, error)
+            for match in matches:
+                heapq.heappush(heap, (match.time, sequence, match))
+                sequence += 1
+        fill()
+        # nothing still being searched can hold a line earlier than this
+        floor = min(bound for bound, archive in pending.values()) if pending else None
+        while heap and (floor is None or heap[0][0] <= floor):
+            yield heapq.heappop(heap)[2]
+
+class _SerialPool:
+    """
+    Stand-in for a process pool that runs each call as it is submitted.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as err:
+            future.set_exception(err)
+        return future
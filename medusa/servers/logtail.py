@@ -0,0 +1,266 @@
+"""
+Incremental reader for the `logs/latest.log` of each server.
+
+A `LogTail` remembers the inode of the log and the byte offset up to which it
+has been read, so each poll only reads what was appended since. New data is
+read in large blocks that end on a line boundary, and each block is searched
+for events with a single precompiled pattern per server type rather than line
+by line. Offsets can be saved with `LogOffsets` so that the next process picks
+up where this one stopped.
+
+Minecraft rotates `latest.log` by renaming it when the server starts. A tail
+notices the new inode (or a file shorter than its offset), finishes reading the
+old file through the handle it still holds, and continues from the start of
+the new one.
+"""
+import json
+import os
+import re
+from typing import Dict, Iterator, NamedTuple, Pattern, Tuple, Union
+
+from .. import config, storage
+from . import FABRIC, FORGE, VANILLA
+from .models import Server
+from .registry import path_key
+
+LOG_PATH = os.path.join('logs', 'latest.log')
+
+READ_SIZE = 4 * 1024 * 1024
+"""Bytes read from the log at a time"""
+
+OFFSETS_NAME = 'log_offsets.json'
+
+# `[12:34:56] [Server thread/INFO]: `
+_VANILLA_PREFIX = rb'\[(?P<time>\d\d:\d\d:\d\d)\] \[[^\]\n]+/(?P<level>[A-Z]+)\]: '
+# `[12:34:56] [Server thread/INFO] (Minecraft) `, or the vanilla prefix on older loaders
+_FABRIC_PREFIX = rb'\[(?P<time>\d\d:\d\d:\d\d)\] \[[^\]\n]+/(?P<level>[A-Z]+)\](?: \([^)\n]*\) |: )'
+# `[12Mar2021 12:34:56.789] [Server thread/INFO] [net.minecraft.server.MinecraftServer/]: `
+_FORGE_PREFIX = rb'\[(?P<time>[^\]\n]+)\] \[[^\]\n]+/(?P<level>[A-Z]+)\] \[[^\]\n]*\]: '
+# anything shaped like one of the above, for types without a prefix of their own
+_ANY_PREFIX = rb'\[(?P<time>[^\]\n]+)\] \[[^\]\n]+/(?P<level>[A-Z]+)\](?: \[[^\]\n]*\]: | \([^)\n]*\) |: )'
+
+LINE_PREFIXES = {
+    VANILLA: _VANILLA_PREFIX,
+    FABRIC: _FABRIC_PREFIX,
+    FORGE: _FORGE_PREFIX,
+}
+"""Pattern of the text before the message on each line, by server type"""
+
+# each alternative is named after the kind of event it produces
+_EVENTS = rb'|'.join([
+    rb'(?P<join>(?P<join_player>[\w.]+) joined the game)',
+    rb'(?P<leave>(?P<leave_player>[\w.]+) left the game)',
+    rb"(?P<lag>Can't keep up! Is the server overloaded\?[^\r\n]*)",
+    rb'(?P<crash>This crash report has been saved to: (?P<crash_report>[^\r\n]*))',
+    rb'(?P<chat>(?:\[Not Secure\] )?<(?P<chat_player>[^>\n]+)> (?P<chat_text>[^\r\n]*))',
+])
+
+EVENT_KINDS = ('join', 'leave', 'lag', 'crash', 'chat')
+
+class LogEvent(NamedTuple):
+    """
+    Something that happened on a server, as read from its log.
+    """
+    kind: str
+    """One of `EVENT_KINDS`"""
+    time: str
+    """Timestamp as logged, which for most types is the time of day only"""
+    level: str
+    player: Union[str, None]
+    """Player who joined, left, or chatted"""
+    text: str
+    """Chat message, path of the crash report, or the full lag warning"""
+    offset: int
+    """Byte offset of the line in the log"""
+
+_patterns: Dict[str, Pattern] = {}
+
+def get_event_pattern(srv_type: str) -> Pattern:
+    """
+    Returns the compiled pattern that finds events in logs of the given type.
+    """
+    pattern = _patterns.get(srv_type)
+    if pattern is None:
+        prefix = LINE_PREFIXES.get(srv_type, _ANY_PREFIX)
+        pattern = re.compile(rb'^' + prefix + rb'(?:' + _EVENTS + rb')\r?$', re.MULTILINE)
+        _patterns[srv_type] = pattern
+    return pattern
+
+def _decode(value: Union[bytes, None]) -> Union[str, None]:
+    return None if value is None else value.decode('utf-8', errors='replace')
+
+class LogTail:
+    """
+    Reads what has been appended to a server's `logs/latest.log` since the
+    last read.
+    """
+
+    def __init__(self, srv: Server, offset: int = 0, ino: int = None):
+        self.srv = srv
+        self.path = os.path.join(srv.Path, LOG_PATH)
+        self.offset = offset
+        """Byte offset of the first line not yet read"""
+        self.ino = ino
+        """Inode of the log being read, or `None` before it is first opened"""
+        self.rotations = 0
+        self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self) -> bool:
+        try:
+            file = open(self.path, 'rb', buffering=0)
+        except OSError:
+            return False
+        stat = os.fstat(file.fileno())
+        if self.ino is not None and (stat.st_ino != self.ino or stat.st_size < self.offset):
+            # rotated while nobody was reading; what was left in the old log is gone
+            self.offset = 0
+            self.rotations += 1
+        self.ino = stat.st_ino
+        self._file = file
+        return True
+
+    def skip_to_end(self):
+        """
+        Opens the log and skips what it already holds, so that only lines
+        appended from now on are read, even if the log is rotated first.
+        """
+        if self._file is None and not self._open():
+            return
+        self.offset = os.fstat(self._file.fileno()).st_size
+
+    def _drain(self) -> Iterator[Tuple[int, bytes]]:
+        while True:
+            self._file.seek(self.offset)
+            data = self._file.read(READ_SIZE)
+            if not data:
+                return
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                if len(data) < READ_SIZE:
+                    # the last line is still being written
+                    return
+                end = len(data)
+            start = self.offset
+            self.offset += end
+            yield start, data[:end] if end < len(data) else data
+            if len(data) < READ_SIZE:
+                return
+
+    def read_blocks(self) -> Iterator[Tuple[int, bytes]]:
+        """
+        Yields `(offset, data)` for each block of complete lines appended since
+        the last read, following the log across rotations. A line still being
+        written is left for the next read.
+        """
+        if self._file is None and not self._open():
+            return
+        while True:
+            yield from self._drain()
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                # renamed away and not yet replaced; the old file may still grow
+                return
+            if stat.st_ino == self.ino:
+                if stat.st_size >= self.offset:
+                    return
+                # truncated in place
+                self.offset = 0
+                self.rotations += 1
+                continue
+            self.close()
+            self.ino = None
+            self.offset = 0
+            self.rotations += 1
+            if not self._open():
+                return
+
+    def lines(self) -> Iterator[Tuple[int, str]]:
+        """
+        Yields `(offset, line)` for each complete line appended since the last read.
+        """
+        for start, block in self.read_blocks():
+            position = start
+            lines = block.split(b'\n')
+            if lines[-1] == b'':
+                lines.pop()
+            for line in lines:
+                yield position, line.rstrip(b'\r').decode('utf-8', errors='replace')
+                position += len(line) + 1
+
+    def events(self) -> Iterator[LogEvent]:
+        """
+        Yields the events logged since the last read.
+        """
+        pattern = get_event_pattern(self.srv.Type)
+        for start, block in self.read_blocks():
+            for match in pattern.finditer(block):
+                kind = match.lastgroup
+                groups = match.groupdict()
+                player = groups.get(kind + '_player')
+                if kind == 'chat':
+                    text = groups['chat_text']
+                elif kind == 'crash':
+                    text = groups['crash_report']
+                else:
+                    text = match.group(kind)
+                yield LogEvent(kind, _decode(groups['time']), _decode(groups['level']),
+                    _decode(player), _decode(text), start + match.start())
+
+def get_offsets_location() -> str:
+    """
+    Returns the path of the saved log offsets, which live next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), OFFSETS_NAME)
+
+class LogOffsets:
+    """
+    Saved read positions of server logs, keyed by the path of each log.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.entries = {}
+
+    @classmethod
+    def load(cls, path: str = None) -> 'LogOffsets':
+        """
+        Reads the offsets at the given path, or the default location if omitted.
+        A missing or unreadable file yields no offsets.
+        """
+        offsets = cls(path or get_offsets_location())
+        try:
+            with open(offsets.path, 'r') as file:
+                offsets.entries = json.load(file).get('entries', {})
+        except (OSError, ValueError, AttributeError):
+            offsets.entries = {}
+        return offsets
+
+    def open(self, srv: Server) -> LogTail:
+        """
+        Returns a tail of the server's log that resumes at the saved offset.
+        """
+        entry = self.entries.get(path_key(srv.Path)) or {}
+        return LogTail(srv, entry.get('offset', 0), entry.get('ino'))
+
+    def update(self, tail: LogTail):
+        """
+        Records how far the tail has read.
+        """
+        if tail.ino is not None:
+            self.entries[path_key(tail.srv.Path)] = {'ino': tail.ino, 'offset': tail.offset}
+
+    def save(self):
+        """
+        Writes the offsets to disk. Nothing is written if the directory holding
+        the config does not exist yet.
+        """
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        with storage.atomic_open(self.path) as file:
+            json.dump({'entries': self.entries}, file)
@@ -1,26 +1,25 @@
-from enum import Enum
-import io
 import json
 import os
-import pathlib
-from pprint import pprint
-from types import new_class
-from prettytable import PrettyTable
-import argparse
-
-import jsonpickle
-
-from medusa.servers import fabric, vanilla
+from contextlib import contextmanager
 
 from .. import config
 from .. import filebases
 from .. import parsers
+from .. import storage
+from .detection import detect_server_type
 from .models import Server
-from . import FABRIC, FORGE, NOTASERVER, VANILLA, forge
+from .registry import (AmbiguousIdentifierError, ServerRegistry, REGISTRY_VERSION,
+    decode_registry, encode_registry)
+from .scan_cache import ScanCache
+from . import NOTASERVER, backends
 
 serv_subparser = None
 _servers = None
 
+# registry most recently loaded from the config, and the config version it came from
+_loaded_servers = None
+_loaded_version = None
+
 def process_server(args):
     """
     Process CLI arguments for `server` commands. This method should really
@@ -32,21 +31,32 @@ def process_server(args):
         args : List of str
             Command-line arguments from and including the `server` command.
     """
-    global _servers
     parser = parsers.get_server_parsers()
     args = parser.parse_args(args)
-    _servers = get_servers_from_config()
+    get_servers()
 
     if (args.action == 'create'):
         create_server(args.path, args.type, args.alias)
     elif (args.action == 'remove'):
-        deregister_server(args.identifier)
+        try:
+            deregister_server(args.identifier)
+        except AmbiguousIdentifierError as amb:
+            print(amb)
     elif (args.action == 'list'):
-        list_servers()
+        list_servers(plain=args.plain)
     elif (args.action == 'scan'):
-        scan_directory_for_servers("")
+        scan_directory_for_servers("", verbosity=args.verbose + 1, jobs=args.jobs,
+            use_cache=not args.no_cache)
+    elif (args.action == 'watch'):
+        from . import watch
+        watch.watch_servers(args.path, delay=args.delay, use_inotify=not args.poll,
+            verbosity=args.verbose + 1)
     elif (args.action == 'set'):
-        srv = get_server_by_identifier(args.identifier)
+        try:
+            srv = get_server_by_identifier(args.identifier)
+        except AmbiguousIdentifierError as amb:
+            print(amb)
+            return
         if (srv is None):
             print('No server "{}"'.format(args.identifier))
             return
@@ -62,11 +72,26 @@ def process_server(args):
     else:
         parser.print_help()
 
-def scan_directory_for_servers(scan_path: str = "", verbosity: int = 1):
+def scan_directory_for_servers(scan_path: str = "", verbosity: int = 1, jobs: int = 1,
+        use_cache: bool = True):
     """
     Searches the named directory for any servers that aren't
     already registered. Returns the new servers that were discovered.
 
+    Detection, stale-entry pruning, and `.medusa` writes are spread over a pool
+    of `jobs` worker threads, which hides filesystem latency on network storage.
+    The registry itself is only changed once every worker has finished, in
+    path order, so the result does not depend on how the work was scheduled.
+
+    Each directory's server jar is also fingerprinted, which gives the exact
+    loader and Minecraft version and overrides the type the detectors guessed
+    from file names. Registered servers whose fingerprint has changed, say
+    after an upgrade, have their entry updated.
+
+    Detection results are kept in the scan cache, so a directory is only
+    inspected again once its top-level listing has changed, and a jar is
+    only opened again once it has been replaced or modified.
+
     Parameters
     ----------
         scan_path: str
@@ -77,13 +102,20 @@ def scan_directory_for_servers(scan_path: str = "", verbosity: int = 1):
         verbosity: int
             Level of verbosity to use. The higher the number, the more verbose the output.
 
+        jobs: int
+            Number of worker threads to use. Values below 2 scan serially.
+
+        use_cache: bool
+            Whether to reuse and update the results of previous scans.
+
     Returns
     -------
         count: Number of added Servers
             The number of new Servers that were registered with Medusa.
             Returns zero if no new servers were registered during the scan.
     """
-    global _servers
+    # fingerprinting pulls in zipfile and friends, which other commands never need
+    from .fingerprint import describe, get_type
     if (scan_path == ""):
         data_dir = config.get_config_value('server_directory')
     else:
@@ -92,34 +124,62 @@ def scan_directory_for_servers(scan_path: str = "", verbosity: int = 1):
     if verbosity > 0:
         print('Scanning for existing servers in', data_dir)
 
-    dataset = os.scandir(data_dir)
-
-    if _servers != None and len(_servers) > 0:
-    # remove entries for servers that no longer exist
-        for saved in reversed(_servers):
-            if not os.path.isdir(saved.Path):
-                _servers.remove(saved)
-
-    # scan for servers in the server directory
-    new_count = 0
-    for dir in dataset:        
-        # reject non-servers unless user manually adds them
-        dir_type = NOTASERVER
-        if (forge.is_path_forge(dir.path)):
-            dir_type = FORGE
-        elif (fabric.is_path_fabirc(dir.path)):
-            dir_type = FABRIC
-        elif (vanilla.is_path_vanilla(dir.path)):
-            dir_type = VANILLA
-
-        if dir_type == NOTASERVER:
-            continue
-        
-        # record any successes
-        regSuccess = register_server(dir.path ,dir_type)
-        if regSuccess:
-            new_count += 1
-
+    with os.scandir(data_dir) as dataset:
+        candidates = sorted(os.path.abspath(dir.path) for dir in dataset if dir.is_dir())
+    saved = list(get_servers())
+    cache = ScanCache.load() if use_cache else None
+
+    with _worker_pool(jobs) as pool:
+        # find entries for servers that no longer exist
+        still_exists = list(pool.map(lambda srv: os.path.isdir(srv.Path), saved))
+        stale = [srv for srv, exists in zip(saved, still_exists) if not exists]
+        live = ServerRegistry(srv for srv, exists in zip(saved, still_exists) if exists)
+
+        # scan for servers in the server directory, rejecting non-servers
+        # unless user manually adds them
+        found = []
+        refreshed = []
+        detected = pool.map(lambda path: (_detect_with_cache(path, cache), _fingerprint_with_cache(path, cache)),
+            candidates)
+        for path, ((dir_type, confidence), fp) in zip(candidates, detected):
+            if fp is not None:
+                dir_type, confidence = get_type(fp), 1.0
+            if dir_type == NOTASERVER:
+                continue
+            if verbosity > 1:
+                print('Detected {} server at {} (confidence {:.2f}){}'.format(dir_type, path, confidence,
+                    ': ' + describe(fp) if fp is not None else ''))
+            existing = live.find_all(path)
+            if existing:
+                if fp is not None:
+                    refreshed.extend((srv, _with_fingerprint(Server.from_dict(srv.to_dict()), fp))
+                        for srv in existing if _get_fingerprint(srv)[:3] != fp[:3])
+                continue
+            found.append(_with_fingerprint(_new_server(path, dir_type), fp))
+
+        list(pool.map(_write_dotmedusa, found))
+
+    if cache is not None:
+        cache.prune(data_dir, candidates)
+        cache.save()
+        if verbosity > 1:
+            print('Scan cache: {} hits, {} misses'.format(cache.hits, cache.misses))
+            print('Fingerprint cache: {} hits, {} misses'.format(cache.fingerprint_hits, cache.fingerprint_misses))
+
+    # apply every registry change at once
+    with transaction() as txn:
+        for srv in stale:
+            if verbosity > 1:
+                print('Removing missing server', srv.Path)
+            txn.remove(srv)
+        for old, new in refreshed:
+            if verbosity > 0:
+                print('Updated {} to {}'.format(old.Path, describe(_get_fingerprint(new))))
+            txn.replace(old, new)
+        for srv in found:
+            txn.add(srv)
+
+    new_count = len(found)
     if verbosity > 0:
         if new_count > 0:
             print('Found {} servers'.format(new_count))
@@ -127,23 +187,127 @@ def scan_directory_for_servers(scan_path: str = "", verbosity: int = 1):
             print('Didn\'t find any servers')
     return new_count
 
+def _detect_with_cache(path: str, cache: ScanCache = None):
+    """
+    Detects the type of the server at `path`, consulting and updating the
+    given scan cache when there is one.
+    """
+    if cache is None:
+        return detect_server_type(path)
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return detect_server_type(path)
+
+    cached = cache.lookup(path, stat)
+    if cached is not None:
+        return cached
+
+    dir_type, confidence = detect_server_type(path)
+    cache.store(path, stat, dir_type, confidence)
+    return dir_type, confidence
+
+def _fingerprint_with_cache(path: str, cache: ScanCache = None):
+    """
+    Fingerprints the server at `path`, consulting and updating the given
+    scan cache when there is one.
+    """
+    from .fingerprint import Fingerprint, fingerprint_directory, get_inputs
+    if cache is None:
+        return fingerprint_directory(path)
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return fingerprint_directory(path)
+
+    cached = cache.lookup_fingerprint(path, stat)
+    inputs = None
+    if cached is None:
+        # the directory has changed, though perhaps only by files such as
+        # `.medusa`; the state is taken before the jars are read, so one
+        # replaced while being read is read again next time
+        inputs = cache.stat_inputs(path, get_inputs(path))
+        cached = cache.lookup_fingerprint(path, stat, inputs)
+    if cached is not None:
+        return Fingerprint(*cached) if cached else None
+
+    fp = fingerprint_directory(path)
+    cache.store_fingerprint(path, stat, inputs, list(fp) if fp is not None else [])
+    return fp
+
+def _get_fingerprint(srv: Server) -> 'Fingerprint':
+    """
+    Returns the loader and versions recorded for the server, which are all
+    `None` if it has not been fingerprinted.
+    """
+    from .fingerprint import Fingerprint
+    return Fingerprint(getattr(srv, 'Loader', None), getattr(srv, 'LoaderVersion', None),
+        getattr(srv, 'MinecraftVersion', None), '')
 
+def _with_fingerprint(srv: Server, fp: 'Fingerprint' = None) -> Server:
+    """
+    Records the loader and versions of the fingerprint on the server and returns it.
+    """
+    if fp is not None:
+        srv.Loader, srv.LoaderVersion, srv.MinecraftVersion = fp.loader, fp.loader_version, fp.mc_version
+    return srv
 
-def list_servers():
+def _worker_pool(jobs: int):
+    """
+    Returns an executor running `jobs` threads, or a serial stand-in
+    when no more than one job is requested.
+    """
+    if jobs is not None and jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='medusa-scan')
+    return _SerialExecutor()
+
+class _SerialExecutor:
+    """
+    Minimal executor that runs each call in the calling thread.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+def list_servers(plain: bool = False):
     """
     Prints a table of the servers to the console. The paths are
     constructed relative to the server directory.
+
+    Parameters
+    ----------
+        plain: bool
+            Print one tab-separated line per server as it is read instead of
+            a table, which needs every row before it can be laid out.
     """
-    if len(get_servers()) == 0:
+    servers = get_servers()
+    if len(servers) == 0:
         print('No registered servers')
         return
 
+    srv_dir = config.get_config_value('server_directory')
+    if plain:
+        for srv in servers:
+            print('\t'.join([srv.Alias or '', os.path.relpath(srv.Path, srv_dir), srv.Type or '']))
+        return
+
+    # prettytable is slow to import and only needed here
+    from prettytable import PrettyTable
+    from .fingerprint import describe
     x = PrettyTable()
-    x.field_names = ['Alias', 'Path', 'Type']
+    x.field_names = ['Alias', 'Path', 'Type', 'Version']
     x.align = 'l'
-    srv_dir = config.get_config_value('server_directory')
-    for srv in get_servers():
-        x.add_row([srv.Alias, os.path.relpath(srv.Path, srv_dir), srv.Type])
+    for srv in servers:
+        fp = _get_fingerprint(srv)
+        x.add_row([srv.Alias, os.path.relpath(srv.Path, srv_dir), srv.Type, describe(fp) if fp.loader else ''])
 
     print(x)
 
@@ -166,32 +330,254 @@ def get_servers_from_config() -> list[Server]:
     """
     if not os.path.isfile(config.get_config_location()):
         raise FileNotFoundError(config.get_config_location(), 'is not a file.')
-    with open(config.get_config_location(), 'r') as f:
-        data_string = f.read()
-        data_set = jsonpickle.decode(data_string)
-        data_set = data_set['server_registry']
-        return data_set
+    # decode from the shared snapshot so the file is parsed once per change
+    data_set = config.get_config()
+    servers, legacy = decode_registry(data_set['server_registry'])
+    if legacy or data_set.get('registry_version') is None:
+        _migrate_registry()
+    return servers
+
+def get_servers():
+    """
+    Returns the registry of all of the servers registered with Medusa, as
+    provided by the configured registry backend. See `get_backend()`.
+    """
+    return get_backend().get_registry()
 
-def get_servers() -> list[Server]:
+class JsonBackend(backends.RegistryBackend):
     """
-    Returns a list of all of the servers registered with Medusa.
+    Default backend, which keeps the registry in the `server_registry` list of
+    the config file. The registry is held in memory, read from the config once,
+    and read again only after the config file changes, except while a
+    transaction is open. Each commit rewrites the whole list.
     """
-    global _servers
-    if _servers is None:
-        _servers = get_servers_from_config()
 
-    return _servers
+    name = 'json'
+
+    def get_registry(self) -> ServerRegistry:
+        global _servers, _loaded_servers, _loaded_version
+        if _servers is not None and _servers is _loaded_servers and _transaction is None:
+            if config.get_config_version() != _loaded_version:
+                _servers = None
+
+        if _servers is None:
+            version = config.get_config_version()
+            _servers = ServerRegistry(get_servers_from_config())
+            _loaded_servers = _servers
+            _loaded_version = version
+        if not isinstance(_servers, ServerRegistry):
+            # `_servers` may have been assigned a plain list of servers
+            _servers = ServerRegistry(_servers)
+
+        return _servers
+
+    def commit(self, txn):
+        if len(txn.ops) == 0:
+            return
+
+        with _locked_registry() as (data, stored):
+            txn.apply_to(stored)
+
+    def rollback(self, txn):
+        servers = self.get_registry()
+        for op in reversed(txn.ops):
+            if op[0] == 'add':
+                servers.remove(op[2])
+            elif op[0] == 'remove':
+                servers.add(op[2])
+            elif op[0] == 'replace':
+                servers.replace(op[3], op[2])
+
+_json_backend = JsonBackend()
+_sqlite_backend = None
+
+def get_backend() -> backends.RegistryBackend:
+    """
+    Returns the registry backend selected by the `registry_backend` config key:
+    `json` (the default) or `sqlite`. An open transaction keeps the backend it
+    started with.
+    """
+    global _sqlite_backend
+    if _transaction is not None:
+        return _transaction.backend
+
+    try:
+        name = config.get_config().get('registry_backend') or backends.DEFAULT_BACKEND
+    except (OSError, ValueError, AttributeError):
+        name = backends.DEFAULT_BACKEND
+
+    if name != backends.SqliteBackend.name:
+        return _json_backend
+
+    path = backends.get_sqlite_location()
+    if _sqlite_backend is None or _sqlite_backend.path != path:
+        _close_sqlite_backend()
+        # a new database starts out with the servers registered in the config
+        existing = None if os.path.exists(path) else get_servers_from_config()
+        _sqlite_backend = backends.SqliteBackend(path, import_servers=existing)
+    return _sqlite_backend
+
+def _close_sqlite_backend():
+    global _sqlite_backend
+    if _sqlite_backend is not None:
+        _sqlite_backend.close()
+        _sqlite_backend = None
 
 def get_server_by_identifier(identifier: str):
     """
     Finds the server that can be identified by the given string. If no such server
     is found, then `None` is returned.
+
+    Raises
+    ------
+        AmbiguousIdentifierError
+            If the identifier matches more than one server, such as two servers
+            in different directories that share a directory name.
     """
-    for srv in get_servers():
-        if srv.is_identifiable_by(identifier):
-            return srv
-    
-    return None
+    return get_servers().find(identifier)
+
+class RegistryTransaction:
+    """
+    Collects changes to the server registry so that the backend can save them
+    all at once. Changes are applied to the registry returned by `get_servers()`
+    straight away; the JSON backend replays them onto the registry stored in the
+    config when the transaction commits, while the SQLite backend runs them
+    inside a database transaction.
+
+    Transactions are opened with `transaction()` rather than constructed directly.
+    """
+
+    def __init__(self, backend: backends.RegistryBackend):
+        self.backend = backend
+        self.ops = []
+
+    def add(self, srv: Server):
+        """
+        Registers a new server.
+        """
+        get_servers().add(srv)
+        self.ops.append(('add', None, srv))
+
+    def remove(self, srv: Server):
+        """
+        Deregisters a server currently in the registry.
+        """
+        path = get_servers().indexed_path(srv)
+        get_servers().remove(srv)
+        self.ops.append(('remove', path, srv))
+
+    def replace(self, old: Server, new: Server):
+        """
+        Replaces a registered server with an updated entry. `old` and `new` may
+        be the same object if it was edited in place.
+        """
+        path = get_servers().indexed_path(old)
+        get_servers().replace(old, new)
+        self.ops.append(('replace', path, old, new))
+
+    def rollback(self):
+        """
+        Reverts the registry to its state before the transaction.
+        Fields of servers that were edited in place are not restored.
+        """
+        self.backend.rollback(self)
+        self.ops = []
+
+    def apply_to(self, stored: ServerRegistry):
+        """
+        Replays the recorded changes onto a registry read from disk, matching
+        entries by path so that changes made by other processes are kept.
+        """
+        for op in self.ops:
+            if op[0] == 'add':
+                if not stored.find_all(op[2].Path):
+                    stored.add(op[2])
+            elif op[0] == 'remove':
+                for srv in _find_by_path(stored, op[1]):
+                    stored.remove(srv)
+            elif op[0] == 'replace':
+                matches = _find_by_path(stored, op[1])
+                if matches:
+                    stored.replace(matches[0], op[3])
+                else:
+                    stored.add(op[3])
+
+    def commit(self):
+        """
+        Saves the recorded changes through the backend in one pass.
+        """
+        self.backend.commit(self)
+        self.ops = []
+
+@contextmanager
+def _locked_registry():
+    """
+    Reads the config and its registry under the config lock and yields them
+    as `(data, registry)`. When the block exits, the registry is written back
+    in the current format with a single atomic write.
+    """
+    # hold the lock across the read and the write, so that changes
+    # committed by other Medusa processes in between are not lost
+    path = config.get_config_location()
+    with storage.locked(path):
+        with open(path, 'r') as data_file:
+            data = json.load(data_file)
+        servers, legacy = decode_registry(data.get('server_registry'))
+        stored = ServerRegistry(servers)
+        yield data, stored
+        data['registry_version'] = REGISTRY_VERSION
+        data['server_registry'] = encode_registry(stored)
+        with storage.atomic_open(path) as data_file:
+            json.dump(data, data_file)
+    config.invalidate_config()
+
+def _migrate_registry():
+    """
+    Rewrites a registry stored by `jsonpickle` in the plain-JSON format.
+    """
+    try:
+        with _locked_registry():
+            pass
+    except OSError:
+        # a read-only config still loads; it just stays in the old format
+        pass
+
+def _find_by_path(servers: ServerRegistry, path: str):
+    return [srv for srv in servers.find_all(path) if servers.indexed_path(srv) == path]
+
+_transaction = None
+
+@contextmanager
+def transaction():
+    """
+    Opens a registry transaction. Everything registered, deregistered, or updated
+    inside the `with` block is saved once, when the block exits. If the block
+    raises, the registry is rolled back and nothing is saved.
+    Transactions opened inside another transaction join the outer one.
+
+    Example
+    -------
+        with manager.transaction():
+            manager.register_server('/srv/a', FORGE)
+            manager.deregister_server('old')
+    """
+    global _transaction
+    if _transaction is not None:
+        yield _transaction
+        return
+
+    backend = get_backend()
+    txn = RegistryTransaction(backend)
+    backend.begin(txn)
+    _transaction = txn
+    try:
+        yield txn
+        txn.commit()
+    except BaseException:
+        txn.rollback()
+        raise
+    finally:
+        _transaction = None
 
 # Create a new server
 def create_server(path, type = None, alias = None):
@@ -210,6 +596,8 @@ def deregister_server(identifier: str):
     ------
         KeyError
             If no known server matches the given identifier.
+        AmbiguousIdentifierError
+            If the identifier matches more than one server.
         ValueError
             If the given identifier is None or empty.
     """
@@ -218,22 +606,12 @@ def deregister_server(identifier: str):
         raise ValueError('Identifier None or empty')
     
     # get identified server or raise error
-    target = None
-    for srv in get_servers():
-        if srv.is_identifiable_by(identifier):
-            target = srv
-            _servers.remove(srv)
-            break
+    target = get_server_by_identifier(identifier)
     if target is None:
         raise KeyError('No server identifiable by', identifier)
 
-    # remove from config
-    with open(config.get_config_location(), 'r+') as conf:
-        conf_json = jsonpickle.decode(conf.read())
-        conf_json['server_registry'].remove(target)
-        conf.seek(0)
-        conf.write(jsonpickle.encode(conf_json))
-        conf.truncate()
+    with transaction() as txn:
+        txn.remove(target)
 
 def update_server(old_id: str, updated: Server):
     """
@@ -253,19 +631,8 @@ def update_server(old_id: str, updated: Server):
     if target is None:
         raise KeyError(f'No server "{old_id}"')
 
-    # Update servers in memory
-    _servers.remove(target)
-    _servers.append(updated)
-
-    # Read in current config file, write updated server
-    path = config.get_config_location()
-    with open(path, 'a+') as data_file:
-        data_file.seek(0)
-        data = jsonpickle.decode(data_file.read())
-        data['server_registry'] = _servers
-        data_file.write(jsonpickle.encode(data))
-
-    pass
+    with transaction() as txn:
+        txn.replace(target, updated)
 
 def register_server(path: str, srv_type: str, alias: str = None):
     """
@@ -294,41 +661,42 @@ def register_server(path: str, srv_type: str, alias: str = None):
             If there is an error reading or writing the config file from/to disk
     """
 
+    new = _new_server(path, srv_type, alias)
+
+    if get_servers().find_all(path) or get_servers().find_all(new.Path):
+        return False
+
+    _write_dotmedusa(new)
+
+    # Write entry to server_reigstry in config
+    with transaction() as txn:
+        txn.add(new)
+        
+    return True
+
+def _new_server(path: str, srv_type: str, alias: str = None) -> Server:
+    """
+    Builds the `Server` entry for a directory that is about to be registered.
+    """
     new = Server()
     new.Path = os.path.abspath(path)
     new.Type = srv_type
     new.Alias = alias
-    if alias:
-        alias = alias.strip()
-
-    for srv in get_servers():
-        if srv.is_identifiable_by(path):
-            return False
+    return new
 
-    # Read in current config
-    with open(config.get_config_location(), 'r') as data_file:
-        data = jsonpickle.decode(data_file.read())
-    
-    # Write .medusa to the server directory
-    with open(os.path.join(new.Path,'.medusa'), 'w') as dotmedusa:
+def _write_dotmedusa(srv: Server):
+    """
+    Writes the `.medusa` file into the given server's directory.
+    """
+    with open(os.path.join(srv.Path,'.medusa'), 'w') as dotmedusa:
         # If alias is given, then the base dotmedusa file must be modified before writing to disk
-        if new.Alias:
+        if srv.Alias:
             dm = json.loads(filebases.DOT_MEDUSA)
-            dm["metadata"]["alias"] = new.Alias
+            dm["metadata"]["alias"] = srv.Alias
             dotmedusa.write(json.dumps(dm))
         else:
             dotmedusa.write(filebases.DOT_MEDUSA)
 
-    # Write entry to server_reigstry in config
-    with open(config.get_config_location(), 'w') as data_file:
-        set = get_servers()
-        set.append(new)
-        data['server_registry'] = set
-        encoded = jsonpickle.encode(data)
-        data_file.write(encoded)
-        
-    return True
-
 def find_startup_script_paths(path: str):
     """
     Finds the startup scripts, if any, for this Server.
@@ -346,7 +714,6 @@ def find_startup_script_paths(path: str):
             Path to the directory which may contain top-level
             startup scripts.
     """
-    path = pathlib.Path(path)
     found = []
     target_ext = ['.bat', '.sh']
 
@@ -1,8 +1,7 @@
 import abc
-from enum import Enum
+import importlib
 import os
-from pathlib import PurePath
-from typing import Union
+from typing import Callable, List, Union
 
 from .. import parsers
 
@@ -22,9 +21,56 @@ class Server:
     Type: str
     """Type of the server"""
 
+    Loader: Union[str, None] = None
+    """Loader read from the server's files, such as `forge` or `paper`, if known"""
+
+    LoaderVersion: Union[str, None] = None
+    """Version of the loader, if known"""
+
+    MinecraftVersion: Union[str, None] = None
+    """Version of Minecraft the server runs, if known"""
+
     def __str__(self):
         return "{}\t{}\t{}".format(self.Alias, self.Path, self.Type)
 
+    @property
+    def display_name(self) -> str:
+        """
+        Name to show for the server: its alias, or its directory's name if it has none.
+        """
+        return self.Alias or os.path.basename(os.path.normpath(self.Path))
+
+    def to_dict(self) -> dict:
+        """
+        Returns the plain-JSON representation of this server used in the registry.
+        """
+        data = {
+            'Alias': self.Alias,
+            'Path': self.Path,
+            'Type': getattr(self, 'Type', None),
+        }
+        # only servers that have been fingerprinted carry versions
+        if self.Loader is not None:
+            data['Loader'] = self.Loader
+            data['LoaderVersion'] = self.LoaderVersion
+            data['MinecraftVersion'] = self.MinecraftVersion
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Server':
+        """
+        Builds a server from the representation returned by `to_dict`.
+        Missing fields keep their defaults, so older entries still load.
+        """
+        srv = cls()
+        srv.Alias = data.get('Alias')
+        srv.Path = data.get('Path', '')
+        srv.Type = data.get('Type')
+        srv.Loader = data.get('Loader')
+        srv.LoaderVersion = data.get('LoaderVersion')
+        srv.MinecraftVersion = data.get('MinecraftVersion')
+        return srv
+
     def __eq__(self, other):
         return self.is_identifiable_by(other)
 
@@ -42,6 +88,7 @@ class Server:
             return True
         
         # match directory name of a server
+        from pathlib import PurePath
         parts = PurePath(self.Path).parts
         if identifier == parts[-1]:
             return True
@@ -68,24 +115,166 @@ class ServerController(abc.ABC):
         
         return run_parser
 
+    def send_command(self, command: str, timeout: float = None) -> str:
+        """
+        Runs a console command on the server over RCON and returns its response.
+        A server without RCON that was started by this process's supervisor
+        gets the command on its console instead, and nothing is returned.
+
+        Raises
+        ------
+            RconError
+                If RCON is not configured for the server and it is not
+                supervised here, the connection fails, or the server does
+                not answer in time.
+        """
+        from .. import rcon
+        from . import supervisor
+        try:
+            target = rcon.get_rcon_target(self.info)
+        except rcon.RconError:
+            proc = supervisor.get_process(self.info)
+            if proc is None or proc.console_log is not None:
+                raise
+            supervisor.send_console(self.info, command)
+            return ''
+        from .. import loop
+        return loop.run(rcon.get_pool().command(target, command, timeout))
+
     @abc.abstractmethod
-    def startup(cls):
-        print('Starting abstract')
-        pass
+    def startup(self):
+        """
+        Launches the server under the process supervisor and returns its
+        `ServerProcess`. Outside `medusad` the server is detached, with its
+        console output in `logs/console.log`.
+
+        Raises
+        ------
+            SupervisorError
+                If the server is already running or cannot be launched.
+        """
+        from . import supervisor
+        return supervisor.start_server(self.info)
 
     @abc.abstractmethod
-    def shutdown(cls):
-        pass
+    def shutdown(self):
+        """
+        Stops the server. A supervised server gets the `stop` command and then,
+        if it has not exited by each deadline, SIGTERM and SIGKILL. Any other
+        server is sent `stop` over RCON. Returns the exit status if known.
+
+        Raises
+        ------
+            SupervisorError, RconError
+                If the server is neither supervised here nor reachable over RCON.
+        """
+        from . import supervisor
+        if supervisor.get_process(self.info) is not None:
+            return supervisor.stop_server(self.info)
+        self.send_command('stop')
+        return None
+
+    def wait_for_stop(self, timeout: float = None):
+        """
+        Waits for a server that `shutdown` could only ask to stop over RCON to
+        save its world and exit, so that it can be started again.
+
+        Raises
+        ------
+            SupervisorError
+                If it is still running after `timeout` seconds, by default
+                the supervisor's `STOP_TIMEOUT`.
+        """
+        from . import supervisor
+        supervisor.wait_for_exit(self.info, supervisor.STOP_TIMEOUT if timeout is None else timeout)
 
 
 __supported_server_types = []
 
-def add_supported_server_type(name: str, info: Server, controller: ServerController):
+def add_supported_server_type(name: str, info: Server, controller: ServerController,
+        detector: Callable[[List[os.DirEntry]], float] = None):
+    """
+    Registers a server type with Medusa.
+
+    Parameters
+    ----------
+        name: str
+            Name of the type, such as `FORGE`.
+
+        info: Server
+            `Server` subclass describing servers of this type.
+
+        controller: ServerController
+            `ServerController` subclass able to control servers of this type.
+
+        detector: Callable (Optional)
+            Detection strategy for this type. It receives the top-level
+            `os.DirEntry` objects of a candidate directory and returns its
+            confidence, from 0 to 1, that the directory holds a server of this type.
+    """
     global __supported_server_types
     if (is_type_supported(name)):
         print('Already know type',name)
     
-    __supported_server_types.append({'name':name, 'info': info, 'controller': controller})
+    __supported_server_types.append({'name':name, 'info': info, 'controller': controller,
+        'detector': detector})
+
+class _LazyServerType(dict):
+    """
+    Supported-type entry whose classes live in a module that is only imported
+    the first time its `info`, `controller`, or `detector` is looked up.
+    """
+
+    def __init__(self, name: str, module: str, info: str, controller: str, detector: str = None):
+        super().__init__(name=name)
+        self._spec = (module, info, controller, detector)
+
+    def __missing__(self, key):
+        if self._spec is None or key not in ('info', 'controller', 'detector'):
+            raise KeyError(key)
+        module, info, controller, detector = self._spec
+        loaded = importlib.import_module(module)
+        self.update({'info': getattr(loaded, info), 'controller': getattr(loaded, controller),
+            'detector': getattr(loaded, detector) if detector else None})
+        self._spec = None
+        return self[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+def add_lazy_server_type(name: str, module: str, info: str, controller: str, detector: str = None):
+    """
+    Registers a server type with Medusa without importing it. The named module
+    is imported the first time the type's classes or detector are needed, so
+    commands that never touch the type do not pay for loading it.
+
+    Parameters
+    ----------
+        name: str
+            Name of the type, such as `FORGE`.
+
+        module: str
+            Absolute name of the module defining the type.
+
+        info, controller, detector: str
+            Names of the `Server` subclass, `ServerController` subclass, and
+            detection strategy within the module. See `add_supported_server_type`.
+    """
+    global __supported_server_types
+    if (is_type_supported(name)):
+        print('Already know type',name)
+
+    __supported_server_types.append(_LazyServerType(name, module, info, controller, detector))
+
+def get_supported_types() -> List[dict]:
+    """
+    Returns the registered server types in the order they were added.
+    """
+    global __supported_server_types
+    return __supported_server_types
     
 def get_supported_type(name: str) -> Union[dict, None]:
     global __supported_server_types
@@ -0,0 +1,298 @@
+"""
+Inventory of the mods and plugins installed on registered servers.
+
+Each jar under a server's `mods/` and `plugins/` is opened as a zip, which
+reads only its central directory, and just the one metadata entry that names
+it is decompressed: `fabric.mod.json` for Fabric, `META-INF/mods.toml` for
+Forge (or `neoforge.mods.toml` for NeoForge), and `plugin.yml` for Spigot and
+Paper. Forge mods that take their version from the jar read
+`META-INF/MANIFEST.MF` as well. Jars are read in a pool of threads, and what
+was found is kept in `data/mod_index.json` by the jar's device, inode, size,
+and modification time, so after the first run an inventory of the fleet costs
+little more than listing the directories.
+"""
+import fnmatch
+import json
+import os
+import re
+import threading
+import zipfile
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
+
+try:
+    import tomllib
+except ImportError:
+    # Python before 3.11; the few keys needed are read line by line instead
+    tomllib = None
+
+from .. import config, storage
+from .jarstore import HashCache, find_jars
+from .models import Server
+
+INDEX_NAME = 'mod_index.json'
+
+METADATA_ENTRIES = (
+    ('fabric.mod.json', 'fabric'),
+    ('META-INF/mods.toml', 'forge'),
+    ('META-INF/neoforge.mods.toml', 'neoforge'),
+    ('paper-plugin.yml', 'paper'),
+    ('plugin.yml', 'bukkit'),
+)
+"""Metadata entries, by preference, and the loader each one belongs to"""
+
+MANIFEST_ENTRY = 'META-INF/MANIFEST.MF'
+
+MAX_METADATA = 1024 * 1024
+"""Largest metadata entry that is read"""
+
+class ModInfo(NamedTuple):
+    """
+    A mod or plugin as declared in its jar.
+    """
+    id: str
+    name: Union[str, None]
+    version: Union[str, None]
+    loader: str
+    """`fabric`, `forge`, `neoforge`, `paper`, or `bukkit`"""
+
+class InstalledMod(NamedTuple):
+    server: str
+    path: str
+    id: str
+    name: Union[str, None]
+    version: Union[str, None]
+    loader: str
+
+def get_index_location() -> str:
+    """
+    Returns the path of the mod index, which lives next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), INDEX_NAME)
+
+def _read_entry(jar: zipfile.ZipFile, name: str) -> Union[str, None]:
+    try:
+        info = jar.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > MAX_METADATA:
+        return None
+    return jar.read(info).decode('utf-8', errors='replace')
+
+def _parse_fabric(text: str) -> List[dict]:
+    data = json.loads(text, strict=False)
+    return [{'id': data.get('id'), 'name': data.get('name'), 'version': data.get('version')}]
+
+_TOML_TABLE = re.compile(r'^\s*\[\[?\s*([^\]]+?)\s*\]\]?')
+_TOML_STRING = re.compile(r'''^\s*(\w+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+
+def _parse_toml_lines(text: str) -> dict:
+    # enough of TOML for the `[[mods]]` tables of a mods.toml
+    data = {'mods': []}
+    table = None
+    quote = None
+    for line in text.splitlines():
+        if quote is not None:
+            # inside a multi-line string, such as a description
+            if line.count(quote) % 2 == 1:
+                quote = None
+            continue
+        for delimiter in ('"""', "'''"):
+            if line.count(delimiter) % 2 == 1:
+                quote = delimiter
+        if quote is not None:
+            continue
+        header = _TOML_TABLE.match(line)
+        if header is not None:
+            table = {} if header.group(1) == 'mods' else None
+            if table is not None:
+                data['mods'].append(table)
+            continue
+        value = _TOML_STRING.match(line)
+        if value is not None and table is not None:
+            table[value.group(1)] = value.group(2) if value.group(2) is not None else value.group(3)
+    return data
+
+def _parse_forge(text: str) -> List[dict]:
+    data = None
+    if tomllib is not None:
+        try:
+            data = tomllib.loads(text)
+        except ValueError:
+            pass
+    if data is None:
+        data = _parse_toml_lines(text)
+    mods = data.get('mods') or []
+    return [{'id': mod.get('modId'), 'name': mod.get('displayName'), 'version': mod.get('version')}
+        for mod in mods if isinstance(mod, dict)]
+
+_YAML_SCALAR = re.compile(r'''^(name|version)\s*:\s*(?:"([^"]*)"|'([^']*)'|([^#\r\n]*?))\s*(?:#.*)?$''')
+
+def _parse_plugin(text: str) -> List[dict]:
+    # only top-level scalars are needed, so no YAML parser is required
+    data = {}
+    for line in text.splitlines():
+        match = _YAML_SCALAR.match(line)
+        if match is not None and match.group(1) not in data:
+            data[match.group(1)] = next(group for group in match.groups()[1:] if group is not None)
+    return [{'id': data.get('name'), 'name': data.get('name'), 'version': data.get('version')}]
+
+_PARSERS = {
+    'fabric': _parse_fabric,
+    'forge': _parse_forge,
+    'neoforge': _parse_forge,
+    'paper': _parse_plugin,
+    'bukkit': _parse_plugin,
+}
+
+def _manifest_version(jar: zipfile.ZipFile) -> Union[str, None]:
+    text = _read_entry(jar, MANIFEST_ENTRY) or ''
+    for line in text.splitlines():
+        if line.startswith('Implementation-Version:'):
+            return line.split(':', 1)[1].strip()
+    return None
+
+def read_jar(path: str) -> List[ModInfo]:
+    """
+    Returns the mods or plugins a jar declares, or an empty list if it has
+    no metadata that Medusa understands, such as a library, or is not a zip.
+    """
+    try:
+        with zipfile.ZipFile(path) as jar:
+            for entry, loader in METADATA_ENTRIES:
+                text = _read_entry(jar, entry)
+                if text is None:
+                    continue
+                try:
+                    mods = _PARSERS[loader](text)
+                except (ValueError, AttributeError, TypeError):
+                    return []
+                infos = []
+                for mod in mods:
+                    if not mod.get('id'):
+                        continue
+                    version = mod.get('version')
+                    if version is not None and not isinstance(version, str):
+                        version = str(version)
+                    if version == '${file.jarVersion}':
+                        version = _manifest_version(jar)
+                    infos.append(ModInfo(str(mod['id']), mod.get('name'), version, loader))
+                return infos
+    except (OSError, zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError, EOFError):
+        pass
+    return []
+
+class ModIndex:
+    """
+    The mods found in each jar, keyed on the jar's device, inode, size, and
+    modification time, as in `HashCache`.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.entries: Dict[str, List[list]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = None) -> 'ModIndex':
+        """
+        Reads the index at the given path, or the default location if omitted.
+        A missing or unreadable file yields an empty index.
+        """
+        index = cls(path or get_index_location())
+        try:
+            with open(index.path, 'r') as file:
+                index.entries = json.load(file).get('entries', {})
+        except (OSError, ValueError, AttributeError):
+            index.entries = {}
+        return index
+
+    def read(self, path: str, stat: os.stat_result) -> List[ModInfo]:
+        """
+        Returns the mods in the jar, from the index if the jar has not changed.
+        """
+        key = HashCache.key(stat)
+        with self._lock:
+            self._seen.add(key)
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.hits += 1
+                return [ModInfo(*mod) for mod in cached]
+            self.misses += 1
+        mods = read_jar(path)
+        with self._lock:
+            self.entries[key] = [list(mod) for mod in mods]
+        return mods
+
+    def save(self):
+        """
+        Writes the entries used since loading to disk, dropping the rest.
+        Nothing is written if the directory holding the config does not exist yet.
+        """
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        entries = {key: mods for key, mods in self.entries.items() if key in self._seen}
+        with storage.atomic_open(self.path) as file:
+            json.dump({'entries': entries}, file)
+
+def get_inventory(servers: Iterable[Server], index: ModIndex, jobs: int = 8) -> List[InstalledMod]:
+    """
+    Returns every mod and plugin installed on the given servers, reading the
+    jars not yet in the index up to `jobs` at a time.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def read_one(item: Tuple[Server, str]) -> List[InstalledMod]:
+        srv, path = item
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return []
+        name = srv.display_name
+        return [InstalledMod(name, path, *mod) for mod in index.read(path, stat)]
+
+    items = [(srv, path) for srv in servers for path in find_jars(srv)]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix='medusa-mods') as pool:
+        return [mod for mods in pool.map(read_one, items) for mod in mods]
+
+def version_key(version: Union[str, None]) -> list:
+    """
+    Returns a key that orders versions such as `1.2.10` after `1.2.9`, and
+    pre-releases such as `1.0-beta` before `1.0`.
+    """
+    key = []
+    for part in re.findall(r'\d+|[A-Za-z]+', version or ''):
+        key.append((1, int(part)) if part.isdigit() else (-1, part.lower()))
+    key.append((0, ''))
+    return key
+
+def find_mod(inventory: Iterable[InstalledMod], pattern: str, version: str = None) -> List[InstalledMod]:
+    """
+    Returns the installs of mods whose ID or name matches the glob, ignoring
+    case, and optionally whose version is exactly `version`.
+    """
+    pattern = pattern.lower()
+    return [mod for mod in inventory
+        if (fnmatch.fnmatchcase(mod.id.lower(), pattern) or fnmatch.fnmatchcase((mod.name or '').lower(), pattern))
+        and (version is None or mod.version == version)]
+
+def find_outdated(inventory: Iterable[InstalledMod]) -> List[Tuple[InstalledMod, str]]:
+    """
+    Returns each install whose version is older than the newest version of
+    the same mod found anywhere in the inventory, with that newest version.
+    """
+    newest: Dict[Tuple[str, str], str] = {}
+    inventory = list(inventory)
+    for mod in inventory:
+        key = (mod.loader, mod.id.lower())
+        if mod.version is not None and (key not in newest or version_key(mod.version) > version_key(newest[key])):
+            newest[key] = mod.version
+    outdated = []
+    for mod in inventory:
+        latest = newest.get((mod.loader, mod.id.lower()))
+        if latest is not None and mod.version is not None and version_key(mod.version) < version_key(latest):
+            outdated.append((mod, latest))
+    return outdated
@@ -0,0 +1,59 @@
+import os
+from typing import Dict
+
+from .models import Server
+
+PROPERTIES_NAME = 'server.properties'
+
+DEFAULT_RCON_PORT = 25575
+
+def read_properties(path: str) -> Dict[str, str]:
+    """
+    Parses a Java `.properties` file as written by Minecraft servers. Comments
+    and blank lines are skipped; keys and values are returned as strings.
+
+    Raises
+    ------
+        OSError
+            If the file cannot be read.
+    """
+    props = {}
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line[0] in '#!':
+                continue
+            key, sep, value = line.partition('=')
+            if not sep:
+                key, sep, value = line.partition(':')
+            props[key.strip()] = value.strip().replace('\\:', ':').replace('\\=', '=')
+    return props
+
+def get_properties(srv: Server) -> Dict[str, str]:
+    """
+    Returns the contents of the server's `server.properties`, or an empty dict
+    if it has none.
+    """
+    try:
+        return read_properties(os.path.join(srv.Path, PROPERTIES_NAME))
+    except OSError:
+        return {}
+
+def get_int(props: Dict[str, str], key: str, default: int) -> int:
+    """
+    Returns a numeric property, or `default` if it is missing or malformed.
+    """
+    try:
+        return int(props.get(key, ''))
+    except ValueError:
+        return default
+
+def get_host(props: Dict[str, str]) -> str:
+    """
+    Returns the address the server listens on, preferring the loopback
+    interface when it listens on every interface.
+    """
+    host = props.get('server-ip', '').strip()
+    if host in ('', '0.0.0.0', '::'):
+        return '127.0.0.1'
+    return host
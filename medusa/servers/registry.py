@@ -0,0 +1,232 @@
+import os
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from .models import Server
+
+REGISTRY_VERSION = 1
+"""
+Version of the `server_registry` format written to the config. Version 0 is the
+original `jsonpickle` encoding, whose entries carry `py/object` tags.
+"""
+
+def encode_registry(servers: Iterable[Server]) -> List[dict]:
+    """
+    Converts servers to the plain-JSON entries stored in `server_registry`.
+    """
+    return [srv.to_dict() for srv in servers]
+
+def decode_registry(entries: List[dict]) -> Tuple[List[Server], bool]:
+    """
+    Converts `server_registry` entries back into servers, accepting entries in
+    the current format as well as those written by `jsonpickle`.
+
+    Returns
+    -------
+        (List of Server, bool)
+            The servers, and whether any entry used the legacy `jsonpickle`
+            format and should be migrated.
+    """
+    servers = []
+    legacy = False
+    for entry in entries or []:
+        if isinstance(entry, dict) and 'py/object' in entry:
+            legacy = True
+            servers.append(_decode_legacy_entry(entry))
+        else:
+            servers.append(Server.from_dict(entry))
+    return servers, legacy
+
+def _decode_legacy_entry(entry: dict) -> Server:
+    # jsonpickle is only needed to migrate old configs, so load it on demand
+    import jsonpickle
+    srv = jsonpickle.Unpickler().restore(entry)
+    if not isinstance(srv, Server):
+        # the recorded class could not be imported, so read the raw fields
+        srv = Server.from_dict(entry.get('py/state', entry))
+    return srv
+
+class AmbiguousIdentifierError(KeyError):
+    """
+    Raised when an identifier matches more than one registered server,
+    such as two servers whose directories share a name.
+    """
+
+    def __init__(self, identifier: str, matches: List[Server]):
+        super().__init__(identifier)
+        self.identifier = identifier
+        self.matches = matches
+
+    def __str__(self):
+        return 'Identifier "{}" matches {} servers: {}'.format(self.identifier, len(self.matches),
+            ', '.join(srv.Path for srv in self.matches))
+
+def path_key(path: str) -> Union[str, None]:
+    """
+    Returns the normalized form of a server path used for indexing.
+    """
+    if not path:
+        return None
+    return os.path.normpath(path)
+
+def basename_key(path: str) -> Union[str, None]:
+    """
+    Returns the directory name of a server path used for indexing.
+    """
+    if not path:
+        return None
+    # pathlib is imported on first use to keep it off the CLI startup path
+    from pathlib import PurePath
+    parts = PurePath(path).parts
+    if len(parts) == 0:
+        return None
+    return parts[-1]
+
+class ServerRegistry:
+    """
+    In-memory collection of the servers known to Medusa, indexed by alias,
+    path, and directory name so that identifiers resolve without comparing
+    against every server.
+
+    The indexes are built from each server's fields at the time it was added,
+    so a server whose fields are edited in place must be passed to `reindex`
+    (or `replace`) afterwards.
+    """
+
+    def __init__(self, servers: Iterable[Server] = None):
+        # servers are kept in a dict of insertion slots, which preserves
+        # their order while allowing constant-time removal
+        self._servers = {}
+        self._slots = {}
+        self._next_slot = 0
+        self._keys = {}
+        self._by_alias = {}
+        self._by_path = {}
+        self._by_basename = {}
+        for srv in servers or []:
+            self.add(srv)
+
+    def __len__(self):
+        return len(self._servers)
+
+    def __iter__(self) -> Iterator[Server]:
+        return iter(list(self._servers.values()))
+
+    def __getitem__(self, index):
+        return list(self._servers.values())[index]
+
+    def __contains__(self, srv):
+        return id(srv) in self._keys
+
+    def _index(self, srv: Server):
+        keys = (srv.Alias or None, path_key(srv.Path), basename_key(srv.Path))
+        self._keys[id(srv)] = keys
+        for index, key in zip((self._by_alias, self._by_path, self._by_basename), keys):
+            if key is not None:
+                index.setdefault(key, []).append(srv)
+
+    def _unindex(self, srv: Server):
+        keys = self._keys.pop(id(srv))
+        for index, key in zip((self._by_alias, self._by_path, self._by_basename), keys):
+            if key is None:
+                continue
+            bucket = [other for other in index[key] if other is not srv]
+            if bucket:
+                index[key] = bucket
+            else:
+                del index[key]
+
+    def add(self, srv: Server):
+        """
+        Adds a server to the end of the registry.
+        """
+        if srv in self:
+            raise ValueError('Server already in registry: {}'.format(srv.Path))
+        self._slots[id(srv)] = self._next_slot
+        self._servers[self._next_slot] = srv
+        self._next_slot += 1
+        self._index(srv)
+
+    def append(self, srv: Server):
+        self.add(srv)
+
+    def extend(self, servers: Iterable[Server]):
+        for srv in servers:
+            self.add(srv)
+
+    def remove(self, srv: Server):
+        """
+        Removes the given server object. Servers are matched by identity,
+        not by `Server.__eq__`.
+
+        Raises
+        ------
+            ValueError
+                If the server is not in the registry.
+        """
+        if srv not in self:
+            raise ValueError('Server not in registry: {}'.format(srv.Path))
+        self._unindex(srv)
+        del self._servers[self._slots.pop(id(srv))]
+
+    def replace(self, old: Server, new: Server):
+        """
+        Puts `new` in the position held by `old`. `old` and `new` may be
+        the same object, in which case its index entries are refreshed.
+        """
+        if old not in self:
+            raise ValueError('Server not in registry: {}'.format(old.Path))
+        if new is not old and new in self:
+            raise ValueError('Server already in registry: {}'.format(new.Path))
+        self._unindex(old)
+        slot = self._slots.pop(id(old))
+        self._slots[id(new)] = slot
+        self._servers[slot] = new
+        self._index(new)
+
+    def reindex(self, srv: Server):
+        """
+        Refreshes the index entries of a server whose fields were changed in place.
+        """
+        self.replace(srv, srv)
+
+    def indexed_path(self, srv: Server) -> Union[str, None]:
+        """
+        Returns the normalized path the server was indexed under, which is its
+        path as of the last `add`, `replace`, or `reindex`.
+        """
+        return self._keys[id(srv)][1]
+
+    def find_all(self, identifier: str) -> List[Server]:
+        """
+        Returns every server the identifier could refer to. Aliases and paths
+        take precedence over directory names, so a directory name is only
+        considered when no alias or path matches.
+        """
+        if identifier is None:
+            return []
+
+        matches = list(self._by_alias.get(identifier, []))
+        for srv in self._by_path.get(path_key(identifier), []):
+            if not any(srv is match for match in matches):
+                matches.append(srv)
+        if matches:
+            return matches
+
+        return list(self._by_basename.get(identifier, []))
+
+    def find(self, identifier: str) -> Union[Server, None]:
+        """
+        Returns the server identified by the given alias, path, or directory
+        name, or `None` if there is no such server.
+
+        Raises
+        ------
+            AmbiguousIdentifierError
+                If the identifier matches more than one server.
+        """
+        matches = self.find_all(identifier)
+        if len(matches) > 1:
+            raise AmbiguousIdentifierError(identifier, matches)
+        if len(matches) == 1:
+            return matches[0]
+        return None
@@ -0,0 +1,302 @@
+"""
+Retention and compaction of the `logs/` and `crash-reports/` directories of
+registered servers.
+
+`plan_retention` decides, for one server, which files to delete because they
+are too old or push the server over its size budget, and which to compress
+harder. The plan is the same whether it is then printed, as with `--dry-run`,
+or carried out by `apply_plan`. Compression runs in worker processes that
+lower their own CPU and I/O priority first, so it does not compete with the
+servers themselves.
+
+The live logs (`latest.log` and `debug.log`) are never touched.
+"""
+import gzip
+import lzma
+import os
+import time
+import zlib
+from typing import Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from .models import Server
+
+DIRECTORIES = ('logs', 'crash-reports')
+
+LIVE_LOGS = ('latest.log', 'debug.log', 'console.log')
+
+FORMATS = ('xz', 'gzip')
+
+COPY_SIZE = 1024 * 1024
+
+class RetentionPolicy(NamedTuple):
+    """
+    Limits applied to each server.
+    """
+    max_age_days: Union[float, None] = 90.0
+    """Files last modified longer ago than this are deleted"""
+    max_bytes: Union[int, None] = None
+    """Oldest files are deleted until the rest fit in this many bytes"""
+    compress_after_days: float = 1.0
+    """Files last modified longer ago than this are compressed with `format`"""
+    format: str = 'xz'
+    """`xz` (lzma) or `gzip` at its highest level"""
+
+class RetentionAction(NamedTuple):
+    action: str
+    """`delete` or `compress`"""
+    path: str
+    size: int
+    reason: str
+
+POLICY_KEYS = {
+    'max_age_days': 'retention_max_age_days',
+    'max_bytes': 'retention_max_size',
+    'compress_after_days': 'retention_compress_after_days',
+    'format': 'retention_format',
+}
+"""Config keys that override the default policy"""
+
+def parse_size(text: str) -> int:
+    """
+    Parses a byte count such as `500M` or `2G`, using powers of 1024.
+
+    Raises
+    ------
+        ValueError
+            If the text is not a number with an optional K, M, G, or T suffix.
+    """
+    text = str(text).strip().upper().rstrip('B')
+    units = 'KMGT'
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * 1024 ** (units.index(text[-1]) + 1))
+    return int(text)
+
+def format_size(size: int) -> str:
+    """
+    Formats a byte count for people, such as `1.5 MiB`.
+    """
+    value = float(size)
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(value) < 1024 or unit == 'GiB':
+            return '{:.0f} {}'.format(value, unit) if unit == 'B' else '{:.1f} {}'.format(value, unit)
+        value /= 1024
+
+def get_policy(**overrides) -> RetentionPolicy:
+    """
+    Returns the policy from the config, with any non-`None` overrides applied.
+
+    Raises
+    ------
+        ValueError
+            If a value in the config or the overrides is malformed.
+    """
+    from .. import config
+    try:
+        cfg = config.get_config()
+    except (OSError, ValueError):
+        cfg = {}
+    values = {}
+    for field, key in POLICY_KEYS.items():
+        value = overrides.get(field)
+        if value is None:
+            value = cfg.get(key)
+        if value is None or value == '':
+            continue
+        if field == 'max_bytes':
+            value = parse_size(value)
+        elif field == 'format':
+            if value not in FORMATS:
+                raise ValueError('Unknown format "{}"; use one of {}'.format(value, ', '.join(FORMATS)))
+        else:
+            value = float(value)
+        values[field] = value
+    return RetentionPolicy(**values)
+
+def _compressed_name(path: str, fmt: str) -> Union[str, None]:
+    # returns the name the file would have once compressed, or None if it already is
+    if path.endswith('.xz'):
+        return None
+    if path.endswith('.gz'):
+        if fmt == 'gzip':
+            # gzip's "extra flags" header byte is 2 for maximum compression
+            try:
+                with open(path, 'rb') as file:
+                    header = file.read(10)
+            except OSError:
+                return None
+            return None if header[8:9] == b'\x02' else path
+        return path[:-len('.gz')] + '.xz'
+    return path + ('.xz' if fmt == 'xz' else '.gz')
+
+def _list_files(srv: Server) -> List[Tuple[str, os.stat_result]]:
+    files = []
+    for directory in DIRECTORIES:
+        try:
+            with os.scandir(os.path.join(srv.Path, directory)) as scan:
+                for entry in scan:
+                    if directory == 'logs' and entry.name in LIVE_LOGS:
+                        continue
+                    if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                        continue
+                    files.append((entry.path, entry.stat(follow_symlinks=False)))
+        except OSError:
+            continue
+    return files
+
+def plan_retention(srv: Server, policy: RetentionPolicy, now: float = None) -> List[RetentionAction]:
+    """
+    Returns what should be done to the server's logs and crash reports to
+    meet the policy: deletions first, oldest first, then compressions.
+    """
+    now = time.time() if now is None else now
+    files = sorted(_list_files(srv), key=lambda item: item[1].st_mtime)
+    actions = []
+    kept = []
+    for path, stat in files:
+        age_days = (now - stat.st_mtime) / 86400
+        if policy.max_age_days is not None and age_days > policy.max_age_days:
+            actions.append(RetentionAction('delete', path, stat.st_size,
+                'older than {:g} days'.format(policy.max_age_days)))
+        else:
+            kept.append((path, stat))
+
+    if policy.max_bytes is not None:
+        total = sum(stat.st_size for path, stat in kept)
+        while kept and total > policy.max_bytes:
+            path, stat = kept.pop(0)
+            total -= stat.st_size
+            actions.append(RetentionAction('delete', path, stat.st_size,
+                'over the {} budget'.format(format_size(policy.max_bytes))))
+
+    for path, stat in kept:
+        if (now - stat.st_mtime) / 86400 <= policy.compress_after_days:
+            continue
+        if _compressed_name(path, policy.format) is not None:
+            actions.append(RetentionAction('compress', path, stat.st_size, 'to {}'.format(policy.format)))
+    return actions
+
+def _open_source(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    return open(path, 'rb')
+
+def _copy(source, target) -> Tuple[int, int]:
+    # returns the length and CRC-32 of everything copied
+    length = 0
+    crc = 0
+    while True:
+        chunk = source.read(COPY_SIZE)
+        if not chunk:
+            return length, crc
+        length += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+        if target is not None:
+            target.write(chunk)
+
+def compress_file(path: str, fmt: str) -> Tuple[str, int, int]:
+    """
+    Compresses a file with the given format, replacing it. The new file is
+    read back and compared with the original before the original is removed,
+    and keeps its modification time. Returns the new path and the sizes
+    before and after.
+    """
+    target_path = _compressed_name(path, fmt)
+    before = os.stat(path)
+    tmp_path = os.path.join(os.path.dirname(path), '.{}.{}.tmp'.format(os.path.basename(target_path), os.getpid()))
+    try:
+        if fmt == 'xz':
+            target = lzma.open(tmp_path, 'wb', preset=9)
+        else:
+            target = gzip.open(tmp_path, 'wb', compresslevel=9)
+        with _open_source(path) as source, target:
+            expected = _copy(source, target)
+        opener = lzma.open if fmt == 'xz' else gzip.open
+        with opener(tmp_path, 'rb') as check:
+            if _copy(check, None) != expected:
+                raise OSError('{} did not survive compression intact'.format(path))
+        os.utime(tmp_path, ns=(before.st_atime_ns, before.st_mtime_ns))
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if target_path != path:
+        os.remove(path)
+    return target_path, before.st_size, os.stat(target_path).st_size
+
+# ioprio_set(2) system call numbers by machine
+_IOPRIO_SET = {'x86_64': 251, 'amd64': 251, 'aarch64': 30, 'arm64': 30, 'i386': 289, 'i686': 289, 'armv7l': 314}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+
+def lower_priority(niceness: int = 19):
+    """
+    Lowers the CPU priority of the calling process and, on Linux, moves it to
+    the idle I/O class, so that it only uses the disk when nobody else is.
+    """
+    try:
+        os.nice(niceness)
+    except (AttributeError, OSError):
+        pass
+    try:
+        import ctypes
+        import ctypes.util
+        import platform
+        number = _IOPRIO_SET.get(platform.machine().lower())
+        libc_name = ctypes.util.find_library('c')
+        if number is not None and libc_name is not None:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            libc.syscall(number, _IOPRIO_WHO_PROCESS, 0, _IOPRIO_CLASS_IDLE << 13)
+    except (OSError, AttributeError):
+        pass
+
+def apply_plan(actions: Iterable[Tuple[Server, RetentionAction]], policy: RetentionPolicy,
+        jobs: int = 2) -> Iterator[dict]:
+    """
+    Carries out planned actions and yields one result per action, with the
+    server's `server` name, the `action`, `path`, `before` and `after` sizes,
+    and an `error` if it failed. Deletions happen straight away; compressions
+    run in up to `jobs` low-priority worker processes.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    compressions = []
+    for srv, action in actions:
+        if action.action == 'delete':
+            result = _result(srv, action)
+            try:
+                os.remove(action.path)
+                result['after'] = 0
+            except OSError as err:
+                result['error'] = str(err)
+            yield result
+        else:
+            compressions.append((srv, action))
+    if not compressions:
+        return
+
+    with ProcessPoolExecutor(max_workers=max(jobs, 1), initializer=lower_priority) as pool:
+        futures = {pool.submit(compress_file, action.path, policy.format): (srv, action)
+            for srv, action in compressions}
+        for future in as_completed(futures):
+            srv, action = futures[future]
+            result = _result(srv, action)
+            try:
+                result['path'], result['before'], result['after'] = future.result()
+            except (OSError, EOFError, zlib.error, lzma.LZMAError) as err:
+                # such as an archive cut short, which is left as it is
+                result['error'] = str(err) or type(err).__name__
+            yield result
+
+def _result(srv: Server, action: RetentionAction) -> dict:
+    return {
+        'server': srv.display_name,
+        'action': action.action,
+        'path': action.path,
+        'before': action.size,
+        'after': action.size,
+        'error': None,
+    }
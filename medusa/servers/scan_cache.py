@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+from typing import List, Tuple, Union
+
+from .. import config, storage
+
+CACHE_NAME = 'scan_cache.json'
+
+def get_scan_cache_location():
+    """
+    Returns the path of the scan cache, which lives next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), CACHE_NAME)
+
+class ScanCache:
+    """
+    Remembers the type detected for each directory seen by a scan, keyed on the
+    directory's inode and modification time. Adding, removing, or renaming a
+    top-level entry changes the directory's mtime, so an unchanged key means
+    the detection result is still valid and the directory need not be read.
+
+    Fingerprints of the server jars are kept alongside, keyed on the inode and
+    modification time of each file they were read from as well as of the
+    directory, since a jar overwritten in place leaves the directory untouched.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.entries = {}
+        self.fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+        self.fingerprint_hits = 0
+        self.fingerprint_misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = None) -> 'ScanCache':
+        """
+        Reads the cache at the given path, or the default location if omitted.
+        A missing or unreadable cache file yields an empty cache.
+        """
+        cache = cls(path or get_scan_cache_location())
+        try:
+            with open(cache.path, 'r') as file:
+                data = json.load(file)
+            cache.entries = data.get('entries', {})
+            cache.fingerprints = data.get('fingerprints', {})
+        except (OSError, ValueError, AttributeError):
+            cache.entries = {}
+            cache.fingerprints = {}
+        return cache
+
+    def lookup(self, path: str, stat: os.stat_result) -> Union[Tuple[str, float], None]:
+        """
+        Returns the cached `(type, confidence)` for the directory, or `None`
+        if it was never scanned or has changed since. Updates the hit/miss counts.
+        """
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry['ino'] == stat.st_ino and entry['mtime_ns'] == stat.st_mtime_ns:
+                self.hits += 1
+                return entry['type'], entry['confidence']
+
+            self.misses += 1
+            return None
+
+    def store(self, path: str, stat: os.stat_result, srv_type: str, confidence: float):
+        """
+        Records the detection result for the directory in its current state.
+        """
+        with self._lock:
+            self.entries[path] = {
+                'ino': stat.st_ino,
+                'mtime_ns': stat.st_mtime_ns,
+                'type': srv_type,
+                'confidence': confidence,
+            }
+
+    @staticmethod
+    def stat_inputs(path: str, inputs: List[str]) -> dict:
+        """
+        Returns the inode and modification time of each of the given paths
+        within the directory, or `None` for those that do not exist.
+        """
+        state = {}
+        for name in inputs:
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except OSError:
+                state[name] = None
+                continue
+            state[name] = [stat.st_ino, stat.st_mtime_ns]
+        return state
+
+    def lookup_fingerprint(self, path: str, stat: os.stat_result, inputs: dict = None) -> Union[list, None]:
+        """
+        Returns the cached fingerprint fields for the directory, or an empty
+        list if it had none. Without `inputs`, the entry is used if neither
+        the directory nor any file it was read from has changed. Otherwise it
+        is used if `inputs`, as returned by `stat_inputs`, match those it was
+        read from, so that files written next to the jars do not invalidate it.
+        Returns `None` if the entry cannot be used.
+        """
+        with self._lock:
+            entry = self.fingerprints.get(path)
+        if entry is None:
+            return None
+        if inputs is None:
+            if entry['ino'] != stat.st_ino or entry['mtime_ns'] != stat.st_mtime_ns:
+                return None
+            inputs = self.stat_inputs(path, entry['inputs'])
+        if inputs != entry['inputs']:
+            return None
+
+        with self._lock:
+            entry['ino'] = stat.st_ino
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self.fingerprint_hits += 1
+        return entry['fingerprint']
+
+    def store_fingerprint(self, path: str, stat: os.stat_result, inputs: dict, fingerprint: list):
+        """
+        Records a fingerprint read from the directory, along with the state of
+        its inputs as returned by `stat_inputs` before they were read. Each
+        fingerprint read counts as a miss.
+        """
+        with self._lock:
+            self.fingerprint_misses += 1
+            self.fingerprints[path] = {
+                'ino': stat.st_ino,
+                'mtime_ns': stat.st_mtime_ns,
+                'inputs': inputs,
+                'fingerprint': fingerprint,
+            }
+
+    def prune(self, parent: str, keep):
+        """
+        Drops entries for directories in `parent` that are not in `keep`.
+        """
+        keep = set(keep)
+        parent = os.path.abspath(parent)
+        for entries in (self.entries, self.fingerprints):
+            for path in list(entries):
+                if os.path.dirname(path) == parent and path not in keep:
+                    del entries[path]
+
+    def save(self):
+        """
+        Writes the cache to disk. Nothing is written if the directory holding
+        the config does not exist yet.
+        """
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        with storage.atomic_open(self.path) as file:
+            json.dump({'entries': self.entries, 'fingerprints': self.fingerprints}, file)
@@ -0,0 +1,458 @@
+"""
+Process supervisor for Minecraft servers launched by Medusa.
+
+Everything runs on the shared event loop from `medusa.loop`: console output is
+read with `add_reader` on each server's pipe, and exits are noticed through a
+pidfd per process (or, where pidfds are unavailable, a single periodic poll),
+so one supervisor handles hundreds of JVMs without a thread per pipe or per
+child. Each server's output is kept in a bounded ring buffer of lines.
+
+Servers are started in their own session, so they outlive the supervisor if
+it exits. A console pipe would not: once the process reading it is gone, the
+server's next write fails. Only a resident process such as `medusad` (see
+`set_resident`) therefore keeps the console attached. Anywhere else the server
+writes its console output to `logs/console.log` and reads no input, and is
+controlled over RCON like any server started outside Medusa.
+"""
+import asyncio
+import collections
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+from typing import Deque, Dict, List, Union
+
+try:
+    import fcntl
+except ImportError:
+    # record locks cannot be tested on Windows
+    fcntl = None
+
+from .models import Server
+
+BUFFER_LINES = 1000
+"""Lines of console output kept per server"""
+
+MAX_LINE = 64 * 1024
+"""Bytes of output without a newline after which the partial line is kept as is"""
+
+STOP_TIMEOUT = 60.0
+"""Seconds allowed for the server to save and exit after the `stop` command"""
+
+TERM_TIMEOUT = 15.0
+"""Seconds allowed after SIGTERM before the server is killed"""
+
+POLL_INTERVAL = 1.0
+"""Seconds between exit checks on platforms without pidfds"""
+
+CONSOLE_LOG = 'console.log'
+"""File in the server's `logs/` that receives the output of a detached server"""
+
+class SupervisorError(Exception):
+    """
+    Raised when a server cannot be started, stopped, or reached through
+    the supervisor.
+    """
+
+def get_launch_command(srv: Server) -> List[str]:
+    """
+    Returns the command that starts the server: its startup script, as found
+    by `find_startup_script_paths`, or else `java -jar` on its server jar.
+
+    Raises
+    ------
+        SupervisorError
+            If the directory has neither a startup script nor a jar.
+    """
+    from . import manager
+    scripts = manager.find_startup_script_paths(srv.Path)
+    preferred = '.bat' if sys.platform == 'win32' else '.sh'
+    scripts = sorted(scripts, key=lambda name: (not name.endswith(preferred), name))
+    if scripts:
+        script = scripts[0]
+        if script.endswith('.bat'):
+            return ['cmd', '/c', script]
+        return ['sh', script]
+
+    jar = _find_server_jar(srv)
+    if jar is None:
+        raise SupervisorError('No startup script or server jar in {}'.format(srv.Path))
+    return ['java'] + shlex.split(_get_java_args()) + ['-jar', jar, 'nogui']
+
+def _find_server_jar(srv: Server) -> Union[str, None]:
+    try:
+        with os.scandir(srv.Path) as scan:
+            jars = sorted(entry.name for entry in scan if entry.name.lower().endswith('.jar') and entry.is_file())
+    except OSError:
+        return None
+    if not jars:
+        return None
+    # prefer the jar named after the server type, then anything that calls itself a server
+    hints = [(getattr(srv, 'Type', None) or '').lower(), 'server']
+    for hint in hints:
+        for jar in jars:
+            if hint and hint in jar.lower():
+                return jar
+    return jars[0]
+
+def _get_java_args() -> str:
+    from .. import config
+    try:
+        return config.get_config().get('java_args') or ''
+    except (OSError, ValueError):
+        return ''
+
+class ServerProcess:
+    """
+    A server started by the supervisor.
+    """
+
+    def __init__(self, srv: Server, popen: subprocess.Popen, buffer_lines: int, console_log: str = None):
+        self.srv = srv
+        self.popen = popen
+        self.pid = popen.pid
+        self.console_log = console_log
+        """File receiving the output of a detached server, or `None` if its console is attached"""
+        self.started_at = time.time()
+        """Wall-clock time at which the process was started"""
+        self.output: Deque[str] = collections.deque(maxlen=buffer_lines)
+        """Most recent lines of console output"""
+        self.returncode = None
+        self.exited = asyncio.get_running_loop().create_future()
+        self._partial = b''
+        self._pidfd = None
+
+    @property
+    def running(self) -> bool:
+        return self.returncode is None
+
+    def to_dict(self) -> dict:
+        return {
+            'server': self.srv.display_name,
+            'path': self.srv.Path,
+            'pid': self.pid,
+            'started_at': self.started_at,
+            'uptime': (time.time() - self.started_at) if self.running else None,
+            'running': self.running,
+            'returncode': self.returncode,
+            'console_log': self.console_log,
+        }
+
+class Supervisor:
+    """
+    Starts, tracks, and stops server processes. Its coroutines must run on
+    the event loop it was created on; the module-level functions take care
+    of that for synchronous callers.
+    """
+
+    def __init__(self, buffer_lines: int = BUFFER_LINES):
+        self.buffer_lines = buffer_lines
+        self._processes: Dict[str, ServerProcess] = {}
+        self._poller = None
+
+    def get(self, srv: Server) -> Union[ServerProcess, None]:
+        """
+        Returns the running process of the server, if it was started here.
+        """
+        proc = self._processes.get(os.path.normpath(srv.Path))
+        if proc is not None and proc.running:
+            return proc
+        return None
+
+    def processes(self) -> List[ServerProcess]:
+        """
+        Returns every process started here, including those that have exited.
+        """
+        return list(self._processes.values())
+
+    async def start(self, srv: Server, command: List[str] = None, detach: bool = False) -> ServerProcess:
+        """
+        Launches the server and begins collecting its output. With `detach`,
+        the output goes to `logs/console.log` instead and the console takes
+        no input, so the server keeps running normally after this process exits.
+
+        Raises
+        ------
+            SupervisorError
+                If the server is already running or cannot be launched.
+        """
+        if self.get(srv) is not None:
+            raise SupervisorError('{} is already running'.format(srv.Path))
+        command = command or get_launch_command(srv)
+        console_log = os.path.join(srv.Path, 'logs', CONSOLE_LOG) if detach else None
+        try:
+            if detach:
+                os.makedirs(os.path.dirname(console_log), exist_ok=True)
+                with open(console_log, 'wb') as output:
+                    popen = subprocess.Popen(command, cwd=srv.Path, stdin=subprocess.DEVNULL,
+                        stdout=output, stderr=subprocess.STDOUT, start_new_session=True)
+            else:
+                popen = subprocess.Popen(command, cwd=srv.Path, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+        except OSError as err:
+            raise SupervisorError('Could not start {}: {}'.format(srv.Path, err))
+
+        proc = ServerProcess(srv, popen, self.buffer_lines, console_log)
+        self._processes[os.path.normpath(srv.Path)] = proc
+        loop = asyncio.get_running_loop()
+        if not detach:
+            os.set_blocking(popen.stdout.fileno(), False)
+            os.set_blocking(popen.stdin.fileno(), False)
+            loop.add_reader(popen.stdout.fileno(), self._on_output, proc)
+
+        if hasattr(os, 'pidfd_open'):
+            try:
+                proc._pidfd = os.pidfd_open(popen.pid)
+            except OSError:
+                proc._pidfd = None
+        if proc._pidfd is not None:
+            loop.add_reader(proc._pidfd, self._check_exit, proc)
+        elif self._poller is None or self._poller.done():
+            self._poller = loop.create_task(self._poll_exits())
+        return proc
+
+    def _on_output(self, proc: ServerProcess) -> bool:
+        # returns whether there may be more output to read right away
+        fd = proc.popen.stdout.fileno()
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b''
+        if not data:
+            asyncio.get_running_loop().remove_reader(fd)
+            if proc._partial:
+                proc.output.append(proc._partial.decode('utf-8', errors='replace'))
+                proc._partial = b''
+            return False
+
+        lines = (proc._partial + data).split(b'\n')
+        proc._partial = lines.pop()
+        if len(proc._partial) > MAX_LINE:
+            lines.append(proc._partial)
+            proc._partial = b''
+        for line in lines:
+            proc.output.append(line.rstrip(b'\r').decode('utf-8', errors='replace'))
+        return True
+
+    def _check_exit(self, proc: ServerProcess):
+        if proc.returncode is not None or proc.popen.poll() is None:
+            return
+        proc.returncode = proc.popen.returncode
+        loop = asyncio.get_running_loop()
+        if proc._pidfd is not None:
+            loop.remove_reader(proc._pidfd)
+            os.close(proc._pidfd)
+            proc._pidfd = None
+        # collect whatever output is still buffered in the pipe
+        while proc.console_log is None and self._on_output(proc):
+            pass
+        for pipe in (proc.popen.stdin, proc.popen.stdout):
+            if pipe is None:
+                continue
+            try:
+                loop.remove_reader(pipe.fileno())
+                pipe.close()
+            except (OSError, ValueError):
+                pass
+        if not proc.exited.done():
+            proc.exited.set_result(proc.returncode)
+
+    async def _poll_exits(self):
+        while any(proc.running for proc in self._processes.values()):
+            await asyncio.sleep(POLL_INTERVAL)
+            for proc in list(self._processes.values()):
+                self._check_exit(proc)
+
+    def send(self, srv: Server, command: str):
+        """
+        Writes a command to the server's console.
+
+        Raises
+        ------
+            SupervisorError
+                If the server is not running under this supervisor or its
+                console is not accepting input.
+        """
+        proc = self.get(srv)
+        if proc is None:
+            raise SupervisorError('{} is not running under this supervisor'.format(srv.Path))
+        if proc.console_log is not None:
+            raise SupervisorError('{} was started without a console; its output goes to {}'.format(
+                srv.Path, proc.console_log))
+        data = (command.rstrip('\n') + '\n').encode('utf-8')
+        try:
+            written = os.write(proc.popen.stdin.fileno(), data)
+        except (BlockingIOError, BrokenPipeError, ValueError) as err:
+            raise SupervisorError('Console of {} is not accepting input: {}'.format(srv.Path, err))
+        if written < len(data):
+            raise SupervisorError('Console of {} accepted only part of the command'.format(srv.Path))
+
+    async def stop(self, srv: Server, stop_timeout: float = STOP_TIMEOUT,
+            term_timeout: float = TERM_TIMEOUT) -> int:
+        """
+        Stops the server, escalating from the `stop` console command to SIGTERM
+        and finally SIGKILL as each deadline passes. Returns its exit status.
+
+        Raises
+        ------
+            SupervisorError
+                If the server is not running under this supervisor.
+        """
+        proc = self.get(srv)
+        if proc is None:
+            raise SupervisorError('{} is not running under this supervisor'.format(srv.Path))
+
+        if proc.console_log is None:
+            try:
+                self.send(srv, 'stop')
+            except SupervisorError:
+                pass
+            stages = ((None, stop_timeout), (signal.SIGTERM, term_timeout), (signal.SIGKILL, None))
+        else:
+            # there is no console to type `stop` into; the server saves on SIGTERM too
+            stages = ((signal.SIGTERM, stop_timeout), (signal.SIGKILL, None))
+        for sig, timeout in stages:
+            if sig is not None:
+                self._signal(proc, sig)
+            try:
+                return await asyncio.wait_for(asyncio.shield(proc.exited), timeout)
+            except asyncio.TimeoutError:
+                continue
+
+    def _signal(self, proc: ServerProcess, sig: int):
+        # startup scripts run the JVM as a child, so signal the whole process group
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+        except OSError:
+            proc.popen.send_signal(sig)
+
+_supervisor = None
+_supervisor_loop = None
+_resident = False
+
+def set_resident(resident: bool = True):
+    """
+    Marks this process as staying up for as long as the servers it starts,
+    as `medusad` does, so that `start_server` keeps their consoles attached.
+    """
+    global _resident
+    _resident = resident
+
+def get_supervisor() -> Supervisor:
+    """
+    Returns the process-wide supervisor, which lives on the shared loop.
+    """
+    global _supervisor, _supervisor_loop
+    from .. import loop
+    current = loop.get_loop()
+    if _supervisor is None or _supervisor_loop is not current:
+        _supervisor = Supervisor()
+        _supervisor_loop = current
+    return _supervisor
+
+async def _call(fn, *args):
+    return fn(*args)
+
+def start_server(srv: Server, command: List[str] = None) -> ServerProcess:
+    """
+    Launches a server under the process-wide supervisor, detached unless this
+    process is resident; see `set_resident`.
+    """
+    from .. import loop
+    return loop.run(get_supervisor().start(srv, command, detach=not _resident))
+
+def stop_server(srv: Server, stop_timeout: float = STOP_TIMEOUT, term_timeout: float = TERM_TIMEOUT) -> int:
+    """
+    Stops a supervised server; see `Supervisor.stop`.
+    """
+    from .. import loop
+    return loop.run(get_supervisor().stop(srv, stop_timeout, term_timeout))
+
+def send_console(srv: Server, command: str):
+    """
+    Writes a command to a supervised server's console.
+    """
+    from .. import loop
+    loop.run(_call(get_supervisor().send, srv, command))
+
+def get_process(srv: Server) -> Union[ServerProcess, None]:
+    """
+    Returns the supervised process of the server, if it is running.
+    """
+    from .. import loop
+    return loop.run(_call(get_supervisor().get, srv))
+
+def world_in_use(srv: Server) -> bool:
+    """
+    Tells whether some process holds the lock on the server's world, as
+    Minecraft does from startup until it has saved the world on shutdown.
+    Always `False` where locks cannot be tested, or for versions that do not
+    lock `session.lock`.
+    """
+    if fcntl is None:
+        return False
+    from . import properties
+    level = properties.get_properties(srv).get('level-name') or 'world'
+    try:
+        file = open(os.path.join(srv.Path, level, 'session.lock'), 'rb')
+    except OSError:
+        return False
+    with file:
+        # Java's `FileChannel.tryLock` takes a POSIX record lock, which `lockf` tests
+        try:
+            fcntl.lockf(file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.lockf(file.fileno(), fcntl.LOCK_UN)
+    return False
+
+def _rcon_open(srv: Server) -> bool:
+    import socket
+    from .. import rcon
+    try:
+        target = rcon.get_rcon_target(srv)
+    except rcon.RconError:
+        return False
+    try:
+        socket.create_connection((target.host, target.port), timeout=1.0).close()
+    except OSError:
+        return False
+    return True
+
+def wait_for_exit(srv: Server, timeout: float = STOP_TIMEOUT):
+    """
+    Waits for a server that is not supervised here, and was asked to stop
+    over RCON, to finish: until its RCON port closes and its world is no
+    longer locked.
+
+    Raises
+    ------
+        SupervisorError
+            If the server still looks like it is running after `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while _rcon_open(srv) or world_in_use(srv):
+        if time.monotonic() >= deadline:
+            raise SupervisorError('{} is still running {:g} seconds after being asked to stop'.format(
+                srv.Path, timeout))
+        time.sleep(min(POLL_INTERVAL, max(deadline - time.monotonic(), 0.01)))
+
+def get_output(srv: Server, lines: int = None) -> List[str]:
+    """
+    Returns the last `lines` lines of console output of a supervised server,
+    or all that are buffered.
+    """
+    from .. import loop
+    def tail():
+        proc = get_supervisor()._processes.get(os.path.normpath(srv.Path))
+        if proc is None:
+            return []
+        output = list(proc.output)
+        return output[-lines:] if lines else output
+    return loop.run(_call(tail))
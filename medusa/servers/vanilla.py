@@ -1,34 +1,34 @@
 import argparse
 from os import PathLike
 import os
-from typing import Union
+from typing import List, Union
 
 from medusa.servers import VANILLA
 
+from .detection import list_top_level, top_level_jars
 from .models import ServerController, Server
 from .. import parsers
 
+def detect_vanilla(entries: List[os.DirEntry]) -> float:
+    """
+    Detection strategy for Vanilla servers. Returns the confidence, from 0 to 1,
+    that the given top-level directory entries belong to a vanilla server.
+    """
+    confidence = 0.0
+    for name in top_level_jars(entries):
+        # strat 1 - jar files, where 'mc' is a much weaker hint than 'minecraft'
+        if 'minecraft' in name:
+            confidence = max(confidence, 0.6)
+        elif 'mc' in name:
+            confidence = max(confidence, 0.3)
+
+    return confidence
+
 def is_path_vanilla(directory: PathLike) -> bool:
     """
     Determines whether the given path points to a vanilla server
     """
-    srv_dir = os.path.abspath(directory)
-    strat_jar = False
-    for dir_path, dir_names, f_names in os.walk(srv_dir):
-        # don't enter subdirectories
-        if dir_path != srv_dir:
-            continue        
-
-        # iterate through file names, recording each strategy's guess
-        for file in f_names:
-            file = file.lower()
-
-            # strat 1 - jar files
-            if file.endswith('.jar'):
-                if 'mc' in file or 'minecraft' in file:
-                    strat_jar =  True
-                    
-    return strat_jar
+    return detect_vanilla(list_top_level(directory)) > 0
 
 class VanillaServer(Server):
     def __init__(self):
@@ -49,11 +49,13 @@ class VanillaController(ServerController):
         
         self.info = srv
 
-    def startup(cls):
+    def startup(self):
         print('Starting server')
+        return super().startup()
 
-    def shutdown(cls):
+    def shutdown(self):
         print('Shutting down server')
+        return super().shutdown()
 
     @classmethod
     def get_parser(cls):
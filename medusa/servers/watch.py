@@ -0,0 +1,298 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterable, Set
+
+from .. import config, storage
+from . import NOTASERVER, manager
+from .detection import detect_server_type
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+"""Events watched on the server directory itself"""
+
+SERVER_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE
+"""Events watched on the top level of each server directory"""
+
+class Inotify:
+    """
+    Thin `ctypes` wrapper around the Linux inotify API.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this platform')
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read_events(self, timeout: float):
+        """
+        Waits up to `timeout` seconds for events and returns them as a list
+        of `(wd, mask, name)` tuples.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class InotifySource:
+    """
+    Reports which server directories changed, using inotify watches on the
+    server directory and on the top level of each directory inside it.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self._inotify = Inotify()
+        self._paths = {}
+        self._watch(self.root, ROOT_MASK)
+        for path in _list_children(self.root):
+            self._watch(path, SERVER_MASK)
+
+    def _watch(self, path: str, mask: int):
+        try:
+            self._paths[self._inotify.add_watch(path, mask)] = path
+        except OSError:
+            # the directory vanished before it could be watched
+            pass
+
+    def poll(self, timeout: float) -> Set[str]:
+        changed = set()
+        for wd, mask, name in self._inotify.read_events(timeout):
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, so every directory must be checked
+                changed.update(_list_children(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+
+            watched = self._paths.get(wd)
+            if watched is None:
+                continue
+            if watched == self.root:
+                if not name:
+                    continue
+                path = os.path.join(self.root, name)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch(path, SERVER_MASK)
+                changed.add(path)
+            else:
+                changed.add(watched)
+        return changed
+
+    def close(self):
+        self._inotify.close()
+
+class PollingSource:
+    """
+    Portable fallback for `InotifySource` that compares snapshots of each
+    directory's top-level listing.
+    """
+
+    def __init__(self, root: str, interval: float = 5.0):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> Dict[str, frozenset]:
+        snapshot = {}
+        for path in _list_children(self.root):
+            try:
+                with os.scandir(path) as scan:
+                    snapshot[path] = frozenset(
+                        (entry.name, entry.stat().st_size if entry.is_file() else None) for entry in scan)
+            except OSError:
+                continue
+        return snapshot
+
+    def poll(self, timeout: float) -> Set[str]:
+        time.sleep(min(timeout, self.interval))
+        previous, self._snapshot = self._snapshot, self._take_snapshot()
+        changed = set()
+        for path in set(previous) | set(self._snapshot):
+            if previous.get(path) != self._snapshot.get(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+def _list_children(root: str) -> Iterable[str]:
+    try:
+        with os.scandir(root) as scan:
+            return [os.path.abspath(entry.path) for entry in scan if entry.is_dir()]
+    except OSError:
+        return []
+
+class Debouncer:
+    """
+    Collects paths and releases each one only after it has been quiet
+    for `delay` seconds, so a burst of events, such as a server jar being
+    copied in, results in a single detection.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending = {}
+
+    def touch(self, paths: Iterable[str], now: float):
+        for path in paths:
+            self._pending[path] = now
+
+    def ready(self, now: float) -> Set[str]:
+        done = set(path for path, last in self._pending.items() if now - last >= self.delay)
+        for path in done:
+            del self._pending[path]
+        return done
+
+    def next_deadline(self, now: float, default: float) -> float:
+        """
+        Returns how long to wait before the next path could become ready.
+        """
+        if not self._pending:
+            return default
+        return max(0.0, min(self._pending.values()) + self.delay - now)
+
+def reconcile_directory(path: str, verbosity: int = 1):
+    """
+    Brings the registry in line with the directory at `path`, registering it if
+    it now holds a server and deregistering it if it no longer exists.
+
+    Returns
+    -------
+        str
+            `'registered'`, `'deregistered'`, or `None` if nothing changed.
+    """
+    path = os.path.abspath(path)
+    registered = manager.get_server_by_identifier(path)
+
+    if not os.path.isdir(path):
+        if registered is None:
+            return None
+        manager.deregister_server(path)
+        if verbosity > 0:
+            print('Deregistered removed server', path)
+        return 'deregistered'
+
+    if registered is not None:
+        return None
+
+    dir_type, confidence = detect_server_type(path)
+    if dir_type == NOTASERVER:
+        return None
+    if manager.register_server(path, dir_type):
+        if verbosity > 0:
+            print('Registered {} server {}'.format(dir_type, path))
+        return 'registered'
+    return None
+
+def open_source(root: str, use_inotify: bool = True, interval: float = 5.0):
+    """
+    Returns an inotify-backed change source for `root`, falling back to
+    polling when inotify is unavailable or not wanted.
+    """
+    if use_inotify:
+        try:
+            return InotifySource(root)
+        except (OSError, AttributeError):
+            pass
+    return PollingSource(root, interval)
+
+def watch_servers(directory: str = None, delay: float = 2.0, use_inotify: bool = True, verbosity: int = 1):
+    """
+    Watches the server directory and keeps the registry up to date until
+    interrupted. Only directories that were created, changed, renamed, or
+    removed are inspected.
+
+    Parameters
+    ----------
+        directory: str
+            Directory to watch. Defaults to the configured `server_directory`.
+
+        delay: float
+            Seconds a directory must stay quiet before it is inspected.
+
+        use_inotify: bool
+            Whether to use inotify. Polling is used if `False` or unavailable.
+
+        verbosity: int
+            Level of verbosity to use. The higher the number, the more verbose the output.
+    """
+    if directory is None:
+        directory = config.get_config_value('server_directory')
+
+    source = open_source(directory, use_inotify, interval=delay)
+    if verbosity > 0:
+        print('Watching {} for servers ({})'.format(directory,
+            'inotify' if isinstance(source, InotifySource) else 'polling'))
+
+    debouncer = Debouncer(delay)
+    try:
+        while True:
+            now = time.monotonic()
+            changed = source.poll(debouncer.next_deadline(now, default=60.0))
+            now = time.monotonic()
+            debouncer.touch(changed, now)
+            for path in sorted(debouncer.ready(now)):
+                if verbosity > 1:
+                    print('Checking', path)
+                try:
+                    reconcile_directory(path, verbosity)
+                except (OSError, storage.LockTimeoutError) as err:
+                    # one unreadable directory or busy registry must not stop the watch;
+                    # the directory is checked again when it next changes
+                    print('Could not check {}: {}'.format(path, err))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
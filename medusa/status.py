@@ -0,0 +1,430 @@
+"""
+`medusa status`, which probes every registered server at once.
+
+Each server is asked for its version, MOTD, player count, and latency with the
+Server List Ping handshake over TCP, and, if `enable-query` is set, for its
+full player list with the GameSpy4 query protocol over UDP. Every UDP query
+shares one non-blocking socket, with responses matched to requests by session
+ID. Each probe has its own timeout, so an unresponsive server costs at most
+one timeout no matter how many servers are probed. Results are shared between
+processes through the `status_cache` module.
+"""
+import asyncio
+import itertools
+import json
+import socket
+import struct
+import sys
+import time
+from typing import Dict, Iterable, List, Tuple, Union
+
+from . import parsers
+from .servers import properties
+from .servers.models import Server
+
+DEFAULT_TIMEOUT = 3.0
+"""Seconds allowed for each probe of each server"""
+
+DEFAULT_PORT = 25565
+
+SLP_PROTOCOL_VERSION = -1
+"""Protocol version sent in the handshake; -1 asks for the server's own"""
+
+MAX_SLP_RESPONSE = 1024 * 1024
+
+QUERY_MAGIC = b'\xfe\xfd'
+QUERY_HANDSHAKE = 9
+QUERY_STAT = 0
+
+class ProbeError(Exception):
+    """
+    Raised when a server answers a probe with something unexpected.
+    """
+
+# Server List Ping
+
+def encode_varint(value: int) -> bytes:
+    """
+    Encodes an int32 as a Minecraft protocol VarInt.
+    """
+    value &= 0xffffffff
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+async def read_varint(reader: asyncio.StreamReader) -> int:
+    """
+    Reads a Minecraft protocol VarInt from the stream.
+    """
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            if value & 0x80000000:
+                value -= 1 << 32
+            return value
+    raise ProbeError('VarInt is too long')
+
+def _slp_packet(packet_id: int, payload: bytes) -> bytes:
+    body = encode_varint(packet_id) + payload
+    return encode_varint(len(body)) + body
+
+def _slp_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return encode_varint(len(data)) + data
+
+async def _read_slp_packet(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    length = await read_varint(reader)
+    if length <= 0 or length > MAX_SLP_RESPONSE:
+        raise ProbeError('Invalid packet length {}'.format(length))
+    data = await reader.readexactly(length)
+    packet_id = data[0]
+    if packet_id & 0x80:
+        raise ProbeError('Unexpected packet id')
+    return packet_id, data[1:]
+
+def _decode_slp_string(data: bytes) -> str:
+    length = 0
+    for index, byte in enumerate(data[:5]):
+        length |= (byte & 0x7f) << (7 * index)
+        if not byte & 0x80:
+            start = index + 1
+            return data[start:start + length].decode('utf-8', errors='replace')
+    raise ProbeError('Malformed string')
+
+def flatten_motd(description) -> str:
+    """
+    Returns the plain text of a MOTD, which may be a string or a chat component.
+    """
+    if isinstance(description, str):
+        return description
+    if isinstance(description, list):
+        return ''.join(flatten_motd(part) for part in description)
+    if isinstance(description, dict):
+        return flatten_motd(description.get('text', '')) + flatten_motd(description.get('extra', []))
+    return ''
+
+async def ping_server(host: str, port: int) -> dict:
+    """
+    Runs the Server List Ping handshake and returns the server's `version`,
+    `motd`, `online` and `max` player counts, and `latency` in milliseconds.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        handshake = (encode_varint(SLP_PROTOCOL_VERSION) + _slp_string(host)
+            + struct.pack('>H', port) + encode_varint(1))
+        writer.write(_slp_packet(0x00, handshake) + _slp_packet(0x00, b''))
+        await writer.drain()
+        packet_id, data = await _read_slp_packet(reader)
+        if packet_id != 0x00:
+            raise ProbeError('Expected a status response but got packet {}'.format(packet_id))
+        try:
+            status = json.loads(_decode_slp_string(data))
+        except ValueError as err:
+            raise ProbeError('Malformed status response: {}'.format(err))
+        if not isinstance(status, dict):
+            raise ProbeError('Malformed status response: not a JSON object')
+
+        token = int(time.monotonic() * 1000) & 0x7fffffffffffffff
+        sent = time.monotonic()
+        writer.write(_slp_packet(0x01, struct.pack('>q', token)))
+        await writer.drain()
+        packet_id, data = await _read_slp_packet(reader)
+        latency = (time.monotonic() - sent) * 1000
+        if packet_id != 0x01 or len(data) < 8 or struct.unpack('>q', data[:8])[0] != token:
+            raise ProbeError('Ping was not echoed')
+    finally:
+        writer.close()
+
+    players = status.get('players')
+    players = players if isinstance(players, dict) else {}
+    version = status.get('version')
+    version = version if isinstance(version, dict) else {}
+    return {
+        'version': version.get('name'),
+        'motd': flatten_motd(status.get('description', '')),
+        'online': players.get('online'),
+        'max': players.get('max'),
+        'latency': round(latency, 1),
+    }
+
+# GameSpy4 query
+
+def _session_id(counter: int) -> int:
+    # servers mask session IDs with 0x0F0F0F0F, so only the low nibble of each byte is usable
+    counter &= 0xffff
+    return ((counter & 0xf) | ((counter >> 4) & 0xf) << 8
+        | ((counter >> 8) & 0xf) << 16 | ((counter >> 12) & 0xf) << 24)
+
+class QueryClient(asyncio.DatagramProtocol):
+    """
+    Sends GameSpy4 queries to any number of servers from one UDP socket per
+    address family, handing each response to the request with the same
+    session ID. The IPv4 socket is opened up front and an IPv6 one the first
+    time an IPv6 server is queried.
+    """
+
+    def __init__(self):
+        self._transports: Dict[int, asyncio.DatagramTransport] = {}
+        self._opening: Dict[int, asyncio.Future] = {}
+        self._sessions = itertools.count(1)
+        self._waiters: Dict[Tuple[int, int], asyncio.Future] = {}
+
+    @classmethod
+    async def open(cls) -> 'QueryClient':
+        client = cls()
+        await client._get_transport(socket.AF_INET)
+        return client
+
+    async def _get_transport(self, family: int) -> asyncio.DatagramTransport:
+        if family in self._transports:
+            return self._transports[family]
+        if family not in self._opening:
+            local_addr = ('::', 0) if family == socket.AF_INET6 else ('0.0.0.0', 0)
+            self._opening[family] = asyncio.ensure_future(asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: self, local_addr=local_addr, family=family))
+        try:
+            transport, _ = await asyncio.shield(self._opening[family])
+        except OSError:
+            # let a later query try again, say once the interface is up
+            self._opening.pop(family, None)
+            raise
+        self._transports[family] = transport
+        return transport
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 5:
+            return
+        packet_type = data[0]
+        (session,) = struct.unpack('>i', data[1:5])
+        waiter = self._waiters.pop((packet_type, session), None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(data[5:])
+
+    def error_received(self, exc):
+        # ICMP errors are not tied to a request; the affected probe times out
+        pass
+
+    def close(self):
+        for transport in self._transports.values():
+            transport.close()
+        self._transports = {}
+
+    async def _request(self, family: int, addr, packet_type: int, session: int, payload: bytes) -> bytes:
+        transport = await self._get_transport(family)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(packet_type, session)] = future
+        try:
+            transport.sendto(QUERY_MAGIC + bytes([packet_type]) + struct.pack('>i', session) + payload, addr)
+            return await future
+        finally:
+            self._waiters.pop((packet_type, session), None)
+
+    async def full_stat(self, host: str, port: int) -> dict:
+        """
+        Requests the full stat of a server and returns its key-value pairs,
+        with the player names under `players`.
+        """
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+        family, addr = infos[0][0], infos[0][4]
+        session = _session_id(next(self._sessions))
+        token = await self._request(family, addr, QUERY_HANDSHAKE, session, b'')
+        try:
+            challenge = int(token.split(b'\x00')[0])
+            payload = struct.pack('>i', challenge)
+        except (ValueError, struct.error):
+            raise ProbeError('Malformed challenge token')
+        data = await self._request(family, addr, QUERY_STAT, session, payload + b'\x00' * 4)
+        return parse_full_stat(data)
+
+def parse_full_stat(data: bytes) -> dict:
+    """
+    Parses the body of a full stat response, after its type and session ID.
+    """
+    # the body opens with 11 bytes of padding ('splitnum\x00\x80\x00')
+    data = data[11:]
+    kv, _, player_section = data.partition(b'\x00\x00\x01player_\x00\x00')
+    fields = kv.split(b'\x00')
+    stat = {}
+    for key, value in zip(fields[0::2], fields[1::2]):
+        stat[key.decode('utf-8', errors='replace')] = value.decode('utf-8', errors='replace')
+    stat['players'] = [name.decode('utf-8', errors='replace') for name in player_section.split(b'\x00') if name]
+    return stat
+
+# probing
+
+def get_probe_targets(srv: Server) -> dict:
+    """
+    Reads the addresses to probe from the server's `server.properties`.
+    """
+    props = properties.get_properties(srv)
+    host = properties.get_host(props)
+    port = properties.get_int(props, 'server-port', DEFAULT_PORT)
+    query_port = None
+    if props.get('enable-query', 'false').lower() == 'true':
+        query_port = properties.get_int(props, 'query.port', port)
+    return {'host': host, 'port': port, 'query_port': query_port}
+
+PROBES = ('slp', 'query')
+"""Probes that `probe_server` can run; `query` only runs on servers with `enable-query`"""
+
+async def probe_server(srv: Server, query: QueryClient, timeout: float = DEFAULT_TIMEOUT,
+        probes: Iterable[str] = PROBES) -> dict:
+    """
+    Probes one server with SLP and, when enabled, the UDP query, running the
+    two at the same time. Each probe is abandoned after `timeout` seconds.
+    `probes` limits which of the two are run.
+    """
+    targets = get_probe_targets(srv)
+    result = {'server': srv.display_name, 'path': srv.Path, 'online': None, 'max': None,
+        'version': None, 'motd': None, 'latency': None, 'players': None, 'ok': False, 'error': None}
+
+    async def bounded(coro):
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            return ProbeError('No answer within {:g}s'.format(timeout))
+        except (OSError, ProbeError, asyncio.IncompleteReadError) as err:
+            return err
+
+    pending = {}
+    if 'slp' in probes:
+        pending['slp'] = bounded(ping_server(targets['host'], targets['port']))
+    if 'query' in probes and targets['query_port'] is not None:
+        pending['query'] = bounded(query.full_stat(targets['host'], targets['query_port']))
+    outcomes = dict(zip(pending, await asyncio.gather(*pending.values())))
+
+    ping = outcomes.get('slp')
+    if isinstance(ping, BaseException):
+        result['error'] = str(ping) or type(ping).__name__
+    elif ping is not None:
+        result.update(ping)
+        result['ok'] = True
+    stat = outcomes.get('query')
+    if isinstance(stat, BaseException):
+        if ping is None:
+            result['error'] = str(stat) or type(stat).__name__
+    elif stat is not None:
+        result['players'] = stat['players']
+        if not result['ok']:
+            # the query still proves the server is up
+            result['ok'] = True
+            result['error'] = None
+            result['version'] = stat.get('version')
+            result['motd'] = stat.get('hostname')
+            result['online'] = _to_int(stat.get('numplayers'))
+            result['max'] = _to_int(stat.get('maxplayers'))
+    return result
+
+def _to_int(value) -> Union[int, None]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+async def probe_servers(servers: Iterable[Server], timeout: float = DEFAULT_TIMEOUT,
+        on_result=None, cache=None, fresh: bool = False) -> List[dict]:
+    """
+    Probes every server concurrently and returns their results in the order
+    given. `on_result`, if provided, is called with each result as soon as it
+    is ready. With a `StatusCache`, recent results are reused unless `fresh`.
+    """
+    query = await QueryClient.open()
+    try:
+        async def run(srv):
+            if cache is not None:
+                result = await cache.probe(srv, query, timeout, fresh)
+            else:
+                result = await probe_server(srv, query, timeout)
+            if on_result is not None:
+                on_result(result)
+            return result
+        return await asyncio.gather(*(run(srv) for srv in servers))
+    finally:
+        query.close()
+
+def process_status(args):
+    """
+    Process CLI arguments for the `status` command.
+
+    Parameters
+    ----------
+        args : List of str
+            Command-line arguments following the `status` command.
+    """
+    from . import loop
+    from .servers import manager
+
+    from .status_cache import StatusCache
+
+    parser = parsers.get_status_parsers()
+    args = parser.parse_args(args)
+
+    cache = StatusCache.open()
+    if args.cache_stats:
+        if cache is None:
+            print('No status cache')
+            return
+        print(cache.describe_stats(cache.read_stats()))
+        return
+
+    if args.server is not None:
+        try:
+            srv = manager.get_server_by_identifier(args.server)
+        except manager.AmbiguousIdentifierError as amb:
+            print(amb)
+            return
+        if srv is None:
+            print('No server "{}"'.format(args.server))
+            return
+        servers = [srv]
+    else:
+        servers = list(manager.get_servers())
+    if len(servers) == 0:
+        print('No registered servers')
+        return
+
+    if args.format == 'ndjson':
+        def emit(result):
+            sys.stdout.write(json.dumps(result) + '\n')
+            sys.stdout.flush()
+        try:
+            loop.run(probe_servers(servers, args.timeout, on_result=emit, cache=cache, fresh=args.fresh))
+        finally:
+            _save_stats(cache, args.verbose)
+        return
+
+    try:
+        results = loop.run(probe_servers(servers, args.timeout, cache=cache, fresh=args.fresh))
+    finally:
+        _save_stats(cache, args.verbose)
+    from prettytable import PrettyTable
+    x = PrettyTable()
+    x.field_names = ['Server', 'Status', 'Version', 'Players', 'Latency', 'MOTD']
+    x.align = 'l'
+    for result in results:
+        if not result['ok']:
+            x.add_row([result['server'], 'offline', '', '', '', result['error']])
+            continue
+        players = '{}/{}'.format(result['online'], result['max'])
+        if result['players']:
+            players += ' ' + ', '.join(result['players'])
+        latency = '' if result['latency'] is None else '{:.0f} ms'.format(result['latency'])
+        x.add_row([result['server'], 'online', result['version'] or '', players, latency,
+            (result['motd'] or '').replace('\n', ' ')])
+    print(x)
+
+def _save_stats(cache, verbose: int):
+    if cache is None:
+        return
+    if verbose:
+        print(cache.describe_stats(cache.stats()), file=sys.stderr)
+    cache.save_stats()
@@ -0,0 +1,300 @@
+"""
+On-disk cache of `medusa status` results, shared by every Medusa process.
+
+Each server's latest probe result is kept in its own small JSON file under
+`data/status_cache/`, with the time at which each field was last measured.
+A field is reused until it is older than its TTL, so slow-changing fields
+such as the version can be kept far longer than the player count. Set
+`status_ttl_<field>` in the config to change a TTL, in seconds. Failures are
+recorded for each probe, so a failed query keeps the fields measured by SLP.
+
+When a server has to be probed, the prober holds an `fcntl` lock on that
+server's entry. Other processes that need the same server meanwhile wait for
+the lock and then read the fresh entry instead of probing the server again.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Set, Tuple, Union
+
+from . import config, status, storage
+from .servers.models import Server
+from .servers.registry import path_key
+
+CACHE_DIR = 'status_cache'
+STATS_NAME = 'stats.json'
+TTL_PREFIX = 'status_ttl_'
+
+DEFAULT_TTLS = {
+    'version': 300.0,
+    'motd': 60.0,
+    'max': 60.0,
+    'online': 5.0,
+    'latency': 5.0,
+    'players': 5.0,
+    'error': 2.0,
+}
+"""Seconds each field is reused for; `error` applies to each failed probe"""
+
+FIELD_PROBES = {
+    'version': 'slp',
+    'motd': 'slp',
+    'max': 'slp',
+    'online': 'slp',
+    'latency': 'slp',
+    'players': 'query',
+}
+"""Probe that measures each cached field"""
+
+def get_status_cache_location() -> str:
+    """
+    Returns the directory of the status cache, which lives next to the config file.
+    """
+    return os.path.join(os.path.dirname(config.get_config_location()), CACHE_DIR)
+
+def get_ttls() -> Dict[str, float]:
+    """
+    Returns the TTL of every field, applying `status_ttl_<field>` overrides
+    from the config. Malformed overrides are ignored.
+    """
+    ttls = dict(DEFAULT_TTLS)
+    try:
+        cfg = config.get_config()
+    except (OSError, ValueError):
+        return ttls
+    for field in ttls:
+        try:
+            ttls[field] = float(cfg[TTL_PREFIX + field])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return ttls
+
+class StatusCache:
+    """
+    Reuses recent probe results and makes sure that only one process at a
+    time probes any given server. Counts how each request was answered:
+    `hits` from the cache, `shared` from a probe made by another process
+    while this one waited, and `misses` by probing the server.
+    """
+
+    def __init__(self, path: str, ttls: Dict[str, float] = None):
+        self.path = path
+        self.ttls = ttls or dict(DEFAULT_TTLS)
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, path: str = None) -> Union['StatusCache', None]:
+        """
+        Opens the cache at the given directory, or the default location if
+        omitted, creating it if needed. Returns `None` when the directory
+        meant to hold it does not exist, as before `config init`.
+        """
+        path = path or get_status_cache_location()
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            return None
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            return None
+        return cls(path, get_ttls())
+
+    def _entry_path(self, srv: Server) -> str:
+        digest = hashlib.sha1(path_key(srv.Path).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest[:20] + '.json')
+
+    def read(self, srv: Server) -> Union[dict, None]:
+        """
+        Returns the cached entry of the server, or `None` if it has none.
+        """
+        try:
+            with open(self._entry_path(srv), 'r') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('path') != path_key(srv.Path) or 'errors' not in entry:
+            return None
+        return entry
+
+    def write(self, srv: Server, entry: dict):
+        """
+        Replaces the cached entry of the server. Readers never see a partial entry.
+        """
+        with storage.atomic_open(self._entry_path(srv)) as file:
+            json.dump(entry, file)
+
+    def stale_probes(self, entry: Union[dict, None], now: float) -> Set[str]:
+        """
+        Returns the probes that must run to bring every field of the entry
+        within its TTL. A probe that failed is retried once its failure is
+        older than the `error` TTL.
+        """
+        if entry is None:
+            return set(status.PROBES)
+        stale = set()
+        for probe, failure in entry['errors'].items():
+            if now - failure[1] > self.ttls['error']:
+                stale.add(probe)
+        for field, probe in FIELD_PROBES.items():
+            if probe in entry['errors']:
+                continue
+            measured = entry['fields'].get(field)
+            if measured is None or now - measured[1] > self.ttls[field]:
+                stale.add(probe)
+        return stale
+
+    def merge(self, entry: Union[dict, None], results: Dict[str, dict], now: float) -> dict:
+        """
+        Returns the entry updated with the result of each probe in `results`.
+        A failed probe is recorded in the entry's `errors` and leaves the
+        unexpired fields of the previous entry in place. The server counts as
+        up while some probe's latest attempt succeeded.
+        """
+        fields, errors = {}, {}
+        if entry is not None:
+            fields = {field: measured for field, measured in entry['fields'].items()
+                if now - measured[1] <= self.ttls[field]}
+            errors = dict(entry['errors'])
+        for probe, result in results.items():
+            if result['ok']:
+                errors.pop(probe, None)
+                for field, field_probe in FIELD_PROBES.items():
+                    if field_probe == probe:
+                        fields[field] = [result[field], now]
+            else:
+                errors[probe] = [result['error'], now]
+        ok = any(FIELD_PROBES[field] not in errors for field in fields)
+        error = None
+        if not ok:
+            error = next(errors[probe][0] for probe in status.PROBES if probe in errors)
+        path = next(iter(results.values()))['path']
+        return {'path': path_key(path), 'ok': ok, 'error': error, 'at': now, 'fields': fields, 'errors': errors}
+
+    def view(self, srv: Server, entry: dict, cached: bool) -> dict:
+        """
+        Returns the entry in the form of a `status.probe_server` result.
+        """
+        result = {'server': srv.display_name, 'path': srv.Path}
+        for field in FIELD_PROBES:
+            measured = entry['fields'].get(field) if entry['ok'] else None
+            result[field] = measured[0] if measured is not None else None
+        result['ok'] = entry['ok']
+        result['error'] = entry['error']
+        result['cached'] = cached
+        return result
+
+    async def _acquire(self, srv: Server, timeout: float) -> Tuple[object, bool]:
+        # returns the open lock file, or None if locking is unavailable or timed out,
+        # and whether another process was holding the lock
+        fcntl = storage.fcntl
+        if fcntl is None:
+            return None, False
+        lock_file = open(storage.get_lock_location(self._entry_path(srv)), 'a')
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        contended = False
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file, contended
+            except (BlockingIOError, PermissionError):
+                contended = True
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    return None, contended
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    async def probe(self, srv: Server, query: 'status.QueryClient', timeout: float = status.DEFAULT_TIMEOUT,
+            fresh: bool = False) -> dict:
+        """
+        Returns the status of the server, probing only for the fields that
+        are not fresh in the cache. With `fresh`, every field is probed again
+        unless another process probed the server while this one waited.
+        """
+        started = time.time()
+        entry = self.read(srv)
+        if not fresh and not self.stale_probes(entry, started):
+            self.hits += 1
+            return self.view(srv, entry, True)
+
+        # a prober can take up to `timeout` for its own probes, which run in parallel
+        lock_file, contended = await self._acquire(srv, timeout + 1.0)
+        try:
+            if contended:
+                entry = self.read(srv)
+                now = time.time()
+                if entry is not None and (entry['at'] >= started if fresh else not self.stale_probes(entry, now)):
+                    self.shared += 1
+                    return self.view(srv, entry, True)
+
+            probes = set(status.PROBES) if fresh else self.stale_probes(entry, time.time())
+            no_query = 'query' in probes and status.get_probe_targets(srv)['query_port'] is None
+            if no_query:
+                probes.discard('query')
+            if probes:
+                self.misses += 1
+                # each probe runs on its own, so that one failing does not discard the other
+                ordered = sorted(probes)
+                results = await asyncio.gather(*(status.probe_server(srv, query, timeout, (probe,))
+                    for probe in ordered))
+                entry = self.merge(entry, dict(zip(ordered, results)), time.time())
+            else:
+                self.hits += 1
+            if no_query:
+                # a query that failed before query was disabled no longer counts
+                entry['errors'].pop('query', None)
+            if no_query and entry['ok']:
+                # there is no player list to measure, which holds until the server is probed again
+                entry['fields']['players'] = [None, time.time()]
+            self.write(srv, entry)
+            return self.view(srv, entry, not probes)
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the counts of this process.
+        """
+        return {'hits': self.hits, 'shared': self.shared, 'misses': self.misses}
+
+    def read_stats(self) -> Dict[str, int]:
+        """
+        Returns the counts accumulated by every process that saved them.
+        """
+        try:
+            with open(os.path.join(self.path, STATS_NAME), 'r') as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            saved = {}
+        return {key: int(saved.get(key, 0)) for key in ('hits', 'shared', 'misses')}
+
+    def save_stats(self):
+        """
+        Adds the counts of this process to the saved totals and resets them.
+        """
+        counts = self.stats()
+        if not any(counts.values()):
+            return
+        path = os.path.join(self.path, STATS_NAME)
+        with storage.locked(path):
+            totals = self.read_stats()
+            for key, count in counts.items():
+                totals[key] += count
+            with storage.atomic_open(path) as file:
+                json.dump(totals, file)
+        self.hits = self.shared = self.misses = 0
+
+    @staticmethod
+    def describe_stats(counts: Dict[str, int]) -> str:
+        """
+        Formats counts as a line such as `Status cache: 8 hits, 1 shared, 1 miss (90% hit rate)`.
+        """
+        total = sum(counts.values())
+        rate = 100.0 * (counts['hits'] + counts['shared']) / total if total else 0.0
+        return 'Status cache: {} hits, {} shared, {} {} ({:.0f}% hit rate)'.format(counts['hits'],
+            counts['shared'], counts['misses'], 'miss' if counts['misses'] == 1 else 'misses', rate)
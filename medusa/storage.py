@@ -0,0 +1,130 @@
+import os
+import stat
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # advisory locks are unavailable on Windows; writes there are atomic but unlocked
+    fcntl = None
+
+LOCK_SUFFIX = '.lock'
+
+LOCK_TIMEOUT = 30.0
+"""Seconds to keep retrying before giving up on a lock"""
+
+class LockTimeoutError(TimeoutError):
+    """
+    Raised when a lock could not be acquired within the allotted time.
+    """
+
+def get_lock_location(path: str) -> str:
+    """
+    Returns the path of the lock file guarding `path`. The lock lives in its own
+    file because `path` itself is replaced, and so changes inode, on every write.
+    """
+    return path + LOCK_SUFFIX
+
+@contextmanager
+def locked(path: str, shared: bool = False, timeout: float = LOCK_TIMEOUT):
+    """
+    Holds an advisory `fcntl` lock for `path` for the duration of the `with` block.
+    Use an exclusive lock around read-modify-write cycles so concurrent Medusa
+    processes cannot overwrite each other's changes.
+
+    Parameters
+    ----------
+        path: str
+            Path of the file to protect.
+
+        shared: bool
+            Take a shared (read) lock instead of an exclusive one.
+
+        timeout: float
+            Seconds to keep retrying, with exponential backoff, before giving up.
+
+    Raises
+    ------
+        LockTimeoutError
+            If the lock could not be acquired within `timeout` seconds.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    lock_file = open(get_lock_location(path), 'a')
+    try:
+        mode = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), mode)
+                break
+            except (BlockingIOError, PermissionError):
+                if time.monotonic() >= deadline:
+                    raise LockTimeoutError('Timed out waiting for lock on {}'.format(path))
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'w'):
+    """
+    Opens a temporary file next to `path` for writing. When the `with` block
+    completes, the data is flushed to disk and the temporary file is renamed
+    over `path`, so readers see either the old or the new contents but never a
+    partial write. If the block raises, `path` is left untouched.
+
+    The new file keeps the permissions of the one it replaces, or gets those
+    of any newly created file.
+    """
+    # tempfile pulls in `random` and friends, so it is only imported for writes
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        permissions = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        permissions = _new_file_permissions()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp makes the file readable by its owner only
+        os.chmod(tmp_path, permissions)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+def _new_file_permissions() -> int:
+    # the umask can only be read by setting it; the most restrictive one is set
+    # meanwhile, so a file another thread creates in between is never too open
+    umask = os.umask(0o077)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def _fsync_directory(directory: str):
+    # persist the rename itself; not every platform can open a directory
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,166 @@
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import access as access_cli
+from medusa import loop
+from medusa.servers import VANILLA, access
+from medusa.servers.access import SyncState
+from medusa.servers.models import Server
+from test.test_rcon import PASSWORD, FakeRconServer
+
+STEVE = {'uuid': '069a79f4-44e9-4726-a5be-fca90e38aaf5', 'name': 'Steve'}
+ALEX = {'uuid': 'ec561538-f3fd-461d-aff5-086b22154bce', 'name': 'Alex'}
+GRIEFER = {'uuid': '00000000-0000-0000-0000-00000000dead', 'name': 'Griefer'}
+
+def op(player: dict, level: int = 4) -> dict:
+    return dict(player, level=level, bypassesPlayerLimit=False)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class MergeTests(unittest.TestCase):
+    def test_merge_keepsServerOnlyEntries(self):
+        self.assertEqual([STEVE, ALEX], access.merge_lists('whitelist', [STEVE], [ALEX, {'name': 'steve'}]))
+        self.assertEqual([STEVE], access.merge_lists('whitelist', [STEVE], [ALEX], exact=True))
+
+    def test_diff_matchesByUuidOrName(self):
+        diff = access.diff_lists('ops', [op(STEVE), op(GRIEFER), {'name': 'alex', 'level': 4}], [op(STEVE, 2), op(ALEX)])
+        self.assertEqual([], diff.added)
+        self.assertEqual([GRIEFER['name']], [entry['name'] for entry in diff.removed])
+        self.assertEqual([op(STEVE, 2), op(ALEX)], diff.changed)
+        self.assertTrue(access.diff_lists('banned-ips', [{'ip': '10.0.0.1'}], [{'ip': '10.0.0.1'}]).empty)
+
+class SyncTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.canonical = os.path.join(self.root, 'access_lists')
+        os.makedirs(self.canonical)
+        self.servers = []
+        self.fakes = []
+
+    def tearDown(self):
+        for fake in self.fakes:
+            loop.run(fake.stop())
+        shutil.rmtree(self.root)
+
+    def add_server(self, name: str, rcon: str = None, **lists) -> Server:
+        srv = Server()
+        srv.Path = os.path.join(self.root, name)
+        srv.Alias = name
+        srv.Type = VANILLA
+        os.makedirs(srv.Path)
+        properties = ['enable-rcon=false']
+        if rcon is not None:
+            port = _free_port()
+            if rcon == 'running':
+                fake = loop.run(FakeRconServer().start())
+                self.fakes.append(fake)
+                port = fake.port
+            properties = ['enable-rcon=true', 'rcon.port={}'.format(port), 'rcon.password=' + PASSWORD]
+        with open(os.path.join(srv.Path, 'server.properties'), 'w') as file:
+            file.write('\n'.join(properties) + '\n')
+        for list_name, entries in lists.items():
+            self.write(os.path.join(srv.Path, list_name.replace('_', '-') + '.json'), entries)
+        self.servers.append(srv)
+        return srv
+
+    def write(self, path: str, entries):
+        with open(path, 'w') as file:
+            json.dump(entries, file, indent=2)
+
+    def read(self, srv: Server, name: str):
+        with open(os.path.join(srv.Path, name + '.json')) as file:
+            return json.load(file)
+
+    def sync(self, *args) -> str:
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=os.path.join(self.root, 'medusa.json')):
+            with patch('medusa.servers.manager.get_servers', return_value=self.servers):
+                with redirect_stdout(out):
+                    access_cli.process_access(['sync'] + list(args))
+        return out.getvalue()
+
+    def test_sync_linksIdenticalListsAndWritesMerged(self):
+        self.write(os.path.join(self.canonical, 'whitelist.json'), [STEVE, ALEX])
+        same = self.add_server('same', whitelist=[STEVE])
+        extra = self.add_server('extra', whitelist=[GRIEFER])
+        out = self.sync()
+        self.assertIn('[same] whitelist: +Alex (linked)', out)
+        self.assertIn('[extra] whitelist: +Steve +Alex', out)
+        self.assertTrue(os.path.samefile(os.path.join(self.canonical, 'whitelist.json'), os.path.join(same.Path, 'whitelist.json')))
+        self.assertEqual([STEVE, ALEX, GRIEFER], self.read(extra, 'whitelist'))
+        self.assertIn('Updated 2 lists on 2 servers (1 linked)', out)
+
+    def test_sync_rewritesOnlyChangedFiles(self):
+        self.write(os.path.join(self.canonical, 'ops.json'), [op(STEVE)])
+        srv = self.add_server('a', ops=[op(STEVE), op(GRIEFER)])
+        path = os.path.join(srv.Path, 'ops.json')
+        before = os.stat(path)
+        out = self.sync()
+        self.assertIn('Updated 0 lists on 0 servers', out)
+        self.assertEqual(before.st_ino, os.stat(path).st_ino)
+        self.assertEqual(before.st_mtime_ns, os.stat(path).st_mtime_ns)
+
+    def test_sync_dryRunChangesNothing(self):
+        self.write(os.path.join(self.canonical, 'banned-ips.json'), [{'ip': '10.0.0.1', 'reason': 'spam'}])
+        srv = self.add_server('a', banned_ips=[{'ip': '10.0.0.2'}])
+        out = self.sync('--dry-run', '--exact')
+        self.assertIn('[a] banned-ips: +10.0.0.1 -10.0.0.2 (linked)', out)
+        self.assertIn('Would update 1 lists on 1 servers', out)
+        self.assertEqual([{'ip': '10.0.0.2'}], self.read(srv, 'banned-ips'))
+
+    def test_sync_reloadsOnlyRunningServersThatChanged(self):
+        self.write(os.path.join(self.canonical, 'whitelist.json'), [STEVE])
+        self.write(os.path.join(self.canonical, 'banned-players.json'), [dict(GRIEFER, reason='griefing')])
+        self.add_server('running', rcon='running', whitelist=[ALEX])
+        self.add_server('unchanged', rcon='running', whitelist=[STEVE], banned_players=[dict(GRIEFER, reason='griefing')])
+        self.add_server('stopped', rcon='stopped', whitelist=[])
+        self.add_server('no-rcon', whitelist=[])
+        out = self.sync('--no-link')
+        self.assertEqual(['whitelist reload', 'ban Griefer griefing'], self.fakes[0].commands)
+        self.assertEqual([], self.fakes[1].commands)
+        self.assertIn('[no-rcon] could not reload: RCON is not enabled', out)
+        self.assertIn('reloaded 1 running servers; 1 failed', out)
+
+    def test_sync_comparesLinkedListsWithWhatWasGiven(self):
+        canonical = os.path.join(self.canonical, 'ops.json')
+        self.write(canonical, [op(STEVE)])
+        srv = self.add_server('a', rcon='running', ops=[op(GRIEFER)])
+        self.sync('--exact')
+        self.assertEqual(['op Steve', 'deop Griefer'], self.fakes[0].commands)
+        # edited in place, so the server's linked copy already holds the change
+        with open(canonical, 'w') as file:
+            json.dump([op(STEVE), op(ALEX)], file)
+        self.assertEqual([op(STEVE), op(ALEX)], self.read(srv, 'ops'))
+        out = self.sync('--exact')
+        self.assertIn('[a] ops: +Alex', out)
+        self.assertEqual(['op Steve', 'deop Griefer', 'op Alex'], self.fakes[0].commands)
+        self.assertEqual({'ops'}, set(SyncState.load(os.path.join(self.root, 'access_state.json')).servers[srv.Path]))
+
+    def test_sync_reappliesChangedEntriesOrAsksForRestart(self):
+        self.write(os.path.join(self.canonical, 'ops.json'), [op(STEVE), op(ALEX, 2)])
+        self.write(os.path.join(self.canonical, 'banned-players.json'),
+            [dict(GRIEFER, reason='griefing'), dict(STEVE, reason='spam', expires='2030-01-01 00:00:00 +0000')])
+        self.add_server('a', rcon='running', ops=[op(STEVE, 3), op(ALEX)],
+            banned_players=[dict(GRIEFER, reason='spam'), dict(STEVE, reason='spam')])
+        out = self.sync('--no-link')
+        self.assertEqual(['deop Steve', 'op Steve', 'pardon Griefer', 'ban Griefer griefing'], self.fakes[0].commands)
+        self.assertIn('[a] ops: ~Alex cannot be applied over RCON', out)
+        self.assertIn('[a] banned-players: ~Steve cannot be applied over RCON', out)
+
+    def test_sync_takesListsFromSourceServer(self):
+        source = self.add_server('source', whitelist=[STEVE])
+        target = self.add_server('target', whitelist=[])
+        with patch('medusa.servers.manager.get_server_by_identifier', return_value=source):
+            out = self.sync('--source', 'source')
+        self.assertNotIn('[source]', out)
+        self.assertTrue(os.path.samefile(os.path.join(source.Path, 'whitelist.json'), os.path.join(target.Path, 'whitelist.json')))
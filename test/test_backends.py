@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import config, filebases
+from medusa.servers import FORGE, VANILLA, backends, manager
+from medusa.servers.models import Server
+from medusa.servers.registry import AmbiguousIdentifierError
+
+class SqliteBackendTests(unittest.TestCase):
+    # sqlite needs a real filesystem, so these tests run in a temporary directory
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.root, 'data', 'medusa.json')
+        os.makedirs(os.path.dirname(self.config_path))
+        self.write_config([])
+        patcher = patch('medusa.config.get_config_location', return_value=self.config_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        config.invalidate_config()
+        manager._servers = None
+
+    def tearDown(self):
+        manager._close_sqlite_backend()
+        manager._servers = None
+        config.invalidate_config()
+        shutil.rmtree(self.root)
+
+    def write_config(self, registry, backend='sqlite'):
+        data = json.loads(filebases.DATA)
+        data['server_registry'] = registry
+        data['registry_backend'] = backend
+        with open(self.config_path, 'w') as file:
+            json.dump(data, file)
+
+    def make_dir(self, *names):
+        path = os.path.join(self.root, 'srvs', *names)
+        os.makedirs(path)
+        return path
+
+    def test_getBackend_defaultsToJson(self):
+        self.write_config([], backend=None)
+        config.invalidate_config()
+        self.assertIsInstance(manager.get_backend(), manager.JsonBackend)
+        self.assertFalse(os.path.exists(backends.get_sqlite_location()))
+
+    def test_getBackend_usesWalAndIndexes(self):
+        backend = manager.get_backend()
+        self.assertIsInstance(backend, backends.SqliteBackend)
+        conn = sqlite3.connect(backend.path)
+        self.assertEqual('wal', conn.execute('PRAGMA journal_mode').fetchone()[0])
+        indexes = {row[1] for row in conn.execute("SELECT * FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({'servers_alias', 'servers_path', 'servers_type'} <= indexes)
+        conn.close()
+
+    def test_getBackend_importsJsonRegistry(self):
+        self.write_config([{'Alias': 'old', 'Path': '/srvs/old', 'Type': FORGE}])
+        config.invalidate_config()
+        srv = manager.get_server_by_identifier('old')
+        self.assertEqual('/srvs/old', srv.Path)
+        self.assertEqual(FORGE, srv.Type)
+        self.assertEqual(1, len(manager.get_servers()))
+
+    def test_register_persistsRows(self):
+        path = self.make_dir('a')
+        self.assertTrue(manager.register_server(path, VANILLA, 'alpha'))
+        self.assertFalse(manager.register_server(path, VANILLA))
+
+        # a second connection sees the committed row
+        manager._close_sqlite_backend()
+        self.assertEqual([path], [srv.Path for srv in manager.get_servers()])
+        self.assertEqual(path, manager.get_server_by_identifier('alpha').Path)
+        self.assertEqual(path, manager.get_server_by_identifier('a').Path)
+        # the JSON registry is left alone
+        with open(self.config_path) as file:
+            self.assertEqual([], json.load(file)['server_registry'])
+
+    def test_update_changesIndexedFields(self):
+        path = self.make_dir('a')
+        manager.register_server(path, VANILLA, 'alpha')
+        srv = manager.get_server_by_identifier('alpha')
+        srv.Alias = 'beta'
+        manager.update_server('alpha', srv)
+        self.assertIsNone(manager.get_server_by_identifier('alpha'))
+        self.assertEqual(path, manager.get_server_by_identifier('beta').Path)
+        self.assertEqual(1, len(manager.get_servers()))
+
+    def test_deregister_raisesWhenAmbiguous(self):
+        manager.register_server(self.make_dir('one', 'world'), VANILLA)
+        manager.register_server(self.make_dir('two', 'world'), VANILLA)
+        with self.assertRaises(AmbiguousIdentifierError):
+            manager.deregister_server('world')
+        manager.deregister_server(os.path.join(self.root, 'srvs', 'one', 'world'))
+        self.assertEqual(1, len(manager.get_servers()))
+
+    def test_transaction_rollsBackOnError(self):
+        manager.register_server(self.make_dir('old'), VANILLA)
+        new = self.make_dir('new')
+        with self.assertRaises(RuntimeError):
+            with manager.transaction():
+                manager.register_server(new, FORGE)
+                manager.deregister_server('old')
+                raise RuntimeError()
+        self.assertEqual(['old'], [os.path.basename(srv.Path) for srv in manager.get_servers()])
+
+    def test_listPlain_streamsRows(self):
+        path = self.make_dir('a')
+        manager.register_server(path, VANILLA, 'alpha')
+        with patch('medusa.config.get_config_value', return_value=os.path.join(self.root, 'srvs')):
+            out = io.StringIO()
+            with redirect_stdout(out):
+                manager.list_servers(plain=True)
+        self.assertEqual('alpha\ta\t{}\n'.format(VANILLA), out.getvalue())
+
+    def test_iterByType_usesTypeColumn(self):
+        manager.register_server(self.make_dir('a'), VANILLA)
+        manager.register_server(self.make_dir('b'), FORGE)
+        registry = manager.get_servers()
+        self.assertEqual(['b'], [os.path.basename(srv.Path) for srv in registry.iter_by_type(FORGE)])
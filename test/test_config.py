@@ -6,8 +6,11 @@ import unittest
 import unittest.mock
 from unittest.mock import MagicMock, patch
 
+import jsonpickle
+
 import medusa.config
 import medusa.parsers
+import medusa.servers.manager
 
 class ConfigTestCase(TestCase):
 
@@ -186,5 +189,47 @@ class ConfigTestCase(TestCase):
         sep = self.fs.path_separator
         mock_print.assert_called_once_with('Created new Medusa config at', f'{sep}brandnew{sep}directory{sep}medusa.json')
 
+    # Verifies that repeated reads share one parse of the config file
+    def test_config_snapshot_parsesOnce(self):
+        self.fs.create_file(medusa.config.get_config_location(),
+            contents='{"server_directory":"/srv","registry_version":1,"server_registry":[]}')
+        medusa.config.invalidate_config()
+        with unittest.mock.patch('json.load', wraps=json.load) as mock_load:
+            medusa.config.get_config_value('server_directory')
+            medusa.config.get_config_value('server_registry')
+            medusa.servers.manager.get_servers_from_config()
+            mock_load.assert_called_once()
+
+    # Verifies that the snapshot is reloaded after the file changes
+    def test_config_snapshot_reloadsOnChange(self):
+        self.fs.create_file(medusa.config.get_config_location(), contents='{"server_directory":"/old"}')
+        medusa.config.invalidate_config()
+        assert medusa.config.get_config_value('server_directory') == '/old'
+
+        # a write from another process, which leaves the snapshot in place
+        with open(medusa.config.get_config_location(), 'w') as file:
+            file.write('{"server_directory":"/newer"}')
+        assert medusa.config.get_config_value('server_directory') == '/newer'
+
+    # Verifies that the snapshot sees this process's own writes
+    def test_config_snapshot_seesOwnWrites(self):
+        self.fs.create_file(medusa.config.get_config_location(), contents='{"server_directory":"/old"}')
+        assert medusa.config.get_config_value('server_directory') == '/old'
+        medusa.config.set_config_value('server_directory', '/new')
+        assert medusa.config.get_config_value('server_directory') == '/new'
+
+    # Verifies that a registry loaded from the config follows changes to the file
+    def test_config_snapshot_reloadsRegistry(self):
+        self.fs.create_file(medusa.config.get_config_location(),
+            contents='{"server_directory":null,"server_registry":[]}')
+        medusa.servers.manager._servers = None
+        assert len(medusa.servers.manager.get_servers()) == 0
+
+        srv = medusa.servers.manager.Server()
+        srv.Path = '/srv/added elsewhere'
+        with open(medusa.config.get_config_location(), 'w') as file:
+            file.write(jsonpickle.encode({'server_directory': None, 'server_registry': [srv]}))
+        assert medusa.servers.manager.get_servers()[0].Path == '/srv/added elsewhere'
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
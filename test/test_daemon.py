@@ -0,0 +1,158 @@
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+from medusa import config, daemon, filebases
+from medusa.servers import manager
+
+class ProtocolTests(unittest.TestCase):
+    def test_message_roundTrip(self):
+        left, right = socket.socketpair()
+        with left, right:
+            daemon.send_message(left, {'op': 'run', 'argv': ['config', 'where']})
+            self.assertEqual({'op': 'run', 'argv': ['config', 'where']}, daemon.recv_message(right))
+
+    def test_recv_returnsNoneOnClose(self):
+        left, right = socket.socketpair()
+        with right:
+            left.close()
+            self.assertIsNone(daemon.recv_message(right))
+
+    def test_recv_rejectsTruncatedMessage(self):
+        left, right = socket.socketpair()
+        with right:
+            left.sendall(daemon.HEADER.pack(100) + b'{"op"')
+            left.close()
+            with self.assertRaises(ConnectionError):
+                daemon.recv_message(right)
+
+    def test_recv_rejectsOversizedMessage(self):
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(daemon.HEADER.pack(daemon.MAX_MESSAGE + 1))
+            with self.assertRaises(ValueError):
+                daemon.recv_message(right)
+
+    def test_isForwardable_keepsInteractiveCommandsLocal(self):
+        self.assertTrue(daemon.is_forwardable(['server', 'list']))
+        self.assertFalse(daemon.is_forwardable(['config', 'init']))
+        self.assertFalse(daemon.is_forwardable(['server', 'watch']))
+        self.assertFalse(daemon.is_forwardable(['daemon', 'stop']))
+        self.assertFalse(daemon.is_forwardable(['logs', '--match', 'lobby-*', '-f']))
+        self.assertTrue(daemon.is_forwardable(['logs', 'events']))
+        self.assertFalse(daemon.is_forwardable(['logs', 'search', 'Steve']))
+        self.assertFalse(daemon.is_forwardable(['status']))
+        self.assertFalse(daemon.is_forwardable(['run', '--all', 'say', 'hi']))
+        self.assertTrue(daemon.is_forwardable(['run', 'lobby', 'start']))
+        self.assertFalse(daemon.is_forwardable([]))
+
+class DaemonTests(unittest.TestCase):
+    # Unix sockets need a real filesystem, so these tests run in a temporary directory
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        # removed last, after any daemon started by the test has been stopped
+        self.addCleanup(shutil.rmtree, self.root)
+        self.config_path = os.path.join(self.root, 'data', 'medusa.json')
+        os.makedirs(os.path.dirname(self.config_path))
+        data = json.loads(filebases.DATA)
+        data['server_directory'] = self.root
+        with open(self.config_path, 'w') as file:
+            json.dump(data, file)
+        patcher = patch('medusa.config.get_config_location', return_value=self.config_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        config.invalidate_config()
+        manager._servers = None
+        self.path = daemon.get_socket_location()
+
+    def tearDown(self):
+        manager._servers = None
+        config.invalidate_config()
+
+    def start_daemon(self):
+        # the daemon marks the process resident, which must not outlive the test
+        patcher = patch('medusa.servers.supervisor._resident', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        server = daemon.Daemon(self.path, verbosity=0)
+        server.bind()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        def stop():
+            daemon.request({'op': 'stop'}, self.path)
+            thread.join(5)
+        self.addCleanup(stop)
+        return server
+
+    def forward(self, argv):
+        out = io.StringIO()
+        err = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            status = daemon.forward(argv, self.path)
+        return status, out.getvalue(), err.getvalue()
+
+    def test_forward_fallsBackWithoutDaemon(self):
+        self.assertIsNone(daemon.forward(['config', 'where'], self.path))
+
+    def test_forward_ignoresStaleSocket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.assertIsNone(daemon.forward(['config', 'where'], self.path))
+
+    def test_forward_runsCommandInDaemon(self):
+        self.start_daemon()
+        status, out, err = self.forward(['config', 'get', 'server_directory'])
+        self.assertEqual((0, self.root + '\n', ''), (status, out, err))
+
+    def test_forward_reportsExitStatus(self):
+        self.start_daemon()
+        status, out, err = self.forward(['server', 'set'])
+        self.assertEqual(2, status)
+        self.assertIn('usage:', err)
+
+    def test_forward_seesChangesFromOtherProcesses(self):
+        self.start_daemon()
+        self.assertEqual('No registered servers\n', self.forward(['server', 'list'])[1])
+        with open(self.config_path) as file:
+            data = json.load(file)
+        data['server_registry'] = [{'Alias': 'lobby', 'Path': os.path.join(self.root, 'lobby'), 'Type': None}]
+        with open(self.config_path, 'w') as file:
+            json.dump(data, file)
+        status, out, err = self.forward(['server', 'list', '--plain'])
+        self.assertEqual('lobby\tlobby\t\n', out)
+
+    def test_forward_runsLocallyWhileDaemonIsBusy(self):
+        self.start_daemon()
+        # a client that has connected but not yet sent its request keeps the daemon busy
+        busy = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        busy.connect(self.path)
+        self.addCleanup(busy.close)
+        self.assertEqual({'op': 'ready'}, daemon.recv_message(busy))
+        with patch('medusa.daemon.READY_TIMEOUT', 0.1):
+            self.assertIsNone(daemon.forward(['config', 'where'], self.path))
+            with self.assertRaises(RuntimeError):
+                daemon.Daemon(self.path).bind()
+        busy.close()
+        self.assertEqual(0, self.forward(['config', 'where'])[0])
+
+    def test_bind_refusesSecondDaemon(self):
+        self.start_daemon()
+        with self.assertRaises(RuntimeError):
+            daemon.Daemon(self.path).bind()
+
+    def test_stop_removesSocket(self):
+        self.start_daemon()
+        self.assertIsNotNone(daemon.request({'op': 'stop'}, self.path))
+        for i in range(100):
+            if not os.path.exists(self.path):
+                break
+            threading.Event().wait(0.01)
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,147 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import dedupe, storage
+from medusa.servers import FORGE, jarstore
+from medusa.servers.jarstore import HashCache
+from medusa.servers.models import Server
+
+JEI = b'jei' * 1000
+JOURNEYMAP = b'journeymap' * 1000
+
+class DedupeTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.data = os.path.join(self.root, 'data')
+        os.makedirs(self.data)
+        self.store = os.path.join(self.data, 'jar_store')
+        self.servers = []
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def add_server(self, name: str, **jars) -> Server:
+        srv = Server()
+        srv.Path = os.path.join(self.root, name)
+        srv.Alias = name
+        srv.Type = FORGE
+        for file_name, content in jars.items():
+            directory, file_name = file_name.split('__')
+            self.write(os.path.join(srv.Path, directory, file_name + '.jar'), content)
+        os.makedirs(srv.Path, exist_ok=True)
+        self.servers.append(srv)
+        return srv
+
+    def write(self, path: str, content: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+
+    def add_fleet(self):
+        self.add_server('a', mods__jei=JEI, mods__journeymap=JOURNEYMAP)
+        self.add_server('b', mods__jei=JEI, plugins__unique=b'unique')
+        self.add_server('c', mods__jei_renamed=JEI, mods__journeymap=JOURNEYMAP)
+
+    def run_dedupe(self, *args) -> str:
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=os.path.join(self.data, 'medusa.json')):
+            with patch('medusa.servers.manager.get_servers', return_value=self.servers):
+                with redirect_stdout(out):
+                    dedupe.process_dedupe(list(args))
+        return out.getvalue()
+
+    def inode(self, *parts) -> int:
+        return os.stat(os.path.join(self.root, *parts)).st_ino
+
+    def test_hashCache_reusesUnchangedFiles(self):
+        self.add_fleet()
+        cache = HashCache(os.path.join(self.data, 'jar_hashes.json'))
+        jars = jarstore.hash_jars(self.servers, cache, 4)
+        self.assertEqual(6, len(jars))
+        self.assertEqual(6, cache.misses)
+        cache.save()
+        cache = HashCache.load(cache.path)
+        with patch('medusa.servers.jarstore.hash_file', wraps=jarstore.hash_file) as hash_file:
+            jarstore.hash_jars(self.servers, cache, 4)
+        self.assertEqual(0, hash_file.call_count)
+        self.assertEqual(6, cache.hits)
+
+    def test_dedupe_linksDuplicatesToStore(self):
+        self.add_fleet()
+        out = self.run_dedupe()
+        self.assertIn('Linked 5 jars, saving {:.1f} KiB'.format((len(JEI) * 2 + len(JOURNEYMAP)) / 1024), out)
+        jei = self.inode('a', 'mods', 'jei.jar')
+        self.assertEqual(jei, self.inode('b', 'mods', 'jei.jar'))
+        self.assertEqual(jei, self.inode('c', 'mods', 'jei_renamed.jar'))
+        self.assertEqual(self.inode('a', 'mods', 'journeymap.jar'), self.inode('c', 'mods', 'journeymap.jar'))
+        self.assertEqual(2, len(list(jarstore.iter_objects(self.store))))
+        with open(os.path.join(self.root, 'b', 'mods', 'jei.jar'), 'rb') as file:
+            self.assertEqual(JEI, file.read())
+        self.assertIn('Linked 0 jars', self.run_dedupe())
+
+    def test_dedupe_linksNewCopyToExistingObject(self):
+        self.add_fleet()
+        self.run_dedupe()
+        self.add_server('d', mods__jei=JEI)
+        self.assertIn('[d] would link mods/jei.jar', self.run_dedupe('--dry-run'))
+        self.assertNotEqual(self.inode('a', 'mods', 'jei.jar'), self.inode('d', 'mods', 'jei.jar'))
+        self.run_dedupe()
+        self.assertEqual(self.inode('a', 'mods', 'jei.jar'), self.inode('d', 'mods', 'jei.jar'))
+
+    def test_dedupe_dryRunChangesNothing(self):
+        self.add_fleet()
+        out = self.run_dedupe('-n')
+        self.assertIn('Would link 5 jars, saving', out)
+        self.assertNotEqual(self.inode('a', 'mods', 'jei.jar'), self.inode('b', 'mods', 'jei.jar'))
+        self.assertFalse(os.path.exists(self.store))
+
+    def test_verify_reportsCorruptObjects(self):
+        self.add_fleet()
+        self.run_dedupe()
+        self.assertIn('Verified 2 jars in the store; 0 corrupt', self.run_dedupe('--verify'))
+        with open(os.path.join(self.root, 'b', 'mods', 'jei.jar'), 'r+b') as file:
+            file.write(b'XX')
+        with self.assertRaises(SystemExit):
+            self.run_dedupe('--verify')
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=os.path.join(self.data, 'medusa.json')):
+            with redirect_stdout(out):
+                self.assertFalse(dedupe.verify(self.store, self.servers))
+        self.assertIn('used by [c] mods/jei_renamed.jar', out.getvalue())
+
+    def test_verify_skipsObjectsRemovedMidway(self):
+        self.add_fleet()
+        self.run_dedupe()
+        gone = next(jarstore.iter_objects(self.store))[0]
+        original = jarstore.hash_file
+        def hash_file(path):
+            if path == gone:
+                raise FileNotFoundError(2, 'No such file or directory', path)
+            return original(path)
+        with patch('medusa.servers.jarstore.hash_file', side_effect=hash_file):
+            self.assertEqual([], jarstore.verify_store(self.store))
+
+    def test_hashCache_savesAtomically(self):
+        self.add_fleet()
+        cache = HashCache(os.path.join(self.data, 'jar_hashes.json'))
+        jarstore.hash_jars(self.servers, cache, 4)
+        with patch('medusa.storage.atomic_open', wraps=storage.atomic_open) as atomic_open:
+            cache.save()
+        atomic_open.assert_called_once_with(cache.path)
+        self.assertEqual(6, len(HashCache.load(cache.path).entries))
+
+    def test_undo_restoresSeparateCopies(self):
+        self.add_fleet()
+        self.run_dedupe()
+        out = self.run_dedupe('--undo')
+        self.assertIn('Copied 5 jars back', out)
+        inodes = {self.inode('a', 'mods', 'jei.jar'), self.inode('b', 'mods', 'jei.jar'), self.inode('c', 'mods', 'jei_renamed.jar')}
+        self.assertEqual(3, len(inodes))
+        self.assertEqual([], list(jarstore.iter_objects(self.store)))
+        with open(os.path.join(self.root, 'c', 'mods', 'journeymap.jar'), 'rb') as file:
+            self.assertEqual(JOURNEYMAP, file.read())
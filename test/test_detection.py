@@ -0,0 +1,64 @@
+from os.path import join
+from unittest.mock import patch
+from pyfakefs.fake_filesystem_unittest import TestCase
+
+from medusa.servers import detection, models, fabric, forge, vanilla, FABRIC, FORGE, NOTASERVER, VANILLA
+
+SUPPORTED = [
+    {'name': FORGE, 'info': None, 'controller': None, 'detector': forge.detect_forge},
+    {'name': FABRIC, 'info': None, 'controller': None, 'detector': fabric.detect_fabric},
+    {'name': VANILLA, 'info': None, 'controller': None, 'detector': vanilla.detect_vanilla},
+]
+
+@patch('medusa.servers.models.get_supported_types', return_value = SUPPORTED)
+class DetectionTests(TestCase):
+    SRV = '/srvs/survival'
+
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_detect_forge(self, mock_types):
+        self.fs.create_file(join(self.SRV, 'forge-1.16.5-36.2.0.jar'))
+        self.fs.create_file(join(self.SRV, 'minecraft_server.1.16.5.jar'))
+        self.assertEqual((FORGE, 1.0), detection.detect_server_type(self.SRV))
+
+    def test_detect_fabric(self, mock_types):
+        self.fs.create_file(join(self.SRV, 'fabric-server-launch.jar'))
+        self.assertEqual((FABRIC, 1.0), detection.detect_server_type(self.SRV))
+
+    def test_detect_vanillaIsLowConfidence(self, mock_types):
+        self.fs.create_file(join(self.SRV, 'minecraft_server.1.16.5.jar'))
+        srv_type, confidence = detection.detect_server_type(self.SRV)
+        self.assertEqual(VANILLA, srv_type)
+        self.assertLess(confidence, 1.0)
+
+    def test_detect_ignoresNestedJars(self, mock_types):
+        self.fs.create_file(join(self.SRV, 'mods', 'forge-helper.jar'))
+        self.fs.create_file(join(self.SRV, 'world', 'region', 'r.0.0.mca'))
+        self.assertEqual((NOTASERVER, 0.0), detection.detect_server_type(self.SRV))
+
+    def test_detect_ignoresJarDirectories(self, mock_types):
+        self.fs.create_dir(join(self.SRV, 'forge.jar'))
+        self.assertEqual((NOTASERVER, 0.0), detection.detect_server_type(self.SRV))
+
+    def test_detect_missingDirectory(self, mock_types):
+        self.assertEqual((NOTASERVER, 0.0), detection.detect_server_type('/no/such/dir'))
+
+    def test_detect_scansOnce(self, mock_types):
+        self.fs.create_file(join(self.SRV, 'fabric-server-launch.jar'))
+        with patch('os.scandir', wraps=detection.os.scandir) as mock_scandir:
+            detection.detect_server_type(self.SRV)
+        mock_scandir.assert_called_once()
+
+    def test_detect_tieGoesToFirstRegistered(self, mock_types):
+        self.fs.create_file(join(self.SRV, 'forge-fabric-bridge.jar'))
+        self.assertEqual((FORGE, 1.0), detection.detect_server_type(self.SRV))
+
+    def test_detect_loadsLazyTypes(self, mock_types):
+        lazy = models._LazyServerType(FABRIC, 'medusa.servers.fabric', 'FabricServer', 'FabricController',
+            'detect_fabric')
+        mock_types.return_value = [lazy]
+        self.fs.create_file(join(self.SRV, 'fabric-server-launch.jar'))
+        self.assertNotIn('detector', dict(lazy))
+        self.assertEqual((FABRIC, 1.0), detection.detect_server_type(self.SRV))
+        self.assertIs(fabric.FabricController, lazy['controller'])
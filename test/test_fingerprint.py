@@ -0,0 +1,164 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import cli, config, filebases
+from medusa.servers import FABRIC, FORGE, VANILLA, fingerprint, manager
+from medusa.servers.fingerprint import Fingerprint
+
+FORGE_MANIFEST = '''Manifest-Version: 1.0\r
+Main-Class: net.minecraftforge.server.ServerMain\r
+Class-Path: libraries/net/minecraft/server/1.16.5/server-1.16.5-extra.jar libr\r
+ aries/org/ow2/asm/asm/9.1/asm-9.1.jar\r
+\r
+Name: net/minecraftforge/versions/forge/\r
+Specification-Title: Forge\r
+Implementation-Version: 36.2.39\r
+\r
+Name: net/minecraftforge/versions/mcp/\r
+Specification-Title: Minecraft\r
+Specification-Version: 1.16.5\r
+\r
+'''
+
+def make_jar(path: str, entries: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as jar:
+        for name, text in entries.items():
+            jar.writestr(name, text)
+
+def vanilla_jar(version: str) -> dict:
+    return {'META-INF/MANIFEST.MF': 'Manifest-Version: 1.0\r\nMain-Class: net.minecraft.bundler.Main\r\n',
+        'version.json': json.dumps({'id': version, 'world_version': 3465})}
+
+def fabric_launcher(loader: str, game: str) -> dict:
+    return {'META-INF/MANIFEST.MF': 'Manifest-Version: 1.0\r\nMain-Class: net.fabricmc.loader.launch.server.FabricServerLauncher\r\n',
+        'install.properties': 'fabric-loader-version={}\ngame-version={}\n'.format(loader, game)}
+
+class FingerprintTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, *parts) -> str:
+        return os.path.join(self.root, *parts)
+
+    def test_parseManifest_joinsWrappedLinesBySection(self):
+        manifest = fingerprint.parse_manifest(FORGE_MANIFEST)
+        self.assertTrue(manifest['']['Class-Path'].endswith('libraries/org/ow2/asm/asm/9.1/asm-9.1.jar'))
+        self.assertEqual('36.2.39', manifest['net/minecraftforge/versions/forge/']['Implementation-Version'])
+
+    def test_fingerprintJar_readsForgeManifest(self):
+        make_jar(self.path('forge-universal.jar'), {'META-INF/MANIFEST.MF': FORGE_MANIFEST})
+        self.assertEqual(Fingerprint('forge', '36.2.39', '1.16.5', 'forge-universal.jar'),
+            fingerprint.fingerprint_jar(self.path('forge-universal.jar')))
+
+    def test_fingerprintJar_readsLegacyForgeAndInstallerProfiles(self):
+        make_jar(self.path('universal.jar'), {'version.json': json.dumps(
+            {'id': '1.12.2-forge1.12.2-14.23.5.2860', 'inheritsFrom': '1.12.2'})})
+        self.assertEqual(('forge', '14.23.5.2860', '1.12.2'), fingerprint.fingerprint_jar(self.path('universal.jar'))[:3])
+        make_jar(self.path('installer.jar'), {'install_profile.json': json.dumps(
+            {'version': 'neoforge-20.4.80', 'minecraft': '1.20.4'})})
+        self.assertEqual(('neoforge', '20.4.80', '1.20.4'), fingerprint.fingerprint_jar(self.path('installer.jar'))[:3])
+
+    def test_fingerprintJar_ignoresPluginsAndBrokenJars(self):
+        # the name alone would pass for a vanilla server
+        make_jar(self.path('mcmmo.jar'), {'plugin.yml': 'name: mcMMO\n'})
+        self.assertIsNone(fingerprint.fingerprint_jar(self.path('mcmmo.jar')))
+        with open(self.path('minecraft_server.jar'), 'wb') as file:
+            file.write(b'not a zip')
+        self.assertIsNone(fingerprint.fingerprint_jar(self.path('minecraft_server.jar')))
+
+    def test_fingerprintJar_ignoresCorruptEntriesAndOddProfiles(self):
+        make_jar(self.path('installer.jar'), {'install_profile.json': json.dumps(
+            {'version': 'forge-1.12.2-14.23.5.2860', 'minecraft': '1.12.2'})})
+        with zipfile.ZipFile(self.path('installer.jar')) as jar:
+            info = jar.getinfo('install_profile.json')
+        with open(self.path('installer.jar'), 'r+b') as file:
+            # the compressed data follows the local header, its name, and its extra field
+            file.seek(info.header_offset + 30 + len(info.filename) + len(info.extra))
+            file.write(b'\xff\xff\xff\xff')
+        self.assertIsNone(fingerprint.fingerprint_jar(self.path('installer.jar')))
+        make_jar(self.path('odd.jar'), {'install_profile.json': json.dumps({'install': 'forge', 'minecraft': 1})})
+        self.assertIsNone(fingerprint.fingerprint_jar(self.path('odd.jar')))
+
+    def test_fingerprintDirectory_prefersLoaderOverVanilla(self):
+        make_jar(self.path('fabric-server-launch.jar'), fabric_launcher('0.14.21', '1.20.1'))
+        make_jar(self.path('server.jar'), vanilla_jar('1.20.1'))
+        self.assertEqual(Fingerprint('fabric', '0.14.21', '1.20.1', 'fabric-server-launch.jar'),
+            fingerprint.fingerprint_directory(self.root))
+        os.remove(self.path('fabric-server-launch.jar'))
+        self.assertEqual(Fingerprint('vanilla', None, '1.20.1', 'server.jar'), fingerprint.fingerprint_directory(self.root))
+
+    def test_fingerprintDirectory_usesLibrariesTheScriptStarts(self):
+        for version in ['1.20.1-47.1.0', '1.20.1-47.2.0']:
+            os.makedirs(self.path('libraries', 'net', 'minecraftforge', 'forge', version))
+        self.assertEqual(('forge', '47.2.0', '1.20.1'), fingerprint.fingerprint_directory(self.root)[:3])
+        with open(self.path('run.sh'), 'w') as file:
+            file.write('java @user_jvm_args.txt @libraries/net/minecraftforge/forge/1.20.1-47.1.0/unix_args.txt "$@"\n')
+        self.assertEqual(('forge', '47.1.0', '1.20.1'), fingerprint.fingerprint_directory(self.root)[:3])
+
+    def test_fingerprintDirectory_mapsNeoForgeToMinecraft(self):
+        os.makedirs(self.path('libraries', 'net', 'neoforged', 'neoforge', '21.0.167'))
+        self.assertEqual(('neoforge', '21.0.167', '1.21'), fingerprint.fingerprint_directory(self.root)[:3])
+
+class ScanTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.root, 'data', 'medusa.json')
+        os.makedirs(os.path.dirname(self.config_path))
+        with open(self.config_path, 'w') as file:
+            file.write(filebases.DATA)
+        patcher = patch('medusa.config.get_config_location', return_value=self.config_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        config.invalidate_config()
+        manager._servers = None
+        cli.register_server_types()
+
+    def tearDown(self):
+        manager._servers = None
+        config.invalidate_config()
+        shutil.rmtree(self.root)
+
+    def scan(self, verbosity: int = 0) -> str:
+        out = io.StringIO()
+        with redirect_stdout(out):
+            manager.scan_directory_for_servers(os.path.join(self.root, 'srvs'), verbosity=verbosity)
+        return out.getvalue()
+
+    def test_scan_recordsFingerprintOnServer(self):
+        make_jar(os.path.join(self.root, 'srvs', 'modded', 'forge-universal.jar'), {'META-INF/MANIFEST.MF': FORGE_MANIFEST})
+        # a plugin whose name the vanilla detector mistakes for a server
+        make_jar(os.path.join(self.root, 'srvs', 'lobby', 'mcmmo.jar'), {'plugin.yml': 'name: mcMMO\n'})
+        make_jar(os.path.join(self.root, 'srvs', 'lobby', 'server.jar'), vanilla_jar('1.20.1'))
+        self.scan()
+        servers = {os.path.basename(srv.Path): srv for srv in manager.get_servers_from_config()}
+        self.assertEqual((FORGE, 'forge', '36.2.39', '1.16.5'), (servers['modded'].Type, servers['modded'].Loader,
+            servers['modded'].LoaderVersion, servers['modded'].MinecraftVersion))
+        self.assertEqual((VANILLA, 'vanilla', '1.20.1'), (servers['lobby'].Type, servers['lobby'].Loader,
+            servers['lobby'].MinecraftVersion))
+
+    def test_scan_skipsUnchangedJarsAndUpdatesUpgrades(self):
+        server_dir = os.path.join(self.root, 'srvs', 'fabric')
+        make_jar(os.path.join(server_dir, 'fabric-server-launch.jar'), fabric_launcher('0.14.21', '1.20.1'))
+        self.scan()
+        with patch('medusa.servers.fingerprint.fingerprint_directory') as fingerprint_directory:
+            self.assertIn('Fingerprint cache: 1 hits, 0 misses', self.scan(verbosity=2))
+        fingerprint_directory.assert_not_called()
+
+        # overwriting the jar in place leaves the directory's mtime alone
+        stat = os.stat(server_dir)
+        make_jar(os.path.join(server_dir, 'fabric-server-launch.jar'), fabric_launcher('0.15.0', '1.20.2'))
+        os.utime(server_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIn('Updated {} to fabric 0.15.0 (1.20.2)'.format(server_dir), self.scan(verbosity=1))
+        srv = manager.get_servers_from_config()[0]
+        self.assertEqual((FABRIC, '0.15.0', '1.20.2'), (srv.Type, srv.LoaderVersion, srv.MinecraftVersion))
@@ -0,0 +1,132 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from medusa import logs
+from medusa.servers import VANILLA
+from medusa.servers.logfollow import LogFollower, RateLimiter
+from medusa.servers.models import Server
+
+class RateLimiterTests(unittest.TestCase):
+    def test_allow_permitsBurstThenSuppresses(self):
+        limiter = RateLimiter(rate=2, burst=3, now=0.0)
+        self.assertEqual([True, True, True, False, False], [limiter.allow(0.0) for i in range(5)])
+        self.assertEqual(2, limiter.suppressed)
+        self.assertTrue(limiter.allow(0.5))
+
+    def test_takeSuppressed_waitsForToken(self):
+        limiter = RateLimiter(rate=1, now=0.0)
+        limiter.allow(0.0)
+        limiter.allow(0.0)
+        self.assertEqual(0, limiter.take_suppressed(0.1))
+        self.assertEqual(1, limiter.take_suppressed(1.1))
+        self.assertEqual(0, limiter.take_suppressed(5.0))
+
+class LogFollowerTests(unittest.TestCase):
+    use_inotify = True
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.servers = {}
+        self.followers = []
+
+    def tearDown(self):
+        for follower in self.followers:
+            follower.close()
+        shutil.rmtree(self.root)
+
+    def add_server(self, name: str, logs_dir: bool = True) -> Server:
+        srv = Server()
+        srv.Path = os.path.join(self.root, name)
+        srv.Alias = name
+        srv.Type = VANILLA
+        os.makedirs(os.path.join(srv.Path, 'logs') if logs_dir else srv.Path)
+        self.servers[name] = srv
+        return srv
+
+    def write(self, name: str, *lines, mode: str = 'a'):
+        with open(os.path.join(self.servers[name].Path, 'logs', 'latest.log'), mode) as file:
+            file.write(''.join(line + '\n' for line in lines))
+
+    def follower(self, **kwargs) -> LogFollower:
+        follower = LogFollower(self.servers.values(), use_inotify=self.use_inotify, **kwargs)
+        self.followers.append(follower)
+        return follower
+
+    def poll(self, follower: LogFollower, expected: int):
+        # inotify events can trickle in over several reads
+        out = []
+        for i in range(20):
+            out += [(srv.Alias, line) for srv, line in follower.poll(0.2)]
+            if len(out) >= expected:
+                break
+        return out
+
+    def test_poll_startsAtEndOfEachLog(self):
+        self.add_server('a')
+        self.add_server('b')
+        self.write('a', 'old line')
+        follower = self.follower()
+        self.write('a', 'a1')
+        self.write('b', 'b1', 'b2')
+        self.assertEqual(sorted([('a', 'a1'), ('b', 'b1'), ('b', 'b2')]), sorted(self.poll(follower, 3)))
+
+    def test_poll_filtersByPattern(self):
+        self.add_server('a')
+        self.write('a', '')
+        follower = self.follower(pattern=re.compile('joined'))
+        self.write('a', 'Steve joined the game', 'Steve left the game')
+        self.assertEqual([('a', 'Steve joined the game')], self.poll(follower, 1))
+
+    def test_poll_limitsNoisyServer(self):
+        self.add_server('noisy')
+        self.add_server('quiet')
+        follower = self.follower(rate=5)
+        self.write('noisy', *['spam {}'.format(i) for i in range(100)])
+        self.write('quiet', 'important')
+        out = self.poll(follower, 6)
+        self.assertIn(('quiet', 'important'), out)
+        self.assertEqual(5, len([line for name, line in out if name == 'noisy']))
+        follower.limiters[id(follower.tails[0])].tokens = 1.0
+        self.assertIn(('noisy', '(95 lines suppressed)'), follower.poll(0.0))
+
+    def test_poll_followsRotation(self):
+        self.add_server('a')
+        self.write('a', 'before')
+        follower = self.follower()
+        self.write('a', 'last of old log')
+        os.rename(os.path.join(self.root, 'a', 'logs', 'latest.log'), os.path.join(self.root, 'a', 'logs', 'old.log'))
+        self.write('a', 'first of new log')
+        self.assertEqual([('a', 'last of old log'), ('a', 'first of new log')], self.poll(follower, 2))
+
+    def test_poll_picksUpLogsDirectoryCreatedLater(self):
+        self.add_server('a', logs_dir=False)
+        with patch('medusa.servers.logfollow.RESCAN_INTERVAL', 0.0):
+            follower = self.follower()
+            os.makedirs(os.path.join(self.root, 'a', 'logs'))
+            self.write('a', 'hello')
+            self.assertEqual([('a', 'hello')], self.poll(follower, 1))
+
+    def test_follow_prefixesAlias(self):
+        self.add_server('lobby')
+        self.add_server('survival-1')
+        self.write('lobby', '')
+        out = io.StringIO()
+        polls = []
+        def until():
+            if len(polls) == 1:
+                self.write('lobby', 'hi')
+            polls.append(None)
+            return len(polls) > 4
+        with patch('medusa.servers.logfollow.POLL_INTERVAL', 0.05):
+            logs.follow(list(self.servers.values()), use_inotify=self.use_inotify, out=out, until=until,
+                interval=0.05)
+        self.assertEqual('[lobby]      hi\n', out.getvalue())
+
+@patch('medusa.servers.logfollow.POLL_INTERVAL', 0.01)
+class PollingLogFollowerTests(LogFollowerTests):
+    use_inotify = False
@@ -0,0 +1,192 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import logs
+from medusa.servers import FORGE, VANILLA, logsearch
+from medusa.servers.logsearch import LogIndex, SearchQuery
+from medusa.servers.models import Server
+
+class ClockTests(unittest.TestCase):
+    def test_stamp_advancesDayAtMidnight(self):
+        clock = logsearch._Clock('2023-01-31')
+        self.assertEqual('2023-01-31 23:59:58', clock.stamp(b'[23:59:58] [Server thread/INFO]: a'))
+        self.assertEqual('2023-01-31 23:59:50', clock.stamp(b'[23:59:50] [Worker/INFO]: out of order'))
+        self.assertEqual('2023-02-01 00:00:03', clock.stamp(b'[00:00:03] [Server thread/INFO]: b'))
+        self.assertIsNone(clock.stamp(b'\tat java.lang.Thread.run(Thread.java:833)'))
+
+    def test_stamp_readsForgeDates(self):
+        clock = logsearch._Clock('2023-03-01')
+        self.assertEqual('2023-02-28 12:34:56', clock.stamp(b'[28Feb2023 12:34:56.789] [main/INFO] [x/]: a'))
+
+class LogSearchTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.index = LogIndex(os.path.join(self.root, 'log_index.json'))
+        self.servers = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def add_server(self, name: str, srv_type: str = VANILLA) -> Server:
+        srv = Server()
+        srv.Path = os.path.join(self.root, name)
+        srv.Alias = name
+        srv.Type = srv_type
+        os.makedirs(os.path.join(srv.Path, 'logs'))
+        self.servers[name] = srv
+        return srv
+
+    def archive(self, name: str, file_name: str, *lines):
+        path = os.path.join(self.servers[name].Path, 'logs', file_name)
+        with gzip.open(path, 'wt') as file:
+            file.write(''.join(line + '\n' for line in lines))
+        return path
+
+    def search(self, query: SearchQuery, jobs: int = 1, servers=None):
+        return list(logsearch.search(servers or self.servers.values(), query, jobs, self.index))
+
+    def add_fleet(self):
+        self.add_server('a')
+        self.add_server('b')
+        self.archive('a', '2023-01-01-1.log.gz',
+            '[10:00:00] [Server thread/INFO]: Steve joined the game',
+            '[10:05:00] [Server thread/INFO]: <Steve> who took my diamonds',
+            '[23:59:00] [Server thread/INFO]: Steve left the game')
+        self.archive('a', '2023-01-02-1.log.gz',
+            '[00:10:00] [Server thread/INFO]: Alex joined the game',
+            '[09:00:00] [Server thread/INFO]: Alex left the game')
+        self.archive('b', '2023-01-01-1.log.gz',
+            '[11:00:00] [Server thread/INFO]: Griefer joined the game',
+            "[11:30:00] [Server thread/WARN]: Can't keep up! Is the server overloaded? Running 2000ms or 40 ticks behind",
+            '[12:00:00] [Server thread/INFO]: Griefer left the game')
+        self.archive('b', '2023-01-01-2.log.gz',
+            '[12:30:00] [Server thread/INFO]: Steve joined the game',
+            '[12:31:00] [Server thread/INFO]: Steve was slain by Zombie',
+            '[12:32:00] [Server thread/INFO]: Steve left the game')
+
+    def test_scanArchive_buildsIndex(self):
+        self.add_fleet()
+        archive = logsearch.find_archives(self.servers['b'])[0]
+        index, matches, error = logsearch.scan_archive(archive, SearchQuery())
+        self.assertIsNone(error)
+        self.assertEqual(('2023-01-01 11:00:00', '2023-01-01 12:00:00'), (index['start'], index['end']))
+        self.assertEqual(0b111, index['events'])
+        self.assertTrue(logsearch.may_mention(index['names'], 'griefer'))
+        self.assertFalse(logsearch.may_mention(index['names'], 'Alex'))
+        # numbers are never recorded, so they cannot rule an archive out
+        self.assertTrue(logsearch.may_mention(index['names'], '1234'))
+        self.assertEqual(3, len(matches))
+
+    def test_findArchives_sortsByDateAndNumber(self):
+        self.add_server('a')
+        for name in ('2023-01-02-1.log.gz', '2023-01-01-10.log.gz', '2023-01-01-9.log.gz'):
+            self.archive('a', name)
+        self.assertEqual(['2023-01-01-9.log.gz', '2023-01-01-10.log.gz', '2023-01-02-1.log.gz'],
+            [os.path.basename(archive.path) for archive in logsearch.find_archives(self.servers['a'])])
+
+    def test_search_mergesServersInTimeOrder(self):
+        self.add_fleet()
+        for jobs in (1, 3):
+            matches = self.search(SearchQuery(), jobs)
+            self.assertEqual(11, len(matches), jobs)
+            self.assertEqual(sorted(match.time for match in matches), [match.time for match in matches])
+            self.assertEqual(['a', 'a', 'b', 'b', 'b', 'b', 'b', 'b', 'a', 'a', 'a'], [match.server for match in matches])
+
+    def test_search_appliesEveryCriterion(self):
+        self.add_fleet()
+        self.assertEqual(['Steve was slain by Zombie', 'Steve left the game'],
+            [match.line[33:] for match in self.search(SearchQuery(player='steve', since='2023-01-01 12:31'))
+                if match.time < '2023-01-01 23'])
+        self.assertEqual(['a', 'b'], [match.server for match in self.search(SearchQuery('diamonds|slain'))])
+        self.assertEqual(1, len(self.search(SearchQuery(kinds=('lag',)))))
+        self.assertEqual(['2023-01-02 00:10:00'], [match.time for match in self.search(SearchQuery('Alex', until='2023-01-02 01'))])
+
+    def test_search_skipsArchivesRuledOutByIndex(self):
+        self.add_fleet()
+        self.search(SearchQuery())
+        with patch('medusa.servers.logsearch.scan_archive', wraps=logsearch.scan_archive) as scan:
+            matches = self.search(SearchQuery(kinds=('lag',)))
+        self.assertEqual(1, scan.call_count)
+        self.assertEqual(1, len(matches))
+        with patch('medusa.servers.logsearch.scan_archive', wraps=logsearch.scan_archive) as scan:
+            matches = self.search(SearchQuery(player='Griefer'))
+        self.assertEqual(1, scan.call_count)
+        self.assertEqual(2, len(matches))
+        with patch('medusa.servers.logsearch.scan_archive', wraps=logsearch.scan_archive) as scan:
+            self.assertEqual([], self.search(SearchQuery(since='2023-01-03')))
+        self.assertEqual(0, scan.call_count)
+
+    def test_search_reportsTruncatedArchivesAndCarriesOn(self):
+        self.add_fleet()
+        path = self.archive('a', '2023-01-02-1.log.gz',
+            *('[{:02}:00:00] [Server thread/INFO]: Alex joined the game'.format(hour) for hour in range(24)))
+        with open(path, 'rb') as file:
+            data = file.read()
+        with open(path, 'wb') as file:
+            file.write(data[:len(data) - 10])
+        errors = []
+        for jobs in (1, 3):
+            results = logsearch.search(self.servers.values(), SearchQuery(), jobs, self.index,
+                on_error=lambda path, error: errors.append(path))
+            matches = list(results)
+            self.assertEqual(9, len([match for match in matches if 'Alex' not in match.line]), jobs)
+            self.assertEqual(sorted(match.time for match in matches), [match.time for match in matches])
+        self.assertEqual([path, path], errors)
+        self.assertIsNone(self.index.get(path))
+
+    def test_index_persistsAndNoticesChanges(self):
+        self.add_fleet()
+        self.search(SearchQuery())
+        self.index.save()
+        index = LogIndex.load(self.index.path)
+        path = self.archive('a', '2023-01-02-1.log.gz', '[08:00:00] [Server thread/INFO]: Notch joined the game')
+        self.assertIsNone(index.get(path))
+        self.assertEqual('2023-01-01 10:00:00', index.get(os.path.join(self.root, 'a', 'logs', '2023-01-01-1.log.gz'))['start'])
+        os.remove(path)
+        index.put(path, {})
+        index.save()
+        self.assertEqual(3, len(LogIndex.load(self.index.path).entries))
+
+    def test_search_findsPlayersOutsideJoinsRegardlessOfIndex(self):
+        self.add_fleet()
+        self.archive('b', '2023-01-02-1.log.gz', '[08:00:00] [Server thread/INFO]: Banned Steve: Griefing',
+            '[08:01:00] [Server thread/INFO]: <Alex> gg/steve.')
+        self.search(SearchQuery())
+        for query in (SearchQuery('Banned', player='Steve'), SearchQuery(player='gg/steve'), SearchQuery(player='griefing')):
+            unindexed = list(logsearch.search(self.servers.values(), query, 1, LogIndex()))
+            self.assertTrue(unindexed, query)
+            self.assertEqual(unindexed, self.search(query), query)
+
+    def test_search_streamsBeforeEveryArchiveIsRead(self):
+        self.add_server('a')
+        for day in range(1, 9):
+            self.archive('a', '2023-01-0{}-1.log.gz'.format(day), '[10:00:00] [Server thread/INFO]: day {}'.format(day))
+        # before and after the archives are indexed
+        for _ in range(2):
+            with patch('medusa.servers.logsearch.scan_archive', wraps=logsearch.scan_archive) as scan:
+                results = logsearch.search(self.servers.values(), SearchQuery(), 1, self.index)
+                self.assertEqual('day 1', next(results).line[33:])
+                self.assertLess(scan.call_count, 8)
+                self.assertEqual(7, len(list(results)))
+
+    def test_processLogs_searchPrintsNdjson(self):
+        self.add_fleet()
+        self.add_server('forge', FORGE)
+        self.archive('forge', '2023-01-05-1.log.gz',
+            '[01Jan2023 10:30:00.000] [Server thread/INFO] [net.minecraft.server.MinecraftServer/]: Steve joined the game')
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=os.path.join(self.root, 'medusa.json')):
+            with patch('medusa.servers.manager.get_servers', return_value=list(self.servers.values())):
+                with redirect_stdout(out):
+                    logs.process_logs(['search', '--kind', 'join', '-p', 'Steve', '-j', '2', '--format', 'ndjson'])
+        matches = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([('a', '2023-01-01 10:00:00'), ('forge', '2023-01-01 10:30:00'), ('b', '2023-01-01 12:30:00')],
+            [(match['server'], match['time']) for match in matches])
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'log_index.json')))
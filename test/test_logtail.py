@@ -0,0 +1,156 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import logs
+from medusa.servers import FABRIC, FORGE, SPIGOT, VANILLA
+from medusa.servers.logtail import LogOffsets, LogTail
+from medusa.servers.models import Server
+
+VANILLA_LOG = '''[12:00:00] [Server thread/INFO]: Starting minecraft server version 1.20.1
+[12:00:05] [Server thread/INFO]: Steve joined the game
+[12:00:06] [Server thread/INFO]: <Steve> hello <world>
+[12:00:07] [Server thread/INFO]: [Not Secure] <Alex> hi
+[12:00:08] [Server thread/WARN]: Can't keep up! Is the server overloaded? Running 2345ms or 46 ticks behind
+[12:00:09] [Server thread/INFO]: Steve left the game
+[12:00:10] [Server thread/ERROR]: This crash report has been saved to: ./crash-reports/crash-2023-01-01_12.00.10-server.txt
+'''
+
+FABRIC_LOG = '''[12:00:00] [main/INFO] (FabricLoader) Loading 42 mods
+[12:00:05] [Server thread/INFO] (Minecraft) Steve joined the game
+[12:00:06] [Server thread/INFO] (Minecraft) <Steve> hello
+'''
+
+FORGE_LOG = '''[01Jan2023 12:00:00.123] [main/INFO] [cpw.mods.modlauncher.Launcher/MODLAUNCHER]: ModLauncher running
+[01Jan2023 12:00:05.456] [Server thread/INFO] [net.minecraft.server.MinecraftServer/]: Steve joined the game
+[01Jan2023 12:00:06.789] [Server thread/INFO] [net.minecraft.server.MinecraftServer/]: <Steve> hello
+'''
+
+class LogTailTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'logs'))
+        self.srv = Server()
+        self.srv.Path = self.root
+        self.srv.Alias = 'lobby'
+        self.srv.Type = VANILLA
+        self.log = os.path.join(self.root, 'logs', 'latest.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, text: str, mode: str = 'a'):
+        with open(self.log, mode, newline='') as file:
+            file.write(text)
+
+    def test_events_parseVanillaLog(self):
+        self.write(VANILLA_LOG)
+        events = list(LogTail(self.srv).events())
+        self.assertEqual(['join', 'chat', 'chat', 'lag', 'leave', 'crash'], [event.kind for event in events])
+        self.assertEqual(('12:00:05', 'INFO', 'Steve'), (events[0].time, events[0].level, events[0].player))
+        self.assertEqual('hello <world>', events[1].text)
+        self.assertEqual('Alex', events[2].player)
+        self.assertIn('2345ms', events[3].text)
+        self.assertEqual('./crash-reports/crash-2023-01-01_12.00.10-server.txt', events[5].text)
+        self.assertEqual(VANILLA_LOG.index('[12:00:05]'), events[0].offset)
+
+    def test_events_useTypePrefix(self):
+        for srv_type, text, time in ((FABRIC, FABRIC_LOG, '12:00:05'), (FORGE, FORGE_LOG, '01Jan2023 12:00:05.456'),
+                (SPIGOT, VANILLA_LOG, '12:00:05')):
+            self.srv.Type = srv_type
+            self.write(text, 'w')
+            events = list(LogTail(self.srv).events())
+            self.assertEqual(('join', time, 'Steve'), (events[0].kind, events[0].time, events[0].player), srv_type)
+            self.assertEqual('chat', events[1].kind)
+
+    def test_events_ignoreOtherTypesPrefix(self):
+        self.write(FORGE_LOG)
+        self.assertEqual([], list(LogTail(self.srv).events()))
+
+    def test_events_readOnlyNewLines(self):
+        tail = LogTail(self.srv)
+        self.write('[12:00:05] [Server thread/INFO]: Steve joined the game\n')
+        self.assertEqual(['join'], [event.kind for event in tail.events()])
+        self.assertEqual([], list(tail.events()))
+        self.write('[12:00:09] [Server thread/INFO]: Steve left the game\n')
+        self.assertEqual(['leave'], [event.kind for event in tail.events()])
+
+    def test_events_waitForCompleteLine(self):
+        tail = LogTail(self.srv)
+        self.write('[12:00:05] [Server thread/INFO]: Steve joined')
+        self.assertEqual([], list(tail.events()))
+        self.assertEqual(0, tail.offset)
+        self.write(' the game\r\n')
+        self.assertEqual(['Steve'], [event.player for event in tail.events()])
+
+    def test_readBlocks_splitOnLineBoundaries(self):
+        self.write(VANILLA_LOG * 50)
+        with patch('medusa.servers.logtail.READ_SIZE', 1000):
+            tail = LogTail(self.srv)
+            blocks = list(tail.read_blocks())
+            self.assertEqual(300, len(list(LogTail(self.srv).events())))
+        self.assertGreater(len(blocks), 1)
+        self.assertTrue(all(block.endswith(b'\n') for start, block in blocks))
+        self.assertEqual(len(VANILLA_LOG) * 50, tail.offset)
+
+    def test_rotation_finishesOldLogFirst(self):
+        tail = LogTail(self.srv)
+        self.write('[12:00:05] [Server thread/INFO]: Steve joined the game\n')
+        list(tail.events())
+        self.write('[12:00:09] [Server thread/INFO]: Steve left the game\n')
+        os.rename(self.log, os.path.join(self.root, 'logs', '2023-01-01-1.log'))
+        self.write('[13:00:05] [Server thread/INFO]: Alex joined the game\n', 'w')
+        self.assertEqual(['Steve', 'Alex'], [event.player for event in tail.events()])
+        self.assertEqual(1, tail.rotations)
+
+    def test_rotation_detectedFromSavedInode(self):
+        self.write('[12:00:05] [Server thread/INFO]: Steve joined the game\n')
+        ino = os.stat(self.log).st_ino
+        os.remove(self.log)
+        self.write('[13:00:05] [Server thread/INFO]: Alex joined the game\n' + 'x' * 100 + '\n')
+        tail = LogTail(self.srv, offset=10, ino=ino + 1)
+        self.assertEqual(['Alex'], [event.player for event in tail.events()])
+
+    def test_truncation_restartsFromBeginning(self):
+        tail = LogTail(self.srv)
+        self.write(VANILLA_LOG)
+        list(tail.events())
+        self.write('[13:00:05] [Server thread/INFO]: Alex joined the game\n', 'w')
+        self.assertEqual(['Alex'], [event.player for event in tail.events()])
+
+    def test_lines_yieldOffsets(self):
+        self.write('first\r\nsecond\n')
+        self.assertEqual([(0, 'first'), (7, 'second')], list(LogTail(self.srv).lines()))
+
+    def test_offsets_resumeAcrossProcesses(self):
+        path = os.path.join(self.root, 'offsets.json')
+        self.write(VANILLA_LOG)
+        offsets = LogOffsets.load(path)
+        tail = offsets.open(self.srv)
+        list(tail.events())
+        offsets.update(tail)
+        offsets.save()
+        self.write('[13:00:05] [Server thread/INFO]: Alex joined the game\n')
+        tail = LogOffsets.load(path).open(self.srv)
+        self.assertEqual(['Alex'], [event.player for event in tail.events()])
+
+    def test_processLogs_printsNewEventsOnce(self):
+        self.write(VANILLA_LOG)
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=os.path.join(self.root, 'medusa.json')):
+            with patch('medusa.servers.manager.get_servers', return_value=[self.srv]):
+                with redirect_stdout(out):
+                    logs.process_logs(['events', '--kind', 'join', '--kind', 'leave'])
+                    logs.process_logs(['events', '--format', 'ndjson'])
+                    self.write('[13:00:05] [Server thread/INFO]: Alex joined the game\n')
+                    logs.process_logs(['events', '--format', 'ndjson'])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(['[lobby] 12:00:05 join Steve', '[lobby] 12:00:09 leave Steve'], lines[:2])
+        self.assertEqual(1, len(lines[2:]))
+        self.assertEqual({'server': 'lobby', 'player': 'Alex', 'kind': 'join'},
+            {key: json.loads(lines[2])[key] for key in ('server', 'player', 'kind')})
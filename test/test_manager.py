@@ -1,9 +1,12 @@
-from os.path import join, curdir
+import os
+from os.path import dirname, join, curdir
 import unittest
 from unittest.mock import MagicMock, patch
 import jsonpickle
 from pyfakefs.fake_filesystem_unittest import TestCase
+import json
 import medusa
+from medusa import storage
 
 from medusa.filebases import DATA
 from medusa.servers import FORGE, manager
@@ -87,7 +90,15 @@ class ManagerTests(TestCase):
         self.fs.create_file(get_config_location())
         args = ['scan']
         manager.process_server(args)
-        mock_scan.assert_called_once_with('')
+        mock_scan.assert_called_once_with('', verbosity=1, jobs=1, use_cache=True)
+    
+    @patch('medusa.servers.manager.scan_directory_for_servers')
+    @patch('medusa.servers.manager.get_servers_from_config')
+    def test_process_scan_passesJobs(self, mock_from, mock_scan):
+        self.fs.create_file(get_config_location())
+        args = ['scan', '--jobs', '8']
+        manager.process_server(args)
+        mock_scan.assert_called_once_with('', verbosity=1, jobs=8, use_cache=True)
     
     @patch('builtins.print')
     @patch('medusa.servers.manager.get_server_by_identifier', return_value = None)
@@ -154,10 +165,9 @@ class ManagerTests(TestCase):
         #mock_print.assert_called_with('Scanning for existing servers in', '/new/dir')
         self.assertEqual(2, mock_print.call_count, 'Print should have been called twice: once when beginning scan and once to recap')
     
-    @patch('medusa.servers.forge.is_path_forge', return_value = True)
+    @patch('medusa.servers.manager.detect_server_type', return_value = (FORGE, 1.0))
     @patch('builtins.print')
-    @patch('medusa.servers.manager.register_server', return_value = 1)    
-    def test_scan_removesDeletedServers(self, mock_register, mock_print, mock_is_forge):
+    def test_scan_removesDeletedServers(self, mock_print, mock_detect):
         # Create two servers, but only keep 1 of them on disk
         srv_stays = Server()
         srv_stays.Path = '/srvs/creative1'
@@ -166,13 +176,73 @@ class ManagerTests(TestCase):
         srv_delete.Path = '/srvs/creative2'
         srv_delete.Type = FORGE
         self.fs.create_dir(srv_stays.Path)
-        
-        manager._servers = [srv_stays, srv_delete]
+        self.fs.create_dir('/srvs/creative3')
+        self.plant_server([srv_stays, srv_delete])
+
         result = manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=1)
-        mock_register.assert_called_once_with(srv_stays.Path, FORGE)
         mock_print.assert_called_with('Found 1 servers')
         self.assertEqual(1, result)
+        self.assertEqual([srv_stays.Path, '/srvs/creative3'], [srv.Path for srv in manager._servers])
+        self.assertEqual([srv_stays.Path, '/srvs/creative3'],
+            [srv.Path for srv in manager.get_servers_from_config()])
+
+    @patch('medusa.servers.manager.detect_server_type', return_value = (FORGE, 1.0))
+    def test_scan_parallelMatchesSerial(self, mock_detect):
+        for i in range(20):
+            self.fs.create_dir('/srvs/s{:02}'.format(i))
+        self.plant_server([])
+
+        result = manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=0, jobs=4)
+        self.assertEqual(20, result)
+        expected = ['/srvs/s{:02}'.format(i) for i in range(20)]
+        self.assertEqual(expected, [srv.Path for srv in manager._servers])
+        for path in expected:
+            self.assertTrue(self.fs.exists(join(path, '.medusa')))
         
+    @patch('builtins.print')
+    def test_scan_reusesCachedDetection(self, mock_print):
+        self.fs.create_file('/srvs/creative1/forge-1.16.5.jar')
+        self.fs.create_dir('/srvs/not a server')
+        self.plant_server([])
+
+        with patch('medusa.servers.manager.detect_server_type', return_value = (FORGE, 1.0)) as mock_detect:
+            manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=0)
+            self.assertEqual(2, mock_detect.call_count)
+            mock_detect.reset_mock()
+
+            manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=2)
+            mock_detect.assert_not_called()
+            mock_print.assert_any_call('Scan cache: 2 hits, 0 misses')
+
+            # a new top-level entry invalidates only that directory
+            # (the fake filesystem leaves directory mtimes alone, so bump it by hand)
+            self.fs.create_file('/srvs/not a server/minecraft_server.jar')
+            os.utime('/srvs/not a server', ns=(0, 1))
+            manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=2)
+            mock_detect.assert_called_once_with('/srvs/not a server')
+            mock_print.assert_any_call('Scan cache: 1 hits, 1 misses')
+
+    @patch('medusa.servers.manager.detect_server_type', return_value = (FORGE, 1.0))
+    def test_scan_noCacheAlwaysDetects(self, mock_detect):
+        self.fs.create_dir('/srvs/creative1')
+        self.plant_server([])
+
+        manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=0, use_cache=False)
+        manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=0, use_cache=False)
+        self.assertEqual(2, mock_detect.call_count)
+        self.assertFalse(self.fs.exists(join(dirname(get_config_location()), 'scan_cache.json')))
+
+    @patch('medusa.servers.manager.detect_server_type', return_value = (FORGE, 1.0))
+    def test_scan_savesCacheAtomically(self, mock_detect):
+        self.fs.create_dir('/srvs/creative1')
+        self.plant_server([])
+        cache_path = join(dirname(get_config_location()), 'scan_cache.json')
+        with patch('medusa.storage.atomic_open', wraps=storage.atomic_open) as mock_write:
+            manager.scan_directory_for_servers(scan_path='/srvs/', verbosity=0)
+        self.assertIn(cache_path, [call.args[0] for call in mock_write.call_args_list])
+        with open(cache_path, 'r') as file:
+            self.assertIn('/srvs/creative1', json.load(file)['entries'])
+
     def test_scan_skipsNonServers(self):
         self.fs.create_dir('/srvs/creative1')
         self.fs.create_file('/srvs/trickytricky')
@@ -213,4 +283,69 @@ class ManagerTests(TestCase):
         srv_updated.Path = '/road/to/owning a home'
         self.plant_server([srv1, srv2])
         manager.update_server('/road/to/riches', srv_updated)
-        self.assertIn(srv_updated, manager._servers)
\ No newline at end of file
+        self.assertIn(srv_updated, manager._servers)
+    def test_update_writesSingleDocument(self):
+        srv1 = Server()
+        srv1.Path = '/road/to/riches'
+        srv_updated = Server()
+        srv_updated.Path = '/road/to/owning a home'
+        self.plant_server([srv1])
+        manager.update_server('/road/to/riches', srv_updated)
+        with open(get_config_location(), 'r') as conf:
+            data = json.load(conf)
+        self.assertEqual(['/road/to/owning a home'], [srv['Path'] for srv in data['server_registry']])
+
+    def test_transaction_writesOnce(self):
+        self.plant_server([])
+        for name in ['a', 'b', 'c']:
+            self.fs.create_dir(join('/srvs', name))
+        with patch('medusa.storage.atomic_open', wraps=storage.atomic_open) as mock_write:
+            with manager.transaction():
+                manager.register_server('/srvs/a', FORGE)
+                manager.register_server('/srvs/b', FORGE)
+                manager.register_server('/srvs/c', FORGE)
+                manager.deregister_server('b')
+            mock_write.assert_called_once()
+        self.assertEqual(['/srvs/a', '/srvs/c'], [srv.Path for srv in manager.get_servers_from_config()])
+
+    def test_transaction_rollsBackOnError(self):
+        existing = Server()
+        existing.Path = '/srvs/old'
+        self.plant_server([existing])
+        self.fs.create_dir('/srvs/new')
+        with self.assertRaises(RuntimeError):
+            with manager.transaction():
+                manager.register_server('/srvs/new', FORGE)
+                manager.deregister_server('old')
+                raise RuntimeError()
+        self.assertEqual(['/srvs/old'], [srv.Path for srv in manager.get_servers()])
+        self.assertEqual(['/srvs/old'], [srv.Path for srv in manager.get_servers_from_config()])
+
+    def test_transaction_keepsOtherWriters(self):
+        mine = Server()
+        mine.Path = '/srvs/mine'
+        self.plant_server([mine])
+        # another process registers a server after this one loaded the registry
+        theirs = Server()
+        theirs.Path = '/srvs/theirs'
+        with open(get_config_location(), 'w') as conf:
+            conf.write(jsonpickle.encode({'server_directory': None, 'server_registry': [mine, theirs]}))
+
+        manager.deregister_server('mine')
+        self.assertEqual(['/srvs/theirs'], [srv.Path for srv in manager.get_servers_from_config()])
+
+    def test_load_migratesJsonpickleRegistry(self):
+        legacy = Server()
+        legacy.Alias = 'Old Timer'
+        legacy.Path = '/srvs/old'
+        legacy.Type = FORGE
+        self.plant_server([legacy])
+        manager._servers = None
+
+        srv = manager.get_server_by_identifier('Old Timer')
+        self.assertEqual('/srvs/old', srv.Path)
+        self.assertEqual(FORGE, srv.Type)
+        with open(get_config_location(), 'r') as conf:
+            data = json.load(conf)
+        self.assertEqual(1, data['registry_version'])
+        self.assertEqual([{'Alias': 'Old Timer', 'Path': '/srvs/old', 'Type': FORGE}], data['server_registry'])
@@ -0,0 +1,165 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import mods, storage
+from medusa.servers import FABRIC, modindex
+from medusa.servers.modindex import ModIndex, ModInfo
+from medusa.servers.models import Server
+
+FORGE_TOML = '''modLoader="javafml"
+loaderVersion="[47,)"
+license="MIT"
+
+[[mods]]
+modId="jei"
+version="${file.jarVersion}"
+displayName="Just Enough Items"
+description=\'\'\'
+version="not this one"
+\'\'\'
+
+[[dependencies.jei]]
+modId="forge"
+'''
+
+PLUGIN_YML = '''name: LuckPerms
+version: "5.4.102"
+main: me.lucko.luckperms.bukkit.loader.BukkitLoaderPlugin
+commands:
+  lp:
+    name: not this one
+'''
+
+def make_jar(path: str, entries: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as jar:
+        jar.writestr('com/example/Big.class', b'\x00' * 100000)
+        for name, text in entries.items():
+            jar.writestr(name, text)
+
+def fabric_jar(mod_id: str, version: str, name: str = None) -> dict:
+    return {'fabric.mod.json': json.dumps({'schemaVersion': 1, 'id': mod_id, 'version': version, 'name': name or mod_id})}
+
+class ReadJarTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read(self, entries: dict):
+        path = os.path.join(self.root, 'mod.jar')
+        make_jar(path, entries)
+        return modindex.read_jar(path)
+
+    def test_readJar_forgeTakesVersionFromManifest(self):
+        mods_toml = {'META-INF/mods.toml': FORGE_TOML,
+            'META-INF/MANIFEST.MF': 'Manifest-Version: 1.0\r\nImplementation-Version: 15.2.0.27\r\n'}
+        self.assertEqual([ModInfo('jei', 'Just Enough Items', '15.2.0.27', 'forge')], self.read(mods_toml))
+        with patch('medusa.servers.modindex.tomllib', None):
+            self.assertEqual([ModInfo('jei', 'Just Enough Items', '15.2.0.27', 'forge')], self.read(mods_toml))
+
+    def test_readJar_readsPluginAndFabricMetadata(self):
+        self.assertEqual([ModInfo('LuckPerms', 'LuckPerms', '5.4.102', 'bukkit')], self.read({'plugin.yml': PLUGIN_YML}))
+        self.assertEqual([ModInfo('sodium', 'Sodium', '0.5.3', 'fabric')], self.read(fabric_jar('sodium', '0.5.3', 'Sodium')))
+
+    def test_readJar_ignoresLibrariesAndBrokenJars(self):
+        self.assertEqual([], self.read({}))
+        self.assertEqual([], self.read({'fabric.mod.json': '{not json'}))
+        with open(os.path.join(self.root, 'broken.jar'), 'wb') as file:
+            file.write(b'not a zip')
+        self.assertEqual([], modindex.read_jar(os.path.join(self.root, 'broken.jar')))
+
+    def test_readJar_onlyDecompressesMetadata(self):
+        path = os.path.join(self.root, 'mod.jar')
+        make_jar(path, fabric_jar('sodium', '0.5.3'))
+        with patch('zipfile.ZipFile.read', wraps=zipfile.ZipFile.read, autospec=True) as read:
+            modindex.read_jar(path)
+        self.assertEqual(['fabric.mod.json'], [call.args[1].filename for call in read.call_args_list])
+
+    def test_versionKey_ordersVersions(self):
+        versions = ['1.0-beta', '1.10', '1.2.9', '1.0', '1.2.10', '1.0.1']
+        self.assertEqual(['1.0-beta', '1.0', '1.0.1', '1.2.9', '1.2.10', '1.10'], sorted(versions, key=modindex.version_key))
+
+class InventoryTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.servers = []
+        self.add_server('a', {'sodium.jar': fabric_jar('sodium', '0.5.3'), 'jei.jar': fabric_jar('jei', '15.2.0')})
+        self.add_server('b', {'sodium-old.jar': fabric_jar('sodium', '0.4.10'), 'lithium.jar': fabric_jar('lithium', '0.11.2')})
+        self.add_server('c', {'sodium.jar': fabric_jar('sodium', '0.5.3')})
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def add_server(self, name: str, jars: dict):
+        srv = Server()
+        srv.Path = os.path.join(self.root, name)
+        srv.Alias = name
+        srv.Type = FABRIC
+        for file_name, entries in jars.items():
+            make_jar(os.path.join(srv.Path, 'mods', file_name), entries)
+        self.servers.append(srv)
+
+    def run_mods(self, *args) -> str:
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=os.path.join(self.root, 'medusa.json')):
+            with patch('medusa.servers.manager.get_servers', return_value=self.servers):
+                with redirect_stdout(out):
+                    mods.process_mods(list(args))
+        return out.getvalue()
+
+    def test_index_skipsUnchangedJars(self):
+        index = ModIndex(os.path.join(self.root, 'mod_index.json'))
+        self.assertEqual(5, len(modindex.get_inventory(self.servers, index, 4)))
+        index.save()
+        index = ModIndex.load(index.path)
+        with patch('medusa.servers.modindex.read_jar') as read_jar:
+            self.assertEqual(5, len(modindex.get_inventory(self.servers, index, 4)))
+        self.assertEqual(0, read_jar.call_count)
+        self.assertEqual(5, index.hits)
+
+    def test_index_savesAtomically(self):
+        index = ModIndex(os.path.join(self.root, 'mod_index.json'))
+        modindex.get_inventory(self.servers, index, 4)
+        with patch('medusa.storage.atomic_open', wraps=storage.atomic_open) as atomic_open:
+            index.save()
+        atomic_open.assert_called_once_with(index.path)
+        self.assertEqual(len(index.entries), len(ModIndex.load(index.path).entries))
+
+    def test_where_findsServersByModAndVersion(self):
+        out = [json.loads(line) for line in self.run_mods('where', 'SODIUM', '0.5.3', '--format', 'ndjson').splitlines()]
+        self.assertEqual(['a', 'c'], [mod['server'] for mod in out])
+        self.assertIn('No server has create', self.run_mods('where', 'create'))
+
+    def test_outdated_comparesAcrossFleet(self):
+        out = self.run_mods('outdated')
+        self.assertIn('| b      | sodium | 0.4.10  | 0.5.3  |', out)
+        self.assertNotIn('lithium', out)
+        self.assertIn('Every server runs', self.run_mods('outdated', 'jei'))
+
+    def test_list_skipsCorruptJars(self):
+        path = os.path.join(self.root, 'a', 'mods', 'corrupt.jar')
+        make_jar(path, fabric_jar('create', '0.5.1'))
+        with zipfile.ZipFile(path) as jar:
+            info = jar.getinfo('fabric.mod.json')
+        with open(path, 'r+b') as file:
+            # the compressed data follows the local header, its name, and its extra field
+            file.seek(info.header_offset + 30 + len(info.filename) + len(info.extra))
+            file.write(b'\xff\xff\xff\xff')
+        out = self.run_mods('list', '--match', 'a')
+        self.assertIn('sodium', out)
+        self.assertNotIn('create', out)
+
+    def test_list_printsEveryServer(self):
+        out = self.run_mods('list', '--match', 'b')
+        self.assertIn('lithium', out)
+        self.assertIn('sodium-old.jar', out)
+        self.assertNotIn('jei', out)
@@ -47,6 +47,23 @@ class ParsersTestCase(TestCase):
         
         args_parsed = parser.parse_args(args)
         assert args_parsed.action == 'scan'
+        assert args_parsed.jobs == 1
+
+    def test_parser_server_scanJobs(self):
+        args = ['scan', '-j', '16']
+        parser = medusa.parsers.get_server_parsers()
+        
+        args_parsed = parser.parse_args(args)
+        assert args_parsed.jobs == 16
+
+    def test_parser_server_watch(self):
+        args = ['watch', '--delay', '0.5', '--poll']
+        parser = medusa.parsers.get_server_parsers()
+        
+        args_parsed = parser.parse_args(args)
+        assert args_parsed.action == 'watch'
+        assert args_parsed.delay == 0.5
+        assert args_parsed.poll
 
     def test_parser_server_setAlias(self):
         args = ['set', 'server id', 'alias', 'nickname']
@@ -0,0 +1,194 @@
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import cli, loop, rcon, run
+from medusa.servers import FORGE
+from medusa.servers.models import Server
+
+PASSWORD = 'hunter2'
+
+class FakeRconServer:
+    """
+    Minimal RCON server that behaves like Minecraft's: it answers packets in
+    order, splits long responses into 4096-byte packets, and answers packets
+    of unknown types with an error message carrying the same ID.
+    """
+
+    def __init__(self, password: str = PASSWORD):
+        self.password = password
+        self.commands = []
+        self.connections = 0
+        self._writers = []
+        # `hang` blocks the connection, like a slow command, until this is set
+        self.release = asyncio.Event()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.drop_all()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def drop_all(self):
+        for writer in self._writers:
+            writer.close()
+        self._writers = []
+
+    def respond(self, command: str) -> str:
+        if command == 'list':
+            return 'There are 0 of a max of 20 players online: '
+        if command.startswith('echo '):
+            return command[5:]
+        if command == 'big':
+            return ''.join(chr(ord('a') + i % 26) for i in range(10000))
+        return 'Unknown or incomplete command'
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.append(writer)
+        authed = False
+        try:
+            while True:
+                packet_id, packet_type, body = await rcon.read_packet(reader)
+                if packet_type == rcon.SERVERDATA_AUTH:
+                    authed = body == self.password
+                    writer.write(rcon.encode_packet(packet_id if authed else -1,
+                        rcon.SERVERDATA_AUTH_RESPONSE, ''))
+                elif packet_type == rcon.SERVERDATA_EXECCOMMAND and authed:
+                    self.commands.append(body)
+                    if body == 'hang':
+                        await self.release.wait()
+                    response = self.respond(body)
+                    for start in range(0, max(len(response), 1), 4096):
+                        writer.write(rcon.encode_packet(packet_id, rcon.SERVERDATA_RESPONSE_VALUE,
+                            response[start:start + 4096]))
+                else:
+                    writer.write(rcon.encode_packet(packet_id, rcon.SERVERDATA_RESPONSE_VALUE,
+                        'Unknown request {:x}'.format(packet_type)))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+class RconConnectionTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await FakeRconServer().start()
+        self.conn = rcon.RconConnection('127.0.0.1', self.server.port, PASSWORD, timeout=1.0)
+
+    async def asyncTearDown(self):
+        await self.conn.close()
+        await self.server.stop()
+
+    async def test_command_returnsResponse(self):
+        await self.conn.connect()
+        self.assertEqual('There are 0 of a max of 20 players online: ', await self.conn.command('list'))
+
+    async def test_command_joinsMultiPacketResponse(self):
+        await self.conn.connect()
+        response = await self.conn.command('big')
+        self.assertEqual(self.server.respond('big'), response)
+
+    async def test_command_pipelinesConcurrentCommands(self):
+        await self.conn.connect()
+        responses = await asyncio.gather(*(self.conn.command('echo {}'.format(i)) for i in range(50)))
+        self.assertEqual([str(i) for i in range(50)], responses)
+        self.assertEqual(1, self.server.connections)
+
+    async def test_connect_rejectsBadPassword(self):
+        self.conn.password = 'wrong'
+        with self.assertRaises(rcon.RconAuthError):
+            await self.conn.connect()
+        self.assertFalse(self.conn.connected)
+
+    async def test_command_timesOutAndRecovers(self):
+        await self.conn.connect()
+        with self.assertRaises(rcon.RconTimeoutError):
+            await self.conn.command('hang', timeout=0.1)
+        # the late response is dropped rather than handed to the next command
+        self.server.release.set()
+        self.assertEqual('still here', await self.conn.command('echo still here'))
+
+    async def test_command_failsWhenConnectionDrops(self):
+        await self.conn.connect()
+        pending = asyncio.ensure_future(self.conn.command('hang'))
+        await asyncio.sleep(0.05)
+        self.server.drop_all()
+        with self.assertRaises(rcon.RconConnectionError):
+            await pending
+
+class RconPoolTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await FakeRconServer().start()
+        self.target = rcon.RconTarget('127.0.0.1', self.server.port, PASSWORD)
+        self.pool = rcon.RconPool(timeout=1.0, retries=2, backoff=0.01)
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        await self.server.stop()
+
+    async def test_pool_reusesConnection(self):
+        await asyncio.gather(*(self.pool.command(self.target, 'list') for i in range(10)))
+        await self.pool.command(self.target, 'list')
+        self.assertEqual(1, self.server.connections)
+
+    async def test_pool_reconnectsAfterDrop(self):
+        await self.pool.command(self.target, 'list')
+        self.server.drop_all()
+        await asyncio.sleep(0.05)
+        self.assertEqual('back', await self.pool.command(self.target, 'echo back'))
+        self.assertEqual(2, self.server.connections)
+
+    async def test_pool_givesUpAfterRetries(self):
+        await self.server.stop()
+        with patch('asyncio.sleep', wraps=asyncio.sleep) as mock_sleep:
+            with self.assertRaises(rcon.RconConnectionError):
+                await self.pool.command(self.target, 'list')
+        self.assertEqual([0.01, 0.02], [call.args[0] for call in mock_sleep.call_args_list])
+
+class SendCommandTests(unittest.TestCase):
+    def setUp(self):
+        self.server = loop.run(FakeRconServer().start())
+        self.root = tempfile.mkdtemp()
+        self.srv = Server()
+        self.srv.Path = self.root
+        self.srv.Type = FORGE
+
+    def tearDown(self):
+        loop.run(rcon.get_pool().close())
+        loop.run(self.server.stop())
+        shutil.rmtree(self.root)
+
+    def write_properties(self, *lines):
+        with open(os.path.join(self.root, 'server.properties'), 'w') as file:
+            file.write('#Minecraft server properties\n' + '\n'.join(lines) + '\n')
+
+    def test_sendCommand_usesServerProperties(self):
+        self.write_properties('enable-rcon=true', 'rcon.port={}'.format(self.server.port),
+            'rcon.password=' + PASSWORD, 'server-ip=')
+        self.assertEqual('hi', rcon.send_command(self.srv, 'echo hi'))
+
+    def test_sendCommand_requiresRcon(self):
+        self.write_properties('enable-rcon=false')
+        with self.assertRaises(rcon.RconError):
+            rcon.send_command(self.srv, 'list')
+
+    def test_processRun_passSendsCommand(self):
+        self.write_properties('enable-rcon=true', 'rcon.port={}'.format(self.server.port),
+            'rcon.password=' + PASSWORD)
+        cli.register_server_types()
+        out = io.StringIO()
+        with patch('medusa.servers.manager.get_server_by_identifier', return_value=self.srv):
+            with redirect_stdout(out):
+                run.process_run(['survival', 'pass', 'echo Hello from RCON'])
+        self.assertEqual('Hello from RCON\n', out.getvalue())
+        self.assertEqual(['echo Hello from RCON'], self.server.commands)
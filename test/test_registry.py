@@ -0,0 +1,81 @@
+import unittest
+
+from medusa.servers.models import Server
+from medusa.servers.registry import AmbiguousIdentifierError, ServerRegistry
+
+def make_server(path, alias = None):
+    srv = Server()
+    srv.Path = path
+    srv.Alias = alias
+    return srv
+
+class RegistryTests(unittest.TestCase):
+
+    def test_find_byAliasPathAndBasename(self):
+        srv = make_server('/srv/mc/survival', 'Main')
+        registry = ServerRegistry([srv, make_server('/srv/mc/creative')])
+        self.assertIs(srv, registry.find('Main'))
+        self.assertIs(srv, registry.find('/srv/mc/survival'))
+        self.assertIs(srv, registry.find('/srv/mc/survival/'))
+        self.assertIs(srv, registry.find('survival'))
+        self.assertIsNone(registry.find('hardcore'))
+
+    def test_find_ambiguousBasenameRaises(self):
+        srv1 = make_server('/srv/a/survival')
+        srv2 = make_server('/srv/b/survival')
+        registry = ServerRegistry([srv1, srv2])
+        with self.assertRaises(AmbiguousIdentifierError) as amb:
+            registry.find('survival')
+        self.assertEqual([srv1, srv2], amb.exception.matches)
+        self.assertIs(srv1, registry.find('/srv/a/survival'))
+
+    def test_find_aliasBeatsBasename(self):
+        by_alias = make_server('/srv/a/one', 'survival')
+        registry = ServerRegistry([by_alias, make_server('/srv/b/survival')])
+        self.assertIs(by_alias, registry.find('survival'))
+
+    def test_remove_updatesIndexes(self):
+        srv1 = make_server('/srv/a/survival', 'A')
+        srv2 = make_server('/srv/b/survival', 'B')
+        registry = ServerRegistry([srv1, srv2])
+        registry.remove(srv1)
+        self.assertEqual(1, len(registry))
+        self.assertIsNone(registry.find('A'))
+        self.assertIs(srv2, registry.find('survival'))
+
+    def test_remove_matchesByIdentity(self):
+        srv = make_server('/srv/a/survival', 'A')
+        twin = make_server('/srv/a/survival', 'A')
+        registry = ServerRegistry([srv])
+        with self.assertRaises(ValueError):
+            registry.remove(twin)
+
+    def test_replace_keepsPositionAndReindexes(self):
+        srv1 = make_server('/srv/one')
+        srv2 = make_server('/srv/two')
+        registry = ServerRegistry([srv1, srv2])
+        updated = make_server('/srv/uno', 'First')
+        registry.replace(srv1, updated)
+        self.assertEqual([updated, srv2], list(registry))
+        self.assertIs(updated, registry.find('First'))
+        self.assertIsNone(registry.find('/srv/one'))
+
+    def test_reindex_afterInPlaceEdit(self):
+        srv = make_server('/srv/one', 'Old')
+        registry = ServerRegistry([srv])
+        srv.Alias = 'New'
+        self.assertIs(srv, registry.find('Old'))
+        registry.reindex(srv)
+        self.assertIsNone(registry.find('Old'))
+        self.assertIs(srv, registry.find('New'))
+
+    def test_add_rejectsDuplicateObject(self):
+        srv = make_server('/srv/one')
+        registry = ServerRegistry([srv])
+        with self.assertRaises(ValueError):
+            registry.add(srv)
+
+    def test_emptyPathIsNotIndexed(self):
+        registry = ServerRegistry([make_server('', 'NoPath')])
+        self.assertIsNone(registry.find(''))
+        self.assertIsNotNone(registry.find('NoPath'))
@@ -0,0 +1,142 @@
+import gzip
+import io
+import lzma
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import logs
+from medusa.servers import VANILLA, logsearch, retention
+from medusa.servers.logsearch import SearchQuery
+from medusa.servers.models import Server
+from medusa.servers.retention import RetentionPolicy
+
+DAY = 86400
+
+class RetentionTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.now = time.time()
+        self.srv = Server()
+        self.srv.Path = os.path.join(self.root, 'lobby')
+        self.srv.Alias = 'lobby'
+        self.srv.Type = VANILLA
+        os.makedirs(os.path.join(self.srv.Path, 'logs'))
+        os.makedirs(os.path.join(self.srv.Path, 'crash-reports'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def add_file(self, name: str, age_days: float, text: str = 'line\n', opener=open) -> str:
+        path = os.path.join(self.srv.Path, name)
+        with opener(path, 'wt') as file:
+            file.write(text)
+        mtime = self.now - age_days * DAY
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def plan(self, **policy):
+        return [(action.action, os.path.relpath(action.path, self.srv.Path))
+            for action in retention.plan_retention(self.srv, RetentionPolicy(**policy), self.now)]
+
+    def test_parseSize_acceptsSuffixes(self):
+        self.assertEqual(512, retention.parse_size('512'))
+        self.assertEqual(1536, retention.parse_size('1.5k'))
+        self.assertEqual(500 * 1024 ** 2, retention.parse_size('500MB'))
+        self.assertRaises(ValueError, retention.parse_size, 'lots')
+
+    def test_plan_deletesOldAndCompressesRest(self):
+        self.add_file('logs/latest.log', 400)
+        self.add_file('logs/2020-01-01-1.log.gz', 400, opener=gzip.open)
+        self.add_file('logs/2023-01-01-1.log.gz', 10, opener=gzip.open)
+        self.add_file('logs/2023-01-02-1.log.xz', 9, opener=lzma.open)
+        self.add_file('logs/2023-01-03-1.log.gz', 0.5, opener=gzip.open)
+        self.add_file('crash-reports/crash-2023-01-01_10.00.00-server.txt', 10)
+        self.assertEqual([
+            ('delete', os.path.join('logs', '2020-01-01-1.log.gz')),
+            ('compress', os.path.join('logs', '2023-01-01-1.log.gz')),
+            ('compress', os.path.join('crash-reports', 'crash-2023-01-01_10.00.00-server.txt')),
+        ], self.plan(max_age_days=30))
+
+    def test_plan_deletesOldestOverBudget(self):
+        for day in range(1, 5):
+            self.add_file('logs/2023-01-0{}-1.log'.format(day), 10 - day, 'x' * 100)
+        self.assertEqual([
+            ('delete', os.path.join('logs', '2023-01-01-1.log')),
+            ('delete', os.path.join('logs', '2023-01-02-1.log')),
+        ], self.plan(max_bytes=250, compress_after_days=30))
+
+    def test_plan_skipsGzipAlreadyAtBestLevel(self):
+        # as rotated by the server, which does not compress at gzip's best level
+        path = self.add_file('logs/2023-01-01-1.log.gz', 5,
+            opener=lambda path, mode: gzip.open(path, mode, compresslevel=1))
+        self.assertEqual([('compress', os.path.join('logs', '2023-01-01-1.log.gz'))], self.plan(format='gzip'))
+        retention.compress_file(path, 'gzip')
+        self.assertEqual([], self.plan(format='gzip'))
+
+    def test_compressFile_keepsContentAndTime(self):
+        text = ''.join('[10:00:{:02d}] [Server thread/INFO]: Steve joined the game\n'.format(i % 60) for i in range(1000))
+        path = self.add_file('logs/2023-01-01-1.log.gz', 5, text, opener=gzip.open)
+        mtime = os.stat(path).st_mtime_ns
+        new_path, before, after = retention.compress_file(path, 'xz')
+        self.assertEqual(path[:-len('.gz')] + '.xz', new_path)
+        self.assertFalse(os.path.exists(path))
+        self.assertLess(after, before)
+        self.assertEqual(mtime, os.stat(new_path).st_mtime_ns)
+        with lzma.open(new_path, 'rt') as file:
+            self.assertEqual(text, file.read())
+        self.assertEqual([os.path.basename(new_path)], os.listdir(os.path.dirname(new_path)))
+
+    def test_applyPlan_reportsTruncatedArchivesAndCarriesOn(self):
+        good = self.add_file('logs/2023-01-01-1.log.gz', 5, 'line\n' * 1000, opener=gzip.open)
+        bad = self.add_file('logs/2023-01-02-1.log.gz', 5, 'line\n' * 1000, opener=gzip.open)
+        with open(bad, 'rb') as file:
+            data = file.read()
+        with open(bad, 'wb') as file:
+            file.write(data[:len(data) // 2])
+        os.utime(bad, (self.now - 5 * DAY, self.now - 5 * DAY))
+        policy = RetentionPolicy(format='xz')
+        actions = [(self.srv, action) for action in retention.plan_retention(self.srv, policy, self.now)]
+        results = {result['path']: result for result in retention.apply_plan(actions, policy, 1)}
+        self.assertIsNone(results[good[:-len('.gz')] + '.xz']['error'])
+        self.assertIsNotNone(results[bad]['error'])
+        self.assertEqual(['2023-01-01-1.log.xz', '2023-01-02-1.log.gz'], sorted(os.listdir(os.path.dirname(bad))))
+
+    def test_search_readsRecompressedArchives(self):
+        path = self.add_file('logs/2023-01-01-1.log.gz', 5, '[10:00:00] [Server thread/INFO]: Steve joined the game\n',
+            opener=gzip.open)
+        retention.compress_file(path, 'xz')
+        matches = list(logsearch.search([self.srv], SearchQuery(player='Steve'), 1))
+        self.assertEqual(['2023-01-01 10:00:00'], [match.time for match in matches])
+
+    def test_processLogs_dryRunChangesNothing(self):
+        old = self.add_file('logs/2020-01-01-1.log.gz', 400, opener=gzip.open)
+        self.add_file('crash-reports/crash.txt', 5, 'x' * 5000)
+        before = sorted(os.listdir(os.path.join(self.srv.Path, 'logs')))
+        out = self.run_retention('--dry-run')
+        self.assertIn('[lobby] would delete {}'.format(os.path.join('logs', '2020-01-01-1.log.gz')), out)
+        self.assertIn('Would delete 1 files', out)
+        self.assertTrue(os.path.exists(old))
+        self.assertEqual(before, sorted(os.listdir(os.path.join(self.srv.Path, 'logs'))))
+
+    def test_processLogs_appliesPolicyFromConfig(self):
+        old = self.add_file('logs/2023-01-01-1.log.gz', 20, opener=gzip.open)
+        self.add_file('crash-reports/crash.txt', 5, 'x' * 5000)
+        config = {'retention_max_age_days': '14', 'retention_format': 'gzip'}
+        with patch('medusa.config.get_config', return_value=config):
+            out = self.run_retention('-j', '1')
+        self.assertFalse(os.path.exists(old))
+        self.assertEqual(['crash.txt.gz'], os.listdir(os.path.join(self.srv.Path, 'crash-reports')))
+        self.assertIn('by deleting 1 files and compressing 1 files', out)
+
+    def run_retention(self, *args) -> str:
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=os.path.join(self.root, 'medusa.json')):
+            with patch('medusa.servers.manager.get_servers', return_value=[self.srv]):
+                with redirect_stdout(out):
+                    logs.process_logs(['retention'] + list(args))
+        return out.getvalue()
@@ -0,0 +1,133 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import loop, rcon, run
+from medusa.servers import FABRIC, FORGE, VANILLA
+from medusa.servers.models import Server
+from test.test_rcon import PASSWORD, FakeRconServer
+
+def make_server(path: str, alias: str = None, srv_type: str = VANILLA) -> Server:
+    srv = Server()
+    srv.Path = path
+    srv.Alias = alias
+    srv.Type = srv_type
+    return srv
+
+class SelectorTests(unittest.TestCase):
+    SERVERS = [
+        make_server('/srvs/lobby-1', 'lobby-1', FORGE),
+        make_server('/srvs/lobby-2', 'lobby-2', VANILLA),
+        make_server('/srvs/survival', None, FABRIC),
+    ]
+
+    def test_isFanout(self):
+        self.assertTrue(run.is_fanout(['--all', 'pass', 'list']))
+        self.assertTrue(run.is_fanout(['-j', '4', '--type=forge', 'pass', 'list']))
+        self.assertFalse(run.is_fanout(['lobby', 'pass', 'list']))
+        self.assertFalse(run.is_fanout(['lobby', 'pass', '--all']))
+
+    def test_select_all(self):
+        self.assertEqual(3, len(run.select_servers(self.SERVERS, all=True)))
+
+    def test_select_typeIgnoresCase(self):
+        self.assertEqual(['/srvs/lobby-1'], [srv.Path for srv in run.select_servers(self.SERVERS, srv_type='forge')])
+
+    def test_select_matchUsesAliasThenDirectory(self):
+        self.assertEqual(['/srvs/lobby-1', '/srvs/lobby-2'],
+            [srv.Path for srv in run.select_servers(self.SERVERS, match='lobby-*')])
+        self.assertEqual(['/srvs/survival'], [srv.Path for srv in run.select_servers(self.SERVERS, match='surv*')])
+
+class FanoutTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.fakes = []
+
+    def tearDown(self):
+        for fake in self.fakes:
+            loop.get_loop().call_soon_threadsafe(fake.release.set)
+        loop.run(rcon.get_pool().close())
+        for fake in self.fakes:
+            loop.run(fake.stop())
+        shutil.rmtree(self.root)
+
+    def add_server(self, name: str, rcon_enabled: bool = True) -> Server:
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        lines = ['enable-rcon=false']
+        if rcon_enabled:
+            fake = loop.run(FakeRconServer().start())
+            self.fakes.append(fake)
+            lines = ['enable-rcon=true', 'rcon.port={}'.format(fake.port), 'rcon.password=' + PASSWORD]
+        with open(os.path.join(path, 'server.properties'), 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        return make_server(path, name)
+
+    def test_runOnServers_reportsInCompletionOrder(self):
+        servers = [self.add_server('a'), self.add_server('off', rcon_enabled=False), self.add_server('b')]
+        results = list(run.run_on_servers(servers, 'echo hi', jobs=4, timeout=2.0))
+        self.assertEqual('off', results[0]['server'])
+        self.assertFalse(results[0]['ok'])
+        self.assertEqual({'a', 'b'}, {result['server'] for result in results[1:]})
+        self.assertTrue(all(result['ok'] and result['response'] == 'hi' for result in results[1:]))
+        self.assertEqual(['echo hi'], self.fakes[0].commands)
+
+    def test_runOnServers_timesOutEachServer(self):
+        servers = [self.add_server('slow'), self.add_server('fast')]
+        self.fakes[1].release.set()
+        results = list(run.run_on_servers(servers, 'hang', jobs=4, timeout=0.2))
+        self.assertEqual(['fast', 'slow'], [result['server'] for result in results])
+        self.assertEqual([True, False], [result['ok'] for result in results])
+        self.assertIn('Timed out', results[1]['error'])
+
+    def test_runOnServers_capsConcurrency(self):
+        servers = [self.add_server(name) for name in 'abcd']
+        start = time.monotonic()
+        list(run.run_on_servers(servers, 'hang', jobs=2, timeout=0.2))
+        # two waves of two servers, each waiting out the timeout
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
+    def test_runOnServers_reportsFanoutFailure(self):
+        servers = [self.add_server('a'), self.add_server('b')]
+        with patch('medusa.rcon.get_pool', side_effect=RuntimeError('pool is gone')):
+            results = list(run.run_on_servers(servers, 'echo hi', jobs=4, timeout=1.0))
+        self.assertEqual(['a', 'b'], [result['server'] for result in results])
+        self.assertTrue(all(result['error'] == 'RuntimeError: pool is gone' for result in results))
+
+    def test_runOnServers_stopsWaitingAtDeadline(self):
+        servers = [self.add_server('a')]
+        async def stalled(*args):
+            await asyncio.sleep(60)
+        with patch('medusa.run.FANOUT_GRACE', 0.2), patch('medusa.run._fanout', side_effect=stalled):
+            start = time.monotonic()
+            results = list(run.run_on_servers(servers, 'hang', jobs=1, timeout=0.1))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([False], [result['ok'] for result in results])
+        self.assertIn('No result within 0.3s', results[0]['error'])
+
+    def test_processRun_printsNdjson(self):
+        servers = [self.add_server('a'), self.add_server('b')]
+        out = io.StringIO()
+        with patch('medusa.servers.manager.get_servers', return_value=servers):
+            with redirect_stdout(out):
+                run.process_run(['--all', '--format', 'ndjson', 'pass', 'echo hello'])
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual({'a', 'b'}, {line['server'] for line in lines})
+        self.assertTrue(all(line['response'] == 'hello' for line in lines))
+
+    def test_processRun_exitsWithFailure(self):
+        servers = [self.add_server('a'), self.add_server('off', rcon_enabled=False)]
+        out = io.StringIO()
+        with patch('medusa.servers.manager.get_servers', return_value=servers):
+            with redirect_stdout(out):
+                with self.assertRaises(SystemExit) as exit:
+                    run.process_run(['--match', '*', 'pass', 'list'])
+        self.assertEqual(1, exit.exception.code)
+        self.assertIn('failed', out.getvalue())
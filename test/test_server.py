@@ -180,14 +180,26 @@ class ServerTestCase(TestCase):
     # the given identifier matches no known servers
     def test_server_deregister_throwsIfNoneFound(self):
         srv = medusa.servers.manager.Server()
-        # Patch the function because we aren't trying to test `is_identifiable_by`,
-        # only that its return value is used properly
-        srv.is_identifiable_by = unittest.mock.MagicMock(return_value=False)
+        srv.Alias = 'agreeable'
+        srv.Path = '/srv/agreeable'
         medusa.servers.manager._servers = [srv]
         
         with self.assertRaises(KeyError):
             medusa.servers.manager.deregister_server('conflicting')
-        srv.is_identifiable_by.assert_called_once()
+        assert len(medusa.servers.manager._servers) == 1
+
+    # Verifies that `deregister_server` refuses to guess between
+    # servers that share an identifier
+    def test_server_deregister_throwsIfAmbiguous(self):
+        srv1 = medusa.servers.manager.Server()
+        srv1.Path = '/srv/one/survival'
+        srv2 = medusa.servers.manager.Server()
+        srv2.Path = '/srv/two/survival'
+        medusa.servers.manager._servers = [srv1, srv2]
+
+        with self.assertRaises(medusa.servers.manager.AmbiguousIdentifierError):
+            medusa.servers.manager.deregister_server('survival')
+        assert len(medusa.servers.manager._servers) == 2
 
     # Verifies that `deregister_server` writes its changed config to disk
     def test_server_deregister_writesConfig(self):
@@ -198,11 +210,7 @@ class ServerTestCase(TestCase):
         existing_server.Type = medusa.servers.FORGE
         self.plant_server([existing_server])
         
-        existing_server.is_identifiable_by = unittest.mock.MagicMock(return_value=True)
-        medusa.servers.manager._servers = [existing_server]
         medusa.servers.manager.deregister_server('delete me!')
-        # Call once in memory, call once on disk
-        assert existing_server.is_identifiable_by.call_count == 2
         
         with open(medusa.config.get_config_location(), 'r') as conf:
             txt = conf.read()
@@ -218,14 +226,20 @@ class ServerTestCase(TestCase):
         existing_server.Type = medusa.servers.FORGE
         self.plant_server([existing_server])
         
-        existing_server.is_identifiable_by = unittest.mock.MagicMock(return_value=True)
-        medusa.servers.manager._servers = [existing_server]
         medusa.servers.manager.deregister_server('traaash')
-        # Call once in memory, call once on disk
-        assert existing_server.is_identifiable_by.call_count == 2
 
         assert len(medusa.servers.manager._servers) == 0
 
+    # Verifies that the registry representation of a server survives a round trip
+    def test_server_toDict_roundTrip(self):
+        srv = medusa.servers.manager.Server()
+        srv.Alias = 'Round Trip'
+        srv.Path = '/srv/round'
+        srv.Type = medusa.servers.FABRIC
+        data = json.loads(json.dumps(srv.to_dict()))
+        copy = medusa.servers.manager.Server.from_dict(data)
+        assert (copy.Alias, copy.Path, copy.Type) == ('Round Trip', '/srv/round', medusa.servers.FABRIC)
+
     # Verifies that a server can be identified by its path
     def test_server_identifiableBy_matchesPath(self):
         path1 = 'C:/Winders/fabric3'
@@ -251,4 +265,12 @@ class ServerTestCase(TestCase):
         srv2 = medusa.servers.manager.Server()
         srv2.Alias = alias2
         srv2.Path = '/var/www/sukkit'
-        assert srv2.is_identifiable_by(alias2)
\ No newline at end of file
+        assert srv2.is_identifiable_by(alias2)
+    # Verifies that a server without an alias is shown by its directory's name
+    def test_server_displayName_fallsBackToDirectory(self):
+        srv = medusa.servers.manager.Server()
+        srv.Alias = ''
+        srv.Path = '/var/www/sukkit/'
+        assert srv.display_name == 'sukkit'
+        srv.Alias = 'lobby'
+        assert srv.display_name == 'lobby'
@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from medusa import filebases
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# how many times longer than a bare interpreter's own startup imports Medusa
+# may spend importing itself and its dependencies, best of RUNS. This is
+# relative, so slow or busy machines do not fail it; the modules each command
+# must not import are the real check.
+STARTUP_FACTOR = {
+    'config': 10,
+    'server': 15,
+}
+RUNS = 3
+
+# modules that only some commands need, and that must not be imported by the others
+HEAVY_MODULES = ['prettytable', 'jsonpickle', 'subprocess', 'inspect', 'sqlite3', 'ctypes',
+    'concurrent.futures', 'zipfile', 'medusa.servers.forge', 'medusa.servers.fabric', 'medusa.servers.vanilla',
+    'medusa.servers.watch']
+
+def parse_importtime(stderr: str):
+    """
+    Returns the cumulative import time, in microseconds, of each top-level
+    import reported by `python -X importtime`.
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+def all_imported(stderr: str):
+    return {line.split('|')[2].strip() for line in stderr.splitlines()
+        if line.startswith('import time:') and line.split('|')[1].strip().isdigit()}
+
+class StartupTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'data'))
+        with open(os.path.join(self.root, 'data', 'medusa.json'), 'w') as file:
+            data = json.loads(filebases.DATA)
+            data['server_directory'] = self.root
+            json.dump(data, file)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_python(self, *args):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        result = subprocess.run([sys.executable, '-X', 'importtime'] + list(args),
+            cwd=self.root, env=env, capture_output=True, text=True)
+        self.assertEqual(0, result.returncode, result.stderr)
+        return result.stderr
+
+    def run_medusa(self, *args):
+        return self.run_python('-m', 'medusa', *args)
+
+    def baseline_import_time(self):
+        # what the interpreter imports for itself, such as `site` and `encodings`
+        return min(sum(parse_importtime(self.run_python('-c', 'pass')).values()) for i in range(RUNS))
+
+    def medusa_import_time(self, stderr: str):
+        return sum(us for name, us in parse_importtime(stderr).items() if name.split('.')[0] == 'medusa')
+
+    def assertWithinBudget(self, command: str, *args):
+        best = None
+        for i in range(RUNS):
+            stderr = self.run_medusa(command, *args)
+            spent = self.medusa_import_time(stderr)
+            best = spent if best is None else min(best, spent)
+        baseline = self.baseline_import_time()
+        self.assertLess(best, STARTUP_FACTOR[command] * baseline,
+            '`medusa {}` spent {} us importing, against {} us for a bare interpreter'.format(command, best, baseline))
+
+    def test_configWhere_importsOnlyConfig(self):
+        imported = all_imported(self.run_medusa('config', 'where'))
+        self.assertNotIn('medusa.servers.manager', imported)
+        self.assertNotIn('medusa.run', imported)
+        self.assertEqual([], [name for name in HEAVY_MODULES if name in imported])
+        self.assertWithinBudget('config', 'where')
+
+    def test_serverList_skipsTypeModules(self):
+        imported = all_imported(self.run_medusa('server', 'list'))
+        self.assertIn('medusa.servers.manager', imported)
+        self.assertEqual([], [name for name in HEAVY_MODULES if name in imported])
+        self.assertWithinBudget('server', 'list')
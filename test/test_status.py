@@ -0,0 +1,226 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import loop, status
+from medusa.servers import VANILLA
+from medusa.servers.models import Server
+
+class FakeSlpServer:
+    """
+    Answers the Server List Ping like a Minecraft server does, or, when
+    `silent`, accepts connections and never answers.
+    """
+
+    def __init__(self, silent: bool = False, players: int = 3, delay: float = 0.0, body: bytes = None,
+            pong: bytes = None):
+        self.silent = silent
+        self.players = players
+        self.delay = delay
+        self.body = body
+        self.pong = pong
+        self.handshakes = []
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _read_packet(self, reader):
+        length = await status.read_varint(reader)
+        return await reader.readexactly(length)
+
+    async def _handle(self, reader, writer):
+        try:
+            if self.silent:
+                await reader.read()
+                return
+            self.handshakes.append(await self._read_packet(reader))
+            await self._read_packet(reader)
+            await asyncio.sleep(self.delay)
+            body = self.body or json.dumps({
+                'version': {'name': '1.20.1', 'protocol': 763},
+                'players': {'online': self.players, 'max': 20},
+                'description': {'text': 'A ', 'extra': [{'text': 'Medusa'}, ' server']},
+            }).encode('utf-8')
+            writer.write(status._slp_packet(0x00, status.encode_varint(len(body)) + body))
+            ping = await self._read_packet(reader)
+            writer.write(status._slp_packet(0x01, ping[1:] if self.pong is None else self.pong))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+class FakeQueryServer(asyncio.DatagramProtocol):
+    """
+    Answers GameSpy4 handshakes and full stat requests, checking the challenge
+    token and masking session IDs the way Minecraft does.
+    """
+
+    TOKEN = 9513307
+
+    def __init__(self, names, host: str = '127.0.0.1'):
+        self.names = names
+        self.host = host
+        self.sessions = []
+
+    async def start(self):
+        self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: self, local_addr=(self.host, 0))
+        self.port = self.transport.get_extra_info('sockname')[1]
+        return self
+
+    async def stop(self):
+        self.transport.close()
+
+    def datagram_received(self, data, addr):
+        packet_type = data[2]
+        session = struct.unpack('>i', data[3:7])[0] & 0x0F0F0F0F
+        self.sessions.append(session)
+        header = bytes([packet_type]) + struct.pack('>i', session)
+        if packet_type == status.QUERY_HANDSHAKE:
+            self.transport.sendto(header + str(self.TOKEN).encode() + b'\x00', addr)
+        elif packet_type == status.QUERY_STAT and struct.unpack('>i', data[7:11])[0] == self.TOKEN:
+            kv = [b'hostname', b'Query MOTD', b'version', b'1.20.1', b'numplayers', str(len(self.names)).encode(),
+                b'maxplayers', b'20']
+            body = b'splitnum\x00\x80\x00' + b'\x00'.join(kv) + b'\x00\x00\x01player_\x00\x00'
+            body += b''.join(name.encode() + b'\x00' for name in self.names) + b'\x00'
+            self.transport.sendto(header + body, addr)
+
+class ProtocolTests(unittest.TestCase):
+    def test_varint_roundTrips(self):
+        async def decode(data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            return await status.read_varint(reader)
+        for value in (0, 1, 127, 128, 25565, 2147483647, -1):
+            self.assertEqual(value, loop.run(decode(status.encode_varint(value))))
+        self.assertEqual(b'\xff\xff\xff\xff\x0f', status.encode_varint(-1))
+
+    def test_sessionId_fitsQueryMask(self):
+        ids = {status._session_id(n) for n in range(1, 5000)}
+        self.assertEqual(4999, len(ids))
+        self.assertTrue(all(session & 0x0F0F0F0F == session for session in ids))
+
+    def test_flattenMotd_joinsChatComponents(self):
+        self.assertEqual('A Medusa server', status.flatten_motd({'text': 'A ', 'extra': [{'text': 'Medusa'}, ' server']}))
+
+class ProbeTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.fakes = []
+
+    def tearDown(self):
+        for fake in self.fakes:
+            loop.run(fake.stop())
+        shutil.rmtree(self.root)
+
+    def add_server(self, name: str, slp=None, query=None, port: int = None) -> Server:
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        lines = ['server-ip=', 'enable-query=false']
+        if slp is not None:
+            self.fakes.append(loop.run(slp.start()))
+            port = slp.port
+        lines.append('server-port={}'.format(port))
+        if query is not None:
+            self.fakes.append(loop.run(query.start()))
+            lines += ['enable-query=true', 'query.port={}'.format(query.port)]
+        with open(os.path.join(path, 'server.properties'), 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        srv = Server()
+        srv.Path = path
+        srv.Alias = name
+        srv.Type = VANILLA
+        return srv
+
+    def test_probe_readsSlpStatus(self):
+        srv = self.add_server('lobby', slp=FakeSlpServer())
+        (result,) = loop.run(status.probe_servers([srv], timeout=2.0))
+        self.assertTrue(result['ok'])
+        self.assertEqual(('1.20.1', 'A Medusa server', 3, 20), (result['version'], result['motd'], result['online'], result['max']))
+        self.assertIsNotNone(result['latency'])
+        self.assertIsNone(result['players'])
+
+    def test_probe_listsPlayersOverQuery(self):
+        servers = [self.add_server(str(i), slp=FakeSlpServer(), query=FakeQueryServer(['alex', 'steve{}'.format(i)]))
+            for i in range(5)]
+        results = loop.run(status.probe_servers(servers, timeout=2.0))
+        for i, result in enumerate(results):
+            self.assertEqual(['alex', 'steve{}'.format(i)], result['players'])
+        sessions = [session for fake in self.fakes if isinstance(fake, FakeQueryServer) for session in fake.sessions]
+        # every probe uses its own session, even though they share a socket
+        self.assertEqual(5, len(set(sessions)))
+
+    def test_probe_timesOutEachServer(self):
+        servers = [self.add_server('dead', slp=FakeSlpServer(silent=True)),
+            self.add_server('live', slp=FakeSlpServer(), query=FakeQueryServer(['alex']))]
+        silent_query = loop.run(FakeQueryServer([]).start())
+        self.fakes.append(silent_query)
+        silent_query.datagram_received = lambda data, addr: None
+        with open(os.path.join(servers[0].Path, 'server.properties'), 'a') as file:
+            file.write('enable-query=true\nquery.port={}\n'.format(silent_query.port))
+
+        start = time.monotonic()
+        dead, live = loop.run(status.probe_servers(servers, timeout=0.3))
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertFalse(dead['ok'])
+        self.assertIn('No answer', dead['error'])
+        self.assertTrue(live['ok'])
+        self.assertEqual(['alex'], live['players'])
+
+    def test_probe_reportsMalformedReplies(self):
+        servers = [self.add_server('list', slp=FakeSlpServer(body=b'["not", "an", "object"]')),
+            self.add_server('short', slp=FakeSlpServer(pong=b'\x00\x01')),
+            self.add_server('fine', slp=FakeSlpServer())]
+        results = loop.run(status.probe_servers(servers, timeout=2.0))
+        self.assertEqual([False, False, True], [result['ok'] for result in results])
+        self.assertIn('not a JSON object', results[0]['error'])
+        self.assertIn('not echoed', results[1]['error'])
+
+    def test_probe_queriesIpv6Servers(self):
+        query = loop.run(FakeQueryServer(['alex'], host='::1').start())
+        self.fakes.append(query)
+        srv = self.add_server('v6', port=1)
+        with open(os.path.join(srv.Path, 'server.properties'), 'w') as file:
+            file.write('server-ip=::1\nserver-port=1\nenable-query=true\nquery.port={}\n'.format(query.port))
+        (result,) = loop.run(status.probe_servers([srv], timeout=2.0))
+        self.assertTrue(result['ok'])
+        self.assertEqual(['alex'], result['players'])
+
+    def test_probe_reportsRefusedConnection(self):
+        srv = self.add_server('closed', port=1)
+        (result,) = loop.run(status.probe_servers([srv], timeout=1.0))
+        self.assertFalse(result['ok'])
+        self.assertTrue(result['error'])
+
+    def test_processStatus_printsNdjson(self):
+        servers = [self.add_server('a', slp=FakeSlpServer()), self.add_server('b', slp=FakeSlpServer(players=0))]
+        out = io.StringIO()
+        with patch('medusa.servers.manager.get_servers', return_value=servers):
+            with redirect_stdout(out):
+                status.process_status(['--format', 'ndjson'])
+        lines = {line['server']: line for line in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual({'a': 3, 'b': 0}, {name: line['online'] for name, line in lines.items()})
+
+    def test_processStatus_printsTable(self):
+        servers = [self.add_server('lobby', slp=FakeSlpServer(), query=FakeQueryServer(['alex']))]
+        out = io.StringIO()
+        with patch('medusa.servers.manager.get_servers', return_value=servers):
+            with redirect_stdout(out):
+                status.process_status([])
+        self.assertIn('online', out.getvalue())
+        self.assertIn('3/20 alex', out.getvalue())
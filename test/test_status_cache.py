@@ -0,0 +1,141 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import loop, status
+from medusa.status_cache import DEFAULT_TTLS, StatusCache, get_ttls
+from test.test_status import FakeQueryServer, FakeSlpServer, ProbeTests
+
+class StatusCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.probes = ProbeTests()
+        self.probes.setUp()
+        self.cache_dir = os.path.join(self.probes.root, 'status_cache')
+        self.cache = StatusCache.open(self.cache_dir)
+
+    def tearDown(self):
+        self.probes.tearDown()
+
+    def probe(self, srv, cache=None, fresh=False, timeout=2.0):
+        async def run():
+            query = await status.QueryClient.open()
+            try:
+                return await (cache or self.cache).probe(srv, query, timeout, fresh)
+            finally:
+                query.close()
+        return loop.run(run())
+
+    def test_probe_reusesResultWithinTtl(self):
+        slp = FakeSlpServer()
+        srv = self.probes.add_server('lobby', slp=slp)
+        first = self.probe(srv)
+        second = self.probe(srv)
+        self.assertEqual(1, len(slp.handshakes))
+        self.assertFalse(first['cached'])
+        self.assertTrue(second['cached'])
+        self.assertEqual(first['motd'], second['motd'])
+        self.assertEqual({'hits': 1, 'shared': 0, 'misses': 1}, self.cache.stats())
+
+    def test_probe_refreshesOnlyStaleFields(self):
+        slp, query = FakeSlpServer(), FakeQueryServer(['alex'])
+        srv = self.probes.add_server('lobby', slp=slp, query=query)
+        self.cache.ttls['players'] = 0.0
+        self.probe(srv)
+        query.names = ['alex', 'steve']
+        result = self.probe(srv)
+        self.assertEqual(1, len(slp.handshakes))
+        self.assertEqual(['alex', 'steve'], result['players'])
+        self.assertEqual(3, result['online'])
+
+    def test_probe_keepsFieldsWhenOneProbeFails(self):
+        slp, query = FakeSlpServer(), FakeQueryServer(['alex'])
+        srv = self.probes.add_server('lobby', slp=slp, query=query)
+        self.cache.ttls['players'] = 0.0
+        first = self.probe(srv)
+        loop.run(query.stop())
+        result = self.probe(srv, timeout=0.2)
+        self.assertTrue(result['ok'])
+        self.assertEqual(first['version'], result['version'])
+        self.assertIsNone(result['players'])
+        entry = self.cache.read(srv)
+        self.assertEqual(['query'], list(entry['errors']))
+        self.assertEqual(set(), self.cache.stale_probes(entry, entry['at']))
+        self.assertEqual(1, len(slp.handshakes))
+
+    def test_probe_freshBypassesCache(self):
+        slp = FakeSlpServer()
+        srv = self.probes.add_server('lobby', slp=slp)
+        self.probe(srv)
+        result = self.probe(srv, fresh=True)
+        self.assertEqual(2, len(slp.handshakes))
+        self.assertFalse(result['cached'])
+
+    def test_probe_cachesFailureBriefly(self):
+        srv = self.probes.add_server('closed', port=1)
+        self.assertFalse(self.probe(srv)['ok'])
+        with patch('medusa.status.probe_server') as probe_server:
+            result = self.probe(srv)
+            self.cache.ttls['error'] = -1.0
+            probe_server.return_value = dict(result, ok=False, error='still closed')
+            self.assertEqual('still closed', self.probe(srv)['error'])
+        self.assertTrue(result['cached'])
+        self.assertEqual(1, probe_server.call_count)
+
+    def test_probe_singleFlightAcrossCaches(self):
+        # each cache takes its own lock file handle, as a separate process would
+        slp = FakeSlpServer(delay=0.2)
+        srv = self.probes.add_server('lobby', slp=slp)
+        other = StatusCache.open(self.cache_dir)
+
+        async def run():
+            query = await status.QueryClient.open()
+            try:
+                return await asyncio.gather(self.cache.probe(srv, query, 2.0), other.probe(srv, query, 2.0))
+            finally:
+                query.close()
+        first, second = loop.run(run())
+        self.assertEqual(1, len(slp.handshakes))
+        self.assertEqual(first['version'], second['version'])
+        self.assertEqual(1, self.cache.misses + other.misses)
+        self.assertEqual(1, self.cache.shared + other.shared)
+
+    def test_stats_accumulateAcrossProcesses(self):
+        self.cache.hits, self.cache.misses = 3, 1
+        self.cache.save_stats()
+        other = StatusCache.open(self.cache_dir)
+        other.shared = 4
+        other.save_stats()
+        totals = other.read_stats()
+        self.assertEqual({'hits': 3, 'shared': 4, 'misses': 1}, totals)
+        self.assertEqual('Status cache: 3 hits, 4 shared, 1 miss (88% hit rate)', StatusCache.describe_stats(totals))
+
+    def test_open_requiresDataDirectory(self):
+        self.assertIsNone(StatusCache.open(os.path.join(self.probes.root, 'missing', 'status_cache')))
+
+    def test_ttls_readFromConfig(self):
+        with patch('medusa.config.get_config', return_value={'status_ttl_players': '30', 'status_ttl_motd': 'x'}):
+            ttls = get_ttls()
+        self.assertEqual(30.0, ttls['players'])
+        self.assertEqual(DEFAULT_TTLS['motd'], ttls['motd'])
+
+    def test_processStatus_usesCacheInDataDirectory(self):
+        slp = FakeSlpServer()
+        servers = [self.probes.add_server('lobby', slp=slp)]
+        config_location = os.path.join(self.probes.root, 'medusa.json')
+        out = io.StringIO()
+        with patch('medusa.config.get_config_location', return_value=config_location):
+            with patch('medusa.servers.manager.get_servers', return_value=servers):
+                with redirect_stdout(out):
+                    status.process_status(['--format', 'ndjson'])
+                    status.process_status(['--format', 'ndjson'])
+                    status.process_status(['--cache-stats'])
+        lines = out.getvalue().splitlines()
+        self.assertEqual([False, True], [json.loads(line)['cached'] for line in lines[:2]])
+        self.assertEqual('Status cache: 1 hits, 0 shared, 1 miss (50% hit rate)', lines[2])
+        self.assertEqual(1, len(slp.handshakes))
@@ -0,0 +1,113 @@
+import json
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import jsonpickle
+from pyfakefs.fake_filesystem_unittest import TestCase
+
+from medusa import config, filebases, storage
+from medusa.servers import VANILLA, manager
+
+WRITERS = 32
+SERVERS_PER_WRITER = 3
+
+def _stress_writer(root: str, writer: int):
+    # each process registers its own servers and sets its own config key
+    os.chdir(root)
+    manager._servers = None
+    for i in range(SERVERS_PER_WRITER):
+        path = os.path.join(root, 'servers', 'w{}-s{}'.format(writer, i))
+        os.makedirs(path)
+        manager.register_server(path, VANILLA)
+    config.set_config_value('writer_{}'.format(writer), writer)
+
+class AtomicWriteTests(TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_atomicOpen_replacesFile(self):
+        self.fs.create_file('/data/medusa.json', contents='old')
+        with storage.atomic_open('/data/medusa.json') as file:
+            file.write('new')
+        with open('/data/medusa.json') as file:
+            self.assertEqual('new', file.read())
+        self.assertEqual(['medusa.json'], os.listdir('/data'))
+
+    def test_atomicOpen_keepsOriginalOnError(self):
+        self.fs.create_file('/data/medusa.json', contents='old')
+        with self.assertRaises(ValueError):
+            with storage.atomic_open('/data/medusa.json') as file:
+                file.write('partial')
+                raise ValueError()
+        with open('/data/medusa.json') as file:
+            self.assertEqual('old', file.read())
+        self.assertEqual(['medusa.json'], os.listdir('/data'))
+
+    def test_atomicOpen_keepsPermissions(self):
+        self.fs.create_file('/data/medusa.json', contents='old')
+        os.chmod('/data/medusa.json', 0o640)
+        with storage.atomic_open('/data/medusa.json') as file:
+            file.write('new')
+        self.assertEqual(0o640, stat.S_IMODE(os.stat('/data/medusa.json').st_mode))
+
+        umask = os.umask(0o027)
+        try:
+            with storage.atomic_open('/data/new.json') as file:
+                file.write('new')
+        finally:
+            os.umask(umask)
+        self.assertEqual(0o640, stat.S_IMODE(os.stat('/data/new.json').st_mode))
+
+@unittest.skipIf(storage.fcntl is None, 'advisory locks need fcntl')
+class LockTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'medusa.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_locked_timesOutWhileHeld(self):
+        with storage.locked(self.path):
+            # flock locks belong to the open file, so a second open contends
+            with self.assertRaises(storage.LockTimeoutError):
+                with storage.locked(self.path, timeout=0.05):
+                    pass
+
+    def test_locked_sharedLocksCoexist(self):
+        with storage.locked(self.path, shared=True):
+            with storage.locked(self.path, shared=True, timeout=0.05):
+                pass
+
+@unittest.skipUnless(storage.fcntl is not None and 'fork' in multiprocessing.get_all_start_methods(),
+    'stress test needs fcntl and fork')
+class ConcurrentWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'data'))
+        os.makedirs(os.path.join(self.root, 'servers'))
+        with open(os.path.join(self.root, 'data', 'medusa.json'), 'w') as file:
+            file.write(filebases.DATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_concurrentWriters_loseNoWrites(self):
+        ctx = multiprocessing.get_context('fork')
+        procs = [ctx.Process(target=_stress_writer, args=(self.root, i)) for i in range(WRITERS)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join(60)
+            self.assertEqual(0, proc.exitcode)
+
+        with open(os.path.join(self.root, 'data', 'medusa.json')) as file:
+            text = file.read()
+        data = jsonpickle.decode(text)
+        self.assertEqual(WRITERS * SERVERS_PER_WRITER, len(data['server_registry']))
+        for i in range(WRITERS):
+            self.assertEqual(i, data['writer_{}'.format(i)])
@@ -0,0 +1,216 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from medusa import cli, loop, run
+from medusa.servers import FORGE, supervisor
+from medusa.servers.forge import ForgeController
+from medusa.servers.models import Server
+
+# stands in for a Minecraft server: echoes console input and exits on `stop`
+FAKE_SERVER = '''
+import signal, sys
+if 'stubborn' in sys.argv:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+for i in range(int(sys.argv[1])):
+    print('line', i)
+print('Done! For help, type "help"', flush=True)
+for line in sys.stdin:
+    line = line.strip()
+    print('> ' + line, flush=True)
+    if line == 'stop' and 'stubborn' not in sys.argv:
+        print('Stopping server', flush=True)
+        sys.exit(0)
+'''
+
+class SupervisorTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'fake_server.py'), 'w') as file:
+            file.write(FAKE_SERVER)
+        self.srv = Server()
+        self.srv.Path = self.root
+        self.srv.Type = FORGE
+        self.supervisor = supervisor.Supervisor(buffer_lines=50)
+
+    def tearDown(self):
+        for proc in self.supervisor.processes():
+            if proc.running:
+                loop.run(self.supervisor.stop(proc.srv, 0.1, 0.1))
+        shutil.rmtree(self.root)
+
+    def start(self, *args):
+        command = [sys.executable, 'fake_server.py'] + [str(arg) for arg in args]
+        return loop.run(self.supervisor.start(self.srv, command))
+
+    def wait_for_output(self, proc, text, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if any(text in line for line in list(proc.output)):
+                return
+            time.sleep(0.01)
+        self.fail('"{}" never appeared in {}'.format(text, list(proc.output)))
+
+    def test_start_recordsProcess(self):
+        proc = self.start(0)
+        self.assertTrue(proc.running)
+        self.assertGreater(proc.pid, 0)
+        self.assertAlmostEqual(time.time(), proc.started_at, delta=5)
+        self.assertIs(proc, self.supervisor.get(self.srv))
+
+    def test_start_refusesRunningServer(self):
+        self.start(0)
+        with self.assertRaises(supervisor.SupervisorError):
+            self.start(0)
+
+    def test_output_keepsOnlyRecentLines(self):
+        proc = self.start(5000)
+        self.wait_for_output(proc, 'Done!')
+        self.assertEqual(50, len(proc.output))
+        self.assertEqual('line 4999', proc.output[-2])
+
+    def test_send_writesToConsole(self):
+        proc = self.start(0)
+        loop.run(supervisor._call(self.supervisor.send, self.srv, 'say hello'))
+        self.wait_for_output(proc, '> say hello')
+
+    def test_stop_usesStopCommand(self):
+        proc = self.start(0)
+        self.assertEqual(0, loop.run(self.supervisor.stop(self.srv, 5.0, 5.0)))
+        self.assertFalse(proc.running)
+        self.assertIn('Stopping server', list(proc.output))
+        self.assertIsNone(self.supervisor.get(self.srv))
+
+    def test_stop_escalatesToKill(self):
+        proc = self.start(0, 'stubborn')
+        self.wait_for_output(proc, 'Done!')
+        start = time.monotonic()
+        returncode = loop.run(self.supervisor.stop(self.srv, 0.2, 0.2))
+        self.assertEqual(-9, returncode)
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
+    def test_start_detachedWritesConsoleToLog(self):
+        command = [sys.executable, 'fake_server.py', '3']
+        proc = loop.run(self.supervisor.start(self.srv, command, detach=True))
+        self.assertEqual(os.path.join(self.root, 'logs', 'console.log'), proc.console_log)
+        with self.assertRaises(supervisor.SupervisorError):
+            loop.run(supervisor._call(self.supervisor.send, self.srv, 'say hello'))
+        # its stdin is empty rather than a pipe left open, so the fake reads EOF and exits
+        deadline = time.monotonic() + 5
+        while proc.running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(0, proc.returncode)
+        with open(proc.console_log) as file:
+            self.assertEqual(['line 0', 'line 1', 'line 2', 'Done! For help, type "help"'], file.read().splitlines())
+
+    def test_stop_signalsDetachedServer(self):
+        with open(os.path.join(self.root, 'idle.py'), 'w') as file:
+            file.write('import time\nprint("Done!", flush=True)\ntime.sleep(60)\n')
+        proc = loop.run(self.supervisor.start(self.srv, [sys.executable, 'idle.py'], detach=True))
+        start = time.monotonic()
+        self.assertEqual(-15, loop.run(self.supervisor.stop(self.srv, 5.0, 5.0)))
+        self.assertLess(time.monotonic() - start, 5.0)
+        self.assertFalse(proc.running)
+
+    def test_processExit_isNoticed(self):
+        proc = self.start(0)
+        os.kill(proc.pid, 15)
+        deadline = time.monotonic() + 5
+        while proc.running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(-15, proc.returncode)
+
+# holds the world's lock the way Minecraft does until it has saved
+LOCK_HOLDER = '''
+import fcntl, sys, time
+with open(sys.argv[1], 'r+b') as file:
+    fcntl.lockf(file.fileno(), fcntl.LOCK_EX)
+    print('locked', flush=True)
+    time.sleep(float(sys.argv[2]))
+'''
+
+@unittest.skipIf(supervisor.fcntl is None, 'record locks are unavailable')
+class WaitForExitTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.srv = Server()
+        self.srv.Path = self.root
+        self.srv.Type = FORGE
+        os.makedirs(os.path.join(self.root, 'world'))
+        open(os.path.join(self.root, 'world', 'session.lock'), 'w').close()
+        self.holder = None
+
+    def tearDown(self):
+        if self.holder is not None:
+            self.holder.kill()
+            self.holder.wait()
+        shutil.rmtree(self.root)
+
+    def hold_lock(self, seconds: float):
+        self.holder = subprocess.Popen([sys.executable, '-c', LOCK_HOLDER,
+            os.path.join(self.root, 'world', 'session.lock'), str(seconds)], stdout=subprocess.PIPE)
+        self.holder.stdout.readline()
+
+    def test_waitForExit_waitsUntilWorldIsReleased(self):
+        self.hold_lock(0.5)
+        self.assertTrue(supervisor.world_in_use(self.srv))
+        with patch('medusa.servers.supervisor.POLL_INTERVAL', 0.05):
+            supervisor.wait_for_exit(self.srv, 10.0)
+        self.assertFalse(supervisor.world_in_use(self.srv))
+
+    def test_restart_refusesToStartOverRunningWorld(self):
+        self.hold_lock(60)
+        cli.register_server_types()
+        with patch.object(ForgeController, 'shutdown', return_value=None), \
+                patch.object(ForgeController, 'startup') as startup, \
+                patch('medusa.servers.manager.get_server_by_identifier', return_value=self.srv), \
+                patch('medusa.servers.supervisor.STOP_TIMEOUT', 0.2), \
+                redirect_stdout(io.StringIO()) as out:
+            run.process_run(['lobby', 'restart'])
+        startup.assert_not_called()
+        self.assertIn('still running 0.2 seconds after being asked to stop', out.getvalue())
+
+class LaunchCommandTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.srv = Server()
+        self.srv.Path = self.root
+        self.srv.Type = FORGE
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def touch(self, name):
+        open(os.path.join(self.root, name), 'w').close()
+
+    def test_launch_prefersStartupScript(self):
+        self.touch('forge-1.16.5.jar')
+        self.touch('start.bat')
+        self.touch('start.sh')
+        self.assertEqual(['sh', 'start.sh'], supervisor.get_launch_command(self.srv))
+
+    def test_launch_fallsBackToTypedJar(self):
+        self.touch('minecraft_server.1.16.5.jar')
+        self.touch('forge-1.16.5.jar')
+        self.assertEqual('forge-1.16.5.jar', supervisor.get_launch_command(self.srv)[-2])
+
+    def test_launch_failsWithoutJar(self):
+        with self.assertRaises(supervisor.SupervisorError):
+            supervisor.get_launch_command(self.srv)
+
+    def test_controller_startsAndStopsScript(self):
+        with open(os.path.join(self.root, 'start.sh'), 'w') as file:
+            file.write('echo booting\nread line\necho "got $line"\n')
+        controller = ForgeController(self.srv)
+        with patch('medusa.servers.supervisor._resident', True):
+            proc = controller.startup()
+        self.assertIsNotNone(supervisor.get_process(self.srv))
+        self.assertIsNotNone(controller.shutdown())
+        self.assertEqual(['booting', 'got stop'], supervisor.get_output(self.srv))
@@ -0,0 +1,113 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+from pyfakefs.fake_filesystem_unittest import TestCase
+
+from medusa.servers import watch, FORGE, NOTASERVER
+from medusa.servers.models import Server
+
+class DebouncerTests(unittest.TestCase):
+    def test_debouncer_waitsForQuiet(self):
+        debouncer = watch.Debouncer(2.0)
+        debouncer.touch(['/srvs/a'], now=0.0)
+        debouncer.touch(['/srvs/a'], now=1.5)
+        self.assertEqual(set(), debouncer.ready(now=3.0))
+        self.assertEqual({'/srvs/a'}, debouncer.ready(now=3.5))
+        self.assertEqual(set(), debouncer.ready(now=10.0))
+
+    def test_debouncer_nextDeadline(self):
+        debouncer = watch.Debouncer(2.0)
+        self.assertEqual(60.0, debouncer.next_deadline(0.0, default=60.0))
+        debouncer.touch(['/srvs/a'], now=1.0)
+        self.assertEqual(1.5, debouncer.next_deadline(1.5, default=60.0))
+
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    @patch('medusa.servers.watch.detect_server_type', return_value = (FORGE, 1.0))
+    @patch('medusa.servers.manager.register_server', return_value = True)
+    @patch('medusa.servers.manager.get_server_by_identifier', return_value = None)
+    def test_reconcile_registersNewServer(self, mock_getby, mock_register, mock_detect):
+        self.fs.create_dir('/srvs/new')
+        result = watch.reconcile_directory('/srvs/new', verbosity=0)
+        self.assertEqual('registered', result)
+        mock_register.assert_called_once_with('/srvs/new', FORGE)
+
+    @patch('medusa.servers.watch.detect_server_type', return_value = (NOTASERVER, 0.0))
+    @patch('medusa.servers.manager.register_server')
+    @patch('medusa.servers.manager.get_server_by_identifier', return_value = None)
+    def test_reconcile_ignoresNonServers(self, mock_getby, mock_register, mock_detect):
+        self.fs.create_dir('/srvs/empty')
+        self.assertIsNone(watch.reconcile_directory('/srvs/empty', verbosity=0))
+        mock_register.assert_not_called()
+
+    @patch('medusa.servers.manager.deregister_server')
+    @patch('medusa.servers.manager.get_server_by_identifier')
+    def test_reconcile_deregistersRemovedServer(self, mock_getby, mock_deregister):
+        mock_getby.return_value = Server()
+        result = watch.reconcile_directory('/srvs/gone', verbosity=0)
+        self.assertEqual('deregistered', result)
+        mock_deregister.assert_called_once_with('/srvs/gone')
+
+    @patch('medusa.servers.watch.detect_server_type')
+    @patch('medusa.servers.manager.get_server_by_identifier')
+    def test_reconcile_skipsKnownServer(self, mock_getby, mock_detect):
+        self.fs.create_dir('/srvs/known')
+        mock_getby.return_value = Server()
+        self.assertIsNone(watch.reconcile_directory('/srvs/known', verbosity=0))
+        mock_detect.assert_not_called()
+
+    @patch('time.sleep')
+    def test_polling_reportsChangedDirectories(self, mock_sleep):
+        self.fs.create_dir('/srvs/a')
+        self.fs.create_dir('/srvs/b')
+        source = watch.PollingSource('/srvs', interval=1.0)
+        self.fs.create_file('/srvs/a/server.jar', contents='abc')
+        self.fs.create_dir('/srvs/c')
+        self.assertEqual({'/srvs/a', '/srvs/c'}, source.poll(1.0))
+        self.assertEqual(set(), source.poll(1.0))
+
+class WatchTests(unittest.TestCase):
+    @patch('medusa.servers.watch.reconcile_directory')
+    @patch('medusa.servers.watch.open_source')
+    def test_watch_keepsGoingAfterFailedCheck(self, mock_source, mock_reconcile):
+        mock_source.return_value.poll.side_effect = [{'/srvs/a'}, {'/srvs/b'}, KeyboardInterrupt]
+        mock_reconcile.side_effect = [PermissionError(13, 'Permission denied', '/srvs/a'), 'registered']
+        out = io.StringIO()
+        with redirect_stdout(out):
+            watch.watch_servers('/srvs', delay=0, verbosity=0)
+        self.assertEqual(['/srvs/a', '/srvs/b'], [call.args[0] for call in mock_reconcile.call_args_list])
+        self.assertIn('Could not check /srvs/a: [Errno 13] Permission denied', out.getvalue())
+        mock_source.return_value.close.assert_called_once_with()
+
+@unittest.skipUnless(hasattr(os, 'uname') and os.uname().sysname == 'Linux', 'inotify is Linux-only')
+class InotifySourceTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'existing'))
+        self.source = watch.InotifySource(self.root)
+
+    def tearDown(self):
+        self.source.close()
+        shutil.rmtree(self.root)
+
+    def test_inotify_reportsNewAndChangedDirectories(self):
+        os.mkdir(os.path.join(self.root, 'fresh'))
+        with open(os.path.join(self.root, 'existing', 'server.jar'), 'w') as jar:
+            jar.write('jar')
+        changed = self.source.poll(1.0)
+        self.assertIn(os.path.join(self.root, 'fresh'), changed)
+        self.assertIn(os.path.join(self.root, 'existing'), changed)
+
+        # directories created while watching are watched as well
+        open(os.path.join(self.root, 'fresh', 'forge.jar'), 'w').close()
+        self.assertEqual({os.path.join(self.root, 'fresh')}, self.source.poll(1.0))
+
+    def test_inotify_reportsRemovedDirectories(self):
+        os.rmdir(os.path.join(self.root, 'existing'))
+        self.assertIn(os.path.join(self.root, 'existing'), self.source.poll(1.0))